@@ -1,10 +1,46 @@
 # Initialize the finance management package
-from .finance_app import register_user, login_user
-from .transactions import add_transaction, delete_transaction, update_transaction
-from .reports import generate_monthly_report, generate_yearly_report, calculate_savings
-from .finance_app import set_monthly_budget, check_budget_exceedance, view_monthly_budgets
-from .finance_app import initialize_db, backup_database, restore_database, view_data
+#
+# Importing the package has no side effects: the public functions and the
+# submodules are loaded on first access, and the database schema is set up
+# when the first connection is opened (see migrations.py).
+import importlib
 
-# initialize the database when the package is imported
-initialize_db()
+# Public functions and the submodule that defines them
+_EXPORTS = {
+    "register_user": "finance_app.auth",
+    "login_user": "finance_app.auth",
+    "add_transaction": "transactions",
+    "delete_transaction": "transactions",
+    "update_transaction": "transactions",
+    "generate_monthly_report": "reports",
+    "generate_yearly_report": "reports",
+    "calculate_totals": "reports",
+    "set_monthly_budget": "budget",
+    "check_budget_exceedance": "budget",
+    "view_monthly_budgets": "budget",
+    "initialize_db": "backup",
+    "backup_database": "backup",
+    "restore_database": "backup",
+    "view_data": "backup",
+}
 
+_SUBMODULES = (
+    "aio", "alerts", "analytics", "archive", "backup", "benchmark", "budget", "changelog", "cli", "connection", "datagen",
+    "db", "export", "forecast", "importers", "instrumentation", "migrations", "prefix_index", "query_plans",
+    "recurring", "report_cache", "reports", "rollups", "schema", "sharding", "statements", "transactions",
+)
+
+__all__ = list(_EXPORTS)
+
+# Function to load a public function or submodule on first access
+def __getattr__(name):
+    # Functions are looked up on every access rather than cached here, so
+    # wrappers installed on the submodule (e.g. by instrumentation) apply
+    if name in _EXPORTS:
+        return getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    if name in _SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__) | set(_SUBMODULES))
@@ -0,0 +1,269 @@
+import asyncio
+import functools
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import budget, connection, reports, sharding, transactions
+from .finance_app import auth
+
+# asyncio facade over the package. Reads run on a bounded pool of threads,
+# each with its own pooled read connection. Writes are queued to a single
+# writer thread, which folds whatever is queued into one group commit, so
+# concurrent writers never contend for the SQLite write lock.
+DEFAULT_READ_WORKERS = 4
+MAX_GROUP_SIZE = 512
+
+_state = {"read_pool": None, "writer": None}
+_write_queue = queue.Queue()
+_start_lock = threading.Lock()
+_stats = {"writes": 0, "groups": 0}
+
+# Function to start the read pool and the writer thread
+def start(read_workers=DEFAULT_READ_WORKERS):
+    """
+    Starts the read thread pool and the writer thread if they are not running.
+
+    Called automatically by the first async call; call it explicitly to size the read pool.
+
+    Args:
+        read_workers (int): Maximum number of concurrent read threads.
+    """
+    with _start_lock:
+        if _state["read_pool"] is None:
+            _state["read_pool"] = ThreadPoolExecutor(
+                max_workers=read_workers, thread_name_prefix="finance-read"
+            )
+        if _state["writer"] is None:
+            writer = threading.Thread(target=_writer_loop, name="finance-writer", daemon=True)
+            writer.start()
+            _state["writer"] = writer
+
+# Function to stop the read pool and the writer thread
+def shutdown():
+    """
+    Drains the write queue, then stops the writer thread and the read pool.
+    """
+    with _start_lock:
+        writer = _state["writer"]
+        if writer is not None:
+            _write_queue.put(None)
+            writer.join()
+            _state["writer"] = None
+        if _state["read_pool"] is not None:
+            _state["read_pool"].shutdown(wait=True)
+            _state["read_pool"] = None
+
+# Function to report how well writes are being grouped
+def write_stats():
+    """
+    Returns the number of writes executed and group commits performed.
+
+    Returns:
+        dict: {"writes": int, "groups": int, "writes_per_group": float}.
+    """
+    stats = dict(_stats)
+    stats["writes_per_group"] = stats["writes"] / stats["groups"] if stats["groups"] else 0.0
+    return stats
+
+# Function to hand a result back to the event loop that is awaiting it
+def _resolve(future, result, error):
+    if future is None:
+        # A write nobody awaits (see _queue_rehash())
+        return
+    loop = future.get_loop()
+    if error is not None:
+        loop.call_soon_threadsafe(_set_exception, future, error)
+    else:
+        loop.call_soon_threadsafe(_set_result, future, result)
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+def _set_exception(future, error):
+    if not future.done():
+        future.set_exception(error)
+
+# Function to run a group of queued writes in one transaction per shard
+def _run_group(group):
+    parts = {}
+    for item in group:
+        parts.setdefault(sharding.call_path(item[0], item[1]), []).append(item)
+    for path, part in parts.items():
+        _run_part(path, part)
+
+# Function to run queued writes against one database in a single transaction
+def _run_part(path, group):
+    outcomes = []
+    moved = []
+    try:
+        with connection.group_commit(path) as conn:
+            for item in group:
+                func, args, kwargs, future, _ = item
+                # A savepoint per call, so one failing write does not undo the others
+                try:
+                    with connection.savepoint(conn, "aio_write"):
+                        outcomes.append((future, func(*args, **kwargs), None))
+                except sqlite3.IntegrityError as e:
+                    if sharding.MOVED_MESSAGE not in str(e):
+                        outcomes.append((future, None, e))
+                    else:
+                        moved.append(item)
+                except Exception as e:
+                    outcomes.append((future, None, e))
+    except Exception as e:
+        # The commit itself failed, so none of the writes are durable
+        outcomes = [(item[3], None, e) for item in group]
+        moved = []
+
+    _stats["writes"] += len(group) - len(moved)
+    _stats["groups"] += 1
+    # Only acknowledge writes once they are committed
+    for future, result, error in outcomes:
+        _resolve(future, result, error)
+    # Writes for users that moved to another shard are retried on their own,
+    # which refreshes the shard map
+    for item in moved:
+        _run_alone(item)
+
+# Function to run a write that manages its own transaction
+def _run_alone(item):
+    func, args, kwargs, future, _ = item
+    try:
+        result, error = func(*args, **kwargs), None
+    except Exception as e:
+        result, error = None, e
+    _stats["writes"] += 1
+    _stats["groups"] += 1
+    _resolve(future, result, error)
+
+# The writer thread: executes queued writes in group commits
+def _writer_loop():
+    stop = False
+    while not stop:
+        item = _write_queue.get()
+        if item is None:
+            break
+
+        # Take everything that is already queued, up to MAX_GROUP_SIZE
+        batch = [item]
+        while len(batch) < MAX_GROUP_SIZE:
+            try:
+                item = _write_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+
+        # Consecutive groupable writes share a commit; the others run alone
+        group = []
+        for item in batch:
+            if item[4]:
+                group.append(item)
+                continue
+            if group:
+                _run_group(group)
+                group = []
+            _run_alone(item)
+        if group:
+            _run_group(group)
+
+    connection.close_connection()
+
+# Function to queue a write for the writer thread and await its result
+async def _write(func, *args, grouped=True, **kwargs):
+    if _state["writer"] is None:
+        start()
+    future = asyncio.get_running_loop().create_future()
+    _write_queue.put((func, args, kwargs, future, grouped))
+    return await future
+
+# Function to run a read on the read pool and await its result
+async def _read(func, *args, **kwargs):
+    if _state["read_pool"] is None:
+        start()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_state["read_pool"], functools.partial(func, *args, **kwargs))
+
+# Function to hand a password hash upgrade from a read thread to the writer
+def _queue_rehash(user_id, stored, new_hash):
+    # Not awaited: the login does not wait for it, and a lost upgrade is redone at the next login
+    _write_queue.put((auth.store_rehash, (user_id, stored, new_hash), {}, None, True))
+
+# Async versions of the write functions (executed by the writer thread)
+async def add_transaction(user_id, transaction_type, category, amount, date=None):
+    """Async version of transactions.add_transaction(); committed in a group."""
+    return await _write(transactions.add_transaction, user_id, transaction_type, category, amount, date)
+
+async def update_transaction(transaction_id, transaction_type=None, category=None, amount=None, date=None):
+    """Async version of transactions.update_transaction(); committed in a group."""
+    return await _write(transactions.update_transaction, transaction_id, transaction_type,
+                        category, amount, date)
+
+async def delete_transaction(transaction_id):
+    """Async version of transactions.delete_transaction(); committed in a group."""
+    return await _write(transactions.delete_transaction, transaction_id)
+
+async def set_monthly_budget(user_id, category, amount, month, year):
+    """Async version of budget.set_monthly_budget(); committed in a group."""
+    return await _write(budget.set_monthly_budget, user_id, category, amount, month, year)
+
+async def add_transactions_bulk(records, chunk_size=transactions.DEFAULT_CHUNK_SIZE, default_user_id=None):
+    """Async version of transactions.add_transactions_bulk(); runs on the writer thread."""
+    # Bulk loads commit per chunk themselves, so they are not grouped
+    return await _write(transactions.add_transactions_bulk, records, chunk_size,
+                        default_user_id, grouped=False)
+
+async def update_transactions(changes, dry_run=False, **filters):
+    """Async version of transactions.update_transactions(); runs on the writer thread."""
+    # May span several shards, so it commits on its own
+    return await _write(transactions.update_transactions, changes, dry_run=dry_run, grouped=False, **filters)
+
+async def delete_transactions(dry_run=False, **filters):
+    """Async version of transactions.delete_transactions(); runs on the writer thread."""
+    return await _write(transactions.delete_transactions, dry_run=dry_run, grouped=False, **filters)
+
+async def register_user(username, password):
+    """Async version of auth.register_user(); runs on the writer thread."""
+    return await _write(auth.register_user, username, password)
+
+# Async versions of the read functions (executed on the read pool)
+async def login_user(username, password):
+    """Async version of auth.login_user(); an upgraded hash is stored by the writer thread."""
+    return await _read(auth.login_user, username, password, _queue_rehash)
+
+async def create_session(username, password):
+    """Async version of auth.create_session(); an upgraded hash is stored by the writer thread."""
+    return await _read(auth.create_session, username, password, _queue_rehash)
+
+async def generate_monthly_report(user_id, month, year):
+    """Async version of reports.generate_monthly_report()."""
+    return await _read(reports.generate_monthly_report, user_id, month, year)
+
+async def generate_yearly_report(user_id, year):
+    """Async version of reports.generate_yearly_report()."""
+    return await _read(reports.generate_yearly_report, user_id, year)
+
+async def calculate_totals(user_id, start_date, end_date):
+    """Async version of reports.calculate_totals()."""
+    return await _read(reports.calculate_totals, user_id, start_date, end_date)
+
+async def check_budget_exceedance(user_id, month, year):
+    """Async version of budget.check_budget_exceedance()."""
+    return await _read(budget.check_budget_exceedance, user_id, month, year)
+
+async def view_monthly_budgets(user_id, month, year):
+    """Async version of budget.view_monthly_budgets()."""
+    return await _read(budget.view_monthly_budgets, user_id, month, year)
+
+async def get_budget_status(user_id, category, month, year):
+    """Async version of budget.get_budget_status()."""
+    return await _read(budget.get_budget_status, user_id, category, month, year)
+
+async def check_all_budget_exceedances(month, year):
+    """Async version of budget.check_all_budget_exceedances(), returning a list."""
+    return await _read(lambda: list(budget.check_all_budget_exceedances(month, year)))
@@ -0,0 +1,188 @@
+from . import connection
+
+# Budget alerts raised at write time. The monthly rollups already are running
+# spent counters per (user, month, category, type); the rollup triggers (see
+# rollups.py) compare the expense counter with the month's budget after every
+# insert and update of a transaction, and queue an alert in budget_alerts when
+# the write moves the counter over the budget. set_monthly_budget() does the
+# same when a budget is set below what was already spent. Alerts are committed
+# together with the write that caused them.
+#
+# budget_alerts is a durable queue that any process can read with
+# get_alerts() and trim with delete_alerts(). Callbacks registered with
+# add_listener() are also called in the writing process once the write has
+# committed.
+ALERTS_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS budget_alerts (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER NOT NULL,
+                        category TEXT,
+                        month INTEGER NOT NULL,
+                        year INTEGER NOT NULL,
+                        budget_amount REAL NOT NULL,
+                        total_spent REAL NOT NULL,
+                        created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))  -- UTC
+                    )'''
+ALERTS_USER_INDEX_SQL = "CREATE INDEX IF NOT EXISTS idx_budget_alerts_user ON budget_alerts (user_id, id)"
+
+INSERT_ALERT_SQL = """
+    INSERT INTO budget_alerts (user_id, category, month, year, budget_amount, total_spent)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+NEW_ALERTS_SQL = """
+    SELECT id, user_id, category, month, year, budget_amount, total_spent, created_at
+    FROM budget_alerts WHERE id > ? ORDER BY id
+"""
+
+_listeners = []
+
+# Function to create the alert queue
+def create_alerts_schema(conn=None):
+    """
+    Creates the budget_alerts table.
+
+    Args:
+        conn (sqlite3.Connection, optional): Connection to use. Defaults to the pooled connection.
+    """
+    if conn is None:
+        conn = connection.get_connection()
+    conn.execute(ALERTS_TABLE_SQL)
+    conn.execute(ALERTS_USER_INDEX_SQL)
+
+# Function to convert an alert row to a dict
+def _to_alert(row):
+    alert_id, user_id, category, month, year, budget_amount, total_spent, created_at = row
+    return {
+        "id": alert_id,
+        "user_id": user_id,
+        "category": category,
+        "month": month,
+        "year": year,
+        "budget_amount": budget_amount,
+        "total_spent": total_spent,
+        "over_budget": total_spent - budget_amount,
+        "created_at": created_at
+    }
+
+# Function to register a callback for new budget alerts
+def add_listener(callback):
+    """
+    Registers a function that is called with every alert raised by this process.
+
+    Callbacks run in the writing thread after the write has committed. An
+    exception raised by a callback propagates to the caller of the write.
+
+    Args:
+        callback (callable): Called as callback(alert) with an alert dict (see get_alerts()).
+    """
+    if callback not in _listeners:
+        _listeners.append(callback)
+
+# Function to unregister an alert callback
+def remove_listener(callback):
+    """
+    Args:
+        callback (callable): A function passed to add_listener().
+    """
+    if callback in _listeners:
+        _listeners.remove(callback)
+
+# Function to remember where the alert queue stood before a write
+def mark(cursor):
+    """
+    Returns the newest alert ID before a write, or None if nobody listens.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor of the connection about to write.
+
+    Returns:
+        int or None: Pass it to collect() after the write.
+    """
+    if not _listeners:
+        return None
+    cursor.execute("SELECT IFNULL(MAX(id), 0) FROM budget_alerts")
+    return cursor.fetchone()[0]
+
+# Function to read the alerts a write has just raised
+def collect(cursor, since, user_id=None):
+    """
+    Returns the alerts a write raised, for notify() once it has committed.
+
+    Must be called inside the write's transaction, before it commits.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor of the connection that wrote.
+        since (int or None): The value mark() returned before the write.
+        user_id (int, optional): The user written to. Restricts the alerts to
+            that user, in case another process wrote between mark() and the write.
+
+    Returns:
+        list: Alert dicts; empty if nobody listens.
+    """
+    if since is None or not _listeners:
+        return []
+    cursor.execute(NEW_ALERTS_SQL, (since,))
+    return [_to_alert(row) for row in cursor.fetchall() if user_id is None or row[1] == user_id]
+
+# Function to call the listeners with alerts once their write has committed
+def notify(raised):
+    """
+    Calls the listeners with each alert after the current write commits.
+
+    Call it after connection.commit(); inside a group commit the listeners
+    run when the group commits, and not at all if it rolls back.
+
+    Args:
+        raised (list): Alerts returned by collect().
+    """
+    if raised:
+        connection.after_commit(lambda: _call_listeners(raised))
+
+def _call_listeners(raised):
+    for alert in raised:
+        for callback in list(_listeners):
+            callback(alert)
+
+# Function to read queued alerts
+def get_alerts(user_id=None, after_id=0, limit=100):
+    """
+    Returns queued alerts in the order they were raised.
+
+    Poll with the last ID seen as after_id to consume the queue incrementally.
+    Reads the current database; when sharded, each shard keeps its own queue
+    (see connection.use_database() and sharding.shard_file()).
+
+    Args:
+        user_id (int, optional): Only return this user's alerts.
+        after_id (int): Only return alerts with a larger ID.
+        limit (int): Maximum number of alerts.
+
+    Returns:
+        list: Alert dicts with id, user_id, category, month, year, budget_amount,
+        total_spent, over_budget and created_at.
+    """
+    conn = connection.get_connection()
+    sql = ("SELECT id, user_id, category, month, year, budget_amount, total_spent, created_at "
+           "FROM budget_alerts WHERE id > ?")
+    params = [after_id]
+    if user_id is not None:
+        sql += " AND user_id = ?"
+        params.append(user_id)
+    sql += " ORDER BY id LIMIT ?"
+    params.append(limit)
+    return [_to_alert(row) for row in conn.execute(sql, params)]
+
+# Function to remove alerts that have been handled
+def delete_alerts(up_to_id):
+    """
+    Deletes every queued alert up to and including an ID.
+
+    Args:
+        up_to_id (int): The last alert ID that was handled.
+
+    Returns:
+        int: Number of alerts deleted.
+    """
+    conn = connection.get_connection()
+    cursor = conn.execute("DELETE FROM budget_alerts WHERE id <= ?", (up_to_id,))
+    connection.commit(conn)
+    return cursor.rowcount
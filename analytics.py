@@ -0,0 +1,393 @@
+import os
+
+try:
+    import numpy as np
+except ImportError:  # optional, only needed for the analytics engine
+    np = None
+
+from . import archive, connection, schema, sharding
+
+# In-memory columnar copy of one user's transactions for dashboard queries.
+# A "ledger" is a dict of NumPy arrays sorted by date:
+#   days      int32  days since 1970-01-01
+#   cents     int64  amount in minor units
+#   income    bool   True for income, False for expense
+#   codes     int32  index into ledger["categories"]
+# Many windows are answered at once with binary searches over prefix sums
+# and bincount, instead of one SQL round-trip per window.
+#
+# A ledger is read from the user's shard and includes the archived years
+# (see archive.py); archived rows are read-only, so refreshing only needs
+# the new rows of the hot database. The ledger also records the shard file,
+# the IDs of its hot rows and the change log position (see changelog.py) it
+# was read at: when the user moved to another shard, or the log shows an
+# update or delete of a loaded row, refreshing reloads the whole ledger.
+
+LOAD_SQL = """
+    SELECT e.id, e.date, e.type, IFNULL(c.name, ''), e.amount_cents
+    FROM transaction_entries AS e
+    LEFT JOIN categories AS c ON c.id = e.category_id
+    WHERE e.user_id = ? AND e.id > ?
+    ORDER BY e.id
+"""
+# End of the change log; sqlite_sequence keeps counting after the log is pruned
+LOG_POSITION_SQL = "SELECT IFNULL((SELECT seq FROM sqlite_sequence WHERE name = 'change_log'), 0)"
+CHANGED_IDS_SQL = """
+    SELECT row_id FROM change_log
+    WHERE seq > ? AND table_name = 'transactions' AND op IN ('U', 'D')
+"""
+FETCH_BATCH_SIZE = 10000
+
+# Function to fail clearly when NumPy is not installed
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("The analytics module requires the 'numpy' package")
+
+# Function to convert 'YYYY-MM-DD' strings (or one string) to day numbers
+def to_days(dates):
+    """
+    Converts dates to integer days since 1970-01-01.
+
+    Args:
+        dates (str or list): One 'YYYY-MM-DD' string or a sequence of them.
+
+    Returns:
+        int or numpy.ndarray: The day number(s).
+    """
+    _require_numpy()
+    if isinstance(dates, str):
+        return int(np.datetime64(dates, 'D').astype(np.int64))
+    return np.asarray(dates, dtype='datetime64[D]').astype(np.int32)
+
+# Function to convert day numbers back to 'YYYY-MM-DD' strings
+def from_days(days):
+    """
+    Converts day numbers to 'YYYY-MM-DD' strings.
+
+    Args:
+        days (numpy.ndarray): Days since 1970-01-01.
+
+    Returns:
+        numpy.ndarray: ISO date strings.
+    """
+    _require_numpy()
+    return np.datetime_as_string(np.asarray(days).astype('datetime64[D]'))
+
+# Function to read transaction rows newer than last_id into column arrays
+def _fetch_columns(conn, user_id, last_id, categories, category_index):
+    ids, dates, income, codes, cents = [], [], [], [], []
+    cursor = conn.execute(LOAD_SQL, (user_id, last_id))
+    while True:
+        rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+        if not rows:
+            break
+        for row_id, date, transaction_type, category, amount_cents in rows:
+            code = category_index.get(category)
+            if code is None:
+                code = category_index[category] = len(categories)
+                categories.append(category)
+            ids.append(row_id)
+            dates.append(date[:10])
+            income.append(transaction_type == schema.TYPE_INCOME)
+            codes.append(code)
+            cents.append(amount_cents)
+    return {
+        "ids": np.asarray(ids, dtype=np.int64),
+        "days": to_days(dates) if dates else np.empty(0, dtype=np.int32),
+        "cents": np.asarray(cents, dtype=np.int64),
+        "income": np.asarray(income, dtype=bool),
+        "codes": np.asarray(codes, dtype=np.int32),
+    }
+
+# Function to get the shard file, log position and changed row IDs since a position
+@sharding.by_user
+def _read_changes(user_id, seq, conn=None):
+    if conn is None:
+        conn = connection.get_connection()
+    shard = os.path.abspath(connection.current_db_path())
+    position = conn.execute(LOG_POSITION_SQL).fetchone()[0]
+    first = conn.execute("SELECT MIN(seq) FROM change_log").fetchone()[0]
+    if (first or position + 1) > seq + 1:
+        # Pruned entries may have changed anything
+        return shard, position, None
+    changed = [row_id for (row_id,) in conn.execute(CHANGED_IDS_SQL, (seq,))]
+    return shard, position, np.asarray(changed, dtype=np.int64)
+
+# Function to read a user's rows newer than last_id from the user's shard
+@sharding.by_user
+def _fetch_new_columns(user_id, last_id, categories, category_index, conn=None):
+    if conn is None:
+        conn = connection.get_connection()
+    return _fetch_columns(conn, user_id, last_id, categories, category_index)
+
+# Function to sort the ledger columns by date and rebuild the prefix sums
+def _index_ledger(ledger):
+    order = np.argsort(ledger["days"], kind='stable')
+    for column in ("days", "cents", "income", "codes"):
+        ledger[column] = ledger[column][order]
+    signed_income = np.where(ledger["income"], ledger["cents"], 0)
+    signed_expense = np.where(ledger["income"], 0, ledger["cents"])
+    # Prefix sums with a leading zero: the sum of rows [lo, hi) is p[hi] - p[lo]
+    ledger["income_prefix"] = np.concatenate(([0], np.cumsum(signed_income)))
+    ledger["expense_prefix"] = np.concatenate(([0], np.cumsum(signed_expense)))
+
+# Function to load one user's transactions into a columnar ledger
+@sharding.by_user
+def load_ledger(user_id, conn=None):
+    """
+    Loads all transactions of a user into compact NumPy arrays.
+
+    Rows are read from the user's shard and from every archived year.
+
+    Args:
+        user_id (int): The ID of the user.
+        conn (sqlite3.Connection, optional): Connection to use. Defaults to the pooled connection
+            of the user's shard.
+
+    Returns:
+        dict: The ledger (see the module comment for its columns).
+    """
+    _require_numpy()
+    if conn is None:
+        conn = connection.get_connection()
+    # Read before the rows: changes in between are seen as changes by the next refresh
+    seq = conn.execute(LOG_POSITION_SQL).fetchone()[0]
+    categories, category_index = [], {}
+    columns = _fetch_columns(conn, user_id, 0, categories, category_index)
+    hot_ids = columns["ids"]
+    last_id = int(columns["ids"].max()) if len(columns["ids"]) else 0
+    archived = [_fetch_columns(archive_conn, user_id, 0, categories, category_index)
+                for archive_conn in archive.archived_connections(0, 9999, conn)]
+    if archived:
+        columns = {name: np.concatenate([columns[name]] + [part[name] for part in archived])
+                   for name in columns}
+    ledger = {
+        "user_id": user_id,
+        "shard": os.path.abspath(connection.current_db_path()),
+        "seq": seq,
+        "ids": hot_ids,
+        "last_id": last_id,
+        "categories": categories,
+        "category_index": category_index,
+        "days": columns["days"],
+        "cents": columns["cents"],
+        "income": columns["income"],
+        "codes": columns["codes"],
+    }
+    _index_ledger(ledger)
+    return ledger
+
+# Function to bring a ledger up to date with the user's transactions
+def refresh_ledger(ledger, conn=None):
+    """
+    Appends rows with an id greater than the last loaded id.
+
+    Only new rows are read, unless the user moved to another shard (new IDs
+    may then be lower than the loaded ones) or the change log shows an update
+    or delete of a loaded row since the last read: the ledger is then
+    reloaded in place with load_ledger().
+
+    Args:
+        ledger (dict): A ledger from load_ledger().
+        conn (sqlite3.Connection, optional): Connection to use. Defaults to the pooled connection
+            of the user's shard.
+
+    Returns:
+        int: The number of rows appended, or of all rows after a reload.
+    """
+    _require_numpy()
+    shard, seq, changed = _read_changes(ledger["user_id"], ledger["seq"], conn)
+    if shard != ledger["shard"] or changed is None or np.isin(changed, ledger["ids"]).any():
+        ledger.update(load_ledger(ledger["user_id"], conn))
+        return len(ledger["days"])
+
+    columns = _fetch_new_columns(ledger["user_id"], ledger["last_id"],
+                                 ledger["categories"], ledger["category_index"], conn)
+    ledger["seq"] = seq
+    added = len(columns["ids"])
+    if not added:
+        return 0
+    for column in ("ids", "days", "cents", "income", "codes"):
+        ledger[column] = np.concatenate((ledger[column], columns[column]))
+    ledger["last_id"] = int(columns["ids"].max())
+    _index_ledger(ledger)
+    return added
+
+# Function to find the row slices of many inclusive date windows at once
+def _window_bounds(ledger, windows):
+    starts = to_days([start for start, _ in windows])
+    ends = to_days([end for _, end in windows])
+    lo = np.searchsorted(ledger["days"], starts, side='left')
+    hi = np.searchsorted(ledger["days"], ends, side='right')
+    return lo, hi
+
+# Function to total income, expenses and savings for many windows at once
+def window_totals(ledger, windows):
+    """
+    Calculates income, expenses and savings for many date windows in one pass.
+
+    Args:
+        ledger (dict): A ledger from load_ledger().
+        windows (list): (start_date, end_date) pairs, both inclusive, as 'YYYY-MM-DD'.
+
+    Returns:
+        dict: Arrays "total_income", "total_expenses" and "savings", one value per window.
+    """
+    _require_numpy()
+    lo, hi = _window_bounds(ledger, windows)
+    income = (ledger["income_prefix"][hi] - ledger["income_prefix"][lo]) / 100
+    expenses = (ledger["expense_prefix"][hi] - ledger["expense_prefix"][lo]) / 100
+    return {"total_income": income, "total_expenses": expenses, "savings": income - expenses}
+
+# Function to break down spending per category for many windows at once
+def category_breakdown(ledger, windows, transaction_type='expense'):
+    """
+    Sums transactions per category for each date window.
+
+    Args:
+        ledger (dict): A ledger from load_ledger().
+        windows (list): (start_date, end_date) pairs, both inclusive.
+        transaction_type (str): 'expense' or 'income'.
+
+    Returns:
+        dict: {"categories": list of names, "totals": array of shape (windows, categories)}.
+    """
+    _require_numpy()
+    lo, hi = _window_bounds(ledger, windows)
+    n_categories = len(ledger["categories"])
+    weights = np.where(ledger["income"] == (transaction_type == 'income'), ledger["cents"], 0)
+    totals = np.zeros((len(windows), n_categories), dtype=np.int64)
+    for i, (a, b) in enumerate(zip(lo, hi)):
+        if b > a:
+            totals[i] = np.bincount(ledger["codes"][a:b], weights=weights[a:b],
+                                    minlength=n_categories).astype(np.int64)
+    return {"categories": list(ledger["categories"]), "totals": totals / 100}
+
+# Function to group totals by calendar month and category
+def monthly_by_category(ledger, transaction_type='expense'):
+    """
+    Groups a user's transactions by calendar month and category.
+
+    Args:
+        ledger (dict): A ledger from load_ledger().
+        transaction_type (str): 'expense' or 'income'.
+
+    Returns:
+        dict: {"months": array of 'YYYY-MM' labels, "categories": list of names,
+        "totals": array of shape (months, categories)}.
+    """
+    _require_numpy()
+    if not len(ledger["days"]):
+        return {"months": np.empty(0, dtype='<U7'), "categories": list(ledger["categories"]),
+                "totals": np.zeros((0, len(ledger["categories"])))}
+    month_numbers = ledger["days"].astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    first = month_numbers[0]
+    n_months = int(month_numbers[-1] - first) + 1
+    n_categories = len(ledger["categories"])
+    selected = ledger["income"] == (transaction_type == 'income')
+    flat = (month_numbers[selected] - first) * n_categories + ledger["codes"][selected]
+    totals = np.bincount(flat, weights=ledger["cents"][selected], minlength=n_months * n_categories)
+    labels = np.datetime_as_string(np.arange(first, first + n_months).astype('datetime64[M]'))
+    return {"months": labels, "categories": list(ledger["categories"]),
+            "totals": totals.reshape(n_months, n_categories) / 100}
+
+# Function to compute month totals and month-over-month changes
+def month_over_month(ledger):
+    """
+    Calculates monthly income, expenses and savings and their change from the previous month.
+
+    Args:
+        ledger (dict): A ledger from load_ledger().
+
+    Returns:
+        dict: Arrays "months", "total_income", "total_expenses", "savings" and
+        the matching "*_delta" arrays (the first month's delta is 0).
+    """
+    _require_numpy()
+    income = monthly_by_category(ledger, 'income')
+    expenses = monthly_by_category(ledger, 'expense')
+    result = {
+        "months": income["months"],
+        "total_income": income["totals"].sum(axis=1),
+        "total_expenses": expenses["totals"].sum(axis=1),
+    }
+    result["savings"] = result["total_income"] - result["total_expenses"]
+    for key in ("total_income", "total_expenses", "savings"):
+        result[key + "_delta"] = np.diff(result[key], prepend=result[key][:1])
+    return result
+
+# Function to build daily income/expense series over a date range
+def _daily_series(ledger, start_date, end_date):
+    start = to_days(start_date)
+    n_days = to_days(end_date) - start + 1
+    lo, hi = _window_bounds(ledger, [(start_date, end_date)])
+    a, b = int(lo[0]), int(hi[0])
+    offsets = ledger["days"][a:b] - start
+    income_mask = ledger["income"][a:b]
+    cents = ledger["cents"][a:b]
+    income = np.bincount(offsets[income_mask], weights=cents[income_mask], minlength=n_days)
+    expense = np.bincount(offsets[~income_mask], weights=cents[~income_mask], minlength=n_days)
+    return start, income / 100, expense / 100
+
+# Function to compute rolling averages of daily spending or income
+def rolling_average(ledger, start_date, end_date, window_days=(30, 90), transaction_type='expense'):
+    """
+    Calculates trailing rolling averages of the daily totals.
+
+    Each value averages the window_days days ending on (and including) that day,
+    counting days without transactions as zero.
+
+    Args:
+        ledger (dict): A ledger from load_ledger().
+        start_date (str): First day of the output series (YYYY-MM-DD).
+        end_date (str): Last day of the output series (YYYY-MM-DD).
+        window_days (int or tuple): One or several window lengths in days.
+        transaction_type (str): 'expense', 'income' or 'savings'.
+
+    Returns:
+        dict: {"dates": array of 'YYYY-MM-DD', <window length>: array of averages, ...}.
+    """
+    _require_numpy()
+    if isinstance(window_days, int):
+        window_days = (window_days,)
+    longest = max(window_days)
+    # Start the series early enough that the first output day has a full window
+    padded_start = str(np.datetime64(start_date, 'D') - (longest - 1))
+    start, income, expense = _daily_series(ledger, padded_start, end_date)
+    series = {'income': income, 'expense': expense, 'savings': income - expense}[transaction_type]
+    prefix = np.concatenate(([0.0], np.cumsum(series)))
+
+    result = {"dates": from_days(np.arange(start + longest - 1, start + len(series)))}
+    for days in window_days:
+        sums = prefix[days:] - prefix[:-days]
+        result[days] = sums[longest - days:] / days
+    return result
+
+# Function to compute cumulative savings day by day
+def cumulative_savings(ledger, start_date=None, end_date=None):
+    """
+    Calculates the running total of income minus expenses for each day.
+
+    Args:
+        ledger (dict): A ledger from load_ledger().
+        start_date (str, optional): First day. Defaults to the first transaction.
+        end_date (str, optional): Last day. Defaults to the last transaction.
+
+    Returns:
+        dict: {"dates": array of 'YYYY-MM-DD', "savings": array of running totals}.
+        The running total includes every transaction before start_date.
+    """
+    _require_numpy()
+    if not len(ledger["days"]):
+        return {"dates": np.empty(0, dtype='<U10'), "savings": np.empty(0)}
+    if start_date is None:
+        start_date = str(from_days(ledger["days"][:1])[0])
+    if end_date is None:
+        end_date = str(from_days(ledger["days"][-1:])[0])
+
+    start, income, expense = _daily_series(ledger, start_date, end_date)
+    # Everything before the range is carried in as the opening balance
+    lo = int(np.searchsorted(ledger["days"], start, side='left'))
+    opening = (ledger["income_prefix"][lo] - ledger["expense_prefix"][lo]) / 100
+    savings = opening + np.cumsum(income - expense)
+    return {"dates": from_days(np.arange(start, start + len(savings))), "savings": savings}
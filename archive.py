@@ -0,0 +1,342 @@
+import argparse
+import os
+import sqlite3
+import threading
+
+from . import backup, connection, rollups, schema, sharding
+
+# Hot/cold split of the transaction entries. Reports and budget checks mostly
+# read the current and previous year, so archive_years() moves the entries of
+# older years out of the database into one SQLite file per year, next to it:
+#   <database stem>.archive-<year>-<version>.db
+# An archive file holds the year's transaction_entries (with the
+# (user_id, type, date, amount_cents) index), a copy of the categories and
+# the year's monthly_rollups. The archived_years table of the hot database
+# records which file holds each year.
+#
+# The monthly rollups of archived years stay in the hot database: they are
+# small, and monthly and yearly reports, budget checks and forecasts keep
+# reading them without touching an archive. Only totals over raw entries add the archived
+# years their period covers (reports.get_totals() and the prefix-sum index).
+#
+# Archive files are never modified or deleted. Archiving a year again (e.g.
+# after transactions were added with an old date) writes the next version of
+# the file with the old and new rows and switches archived_years to it in the
+# same transaction that deletes the rows from the hot database, so readers
+# always see every row exactly once. The previous version stays on disk:
+# snapshots and point-in-time restores taken before still name it in their
+# archived_years, and readers that resolved it just before the switch may
+# still be reading it. After a restore to an older snapshot the next version
+# number may already be taken by a file that later snapshots use, so the
+# first unused number is taken instead. superseded_archives() lists earlier
+# versions; delete them once no backup taken before the re-archive is kept.
+# Archives are opened read-only and immutable, on demand and once per thread,
+# and only by reports whose period includes an archived year.
+#
+# Archived transactions are read-only: update and delete only reach the hot
+# database. New transactions dated in an archived year are added to the hot
+# database until that year is archived again.
+ARCHIVED_YEARS_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS archived_years (
+                        year INTEGER PRIMARY KEY,
+                        file TEXT NOT NULL,          -- relative to the directory of this database
+                        version INTEGER NOT NULL,
+                        row_count INTEGER NOT NULL,
+                        archived_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))  -- UTC
+                    )'''
+
+ARCHIVES_BETWEEN_SQL = "SELECT year, file FROM archived_years WHERE year BETWEEN ? AND ? ORDER BY year"
+# Rows of users that moved to another shard are left alone: they cannot be
+# deleted until purge_moved_users() removes them (see sharding.py)
+YEARS_BEFORE_SQL = """
+    SELECT CAST(substr(date, 1, 4) AS INTEGER) AS year, COUNT(*) FROM transaction_entries
+    WHERE date < ? AND user_id NOT IN (SELECT user_id FROM moved_users)
+    GROUP BY year
+    ORDER BY year
+"""
+YEAR_ENTRIES_SQL = """
+    SELECT id, user_id, type, category_id, amount_cents, date FROM hot.transaction_entries
+    WHERE date >= ? AND date < ? AND user_id NOT IN (SELECT user_id FROM hot.moved_users)
+"""
+DELETE_YEAR_SQL = """
+    DELETE FROM transaction_entries
+    WHERE date >= ? AND date < ? AND user_id NOT IN (SELECT user_id FROM moved_users)
+"""
+ROLLUP_COLUMNS = "user_id, year, month, category_id, type, total_cents, count"
+
+# Open archive connections of the current thread: path -> connection
+_local = threading.local()
+
+# Function to create the archive registry
+def create_archive_schema(conn=None):
+    """
+    Creates the archived_years table.
+
+    Args:
+        conn (sqlite3.Connection, optional): Connection to use. Defaults to the pooled connection.
+    """
+    if conn is None:
+        conn = connection.get_connection()
+    conn.execute(ARCHIVED_YEARS_TABLE_SQL)
+
+# Function to build the file name of an archive
+def _archive_file(db_path, year, version):
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    return f"{stem}.archive-{year}-{version}.db"
+
+# Function to resolve an archive file name against its hot database
+def _archive_path(db_path, file):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), file)
+
+# Function to get the current thread's read-only connection to an archive file
+def _reader(path):
+    readers = getattr(_local, "readers", None)
+    if readers is None:
+        readers = _local.readers = {}
+    conn = readers.get(path)
+    if conn is None:
+        conn = readers[path] = connection.connect_read_only(path, immutable=True)
+    return conn
+
+# Function to get the archives holding part of a period
+def archived_connections(start, end, conn=None):
+    """
+    Returns read-only connections to the archives of the years in a period.
+
+    Reads the archived_years table of the current database (see
+    connection.use_database()); for a period of hot years that is a single
+    primary key lookup and no archive is opened.
+
+    Args:
+        start (int or str): First year, or a YYYY-MM-DD date in it.
+        end (int or str): Last year, or a YYYY-MM-DD date in it.
+        conn (sqlite3.Connection, optional): Connection to the current database. Defaults to the pooled connection.
+
+    Returns:
+        list: sqlite3.Connection objects, one per archived year, oldest first.
+    """
+    if conn is None:
+        conn = connection.get_connection()
+    rows = conn.execute(ARCHIVES_BETWEEN_SQL, (str(start)[:4], str(end)[:4])).fetchall()
+    if not rows:
+        return []
+    db_path = connection.current_db_path()
+    return [_reader(_archive_path(db_path, file)) for _, file in rows]
+
+# Function to read the rollups stored in every archive of a database
+def archived_rollups(conn):
+    """
+    Yields the monthly_rollups rows of all archives of a database.
+
+    Used to rebuild and verify the rollups, which keep counting archived rows.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the hot database.
+
+    Yields:
+        tuple: (user_id, year, month, category_id, type, total_cents, count).
+    """
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'archived_years'").fetchone():
+        return
+    db_path = conn.execute("PRAGMA database_list").fetchone()[2]
+    for (file,) in conn.execute("SELECT file FROM archived_years ORDER BY year").fetchall():
+        yield from _reader(_archive_path(db_path, file)).execute(f"SELECT {ROLLUP_COLUMNS} FROM monthly_rollups")
+
+# Function to close the archive connections of the current thread
+def close_archives():
+    """
+    Closes the archive files opened by the current thread.
+    """
+    readers = getattr(_local, "readers", None) or {}
+    _local.readers = {}
+    for conn in readers.values():
+        conn.close()
+
+# Function to write the next version of a year's archive file
+def _write_archive(path, db_path, year, previous_path):
+    start, end = f"{year:04d}-01-01", f"{year + 1:04d}-01-01"
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute(schema.CATEGORIES_TABLE_SQL)
+        conn.execute(schema.ENTRIES_TABLE_SQL)
+        conn.execute(rollups.ROLLUP_TABLE_SQL)
+        conn.execute("ATTACH DATABASE ? AS hot", (db_path,))
+        conn.execute("INSERT INTO categories (id, name) SELECT id, name FROM hot.categories")
+        if previous_path:
+            conn.execute("ATTACH DATABASE ? AS previous", (previous_path,))
+            conn.execute("INSERT INTO transaction_entries SELECT * FROM previous.transaction_entries")
+        conn.execute("INSERT INTO transaction_entries " + YEAR_ENTRIES_SQL, (start, end))
+        # Indexed after the bulk copy, which is faster than maintaining it row by row
+        conn.execute(backup.INDEXES["idx_entries_user_type_date"])
+        rollups.rebuild_rollups(conn, commit=False)
+        count = conn.execute("SELECT COUNT(*) FROM transaction_entries").fetchone()[0]
+        conn.commit()
+    finally:
+        conn.close()
+    return count
+
+# Function to move one year of the current database into its archive
+def _archive_year(conn, db_path, year):
+    start, end = f"{year:04d}-01-01", f"{year + 1:04d}-01-01"
+    # The write lock keeps other writers out from the copy until the rows are
+    # deleted; the archive is written through its own connection, which reads
+    # the same committed rows
+    conn.execute("BEGIN IMMEDIATE")
+    path = None
+    try:
+        row = conn.execute("SELECT file, version FROM archived_years WHERE year = ?", (year,)).fetchone()
+        # The previous version is kept (see above)
+        previous_path = _archive_path(db_path, row[0]) if row else None
+        version = row[1] + 1 if row else 1
+        # An existing file of that version is left alone: it may be referenced
+        # by a snapshot taken before this database was restored to an older one
+        while os.path.exists(_archive_path(db_path, _archive_file(db_path, year, version))):
+            version += 1
+        file = _archive_file(db_path, year, version)
+        path = _archive_path(db_path, file)
+        count = _write_archive(path, db_path, year, previous_path)
+
+        log_end = conn.execute("SELECT IFNULL(MAX(seq), 0) FROM change_log").fetchone()[0]
+        # The delete triggers would take the moved rows out of the rollups,
+        # which keep counting them
+        conn.execute(f"CREATE TEMP TABLE moved_rollups AS SELECT {ROLLUP_COLUMNS} "
+                     "FROM monthly_rollups WHERE year = ?", (year,))
+        moved = conn.execute(DELETE_YEAR_SQL, (start, end)).rowcount
+        conn.execute("DELETE FROM monthly_rollups WHERE year = ?", (year,))
+        conn.execute(f"INSERT INTO monthly_rollups ({ROLLUP_COLUMNS}) SELECT * FROM temp.moved_rollups")
+        conn.execute("DROP TABLE temp.moved_rollups")
+        # Moving rows is not a change of the data, so the deletes are kept out
+        # of the change log: replaying it onto an older snapshot leaves the rows
+        # in the database, which is just as consistent
+        conn.execute("DELETE FROM change_log WHERE seq > ?", (log_end,))
+        conn.execute("INSERT OR REPLACE INTO archived_years (year, file, version, row_count) VALUES (?, ?, ?, ?)",
+                     (year, file, version, count))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        if path and os.path.exists(path):
+            os.remove(path)
+        raise
+    return moved
+
+# Function to archive the years before a cutoff in the current database
+def _archive_current(before_year, vacuum, progress):
+    conn = connection.get_connection()
+    db_path = connection.current_db_path()
+    if conn.in_transaction:
+        raise RuntimeError("archive_years() cannot run inside an open transaction")
+
+    result = {"years": [], "moved": 0}
+    for year, _ in conn.execute(YEARS_BEFORE_SQL, (f"{int(before_year):04d}-01-01",)).fetchall():
+        result["moved"] += _archive_year(conn, db_path, year)
+        result["years"].append(year)
+        if progress:
+            progress(year)
+    if vacuum and result["years"]:
+        conn.execute("VACUUM")
+    return result
+
+# Function to move the transactions of old years into per-year archive files
+def archive_years(before_year, vacuum=False, progress=None):
+    """
+    Moves every transaction dated before a year into per-year archive files.
+
+    Reports keep returning the same figures: the monthly rollups stay in the
+    database, and calculate_totals() adds the archived years its period
+    covers. The archive files must be backed up alongside the database.
+
+    When sharded, each shard archives its own rows into files next to it;
+    users moved between shards afterwards take their archived transactions
+    along into the target's database (see sharding.move_user()).
+
+    Args:
+        before_year (int): Years before this one are archived.
+        vacuum (bool): VACUUM the database afterwards so the file shrinks.
+        progress (callable, optional): Called with each year once it is archived.
+
+    Returns:
+        dict: "years" archived and the number of transactions "moved".
+    """
+    result = {"years": [], "moved": 0}
+    for _, shard_result in sharding.fan_out(_archive_current, before_year, vacuum, progress):
+        result["years"] = sorted(set(result["years"]) | set(shard_result["years"]))
+        result["moved"] += shard_result["moved"]
+    return result
+
+# Function to list the archived years of the current database
+def list_archives():
+    """
+    Returns:
+        list: Dicts with year, file, version, row_count and archived_at, oldest year first.
+    """
+    conn = connection.get_connection()
+    cursor = conn.execute("SELECT year, file, version, row_count, archived_at FROM archived_years ORDER BY year")
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor]
+
+# Function to find the archive files that a newer version replaced
+def superseded_archives():
+    """
+    Returns the earlier versions of the current database's archive files.
+
+    They are no longer read, but backups taken before their year was archived
+    again still refer to them.
+
+    Returns:
+        list: File names, relative to the directory of the database.
+    """
+    db_path = connection.current_db_path()
+    current = {entry["year"]: entry["version"] for entry in list_archives()}
+    # <database stem>.archive-<year>-<version>.db, as built by _archive_file()
+    prefix = os.path.splitext(os.path.basename(db_path))[0] + ".archive-"
+    files = []
+    for file in sorted(os.listdir(os.path.dirname(os.path.abspath(db_path)))):
+        if not (file.startswith(prefix) and file.endswith(".db")):
+            continue
+        try:
+            year, version = (int(part) for part in file[len(prefix):-3].split("-"))
+        except ValueError:
+            continue
+        if version < current.get(year, 0):
+            files.append(file)
+    return files
+
+# Command line entry point: python -m <package>.archive [status|run BEFORE_YEAR]
+def main(argv=None):
+    """
+    Shows the archived years or archives the years before a cutoff.
+
+    Args:
+        argv (list, optional): Command line arguments without the program name.
+
+    Returns:
+        int: Process exit code.
+    """
+    parser = argparse.ArgumentParser(description="Archive old years of transactions.")
+    parser.add_argument("--db", help="Database file (defaults to the configured path)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="list the archived years")
+    run = commands.add_parser("run", help="archive every year before BEFORE_YEAR")
+    run.add_argument("before_year", type=int)
+    run.add_argument("--vacuum", action="store_true", help="shrink the database file afterwards")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        connection.configure(db_path=args.db)
+    if args.command == "run":
+        result = archive_years(args.before_year, vacuum=args.vacuum,
+                               progress=lambda year: print(f"Archived {year}"))
+        print(f"Moved {result['moved']} transactions from {len(result['years'])} years.")
+        return 0
+
+    archives = list_archives()
+    if not archives:
+        print("No archived years.")
+    for entry in archives:
+        print(f"{entry['year']}: {entry['row_count']} transactions in {entry['file']} "
+              f"(archived {entry['archived_at']})")
+    for file in superseded_archives():
+        print(f"Superseded: {file} (delete once no older backup needs it)")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,107 +1,266 @@
 import sqlite3
 import shutil
 import os
+import gzip
+import tempfile
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for zstd-compressed backups
+    zstandard = None
+
+from . import connection, export, migrations, prefix_index, report_cache, sharding
+
+# Online backup tuning: pages copied per step and the pause between steps
+DEFAULT_PAGES_PER_STEP = 1024
+DEFAULT_STEP_SLEEP = 0.005
+COPY_BUFFER_SIZE = 1024 * 1024
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+
+# Indexes managed by ensure_indexes(). The transaction entry indexes include
+# every column the report and budget queries read, so those queries are
+# answered from the index alone without touching the table.
+INDEXES = {
+    "idx_entries_user_type_date": (
+        "CREATE INDEX IF NOT EXISTS idx_entries_user_type_date "
+        "ON transaction_entries (user_id, type, date, amount_cents)"
+    ),
+    "idx_entries_user_category_date": (
+        "CREATE INDEX IF NOT EXISTS idx_entries_user_category_date "
+        "ON transaction_entries (user_id, category_id, type, date, amount_cents)"
+    ),
+    "idx_entries_user": (
+        "CREATE INDEX IF NOT EXISTS idx_entries_user ON transaction_entries (user_id)"
+    ),
+    "idx_budgets_period_user": (
+        "CREATE INDEX IF NOT EXISTS idx_budgets_period_user "
+        "ON budgets (year, month, user_id, category, amount)"
+    ),
+}
+
+# Indexes that earlier versions created and that are now covered by INDEXES
+RETIRED_INDEXES = ("idx_budgets_user_period",)
 
 # Function to connect to the database
-def connect_db(db_name='finance.db'):
+def connect_db(db_name=None, check_same_thread=True):
     """
-    Establishes a connection to the SQLite database.
+    Establishes a new connection to the SQLite database.
+
+    Most callers should use connection.get_connection(), which reuses a
+    tuned connection per thread instead of opening a new one on every call.
 
     Args:
-        db_name (str): The name of the database file.
+        db_name (str, optional): The name of the database file. Defaults to the
+            path configured in the connection module.
+        check_same_thread (bool): Passed through to sqlite3.connect.
 
     Returns:
         sqlite3.Connection: The connection object.
     """
-    return sqlite3.connect(db_name)
+    if db_name is None:
+        db_name = connection.get_db_path()
+    return sqlite3.connect(db_name, check_same_thread=check_same_thread)
 
 # Function to initialize the database (create tables if they don't exist)
 def initialize_db():
     """
-    Initializes the SQLite database by creating necessary tables for the application.
+    Initializes the SQLite database by applying any pending schema migrations.
+
+    Opening the pooled connection already migrates the database (see
+    migrations.py); this also covers connections opened with migration
+    turned off in connection.configure().
     """
-    conn = connect_db()
-    cursor = conn.cursor()
-
-    # Create users table
-    cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        username TEXT UNIQUE,
-                        password TEXT
-                    )''')
-
-    # Create transactions table
-    cursor.execute('''CREATE TABLE IF NOT EXISTS transactions (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER,
-                        type TEXT,            -- 'income' or 'expense'
-                        category TEXT,        -- e.g., 'Food', 'Rent', 'Salary'
-                        amount REAL,
-                        date TEXT,            -- Date of the transaction (YYYY-MM-DD)
-                        FOREIGN KEY (user_id) REFERENCES users(id)
-                    )''')
-
-    # Create budgets table
-    cursor.execute('''CREATE TABLE IF NOT EXISTS budgets (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER,
-                        category TEXT,
-                        amount REAL,
-                        month INTEGER,
-                        year INTEGER,
-                        FOREIGN KEY (user_id) REFERENCES users(id)
-                    )''')
-
-    conn.commit()
-    conn.close()
+    migrations.migrate(connection.get_connection())
 
     print("Database initialized successfully!")
 
+# Function to create the managed indexes
+def ensure_indexes(conn=None):
+    """
+    Creates any missing index from INDEXES, drops RETIRED_INDEXES and
+    refreshes planner statistics.
+
+    Args:
+        conn (sqlite3.Connection, optional): Connection to use. Defaults to the pooled connection.
+
+    Returns:
+        list: Names of the managed indexes.
+    """
+    if conn is None:
+        conn = connection.get_connection()
+    for name in RETIRED_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    for sql in INDEXES.values():
+        conn.execute(sql)
+    # Lets the planner choose between indexes using real statistics
+    conn.execute("PRAGMA optimize")
+    return list(INDEXES)
+
+# Function to open a compressed (or plain) file for streaming writes
+def _open_for_write(path, compression):
+    if compression is None:
+        return open(path, 'wb')
+    if compression == 'gzip':
+        return gzip.open(path, 'wb')
+    if compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("zstd compression requires the 'zstandard' package")
+        return zstandard.ZstdCompressor().stream_writer(open(path, 'wb'), closefd=True)
+    raise ValueError(f"Unknown compression {compression!r}; use None, 'gzip' or 'zstd'")
+
+# Function to open a backup file for streaming reads, based on its extension
+def _open_for_read(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError("zstd backups require the 'zstandard' package")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return open(path, 'rb')
+
+# Function to take a consistent online copy of a database into another file
+def _online_copy(db_name, target, pages, sleep, progress):
+    source = connect_db(db_name)
+    dest = sqlite3.connect(target)
+    try:
+        # Copies a few pages per step and sleeps in between so writers are not
+        # starved; pages changed by a writer mid-copy make SQLite restart the
+        # copy, so the result is always a consistent snapshot.
+        with dest:
+            source.backup(dest, pages=pages, progress=progress, sleep=sleep)
+        # The snapshot is a standalone file, so keep it out of WAL mode
+        dest.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        dest.close()
+        source.close()
+
 # Function to back up the database
-def backup_database(backup_dir='backups', db_name='finance.db'):
+def backup_database(backup_dir='backups', db_name=None, pages=DEFAULT_PAGES_PER_STEP,
+                    sleep=DEFAULT_STEP_SLEEP, progress=None, compression=None, after_copy=None):
     """
-    Backs up the SQLite database by copying it to a backup directory.
+    Backs up the live SQLite database with the SQLite online backup API.
+
+    The copy is a consistent snapshot even while other connections write. It
+    is written to a timestamped file, optionally streamed through gzip or zstd.
 
     Args:
         backup_dir (str): The directory where the backup should be saved.
-        db_name (str): The name of the database file to be backed up.
+        db_name (str, optional): The name of the database file to be backed up.
+            Defaults to the configured database path.
+        pages (int): Number of pages copied per step (-1 copies everything at once).
+        sleep (float): Seconds to sleep between steps, letting writers in.
+        progress (callable, optional): Called as progress(status, remaining, total)
+            after every step.
+        compression (str, optional): None, 'gzip' or 'zstd' (needs the zstandard package).
+        after_copy (callable, optional): Called with the path of the finished,
+            uncompressed copy, e.g. to read what the snapshot contains.
 
     Returns:
-        str: The path to the backup file.
+        str: The path to the backup file, or None if the backup failed.
     """
+    if db_name is None:
+        db_name = connection.get_db_path()
     if not os.path.exists(backup_dir):
         os.makedirs(backup_dir)
 
-    backup_file = os.path.join(backup_dir, f'backup_{db_name}')
+    stem = os.path.splitext(os.path.basename(db_name))[0]
+    timestamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    backup_file = os.path.join(backup_dir, f'backup_{stem}_{timestamp}.db')
+    if compression is not None:
+        backup_file += COMPRESSION_SUFFIXES.get(compression, '')
+
+    snapshot = backup_file if compression is None else backup_file + '.tmp'
     try:
-        shutil.copyfile(db_name, backup_file)
+        _online_copy(db_name, snapshot, pages, sleep, progress)
+        if after_copy is not None:
+            after_copy(snapshot)
+        if compression is not None:
+            with open(snapshot, 'rb') as src, _open_for_write(backup_file, compression) as dst:
+                shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+            os.remove(snapshot)
         print(f"Database backed up successfully at {backup_file}")
         return backup_file
     except Exception as e:
+        for path in {snapshot, backup_file}:
+            if os.path.exists(path):
+                os.remove(path)
         print(f"Error during backup: {e}")
         return None
 
+# Function to run SQLite's integrity check on a database file
+def check_integrity(db_file):
+    """
+    Runs PRAGMA integrity_check on a database file.
+
+    Args:
+        db_file (str): Path of the database file.
+
+    Returns:
+        bool: True if SQLite reports the file as 'ok'.
+    """
+    conn = sqlite3.connect(db_file)
+    try:
+        return conn.execute("PRAGMA integrity_check").fetchone()[0] == 'ok'
+    except sqlite3.DatabaseError:
+        return False
+    finally:
+        conn.close()
+
 # Function to restore the database from a backup
-def restore_database(backup_file, db_name='finance.db'):
+def restore_database(backup_file, db_name=None, before_swap=None):
     """
-    Restores the SQLite database from a backup file.
+    Restores the SQLite database from a (possibly compressed) backup file.
+
+    The backup is first decompressed into a temporary file next to the
+    database and integrity-checked; only then are the pooled connections
+    closed and the temporary file atomically renamed over the database.
 
     Args:
-        backup_file (str): The path to the backup file.
-        db_name (str): The name of the database file to restore.
+        backup_file (str): The path to the backup file (.db, .db.gz or .db.zst).
+        db_name (str, optional): The name of the database file to restore.
+            Defaults to the configured database path.
+        before_swap (callable, optional): Called with the path of the temporary
+            file before the integrity check, e.g. to replay a change log into it.
 
     Returns:
         bool: True if the restore was successful, False otherwise.
     """
+    if db_name is None:
+        db_name = connection.get_db_path()
     if not os.path.exists(backup_file):
         print(f"Backup file {backup_file} does not exist.")
         return False
 
+    target_dir = os.path.dirname(os.path.abspath(db_name))
+    fd, temp_file = tempfile.mkstemp(prefix='.restore-', suffix='.db', dir=target_dir)
     try:
-        shutil.copyfile(backup_file, db_name)
+        with os.fdopen(fd, 'wb') as dst, _open_for_read(backup_file) as src:
+            shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+            dst.flush()
+            os.fsync(dst.fileno())
+
+        if before_swap is not None:
+            before_swap(temp_file)
+
+        if not check_integrity(temp_file):
+            os.remove(temp_file)
+            print(f"Error during restore: {backup_file} failed the integrity check.")
+            return False
+
+        # Pooled connections must not keep using the file that is being replaced
+        connection.close_all_connections()
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(db_name + suffix):
+                os.remove(db_name + suffix)
+        os.replace(temp_file, db_name)
+        prefix_index.clear()
+        report_cache.clear()
         print(f"Database restored successfully from {backup_file}")
         return True
     except Exception as e:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
         print(f"Error during restore: {e}")
         return False
 
@@ -110,38 +269,41 @@ def view_data(user_id=None):
     """
     Displays the data stored in the database for debugging purposes.
 
+    Rows are streamed in batches, so this works on databases of any size.
+    Use export.list_rows() to browse page by page instead. When sharded, the
+    rows of all users are read from every shard in parallel (in no particular
+    order across shards); the rows of one user come from that user's shard.
+
     Args:
         user_id (int, optional): If provided, displays data for a specific user.
     """
-    conn = connect_db()
-    cursor = conn.cursor()
+    user_filter = user_id or None
 
     # Display all users
-    cursor.execute("SELECT * FROM users")
-    users = cursor.fetchall()
     print("Users:")
-    for user in users:
+    for user in export.iter_rows("users"):
         print(user)
 
     # Display all transactions (optionally filter by user_id)
-    if user_id:
-        cursor.execute("SELECT * FROM transactions WHERE user_id = ?", (user_id,))
-    else:
-        cursor.execute("SELECT * FROM transactions")
-    transactions = cursor.fetchall()
     print("\nTransactions:")
-    for transaction in transactions:
+    for transaction in _iter_user_rows("transactions", user_filter):
         print(transaction)
 
     # Display all budgets 
-    if user_id:
-        cursor.execute("SELECT * FROM budgets WHERE user_id = ?", (user_id,))
-    else:
-        cursor.execute("SELECT * FROM budgets")
-    budgets = cursor.fetchall()
     print("\nBudgets:")
-    for budget in budgets:
+    for budget in _iter_user_rows("budgets", user_filter):
         print(budget)
 
-    conn.close()
-
+# Function to stream the rows of a per-user table from the right shard(s)
+def _iter_user_rows(table, user_id):
+    if not sharding.is_sharded():
+        yield from export.iter_rows(table, user_id=user_id)
+    elif user_id is not None:
+        with connection.use_database(sharding.shard_path(user_id)):
+            yield from export.iter_rows(table, user_id=user_id)
+    else:
+        # user_id is the second column of both tables
+        for index, rows in sharding.fan_out_batches(export.iter_batches, table):
+            for row in rows:
+                if sharding.owns(index, row[1]):
+                    yield row
@@ -0,0 +1,770 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from . import (archive, backup, budget, connection, datagen, forecast, prefix_index, report_cache, reports,
+               transactions)
+from .finance_app import auth
+
+# Benchmark runner for the public functions. A seeded synthetic database is
+# generated per scale (and reused by later runs), then every case is timed
+# call by call. Results are plain JSON, so a run can be saved as a baseline
+# and later runs compared against it.
+
+# Scales: name -> (users, transactions per user)
+SCALES = {
+    "10k": (100, 100),
+    "1m": (1000, 1000),
+    "10m": (10000, 1000),
+}
+DEFAULT_ITERATIONS = 200
+# Cases that copy the whole database run far fewer iterations
+SLOW_CASE_ITERATIONS = {"view_data": 20, "backup_database": 3, "restore_database": 3}
+DEFAULT_STARTUP_REPEATS = 20
+DEFAULT_LOGIN_THREADS = 8
+DEFAULT_LOGINS = 200
+SESSION_LOOKUPS = 20000
+# Multi-year data for measure_archive(): (users, transactions per user, first month, months)
+ARCHIVE_DATASET = (200, 1200, '2019-01-01', 72)
+DEFAULT_ARCHIVE_BEFORE_YEAR = 2023
+# Data for measure_forecast(): (users, transactions per user, first month, months)
+FORECAST_DATASET = (5000, 120, '2022-01-01', 36)
+DEFAULT_FORECAST_REPEATS = 5
+PERCENTILES = (50, 90, 95, 99)
+DEFAULT_THRESHOLD = 0.10
+COMPARE_METRIC = "p50"
+
+# Function to compute latency percentiles and throughput from timings
+def summarize(latencies):
+    """
+    Summarizes a list of call latencies.
+
+    Args:
+        latencies (list): Seconds per call.
+
+    Returns:
+        dict: "iterations", "mean", "min", "max" and p50/p90/p95/p99 in seconds
+        (nearest-rank), plus "ops_per_sec".
+    """
+    ordered = sorted(latencies)
+    count = len(ordered)
+    total = sum(ordered)
+    stats = {
+        "iterations": count,
+        "mean": total / count,
+        "min": ordered[0],
+        "max": ordered[-1],
+        "ops_per_sec": count / total if total else 0.0,
+    }
+    for percentile in PERCENTILES:
+        rank = max(1, -(-percentile * count // 100))
+        stats[f"p{percentile}"] = ordered[rank - 1]
+    return stats
+
+# Function to time a function over a list of argument tuples
+def _time_calls(func, calls):
+    latencies = []
+    with open(os.devnull, 'w') as sink, contextlib.redirect_stdout(sink):
+        for args in calls:
+            started = time.perf_counter()
+            func(*args)
+            latencies.append(time.perf_counter() - started)
+    return latencies
+
+# Function to draw a random date of the generated period
+def _random_date(rng, periods):
+    year, month = rng.choice(periods)
+    return f"{year:04d}-{month:02d}-{rng.randint(1, 28):02d}"
+
+# The benchmark cases: name -> function(rng, context, iterations) returning latencies
+def _bench_add_transaction(rng, context, iterations):
+    calls = [(rng.choice(context["user_ids"]), rng.choice(('income', 'expense')),
+              rng.choice(list(datagen.EXPENSE_CATEGORIES)), round(rng.uniform(1, 200), 2),
+              _random_date(rng, context["periods"])) for _ in range(iterations)]
+    return _time_calls(transactions.add_transaction, calls)
+
+def _bench_generate_monthly_report(rng, context, iterations):
+    calls = []
+    for _ in range(iterations):
+        year, month = rng.choice(context["periods"])
+        calls.append((rng.choice(context["user_ids"]), month, year))
+    return _time_calls(reports.generate_monthly_report, calls)
+
+def _bench_generate_yearly_report(rng, context, iterations):
+    calls = [(rng.choice(context["user_ids"]), rng.choice(context["periods"])[0])
+             for _ in range(iterations)]
+    return _time_calls(reports.generate_yearly_report, calls)
+
+def _bench_calculate_totals(rng, context, iterations):
+    calls = []
+    for _ in range(iterations):
+        first, second = sorted((_random_date(rng, context["periods"]), _random_date(rng, context["periods"])))
+        calls.append((rng.choice(context["user_ids"]), first, second))
+    return _time_calls(reports.calculate_totals, calls)
+
+def _bench_check_budget_exceedance(rng, context, iterations):
+    calls = []
+    for _ in range(iterations):
+        year, month = rng.choice(context["periods"])
+        calls.append((rng.choice(context["user_ids"]), month, year))
+    return _time_calls(budget.check_budget_exceedance, calls)
+
+def _bench_view_monthly_budgets(rng, context, iterations):
+    calls = []
+    for _ in range(iterations):
+        year, month = rng.choice(context["periods"])
+        calls.append((rng.choice(context["user_ids"]), month, year))
+    return _time_calls(budget.view_monthly_budgets, calls)
+
+def _bench_view_data(rng, context, iterations):
+    calls = [(rng.choice(context["user_ids"]),) for _ in range(iterations)]
+    return _time_calls(backup.view_data, calls)
+
+def _bench_backup_database(rng, context, iterations):
+    calls = [(context["backup_dir"],) for _ in range(iterations)]
+    os.makedirs(context["backup_dir"], exist_ok=True)
+    existing = set(os.listdir(context["backup_dir"]))
+    latencies = _time_calls(backup.backup_database, calls)
+    # Backups are full copies of the database; do not let them pile up
+    for name in set(os.listdir(context["backup_dir"])) - existing:
+        os.remove(os.path.join(context["backup_dir"], name))
+    return latencies
+
+def _bench_restore_database(rng, context, iterations):
+    with open(os.devnull, 'w') as sink, contextlib.redirect_stdout(sink):
+        backup_file = backup.backup_database(context["backup_dir"])
+    latencies = _time_calls(backup.restore_database, [(backup_file,)] * iterations)
+    os.remove(backup_file)
+    return latencies
+
+CASES = {
+    "add_transaction": _bench_add_transaction,
+    "generate_monthly_report": _bench_generate_monthly_report,
+    "generate_yearly_report": _bench_generate_yearly_report,
+    "calculate_totals": _bench_calculate_totals,
+    "check_budget_exceedance": _bench_check_budget_exceedance,
+    "view_monthly_budgets": _bench_view_monthly_budgets,
+    "view_data": _bench_view_data,
+    "backup_database": _bench_backup_database,
+    "restore_database": _bench_restore_database,
+}
+
+# Function to create (or reuse) the benchmark database of a scale
+def prepare_database(scale, seed=0, workdir='bench'):
+    """
+    Generates the synthetic database of a scale unless it already exists.
+
+    Args:
+        scale (str): A key of SCALES.
+        seed (int): Seed for datagen.generate_dataset().
+        workdir (str): Directory holding the benchmark databases.
+
+    Returns:
+        str: Path to the database file.
+    """
+    if scale not in SCALES:
+        raise ValueError(f"Unknown scale {scale!r}; use one of {', '.join(SCALES)}")
+    os.makedirs(workdir, exist_ok=True)
+    path = os.path.join(workdir, f"bench_{scale}_seed{seed}.db")
+    if not os.path.exists(path):
+        users, per_user = SCALES[scale]
+        _generate_database(path, users, per_user, seed)
+    return path
+
+# Function to generate a synthetic database file with datagen
+def _generate_database(path, users, per_user, seed, **options):
+    previous = connection.get_db_path()
+    # Generate into a temporary name so an interrupted run is not reused
+    partial = path + ".partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+    connection.configure(db_path=partial)
+    try:
+        with open(os.devnull, 'w') as sink, contextlib.redirect_stdout(sink):
+            datagen.generate_dataset(users, per_user, seed=seed, **options)
+    finally:
+        connection.close_connection(partial)
+        connection.configure(db_path=previous)
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(partial + suffix):
+            os.remove(partial + suffix)
+    os.replace(partial, path)
+
+# Function to copy a generated database to a scratch file the benchmark may change
+def _copy_database(source, run_db):
+    for path in (run_db, run_db + '-wal', run_db + '-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+    with sqlite3.connect(source) as src, sqlite3.connect(run_db) as dst:
+        src.backup(dst)
+    return run_db
+
+# Function to run the benchmark cases at one scale
+def run_benchmarks(scale='10k', seed=0, iterations=DEFAULT_ITERATIONS, cases=None, workdir='bench',
+                   use_cache=False):
+    """
+    Times the public functions against a synthetic database.
+
+    The benchmark works on a copy of the generated database, so writes made
+    by the cases (add_transaction, restore_database) do not leak into later runs.
+
+    Args:
+        scale (str): A key of SCALES.
+        seed (int): Seed for the data and for the arguments of every call.
+        iterations (int): Calls per case (see SLOW_CASE_ITERATIONS for exceptions).
+        cases (list, optional): Names from CASES to run. Defaults to all.
+        workdir (str): Directory holding the benchmark databases.
+        use_cache (bool): Turn the in-process report cache on. Off by default, so
+            repeated arguments measure the queries rather than cache hits.
+
+    Returns:
+        dict: Run metadata and "cases", mapping each case name to summarize() output.
+    """
+    names = list(CASES) if cases is None else list(cases)
+    for name in names:
+        if name not in CASES:
+            raise ValueError(f"Unknown case {name!r}; use any of {', '.join(CASES)}")
+
+    source = prepare_database(scale, seed, workdir)
+    run_db = _copy_database(source, os.path.join(workdir, f"run_{scale}.db"))
+
+    previous_db = connection.get_db_path()
+    previous_cache = report_cache.configure()["enabled"]
+    connection.configure(db_path=run_db)
+    report_cache.configure(enabled=use_cache)
+    # The in-memory indexes are keyed by user only and must not mix databases
+    prefix_index.clear()
+    try:
+        conn = connection.get_connection()
+        user_ids = [row[0] for row in conn.execute("SELECT id FROM users ORDER BY id")]
+        rows = conn.execute("SELECT COUNT(*) FROM transaction_entries").fetchone()[0]
+        context = {
+            "user_ids": user_ids,
+            "periods": datagen.month_range(),
+            "backup_dir": os.path.join(workdir, "backups"),
+        }
+        results = {}
+        for name in names:
+            rng = random.Random(f"{seed}:{name}")
+            count = min(iterations, SLOW_CASE_ITERATIONS.get(name, iterations))
+            results[name] = summarize(CASES[name](rng, context, count))
+    finally:
+        connection.close_all_connections()
+        connection.configure(db_path=previous_db)
+        report_cache.configure(enabled=previous_cache)
+        prefix_index.clear()
+
+    return {
+        "scale": scale,
+        "rows": rows,
+        "seed": seed,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "cases": results,
+    }
+
+# Run in a fresh interpreter by measure_startup(): times the package import
+# and the first report query (which opens the connection and checks the schema)
+_STARTUP_SCRIPT = '''
+import json, time
+started = time.perf_counter()
+import {package}
+imported = time.perf_counter()
+{package}.reports.get_totals(1, '2024-01-01', '2024-12-31')
+print(json.dumps({{"import": imported - started, "first_query": time.perf_counter() - started}}))
+'''
+
+# Function to run the startup script in a new interpreter
+def _run_startup_script(script, flags, env, cwd):
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, *flags, "-c", script], env=env, cwd=cwd,
+                            capture_output=True, text=True, check=True).stdout
+    timings = json.loads(output.splitlines()[-1])
+    timings["process"] = time.perf_counter() - started
+    return timings
+
+# Function to time the package import and first query in fresh interpreters
+def measure_startup(repeats=DEFAULT_STARTUP_REPEATS, seed=0, workdir='bench'):
+    """
+    Times importing the package and answering a first query in new processes.
+
+    The package sources are copied to a temporary directory without their
+    bytecode cache. Cold runs use `python -B`, so every module of the package
+    is compiled from source; warm runs follow one run that writes the cache.
+    The standard library's cache and the OS file cache are warm in both.
+
+    Args:
+        repeats (int): Processes started per mode.
+        seed (int): Seed of the 10k benchmark database used for the first query.
+        workdir (str): Directory holding the benchmark databases.
+
+    Returns:
+        dict: Run metadata like run_benchmarks(), with cases "import", "first_query"
+        and "process" (whole interpreter run) suffixed by "_cold" and "_warm".
+    """
+    db_path = os.path.abspath(prepare_database("10k", seed, workdir))
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute("SELECT COUNT(*) FROM transaction_entries").fetchone()[0]
+    source = os.path.dirname(os.path.abspath(__file__))
+    script = _STARTUP_SCRIPT.format(package=__package__)
+
+    timings = {}
+    with tempfile.TemporaryDirectory() as root:
+        shutil.copytree(source, os.path.join(root, __package__),
+                        ignore=shutil.ignore_patterns('__pycache__', '*.db', '*.db-*', '*.jsonl', workdir))
+        env = dict(os.environ, PYTHONPATH=root, FINANCE_DB_PATH=db_path)
+        # The warm-up run must be able to write the bytecode cache next to the sources
+        for name in ("PYTHONPYCACHEPREFIX", "PYTHONDONTWRITEBYTECODE"):
+            env.pop(name, None)
+        for mode, flags in (("cold", ["-B"]), ("warm", [])):
+            if mode == "warm":
+                _run_startup_script(script, flags, env, root)
+            for _ in range(repeats):
+                for name, seconds in _run_startup_script(script, flags, env, root).items():
+                    timings.setdefault(f"{name}_{mode}", []).append(seconds)
+
+    return {
+        "scale": "startup",
+        "rows": rows,
+        "seed": seed,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "cases": {name: summarize(values) for name, values in sorted(timings.items())},
+    }
+
+# Function to time calls made from several threads at once
+def _time_concurrently(func, calls, threads):
+    def timed(args):
+        started = time.perf_counter()
+        func(*args)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = list(pool.map(timed, calls))
+    stats = summarize(latencies)
+    # Throughput of the whole burst, not of a single thread
+    stats["ops_per_sec"] = len(calls) / (time.perf_counter() - started)
+    return stats
+
+# Function to measure login throughput with concurrent clients
+def measure_logins(threads=DEFAULT_LOGIN_THREADS, logins=DEFAULT_LOGINS, seed=0, workdir='bench'):
+    """
+    Times logins and session lookups issued by several threads at once.
+
+    Works on a copy of the 10k benchmark database whose users are reset to
+    legacy SHA-256 password hashes. Cases: "login_rehash" (each user's first
+    login, which also upgrades the hash), "login" (KDF verification),
+    "login_wrong_password" and "session_lookup" (auth.get_session() with a
+    token from auth.create_session(), i.e. a request that skips the KDF).
+    ops_per_sec is the throughput of all threads together.
+
+    Args:
+        threads (int): Concurrent clients.
+        logins (int): Logins per login case.
+        seed (int): Seed of the database and of the username choice.
+        workdir (str): Directory holding the benchmark databases.
+
+    Returns:
+        dict: Run metadata like run_benchmarks(), with the KDF settings under "auth".
+    """
+    run_db = _copy_database(prepare_database("10k", seed, workdir), os.path.join(workdir, "run_login.db"))
+    password = datagen.DEFAULT_PASSWORD
+    legacy_hash = hashlib.sha256(password.encode()).hexdigest()
+    rng = random.Random(f"{seed}:login")
+
+    previous_db = connection.get_db_path()
+    connection.configure(db_path=run_db)
+    results = {}
+    try:
+        conn = connection.get_connection()
+        conn.execute("UPDATE users SET password = ?", (legacy_hash,))
+        conn.commit()
+        usernames = [row[0] for row in conn.execute("SELECT username FROM users ORDER BY id")]
+        rows = conn.execute("SELECT COUNT(*) FROM transaction_entries").fetchone()[0]
+
+        with open(os.devnull, 'w') as sink, contextlib.redirect_stdout(sink):
+            results["login_rehash"] = _time_concurrently(
+                auth.login_user, [(name, password) for name in usernames], threads)
+            results["login"] = _time_concurrently(
+                auth.login_user, [(rng.choice(usernames), password) for _ in range(logins)], threads)
+            results["login_wrong_password"] = _time_concurrently(
+                auth.login_user, [(rng.choice(usernames), "wrong") for _ in range(logins)], threads)
+        tokens = [auth.create_session(name, password) for name in usernames[:threads]]
+        results["session_lookup"] = _time_concurrently(
+            auth.get_session, [(rng.choice(tokens),) for _ in range(SESSION_LOOKUPS)], threads)
+    finally:
+        auth.clear_sessions()
+        connection.close_all_connections()
+        connection.configure(db_path=previous_db)
+
+    settings = auth.configure()
+    return {
+        "scale": f"login x{threads}",
+        "rows": rows,
+        "seed": seed,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "auth": {name: settings[name] for name in ("algorithm", "scrypt_n", "scrypt_r", "scrypt_p",
+                                                   "pbkdf2_iterations", "kdf_workers")},
+        "cases": results,
+    }
+
+# Function to get the size of a database file with its WAL folded in
+def _database_bytes(path):
+    with sqlite3.connect(path) as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return os.path.getsize(path)
+
+# Function to measure report latency and database size before and after archiving
+def measure_archive(before_year=DEFAULT_ARCHIVE_BEFORE_YEAR, iterations=DEFAULT_ITERATIONS, seed=0,
+                    workdir='bench'):
+    """
+    Times reports over hot and archived years before and after archive.archive_years().
+
+    Works on a copy of a generated database spanning ARCHIVE_DATASET. The
+    same calls are timed on the full database ("_before") and after the
+    years before before_year were archived and the database vacuumed
+    ("_after"). Cases: yearly reports and half-year totals of the last year
+    ("_hot") and of the first year ("_cold"), and totals over all years. The
+    report cache and the prefix-sum index are off, so every call queries.
+
+    Args:
+        before_year (int): Years before this one are archived.
+        iterations (int): Calls per case and phase.
+        seed (int): Seed of the data and of the user choice.
+        workdir (str): Directory holding the benchmark databases.
+
+    Returns:
+        dict: Run metadata like run_benchmarks(), with "sizes" in bytes of the
+        database before and after and of the archive files, and the seconds
+        the archiving took.
+    """
+    users, per_user, start_date, months = ARCHIVE_DATASET
+    os.makedirs(workdir, exist_ok=True)
+    source = os.path.join(workdir, f"bench_archive_seed{seed}.db")
+    if not os.path.exists(source):
+        _generate_database(source, users, per_user, seed, start_date=start_date, months=months)
+    run_db = _copy_database(source, os.path.join(workdir, "run_archive.db"))
+    periods = datagen.month_range(start_date, months)
+    first_year, last_year = periods[0][0], periods[-1][0]
+
+    previous_db = connection.get_db_path()
+    previous_cache = report_cache.configure()["enabled"]
+    previous_index = prefix_index.is_enabled()
+    connection.configure(db_path=run_db)
+    report_cache.configure(enabled=False)
+    prefix_index.set_enabled(False)
+    results = {}
+    try:
+        conn = connection.get_connection()
+        user_ids = [row[0] for row in conn.execute("SELECT id FROM users ORDER BY id")]
+        rows = conn.execute("SELECT COUNT(*) FROM transaction_entries").fetchone()[0]
+        rng = random.Random(f"{seed}:archive")
+        picked = [rng.choice(user_ids) for _ in range(iterations)]
+        cases = {
+            "yearly_report_hot": (reports.generate_yearly_report, [(u, last_year) for u in picked]),
+            "yearly_report_cold": (reports.generate_yearly_report, [(u, first_year) for u in picked]),
+            "totals_hot": (reports.calculate_totals,
+                           [(u, f"{last_year}-01-01", f"{last_year}-06-30") for u in picked]),
+            "totals_cold": (reports.calculate_totals,
+                            [(u, f"{first_year}-01-01", f"{first_year}-06-30") for u in picked]),
+            "totals_all_years": (reports.calculate_totals,
+                                 [(u, f"{first_year}-01-01", f"{last_year}-12-31") for u in picked]),
+        }
+
+        sizes = {"before": _database_bytes(run_db)}
+        for name, (func, calls) in cases.items():
+            results[f"{name}_before"] = summarize(_time_calls(func, calls))
+        started = time.perf_counter()
+        archived = archive.archive_years(before_year, vacuum=True)
+        archive_seconds = time.perf_counter() - started
+        sizes["after"] = _database_bytes(run_db)
+        sizes["archives"] = sum(os.path.getsize(os.path.join(workdir, entry["file"]))
+                                for entry in archive.list_archives())
+        for name, (func, calls) in cases.items():
+            results[f"{name}_after"] = summarize(_time_calls(func, calls))
+    finally:
+        archive.close_archives()
+        connection.close_all_connections()
+        connection.configure(db_path=previous_db)
+        report_cache.configure(enabled=previous_cache)
+        prefix_index.set_enabled(previous_index)
+
+    return {
+        "scale": f"archive {first_year}-{last_year}, before {before_year}",
+        "rows": rows,
+        "seed": seed,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "sizes": sizes,
+        "archived": {"years": archived["years"], "moved": archived["moved"], "seconds": archive_seconds},
+        "cases": results,
+    }
+
+# Function to measure forecast throughput in users per second
+def measure_forecast(repeats=DEFAULT_FORECAST_REPEATS, batch_size=forecast.DEFAULT_BATCH_SIZE, seed=0,
+                     workdir='bench'):
+    """
+    Times forecast.refresh_forecasts() over every user of a generated database.
+
+    Works on a copy of a database spanning FORECAST_DATASET. Cases:
+    "forecast_all" recomputes every user (refresh policy 'always'),
+    "forecast_unchanged" checks every user without recomputing any (policy
+    'changed' right after a full refresh), and "forecast_per_user" recomputes
+    every user with batches of one user, as a per-user loop would.
+
+    Args:
+        repeats (int): Timed refreshes per case.
+        batch_size (int): Users per batch for the batched cases.
+        seed (int): Seed of the data and of the Monte Carlo draws.
+        workdir (str): Directory holding the benchmark databases.
+
+    Returns:
+        dict: Run metadata like run_benchmarks(), with one latency summary per
+        case (seconds per refresh) and "users_per_sec" per case.
+    """
+    users, per_user, start_date, months = FORECAST_DATASET
+    os.makedirs(workdir, exist_ok=True)
+    source = os.path.join(workdir, f"bench_forecast_seed{seed}.db")
+    if not os.path.exists(source):
+        _generate_database(source, users, per_user, seed, start_date=start_date, months=months)
+    run_db = _copy_database(source, os.path.join(workdir, "run_forecast.db"))
+    # Forecast from the month after the generated data
+    year, month = datagen.month_range(start_date, months + 1)[-1]
+    as_of = f"{year:04d}-{month:02d}-01"
+
+    previous_db = connection.get_db_path()
+    previous_settings = forecast.configure()
+    connection.configure(db_path=run_db)
+    forecast.configure(seed=seed)
+    results = {}
+    throughput = {}
+    try:
+        conn = connection.get_connection()
+        rows = conn.execute("SELECT COUNT(*) FROM transaction_entries").fetchone()[0]
+        cases = {
+            "forecast_all": ('always', batch_size),
+            "forecast_unchanged": ('changed', batch_size),
+            "forecast_per_user": ('always', 1),
+        }
+        for name, (policy, case_batch_size) in cases.items():
+            forecast.configure(policy=policy)
+            latencies = []
+            for _ in range(repeats):
+                result = forecast.refresh_forecasts(as_of, batch_size=case_batch_size)
+                latencies.append(result["seconds"])
+            results[name] = summarize(latencies)
+            throughput[name] = result["users"] / results[name]["p50"]
+    finally:
+        connection.close_all_connections()
+        connection.configure(db_path=previous_db)
+        forecast.configure(policy=previous_settings["policy"], seed=previous_settings["seed"])
+
+    return {
+        "scale": f"forecast {users} users, {months} months",
+        "rows": rows,
+        "seed": seed,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "batch_size": batch_size,
+        "users_per_sec": throughput,
+        "cases": results,
+    }
+
+# Function to compare a run against a baseline run
+def compare_results(baseline, current, threshold=DEFAULT_THRESHOLD, metric=COMPARE_METRIC):
+    """
+    Compares the latencies of two benchmark runs case by case.
+
+    Args:
+        baseline (dict): A result of run_benchmarks() (e.g. loaded from JSON).
+        current (dict): The result to check.
+        threshold (float): Relative slowdown tolerated before flagging, e.g. 0.10 for 10%.
+        metric (str): Latency statistic to compare, e.g. 'p50' or 'p90'.
+
+    Returns:
+        list: One dict per case present in both runs with "case", "baseline",
+        "current", "change" (relative) and "regression" (bool).
+    """
+    rows = []
+    for name, stats in current["cases"].items():
+        if name not in baseline["cases"]:
+            continue
+        before = baseline["cases"][name][metric]
+        after = stats[metric]
+        change = (after - before) / before if before else 0.0
+        rows.append({"case": name, "baseline": before, "current": after, "change": change,
+                     "regression": change > threshold})
+    return rows
+
+# Function to print a benchmark result as a table
+def print_results(result):
+    """
+    Prints one line per case with throughput and latency percentiles in milliseconds.
+
+    Args:
+        result (dict): A result of run_benchmarks().
+    """
+    print(f"Scale {result['scale']} ({result['rows']} rows), seed {result['seed']}, "
+          f"Python {result['python']}, SQLite {result['sqlite']}")
+    print(f"{'case':<26}{'ops/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, stats in result["cases"].items():
+        print(f"{name:<26}{stats['ops_per_sec']:>10.1f}{stats['p50'] * 1000:>10.3f}"
+              f"{stats['p90'] * 1000:>10.3f}{stats['p99'] * 1000:>10.3f}{stats['max'] * 1000:>10.3f}")
+
+# Command line entry point: python -m <package>.benchmark run|startup|login|archive|forecast|compare ...
+def main(argv=None):
+    """
+    Runs benchmarks and saves them as JSON, or compares two saved runs.
+
+    Args:
+        argv (list, optional): Command line arguments without the program name.
+
+    Returns:
+        int: Process exit code; 1 if compare found a regression.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the finance functions.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run the benchmarks")
+    run.add_argument("--scale", action="append", choices=list(SCALES),
+                     help="scale to run (repeatable, default 10k)")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    run.add_argument("--case", action="append", choices=list(CASES), help="case to run (repeatable)")
+    run.add_argument("--workdir", default="bench")
+    run.add_argument("--cache", action="store_true", help="turn the in-process report cache on")
+    run.add_argument("--output", help="JSON file to write; '{scale}' is replaced by the scale")
+    run.add_argument("--baseline", help="JSON file of an earlier run to compare against")
+    run.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    startup = commands.add_parser("startup", help="time cold and warm imports in new processes")
+    startup.add_argument("--repeats", type=int, default=DEFAULT_STARTUP_REPEATS)
+    startup.add_argument("--seed", type=int, default=0)
+    startup.add_argument("--workdir", default="bench")
+    startup.add_argument("--output", help="JSON file to write")
+    startup.add_argument("--baseline", help="JSON file of an earlier startup run to compare against")
+    startup.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    login = commands.add_parser("login", help="time concurrent logins and session lookups")
+    login.add_argument("--threads", type=int, default=DEFAULT_LOGIN_THREADS)
+    login.add_argument("--logins", type=int, default=DEFAULT_LOGINS)
+    login.add_argument("--seed", type=int, default=0)
+    login.add_argument("--workdir", default="bench")
+    login.add_argument("--output", help="JSON file to write")
+    login.add_argument("--baseline", help="JSON file of an earlier login run to compare against")
+    login.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    archiving = commands.add_parser("archive", help="time reports before and after archiving old years")
+    archiving.add_argument("--before-year", type=int, default=DEFAULT_ARCHIVE_BEFORE_YEAR)
+    archiving.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    archiving.add_argument("--seed", type=int, default=0)
+    archiving.add_argument("--workdir", default="bench")
+    archiving.add_argument("--output", help="JSON file to write")
+
+    forecasting = commands.add_parser("forecast", help="time forecast refreshes in users per second")
+    forecasting.add_argument("--repeats", type=int, default=DEFAULT_FORECAST_REPEATS)
+    forecasting.add_argument("--batch-size", type=int, default=forecast.DEFAULT_BATCH_SIZE)
+    forecasting.add_argument("--seed", type=int, default=0)
+    forecasting.add_argument("--workdir", default="bench")
+    forecasting.add_argument("--output", help="JSON file to write")
+    forecasting.add_argument("--baseline", help="JSON file of an earlier forecast run to compare against")
+    forecasting.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    compare = commands.add_parser("compare", help="compare two saved runs")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    compare.add_argument("--metric", default=COMPARE_METRIC)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        with open(args.current, encoding='utf-8') as f:
+            current = json.load(f)
+        return _report_comparison(compare_results(baseline, current, args.threshold, args.metric),
+                                  args.metric)
+
+    if args.command == "startup":
+        result = measure_startup(args.repeats, seed=args.seed, workdir=args.workdir)
+        print_results(result)
+        return _save_and_compare(result, args.output, args.baseline, args.threshold)
+
+    if args.command == "login":
+        result = measure_logins(args.threads, args.logins, seed=args.seed, workdir=args.workdir)
+        print_results(result)
+        return _save_and_compare(result, args.output, args.baseline, args.threshold)
+
+    if args.command == "archive":
+        result = measure_archive(args.before_year, args.iterations, seed=args.seed, workdir=args.workdir)
+        print_results(result)
+        sizes = result["sizes"]
+        print(f"Archived {result['archived']['moved']} transactions of {len(result['archived']['years'])} "
+              f"years in {result['archived']['seconds']:.1f}s; database {sizes['before'] / 1e6:.1f} MB -> "
+              f"{sizes['after'] / 1e6:.1f} MB, archives {sizes['archives'] / 1e6:.1f} MB")
+        return _save_and_compare(result, args.output, None, DEFAULT_THRESHOLD)
+
+    if args.command == "forecast":
+        result = measure_forecast(args.repeats, args.batch_size, seed=args.seed, workdir=args.workdir)
+        print_results(result)
+        for name, users_per_sec in result["users_per_sec"].items():
+            print(f"{name:<26}{users_per_sec:>10.0f} users/s")
+        return _save_and_compare(result, args.output, args.baseline, args.threshold)
+
+    status = 0
+    for scale in args.scale or ["10k"]:
+        result = run_benchmarks(scale, seed=args.seed, iterations=args.iterations, cases=args.case,
+                                workdir=args.workdir, use_cache=args.cache)
+        print_results(result)
+        output = args.output.replace("{scale}", scale) if args.output else None
+        baseline = args.baseline.replace("{scale}", scale) if args.baseline else None
+        status = max(status, _save_and_compare(result, output, baseline, args.threshold))
+    return status
+
+# Function to save a result and compare it against a baseline file
+def _save_and_compare(result, output, baseline_path, threshold):
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f"Results saved to {output}")
+    if not baseline_path:
+        return 0
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    return _report_comparison(compare_results(baseline, result, threshold), COMPARE_METRIC)
+
+# Function to print a comparison and turn it into an exit code
+def _report_comparison(rows, metric):
+    for row in rows:
+        flag = "REGRESSION" if row["regression"] else "ok"
+        print(f"{row['case']:<26}{metric} {row['baseline'] * 1000:>10.3f} ms -> "
+              f"{row['current'] * 1000:>10.3f} ms ({row['change']:+.1%}) {flag}")
+    regressions = [row for row in rows if row["regression"]]
+    if regressions:
+        print(f"{len(regressions)} case(s) slower than the baseline.")
+        return 1
+    print("No regressions.")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,6 +1,73 @@
-import sqlite3
+import calendar
+import heapq
+
+from . import alerts, connection, recurring, report_cache, schema, sharding
+
+# Existing budget for one category and month
+BUDGET_LOOKUP_SQL = """
+    SELECT * FROM budgets WHERE user_id = ? AND category = ? AND month = ? AND year = ?
+"""
+
+# Budgets of one user for one month; served by the budgets period index
+BUDGETS_FOR_MONTH_SQL = """
+    SELECT category, amount FROM budgets WHERE user_id = ? AND year = ? AND month = ?
+"""
+
+# Budget and spending of one category and month: two primary key / index
+# lookups, the spending being the running expense counter in the rollups
+BUDGET_STATUS_SQL = """
+    SELECT b.amount, IFNULL((
+        SELECT r.total_cents FROM monthly_rollups AS r
+        JOIN categories AS c ON c.id = r.category_id
+        WHERE r.user_id = b.user_id AND r.year = b.year AND r.month = b.month
+        AND c.name = b.category AND r.type = 0
+    ), 0)
+    FROM budgets AS b
+    WHERE b.user_id = ? AND b.year = ? AND b.month = ? AND b.category = ?
+"""
+
+# Budgets of one month joined with the month's expenses from the monthly
+# rollups, keeping only the categories where spending exceeds the budget.
+# Budget names are resolved through the categories dictionary; spending is
+# compared in cents (expense type code 0).
+EXCEEDED_BUDGETS_SQL = """
+    SELECT b.category, b.amount, IFNULL(r.total_cents, 0) / 100.0 AS total_spent
+    FROM budgets AS b
+    LEFT JOIN categories AS c ON c.name = b.category
+    LEFT JOIN monthly_rollups AS r
+        ON r.user_id = b.user_id AND r.year = b.year AND r.month = b.month
+        AND r.category_id = c.id AND r.type = 0
+    WHERE b.user_id = ? AND b.year = ? AND b.month = ?
+    AND IFNULL(r.total_cents, 0) > round(b.amount * 100)
+"""
+
+# Budgets of one month with the month's spending in cents, exceeded or not
+BUDGET_SPENDING_SQL = """
+    SELECT b.category, b.amount, IFNULL(r.total_cents, 0)
+    FROM budgets AS b
+    LEFT JOIN categories AS c ON c.name = b.category
+    LEFT JOIN monthly_rollups AS r
+        ON r.user_id = b.user_id AND r.year = b.year AND r.month = b.month
+        AND r.category_id = c.id AND r.type = 0
+    WHERE b.user_id = ? AND b.year = ? AND b.month = ?
+"""
+
+# Same as EXCEEDED_BUDGETS_SQL for every user at once; served by the
+# (year, month, user_id) budgets index
+ALL_EXCEEDED_BUDGETS_SQL = """
+    SELECT b.user_id, b.category, b.amount, IFNULL(r.total_cents, 0) / 100.0 AS total_spent
+    FROM budgets AS b
+    LEFT JOIN categories AS c ON c.name = b.category
+    LEFT JOIN monthly_rollups AS r
+        ON r.user_id = b.user_id AND r.year = b.year AND r.month = b.month
+        AND r.category_id = c.id AND r.type = 0
+    WHERE b.year = ? AND b.month = ?
+    AND IFNULL(r.total_cents, 0) > round(b.amount * 100)
+    ORDER BY b.user_id
+"""
 
 # Function to set a monthly budget for a specific category
+@sharding.by_user
 def set_monthly_budget(user_id, category, amount, month, year):
     """
     Sets a monthly budget for a specific category.
@@ -15,13 +82,11 @@ def set_monthly_budget(user_id, category, amount, month, year):
     Returns:
         None
     """
-    conn = sqlite3.connect('finance.db')
+    conn = connection.get_connection()
     cursor = conn.cursor()
 
     # Check if a budget for this category and month already exists
-    cursor.execute("""
-        SELECT * FROM budgets WHERE user_id = ? AND category = ? AND month = ? AND year = ?
-    """, (user_id, category, month, year))
+    cursor.execute(BUDGET_LOOKUP_SQL, (user_id, category, month, year))
     existing_budget = cursor.fetchone()
 
     if existing_budget:
@@ -38,51 +103,124 @@ def set_monthly_budget(user_id, category, amount, month, year):
         """, (user_id, category, amount, month, year))
         print(f"Set budget for {category} in {month}/{year} to {amount}.")
 
-    conn.commit()
-    conn.close()
+    # Queue an alert if the month's spending is over the new budget but was not over the old one
+    since = alerts.mark(cursor)
+    cursor.execute(BUDGET_STATUS_SQL, (user_id, int(year), int(month), category))
+    _, spent_cents = cursor.fetchone()
+    if spent_cents > round(amount * 100) and (not existing_budget or spent_cents <= round(existing_budget[3] * 100)):
+        cursor.execute(alerts.INSERT_ALERT_SQL, (user_id, category, month, year, amount, spent_cents / 100.0))
+    raised = alerts.collect(cursor, since, user_id)
 
-# Function to check if the user has exceeded their budget in any category for the current month
-def check_budget_exceedance(user_id, month, year):
+    connection.commit(conn)
+    connection.after_commit(lambda: report_cache.bump_version(user_id))
+    alerts.notify(raised)
+
+# Function to look up how much of a budget has been spent
+@sharding.by_user
+def get_budget_status(user_id, category, month, year):
     """
-    Checks if the user has exceeded their budget for any category in a given month and year.
+    Returns the budget of one category and month next to what has been spent.
+
+    Spending is read from the running monthly counters, so this is two
+    indexed lookups no matter how many transactions the month has.
+
+    Args:
+        user_id (int): The ID of the user.
+        category (str): The budget category.
+        month (int): The month (1-12).
+        year (int): The year (e.g., 2024).
+
+    Returns:
+        dict: budget_amount, total_spent, remaining and exceeded, or None if no
+        budget is set for the category and month.
+    """
+    conn = connection.get_connection()
+    row = conn.execute(BUDGET_STATUS_SQL, (user_id, int(year), int(month), category)).fetchone()
+    if row is None:
+        return None
+    budget_amount, spent_cents = row
+    return {
+        "budget_amount": budget_amount,
+        "total_spent": spent_cents / 100.0,
+        "remaining": budget_amount - spent_cents / 100.0,
+        "exceeded": spent_cents > round(budget_amount * 100)
+    }
+
+# Function to get the exceeded budgets of a month without printing them
+@sharding.by_user
+def get_budget_exceedances(user_id, month, year, include_projected=False):
+    """
+    Returns the categories over budget in a given month, using the report cache.
 
     Args:
         user_id (int): The ID of the user.
         month (int): The month to check (1-12).
         year (int): The year to check (e.g., 2024).
+        include_projected (bool): Count the recurring expenses of the month that
+            are not materialized yet (see recurring.py) as spent.
 
     Returns:
         list: A list of categories where the budget has been exceeded.
     """
-    conn = sqlite3.connect('finance.db')
+    return report_cache.get_or_compute("budget_exceedances", user_id, (month, year, include_projected),
+                                       _compute_budget_exceedances)
+
+def _compute_budget_exceedances(user_id, month, year, include_projected=False):
+    conn = connection.get_connection()
     cursor = conn.cursor()
 
-    # Get all the budgets set for the user for the given month and year
-    cursor.execute("""
-        SELECT category, amount FROM budgets WHERE user_id = ? AND month = ? AND year = ?
-    """, (user_id, month, year))
-    budgets = cursor.fetchall()
+    if include_projected:
+        rows = _projected_exceeded_rows(cursor, user_id, int(month), int(year))
+    else:
+        # Compare every budget of the month with its spending in a single query
+        cursor.execute(EXCEEDED_BUDGETS_SQL, (user_id, int(year), int(month)))
+        rows = cursor.fetchall()
 
     exceeded_categories = []
+    for category, budget_amount, total_spent in rows:
+        exceeded_categories.append({
+            "category": category,
+            "budget_amount": budget_amount,
+            "total_spent": total_spent,
+            "over_budget": total_spent - budget_amount
+        })
+    return exceeded_categories
 
-    # For each budgeted category, check if the user has exceeded the budget
-    for category, budget_amount in budgets:
-        cursor.execute("""
-            SELECT SUM(amount) FROM transactions
-            WHERE user_id = ? AND type = 'expense' AND category = ? 
-            AND strftime('%m', date) = ? AND strftime('%Y', date) = ?
-        """, (user_id, category, f'{month:02}', str(year)))
-        total_spent = cursor.fetchone()[0] or 0.0
-
-        if total_spent > budget_amount:
-            exceeded_categories.append({
-                "category": category,
-                "budget_amount": budget_amount,
-                "total_spent": total_spent,
-                "over_budget": total_spent - budget_amount
-            })
-
-    conn.close()
+# Function to find the budgets of a month exceeded once its projected recurring expenses are added
+def _projected_exceeded_rows(cursor, user_id, month, year):
+    last_day = calendar.monthrange(year, month)[1]
+    projected = {}
+    for occurrence in recurring.iter_projected(user_id, f"{year:04d}-{month:02d}-01",
+                                               f"{year:04d}-{month:02d}-{last_day:02d}"):
+        if occurrence["type"] == 'expense':
+            category = occurrence["category"]
+            projected[category] = projected.get(category, 0) + schema.to_cents(occurrence["amount"])
+
+    cursor.execute(BUDGET_SPENDING_SQL, (user_id, year, month))
+    rows = []
+    for category, budget_amount, spent_cents in cursor.fetchall():
+        spent_cents += projected.get(category, 0)
+        if spent_cents > round(budget_amount * 100):
+            rows.append((category, budget_amount, spent_cents / 100.0))
+    return rows
+
+# Function to check if the user has exceeded their budget in any category for the current month
+@sharding.by_user
+def check_budget_exceedance(user_id, month, year, include_projected=False):
+    """
+    Checks if the user has exceeded their budget for any category in a given month and year.
+
+    Args:
+        user_id (int): The ID of the user.
+        month (int): The month to check (1-12).
+        year (int): The year to check (e.g., 2024).
+        include_projected (bool): Count the recurring expenses of the month that
+            are not materialized yet (see recurring.py) as spent.
+
+    Returns:
+        list: A list of categories where the budget has been exceeded.
+    """
+    exceeded_categories = get_budget_exceedances(user_id, month, year, include_projected)
 
     if exceeded_categories:
         for exceeded in exceeded_categories:
@@ -93,7 +231,32 @@ def check_budget_exceedance(user_id, month, year):
 
     return exceeded_categories
 
+# Function to get the budgets of a month without printing them
+@sharding.by_user
+def get_monthly_budgets(user_id, month, year):
+    """
+    Returns the budgets a user set for a given month, using the report cache.
+
+    Args:
+        user_id (int): The ID of the user.
+        month (int): The month (1-12).
+        year (int): The year (e.g., 2024).
+
+    Returns:
+        list: A list of (category, amount) tuples.
+    """
+    return report_cache.get_or_compute("monthly_budgets", user_id, (month, year), _compute_monthly_budgets)
+
+def _compute_monthly_budgets(user_id, month, year):
+    conn = connection.get_connection()
+    cursor = conn.cursor()
+
+    # Fetch all budgets for the user for the given month and year
+    cursor.execute(BUDGETS_FOR_MONTH_SQL, (user_id, year, month))
+    return cursor.fetchall()
+
 # Function to display all budgets for a user for a given month and year
+@sharding.by_user
 def view_monthly_budgets(user_id, month, year):
     """
     Displays all the set budgets for a user in a given month and year.
@@ -106,14 +269,7 @@ def view_monthly_budgets(user_id, month, year):
     Returns:
         list: A list of budgets with category and amount for the given month and year.
     """
-    conn = sqlite3.connect('finance.db')
-    cursor = conn.cursor()
-
-    # Fetch all budgets for the user for the given month and year
-    cursor.execute("""
-        SELECT category, amount FROM budgets WHERE user_id = ? AND month = ? AND year = ?
-    """, (user_id, month, year))
-    budgets = cursor.fetchall()
+    budgets = get_monthly_budgets(user_id, month, year)
 
     if budgets:
         print(f"Budgets for {month}/{year}:")
@@ -122,5 +278,58 @@ def view_monthly_budgets(user_id, month, year):
     else:
         print(f"No budgets set for {month}/{year}.")
 
-    conn.close()
     return budgets
+
+# Function to check the budgets of every user for a month in one pass
+def check_all_budget_exceedances(month, year, batch_size=1000):
+    """
+    Streams every exceeded budget of every user for a given month and year.
+
+    This is the batch counterpart of check_budget_exceedance() for alert jobs:
+    it runs one query for all users, fetches results in batches and prints nothing.
+    When sharded, the query runs on every shard in parallel and the results
+    are merged by user_id.
+
+    Args:
+        month (int): The month to check (1-12).
+        year (int): The year to check (e.g., 2024).
+        batch_size (int): Number of rows fetched from SQLite at a time.
+
+    Yields:
+        dict: One record per exceeded budget with user_id, category, budget_amount,
+        total_spent and over_budget, ordered by user_id.
+    """
+    if sharding.is_sharded():
+        results = sharding.fan_out(_owned_exceeded_rows, month, year, batch_size)
+        rows = heapq.merge(*(shard_rows for _, shard_rows in results), key=lambda row: row[0])
+    else:
+        rows = _iter_exceeded_rows(month, year, batch_size)
+
+    for user_id, category, budget_amount, total_spent in rows:
+        yield {
+            "user_id": user_id,
+            "category": category,
+            "budget_amount": budget_amount,
+            "total_spent": total_spent,
+            "over_budget": total_spent - budget_amount
+        }
+
+# Function to stream the exceeded budgets of every user in the current database
+def _iter_exceeded_rows(month, year, batch_size):
+    conn = connection.get_connection()
+    cursor = conn.cursor()
+    cursor.execute(ALL_EXCEEDED_BUDGETS_SQL, (int(year), int(month)))
+
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+# Function to list the exceeded budgets of the users living on the current shard
+def _owned_exceeded_rows(month, year, batch_size):
+    index = sharding.current_shard()
+    return [row for row in _iter_exceeded_rows(month, year, batch_size) if sharding.owns(index, row[0])]
@@ -0,0 +1,351 @@
+import gzip
+import json
+import os
+import sqlite3
+from datetime import datetime, timezone
+from itertools import groupby
+
+from . import backup, connection
+
+# Append-only log of every change to transactions and budgets. Together with
+# periodic full snapshots it allows incremental backups (only new log entries
+# are written out) and point-in-time restore (snapshot + replay).
+CHANGE_LOG_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS change_log (
+                        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                        ts TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),  -- UTC
+                        table_name TEXT NOT NULL,
+                        op TEXT NOT NULL,         -- 'I', 'U' or 'D'
+                        row_id INTEGER NOT NULL,
+                        data TEXT                 -- JSON of the new row, NULL for deletes
+                    )'''
+
+# Columns captured per logged table, in replay order (id first)
+LOGGED_TABLES = {
+    "transactions": ("id", "user_id", "type", "category", "amount", "date"),
+    "budgets": ("id", "user_id", "category", "amount", "month", "year"),
+}
+
+# Tables whose rows are stored elsewhere: transactions are logged from
+# transaction_entries, with expressions that turn the compact columns back
+# into the logged ones. Replays go through the transactions view, so change
+# logs written before and after the compact schema replay the same way.
+LOGGED_SOURCES = {
+    "transactions": ("transaction_entries", {
+        "type": "CASE NEW.type WHEN 1 THEN 'income' WHEN 0 THEN 'expense' END",
+        "category": "(SELECT name FROM categories WHERE id = NEW.category_id)",
+        "amount": "NEW.amount_cents / 100.0",
+    }),
+}
+
+MANIFEST_NAME = 'manifest.jsonl'
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+REPLAY_BATCH_SIZE = 10000
+
+# Function to build the change log triggers for one table
+def _trigger_sql(table, columns):
+    source, expressions = LOGGED_SOURCES.get(table, (table, {}))
+    new_json = "json_object(" + ", ".join(
+        f"'{c}', {expressions.get(c, 'NEW.' + c)}" for c in columns
+    ) + ")"
+    return {
+        f"trg_changelog_{table}_insert": f'''CREATE TRIGGER IF NOT EXISTS trg_changelog_{table}_insert
+                        AFTER INSERT ON {source}
+                    BEGIN
+                        INSERT INTO change_log (table_name, op, row_id, data)
+                        VALUES ('{table}', 'I', NEW.id, {new_json});
+                    END''',
+        f"trg_changelog_{table}_update": f'''CREATE TRIGGER IF NOT EXISTS trg_changelog_{table}_update
+                        AFTER UPDATE ON {source}
+                    BEGIN
+                        INSERT INTO change_log (table_name, op, row_id, data)
+                        VALUES ('{table}', 'U', NEW.id, {new_json});
+                    END''',
+        f"trg_changelog_{table}_delete": f'''CREATE TRIGGER IF NOT EXISTS trg_changelog_{table}_delete
+                        AFTER DELETE ON {source}
+                    BEGIN
+                        INSERT INTO change_log (table_name, op, row_id, data)
+                        VALUES ('{table}', 'D', OLD.id, NULL);
+                    END''',
+    }
+
+CHANGE_LOG_TRIGGERS_SQL = {}
+for _table, _columns in LOGGED_TABLES.items():
+    CHANGE_LOG_TRIGGERS_SQL.update(_trigger_sql(_table, _columns))
+
+# Function to create the change log table and its triggers
+def create_changelog_schema(conn=None):
+    """
+    Creates the change_log table and the triggers that fill it.
+
+    Args:
+        conn (sqlite3.Connection, optional): Connection to use. Defaults to the pooled connection.
+    """
+    if conn is None:
+        conn = connection.get_connection()
+    conn.execute(CHANGE_LOG_TABLE_SQL)
+    for sql in CHANGE_LOG_TRIGGERS_SQL.values():
+        conn.execute(sql)
+
+# Function to normalise a restore target to the change log timestamp format
+def _format_timestamp(value):
+    if isinstance(value, str):
+        return value
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime(TIMESTAMP_FORMAT)[:-3]
+
+# Function to read the backup manifest
+def read_manifest(backup_dir='backups'):
+    """
+    Reads the list of snapshots and change log deltas written to a backup directory.
+
+    Args:
+        backup_dir (str): The backup directory.
+
+    Returns:
+        list: Manifest entries in the order they were written. Snapshots have
+        kind 'snapshot', file, seq and ts; deltas have kind 'delta', file,
+        from_seq, to_seq and ts.
+    """
+    path = os.path.join(backup_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# Function to append an entry to the backup manifest
+def _append_manifest(backup_dir, entry):
+    with open(os.path.join(backup_dir, MANIFEST_NAME), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+# Function to get the current end of the change log and the database clock
+def _log_position(conn):
+    # sqlite_sequence still knows the last number after the log was pruned
+    return conn.execute(
+        "SELECT IFNULL((SELECT seq FROM sqlite_sequence WHERE name = 'change_log'), 0), "
+        "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+    ).fetchone()
+
+# Function to take a full snapshot that the change log can be replayed onto
+def take_snapshot(backup_dir='backups', db_name=None, **backup_options):
+    """
+    Takes a full hot backup and records it in the manifest with the change log position.
+
+    The log position is read from the finished copy, so it is exactly the
+    last change the snapshot contains, even when writes commit while the copy
+    is running; a restore replays only the changes after it.
+
+    Args:
+        backup_dir (str): The backup directory.
+        db_name (str, optional): The database file. Defaults to the configured path.
+        **backup_options: Passed to backup.backup_database() (pages, sleep, progress, compression).
+
+    Returns:
+        str: The path to the snapshot file, or None if the backup failed.
+    """
+    if db_name is None:
+        db_name = connection.get_db_path()
+    # Export pending changes first so every delta ends before this snapshot starts
+    backup_changes(backup_dir, db_name)
+    position = {}
+
+    def read_position(copy_file):
+        copy = sqlite3.connect(copy_file)
+        try:
+            position["seq"], position["ts"] = _log_position(copy)
+        finally:
+            copy.close()
+
+    snapshot = backup.backup_database(backup_dir, db_name, after_copy=read_position, **backup_options)
+    if snapshot is not None:
+        _append_manifest(backup_dir, {
+            "kind": "snapshot", "file": os.path.basename(snapshot), "seq": position["seq"],
+            "ts": position["ts"]
+        })
+    return snapshot
+
+# Function to write the change log entries not yet backed up
+def backup_changes(backup_dir='backups', db_name=None, prune=True):
+    """
+    Writes the change log entries added since the last incremental backup to a gzipped JSONL delta.
+
+    Args:
+        backup_dir (str): The backup directory.
+        db_name (str, optional): The database file. Defaults to the configured path.
+        prune (bool): Delete the exported entries from the live change log afterwards.
+
+    Returns:
+        str: The path of the delta file, or None if there was nothing new to back up.
+    """
+    if not os.path.exists(backup_dir):
+        os.makedirs(backup_dir)
+    conn = connection.get_connection(db_name)
+
+    # Deltas form one unbroken chain: a snapshot may already hold entries
+    # that no delta has yet, and older snapshots still need them
+    last_seq = max([e["to_seq"] for e in read_manifest(backup_dir) if e["kind"] == "delta"] + [0])
+    to_seq, ts = _log_position(conn)
+    if to_seq <= last_seq:
+        return None
+
+    delta_file = os.path.join(backup_dir, f'changes_{last_seq + 1:012}_{to_seq:012}.jsonl.gz')
+    cursor = conn.execute(
+        "SELECT seq, ts, table_name, op, row_id, data FROM change_log "
+        "WHERE seq > ? AND seq <= ? ORDER BY seq",
+        (last_seq, to_seq),
+    )
+    with gzip.open(delta_file, 'wt', encoding='utf-8') as f:
+        while True:
+            rows = cursor.fetchmany(REPLAY_BATCH_SIZE)
+            if not rows:
+                break
+            for seq, entry_ts, table, op, row_id, data in rows:
+                f.write(json.dumps([seq, entry_ts, table, op, row_id, data]) + '\n')
+
+    _append_manifest(backup_dir, {
+        "kind": "delta", "file": os.path.basename(delta_file),
+        "from_seq": last_seq + 1, "to_seq": to_seq, "ts": ts
+    })
+
+    if prune:
+        conn.execute("DELETE FROM change_log WHERE seq <= ?", (to_seq,))
+        conn.commit()
+    return delta_file
+
+# Function to stream the logged changes after a snapshot up to a point in time
+def iter_changes(backup_dir, after_seq, until_ts):
+    """
+    Yields change log entries from the delta files in sequence order.
+
+    Args:
+        backup_dir (str): The backup directory.
+        after_seq (int): Only entries with a greater sequence number are returned.
+        until_ts (str): Only entries logged at or before this UTC timestamp are returned.
+
+    Yields:
+        tuple: (seq, ts, table_name, op, row_id, data).
+    """
+    for entry in read_manifest(backup_dir):
+        if entry["kind"] != "delta" or entry["to_seq"] <= after_seq:
+            continue
+        with gzip.open(os.path.join(backup_dir, entry["file"]), 'rt', encoding='utf-8') as f:
+            for line in f:
+                change = json.loads(line)
+                if change[0] <= after_seq:
+                    continue
+                if change[1] > until_ts:
+                    return
+                yield tuple(change)
+
+# Function to apply logged changes to a database connection in batches
+def replay_changes(conn, changes, batch_size=REPLAY_BATCH_SIZE):
+    """
+    Applies change log entries to a database.
+
+    Runs of consecutive entries with the same table and operation are applied
+    with a single executemany. Every operation is idempotent (insert-or-ignore,
+    full-row update, delete by id), so replaying an entry twice is harmless.
+
+    Args:
+        conn (sqlite3.Connection): The database to modify.
+        changes (iterable): Entries as yielded by iter_changes().
+        batch_size (int): Maximum number of entries per executemany.
+
+    Returns:
+        int: The number of entries applied.
+    """
+    applied = 0
+    batch = []
+    for key, group in groupby(changes, key=lambda change: (change[2], change[3])):
+        table, op = key
+        columns = LOGGED_TABLES[table]
+        if op == 'I':
+            sql = (f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) "
+                   f"VALUES ({', '.join('?' for _ in columns)})")
+        elif op == 'U':
+            sql = (f"UPDATE {table} SET {', '.join(f'{c} = ?' for c in columns[1:])} "
+                   "WHERE id = ?")
+        else:
+            sql = f"DELETE FROM {table} WHERE id = ?"
+
+        for change in group:
+            if op == 'D':
+                batch.append((change[4],))
+            else:
+                row = json.loads(change[5])
+                values = [row[c] for c in columns]
+                batch.append(values if op == 'I' else values[1:] + values[:1])
+            if len(batch) >= batch_size:
+                conn.executemany(sql, batch)
+                applied += len(batch)
+                batch = []
+        if batch:
+            conn.executemany(sql, batch)
+            applied += len(batch)
+            batch = []
+    return applied
+
+# Function to restore the database as it was at a given time
+def restore_to_point_in_time(target, backup_dir='backups', db_name=None):
+    """
+    Restores the newest snapshot taken before `target` and replays the change log up to it.
+
+    A fresh snapshot is taken after a successful restore, so that later
+    restores start from the restored state.
+
+    Args:
+        target (str or datetime): The point in time to restore to. Strings are UTC
+            in the change log format ('YYYY-MM-DD HH:MM:SS.SSS'); naive datetimes
+            are taken as UTC.
+        backup_dir (str): The backup directory.
+        db_name (str, optional): The database file. Defaults to the configured path.
+
+    Returns:
+        bool: True if the restore was successful, False otherwise.
+    """
+    target = _format_timestamp(target)
+    snapshots = [e for e in read_manifest(backup_dir)
+                 if e["kind"] == "snapshot" and e["ts"] <= target]
+    if not snapshots:
+        print(f"No snapshot found taken before {target}.")
+        return False
+    snapshot = snapshots[-1]
+    manifest_seq = max([e.get("to_seq", e.get("seq", 0)) for e in read_manifest(backup_dir)] + [0])
+
+    def replay(temp_file):
+        conn = sqlite3.connect(temp_file)
+        try:
+            # Replayed changes must not be logged again in the restored database
+            for name in CHANGE_LOG_TRIGGERS_SQL:
+                conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+            has_alerts = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'budget_alerts'"
+            ).fetchone()
+            with conn:
+                last_alert = 0
+                if has_alerts:
+                    last_alert = conn.execute("SELECT IFNULL(MAX(id), 0) FROM budget_alerts").fetchone()[0]
+                applied = replay_changes(conn, iter_changes(backup_dir, snapshot["seq"], target))
+                # The rollup triggers queue alerts again for the replayed
+                # writes; those alerts were already raised the first time
+                if has_alerts:
+                    conn.execute("DELETE FROM budget_alerts WHERE id > ?", (last_alert,))
+                conn.execute("DELETE FROM change_log")
+                # New entries must number after everything already in the manifest
+                conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'change_log'",
+                             (manifest_seq,))
+            create_changelog_schema(conn)
+            conn.commit()
+            print(f"Replayed {applied} changes onto snapshot {snapshot['file']}.")
+        finally:
+            conn.close()
+
+    snapshot_file = os.path.join(backup_dir, snapshot["file"])
+    if not backup.restore_database(snapshot_file, db_name, before_swap=replay):
+        return False
+    # Start a new base so later restores do not mix in log entries from the
+    # timeline that was just rolled back
+    take_snapshot(backup_dir, db_name)
+    return True
@@ -0,0 +1,466 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import shlex
+import signal
+import socket
+import sys
+import threading
+
+# Non-interactive command line for scripts and cron:
+#   python -m <package>.cli add 1 expense Food 12.50 --date 2024-03-01
+#   python -m <package>.cli batch commands.jsonl     (or '-' for stdin)
+#   python -m <package>.cli serve --socket /tmp/finance.sock
+#   python -m <package>.cli --socket /tmp/finance.sock monthly-report 1 3 2024
+# Every command prints one JSON line: {"ok": true, "result": ...} or
+# {"ok": false, "error": "..."}. A batch runs all its commands in one process
+# over the pooled connection. With --socket the command is sent to a running
+# daemon instead, so the client only pays for starting Python: this module
+# imports the rest of the package lazily, when a command is executed.
+#
+# Batch files and socket clients send one command per line, either as the
+# same words as on the command line or as a JSON object such as
+#   {"command": "add", "user_id": 1, "type": "expense", "category": "Food", "amount": 12.5}
+# JSON requests may pass "token" (from login) instead of "user_id", and an
+# "id" that is echoed in the response.
+DEFAULT_SOCKET = os.environ.get('FINANCE_SOCKET')
+
+# Seconds between checks of serve()'s stop event
+STOP_POLL_INTERVAL = 0.2
+
+# The commands. Each returns a JSON-serializable result and raises on failure;
+# the package modules are imported on first use.
+def _register(username, password):
+    from .finance_app import auth
+    if not auth.register_user(username, password):
+        raise ValueError("username already exists")
+    return {"registered": True}
+
+def _login(username, password):
+    from .finance_app import auth
+    token = auth.create_session(username, password)
+    if token is None:
+        raise ValueError("invalid username or password")
+    return {"user_id": auth.get_session(token)["user_id"], "token": token}
+
+def _logout(token):
+    from .finance_app import auth
+    return {"ended": auth.end_session(token)}
+
+def _add(user_id, type, category, amount, date=None):
+    from . import transactions
+    return {"transaction_id": transactions.add_transaction(user_id, type, category, amount, date)}
+
+def _update(transaction_id, type=None, category=None, amount=None, date=None):
+    from . import transactions
+    changes = {name: value for name, value in
+               (("type", type), ("category", category), ("amount", amount), ("date", date))
+               if value is not None}
+    return {"changed": transactions.update_transactions(changes, ids=[transaction_id])}
+
+def _delete(transaction_id):
+    from . import transactions
+    return {"deleted": transactions.delete_transactions(ids=[transaction_id])}
+
+def _monthly_report(user_id, month, year):
+    from . import reports
+    return reports.get_monthly_report(user_id, month, year)
+
+def _yearly_report(user_id, year):
+    from . import reports
+    return reports.get_yearly_report(user_id, year)
+
+def _totals(user_id, start_date, end_date):
+    from . import reports
+    return reports.get_totals(user_id, start_date, end_date)
+
+def _set_budget(user_id, category, amount, month, year):
+    from . import budget
+    budget.set_monthly_budget(user_id, category, amount, month, year)
+    return budget.get_budget_status(user_id, category, month, year)
+
+def _check_budget(user_id, month, year):
+    from . import budget
+    return budget.get_budget_exceedances(user_id, month, year)
+
+def _budgets(user_id, month, year):
+    from . import budget
+    return [{"category": category, "amount": amount}
+            for category, amount in budget.get_monthly_budgets(user_id, month, year)]
+
+def _backup(backup_dir='backups', compression=None):
+    from . import backup
+    path = backup.backup_database(backup_dir, compression=compression)
+    if path is None:
+        raise RuntimeError("backup failed")
+    return {"path": path}
+
+def _ping():
+    return {"pid": os.getpid()}
+
+# Commands: name -> (function, help, parameters). A parameter is
+# (name, type) if required or (name, type, default) if optional.
+COMMANDS = {
+    "register": (_register, "register a new user", [("username", str), ("password", str)]),
+    "login": (_login, "check credentials and open a session", [("username", str), ("password", str)]),
+    "logout": (_logout, "end a session", [("token", str)]),
+    "add": (_add, "add a transaction", [
+        ("user_id", int), ("type", str), ("category", str), ("amount", float), ("date", str, None)]),
+    "update": (_update, "update a transaction", [
+        ("transaction_id", int), ("type", str, None), ("category", str, None), ("amount", float, None),
+        ("date", str, None)]),
+    "delete": (_delete, "delete a transaction", [("transaction_id", int)]),
+    "monthly-report": (_monthly_report, "income, expenses and savings of a month", [
+        ("user_id", int), ("month", int), ("year", int)]),
+    "yearly-report": (_yearly_report, "income, expenses and savings of a year", [
+        ("user_id", int), ("year", int)]),
+    "totals": (_totals, "totals of a date range", [("user_id", int), ("start_date", str), ("end_date", str)]),
+    "set-budget": (_set_budget, "set a monthly budget", [
+        ("user_id", int), ("category", str), ("amount", float), ("month", int), ("year", int)]),
+    "check-budget": (_check_budget, "budgets exceeded in a month", [
+        ("user_id", int), ("month", int), ("year", int)]),
+    "budgets": (_budgets, "budgets of a month", [("user_id", int), ("month", int), ("year", int)]),
+    "backup": (_backup, "back up the database", [("backup_dir", str, 'backups'), ("compression", str, None)]),
+    "ping": (_ping, "check that the daemon is running", []),
+}
+
+# Function to build the argument parser, with one subcommand per command
+def _build_parser():
+    parser = argparse.ArgumentParser(prog=f"python -m {__package__}.cli",
+                                     description="Run finance commands without prompts.")
+    parser.add_argument("--db", help="Database file (defaults to the configured path)")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET,
+                        help="Send commands to the daemon on this Unix socket (default $FINANCE_SOCKET)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    for name, (_, help_text, params) in COMMANDS.items():
+        command = commands.add_parser(name, help=help_text)
+        for param in params:
+            if len(param) == 2:
+                command.add_argument(param[0], type=param[1])
+            else:
+                command.add_argument("--" + param[0].replace("_", "-"), dest=param[0], type=param[1],
+                                     default=param[2])
+
+    batch = commands.add_parser("batch", help="run the commands of a file, one per line")
+    batch.add_argument("file", nargs="?", default="-", help="command file, '-' for stdin (default)")
+    batch.add_argument("--group-commit", action="store_true",
+                       help="commit all writes of the batch at once (not with sharding)")
+    batch.add_argument("--stop-on-error", action="store_true")
+
+    serve = commands.add_parser("serve", help="run the command daemon on a Unix socket")
+    serve.add_argument("--socket", dest="serve_socket", help="Socket path (default $FINANCE_SOCKET)")
+    return parser
+
+_parser = []
+
+# Function to get the argument parser, built once
+def _get_parser():
+    if not _parser:
+        _parser.append(_build_parser())
+    return _parser[0]
+
+# Function to turn one batch line into a request dict
+def parse_line(line):
+    """
+    Parses a command line or JSON object into a request.
+
+    Args:
+        line (str): e.g. 'add 1 expense Food 12.5' or '{"command": "add", ...}'.
+
+    Returns:
+        dict or None: The request, or None for blank lines and '#' comments.
+
+    Raises:
+        ValueError: If the line cannot be parsed.
+    """
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    if line.startswith("{"):
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            raise ValueError("a JSON request must be an object")
+        return request
+
+    words = shlex.split(line)
+    if not words or words[0] not in COMMANDS:
+        raise ValueError(f"unknown command {words[0] if words else line!r}")
+    try:
+        # argparse reports errors on stderr; the response already carries them
+        with contextlib.redirect_stderr(io.StringIO()):
+            args = _get_parser().parse_args(words)
+    except SystemExit:
+        raise ValueError(f"invalid arguments for {words[0]!r}: {line}")
+    return _to_request(args)
+
+# Function to convert parsed command line arguments to a request dict
+def _to_request(args):
+    request = {"command": args.command}
+    for param in COMMANDS[args.command][2]:
+        value = getattr(args, param[0])
+        if value is not None:
+            request[param[0]] = value
+    return request
+
+# Function to execute one request in this process
+def execute(request):
+    """
+    Runs one command and reports its result instead of raising.
+
+    Args:
+        request (dict): "command" plus the command's parameters by name;
+            optionally "token" in place of "user_id" and an "id" to echo.
+
+    Returns:
+        dict: {"ok": True, "result": ...} or {"ok": False, "error": str},
+        with the request's "id" if it had one.
+    """
+    response = {"id": request["id"]} if "id" in request else {}
+    try:
+        name = request.get("command")
+        if name not in COMMANDS:
+            raise ValueError(f"unknown command {name!r}")
+        func, _, params = COMMANDS[name]
+
+        values = {key: value for key, value in request.items() if key not in ("command", "id")}
+        if "token" in values and name != "logout":
+            from .finance_app import auth
+            session = auth.get_session(values.pop("token"))
+            if session is None:
+                raise PermissionError("invalid or expired session token")
+            values.setdefault("user_id", session["user_id"])
+
+        kwargs = {}
+        for param in params:
+            if param[0] in values:
+                value = values.pop(param[0])
+                kwargs[param[0]] = None if value is None else param[1](value)
+            elif len(param) == 2:
+                raise ValueError(f"missing argument {param[0]!r} for {name!r}")
+        if values:
+            raise ValueError(f"unknown arguments for {name!r}: {', '.join(sorted(values))}")
+
+        response.update(ok=True, result=func(**kwargs))
+    except Exception as e:
+        response.update(ok=False, error=str(e) or type(e).__name__)
+    return response
+
+# Function to run the commands of a stream in this process
+def run_batch(lines, out, group=False, stop_on_error=False):
+    """
+    Executes one command per line and writes one JSON response per line.
+
+    Args:
+        lines (iterable): Command lines or JSON objects (see parse_line()).
+        out (file): Text stream the responses are written to.
+        group (bool): Commit all writes at once at the end (connection.group_commit());
+            a failing command only undoes its own changes.
+        stop_on_error (bool): Stop at the first failing command.
+
+    Returns:
+        int: Number of failed commands.
+    """
+    from . import connection, sharding
+    if group and sharding.is_sharded():
+        raise ValueError("--group-commit is not supported on a sharded database")
+
+    failures = 0
+    with connection.group_commit() if group else contextlib.nullcontext() as conn:
+        for line in lines:
+            try:
+                request = parse_line(line)
+            except ValueError as e:
+                request, response = {}, {"ok": False, "error": str(e)}
+            else:
+                if request is None:
+                    continue
+                if group:
+                    response = _execute_in_savepoint(conn, request)
+                else:
+                    response = execute(request)
+            out.write(json.dumps(response) + "\n")
+            if not response["ok"]:
+                failures += 1
+                if stop_on_error:
+                    break
+    out.flush()
+    return failures
+
+# Function to execute a request so that a failure leaves the group's other writes intact
+def _execute_in_savepoint(conn, request):
+    from . import connection
+    try:
+        with connection.savepoint(conn, "cli_command"):
+            response = execute(request)
+            if not response["ok"]:
+                raise RuntimeError(response["error"])
+    except RuntimeError:
+        pass
+    return response
+
+# Function to answer the requests of one daemon client
+def _serve_client(client):
+    from . import connection
+    try:
+        with client, client.makefile("rwb") as stream:
+            for raw in stream:
+                try:
+                    request = parse_line(raw.decode("utf-8"))
+                except ValueError as e:
+                    response = {"ok": False, "error": str(e)}
+                else:
+                    if request is None:
+                        continue
+                    response = execute(request)
+                stream.write((json.dumps(response) + "\n").encode("utf-8"))
+                stream.flush()
+    finally:
+        # The thread ends with the client; its pooled connections would otherwise stay open
+        connection.close_connection()
+
+# Function to run the command daemon
+def serve(socket_path, stop=None):
+    """
+    Listens on a Unix socket and executes the commands clients send.
+
+    Each client connection is served by its own thread, which reuses its
+    pooled database connection for all of that client's commands and closes
+    it when the client disconnects. Session tokens from login stay valid
+    across clients until the daemon stops. The socket is only accessible to
+    the current user. Runs until SIGINT or SIGTERM, or until `stop` is set.
+
+    Args:
+        socket_path (str): Path of the socket to create.
+        stop (threading.Event, optional): Stops the daemon when set. Signal handlers
+            are only installed in the main thread, so a daemon running in another
+            thread is stopped this way.
+    """
+    from . import connection
+
+    if os.path.exists(socket_path):
+        # A stale socket from a daemon that did not shut down cleanly
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except OSError:
+            os.remove(socket_path)
+        else:
+            raise RuntimeError(f"A daemon is already listening on {socket_path}")
+        finally:
+            probe.close()
+
+    # Open the database (and apply migrations) before accepting clients
+    connection.get_connection()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    previous_umask = os.umask(0o077)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(previous_umask)
+    server.listen()
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    if stop is not None:
+        # Wake up regularly to check the event
+        server.settimeout(STOP_POLL_INTERVAL)
+    print(f"Listening on {socket_path}", file=sys.stderr)
+
+    # The package functions print messages; responses carry the results instead.
+    # redirect_stdout() restores whatever stdout was before, e.g. when the
+    # daemon runs inside another program
+    try:
+        with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+            while stop is None or not stop.is_set():
+                try:
+                    client, _ = server.accept()
+                except socket.timeout:
+                    continue
+                client.settimeout(None)
+                threading.Thread(target=_serve_client, args=(client,), daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.remove(socket_path)
+
+# Function to send requests to the daemon and yield its responses
+def send(socket_path, lines):
+    """
+    Sends command lines to a daemon and yields the raw JSON responses.
+
+    Args:
+        socket_path (str): The daemon's socket.
+        lines (iterable): Command lines or JSON objects (see parse_line()).
+
+    Yields:
+        str: One JSON response line per command.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        with client.makefile("rwb") as stream:
+            for line in lines:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                stream.write(line.encode("utf-8") + b"\n")
+                stream.flush()
+                response = stream.readline()
+                if not response:
+                    raise ConnectionError("the daemon closed the connection")
+                yield response.decode("utf-8").rstrip("\n")
+
+# Command line entry point: python -m <package>.cli [--db PATH] [--socket PATH] COMMAND ...
+def main(argv=None):
+    """
+    Runs one command, a batch of commands or the daemon.
+
+    Args:
+        argv (list, optional): Command line arguments without the program name.
+
+    Returns:
+        int: Process exit code; 1 if any command failed.
+    """
+    args = _get_parser().parse_args(argv)
+    if args.db:
+        from . import connection
+        connection.configure(db_path=args.db)
+
+    if args.command == "serve":
+        socket_path = args.serve_socket or args.socket
+        if not socket_path:
+            print("serve needs --socket or FINANCE_SOCKET", file=sys.stderr)
+            return 2
+        serve(socket_path)
+        return 0
+
+    if args.command == "batch":
+        source = sys.stdin if args.file == "-" else open(args.file, encoding="utf-8")
+        with source:
+            if args.socket:
+                failures = 0
+                for response in send(args.socket, source):
+                    print(response)
+                    failures += not json.loads(response)["ok"]
+                    if failures and args.stop_on_error:
+                        break
+                return 1 if failures else 0
+            out = sys.stdout
+            with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+                failures = run_batch(source, out, group=args.group_commit, stop_on_error=args.stop_on_error)
+        return 1 if failures else 0
+
+    request = _to_request(args)
+    if args.socket:
+        response = next(send(args.socket, [json.dumps(request)]))
+        print(response)
+        return 0 if json.loads(response)["ok"] else 1
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+        response = execute(request)
+    print(json.dumps(response))
+    return 0 if response["ok"] else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,414 @@
+import os
+import sqlite3
+import threading
+import urllib.parse
+from contextlib import contextmanager
+
+from . import backup, migrations
+
+# Default settings for the shared connection manager. The database path can
+# also be provided through the FINANCE_DB_PATH environment variable.
+DEFAULT_DB_PATH = os.environ.get('FINANCE_DB_PATH', 'finance.db')
+DEFAULT_CACHE_SIZE = -64000        # negative values are KiB (here ~64 MB)
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024
+
+_settings = {
+    "db_path": DEFAULT_DB_PATH,
+    "cache_size": DEFAULT_CACHE_SIZE,
+    "mmap_size": DEFAULT_MMAP_SIZE,
+    "migrate": True,
+}
+
+_local = threading.local()
+_generation = [0]
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "closed": 0}
+
+# Every connection handed out, so close_all_connections() can reach other threads
+_open_connections = []
+
+# Functions called with every new pooled connection (see add_connection_hook)
+_connection_hooks = []
+
+# Function to change the connection settings used by the whole package
+def configure(db_path=None, cache_size=None, mmap_size=None, migrate=None):
+    """
+    Updates the settings used for new pooled connections.
+
+    Connections are cached per path, so changing db_path takes effect on the
+    next get_connection() call; PRAGMA changes only apply to new connections.
+
+    Args:
+        db_path (str, optional): Path of the SQLite database file.
+        cache_size (int, optional): Value for PRAGMA cache_size (pages, or KiB if negative).
+        mmap_size (int, optional): Value for PRAGMA mmap_size in bytes.
+        migrate (bool, optional): Apply pending schema migrations when a
+            connection is opened (default True).
+
+    Returns:
+        dict: The settings now in effect.
+    """
+    if db_path is not None:
+        _settings["db_path"] = db_path
+    if cache_size is not None:
+        _settings["cache_size"] = cache_size
+    if mmap_size is not None:
+        _settings["mmap_size"] = mmap_size
+    if migrate is not None:
+        _settings["migrate"] = migrate
+    return dict(_settings)
+
+# Function to get the configured database path
+def get_db_path():
+    """
+    Returns the path of the database file used by the package.
+
+    Returns:
+        str: The configured database path.
+    """
+    return _settings["db_path"]
+
+# Function to get the database get_connection() uses by default in this thread
+def current_db_path():
+    """
+    Returns the database selected by use_database(), or the configured path.
+
+    Returns:
+        str: The database path get_connection() opens without arguments.
+    """
+    return getattr(_local, "db_path", None) or _settings["db_path"]
+
+# Function to apply the performance PRAGMAs to a new connection
+def _tune_connection(conn):
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size={int(_settings['cache_size'])}")
+    conn.execute(f"PRAGMA mmap_size={int(_settings['mmap_size'])}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+
+# Function to get the shared connection for the current thread
+def get_connection(db_path=None, migrate=True):
+    """
+    Returns the thread-local connection for the database, opening it on first use.
+
+    Without db_path, the database selected by use_database() is used if the
+    thread is inside such a block, otherwise the configured path.
+
+    The connection is created through backup.connect_db and tuned with WAL
+    journaling, synchronous=NORMAL and the configured cache and mmap sizes.
+    A new connection first brings the database schema up to date (see
+    migrations.py); for an up-to-date database that is one PRAGMA read.
+    It is only ever used by the thread that opened it, but is created with
+    check_same_thread=False so close_all_connections() can close it from
+    another thread. Callers must not close it; use close_connection() instead.
+
+    Args:
+        db_path (str, optional): Database path. Defaults to the current database (see use_database()).
+        migrate (bool): Apply pending migrations when the connection is opened.
+            Pass False for SQLite files that are not finance databases, such as
+            the shared report cache.
+
+    Returns:
+        sqlite3.Connection: The pooled connection for this thread.
+    """
+    if db_path is None:
+        db_path = current_db_path()
+
+    connections = getattr(_local, "connections", None)
+    if connections is None or _local.generation != _generation[0]:
+        # First use in this thread, or close_all_connections() ran since
+        connections = _local.connections = {}
+        _local.generation = _generation[0]
+
+    conn = connections.get(db_path)
+    if conn is not None:
+        with _stats_lock:
+            _stats["hits"] += 1
+        return conn
+
+    conn = backup.connect_db(db_path, check_same_thread=False)
+    _tune_connection(conn)
+    # Registered before migrating, so code run by a migration that asks for
+    # the pooled connection gets this one
+    connections[db_path] = conn
+    if migrate and _settings["migrate"] and migrations.get_version(conn) < migrations.LATEST_VERSION:
+        try:
+            migrations.migrate(conn)
+        except Exception:
+            del connections[db_path]
+            conn.close()
+            raise
+    for hook in list(_connection_hooks):
+        hook(conn)
+    with _stats_lock:
+        _stats["misses"] += 1
+        _open_connections.append(conn)
+    return conn
+
+# Function to open a separate read-only connection
+def connect_read_only(db_path=None, immutable=False):
+    """
+    Opens a new read-only connection that is not part of the pool.
+
+    Meant for long read jobs such as worker processes: the connection cannot
+    write, does not run migrations and uses the configured cache and mmap sizes.
+    The caller owns it and must close it.
+
+    Args:
+        db_path (str, optional): Database path. Defaults to the current database (see use_database()).
+        immutable (bool): The file is never changed while open (e.g. an
+            archive), so SQLite can skip locking and change detection.
+
+    Returns:
+        sqlite3.Connection: The read-only connection.
+    """
+    if db_path is None:
+        db_path = current_db_path()
+    uri = "file:" + urllib.parse.quote(os.path.abspath(db_path)) + "?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.execute("PRAGMA query_only=ON")
+    conn.execute(f"PRAGMA cache_size={int(_settings['cache_size'])}")
+    conn.execute(f"PRAGMA mmap_size={int(_settings['mmap_size'])}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+# Function to close the connection(s) held by the current thread
+def close_connection(db_path=None):
+    """
+    Closes the current thread's pooled connection.
+
+    Args:
+        db_path (str, optional): Only close the connection for this path. If None,
+            all connections held by the current thread are closed.
+    """
+    connections = getattr(_local, "connections", None)
+    if not connections:
+        return
+
+    paths = [db_path] if db_path is not None else list(connections)
+    for path in paths:
+        conn = connections.pop(path, None)
+        if conn is not None:
+            _discard(conn)
+
+# Function to close every pooled connection, in all threads
+def close_all_connections():
+    """
+    Closes every connection handed out by the pool. Intended for shutdown,
+    tests and before replacing the database file (e.g. on restore).
+    """
+    with _stats_lock:
+        connections = list(_open_connections)
+    for conn in connections:
+        _discard(conn)
+    # Other threads drop their now-closed entries on their next get_connection()
+    _generation[0] += 1
+
+# Function to run a function on every pooled connection, present and future
+def add_connection_hook(hook):
+    """
+    Registers a function that is called with every new pooled connection.
+
+    The hook is also applied right away to the connections already open.
+
+    Args:
+        hook (callable): Called as hook(conn) with a sqlite3.Connection.
+    """
+    with _stats_lock:
+        if hook not in _connection_hooks:
+            _connection_hooks.append(hook)
+        connections = list(_open_connections)
+    for conn in connections:
+        hook(conn)
+
+# Function to stop applying a hook to new connections
+def remove_connection_hook(hook):
+    """
+    Unregisters a hook added with add_connection_hook(). Connections it was
+    already applied to are left as they are.
+
+    Args:
+        hook (callable): The hook to remove.
+    """
+    with _stats_lock:
+        if hook in _connection_hooks:
+            _connection_hooks.remove(hook)
+
+# Function to list the pooled connections that are currently open
+def open_connections():
+    """
+    Returns:
+        list: Every open pooled connection, across all threads.
+    """
+    with _stats_lock:
+        return list(_open_connections)
+
+def _discard(conn):
+    with _stats_lock:
+        if conn in _open_connections:
+            _open_connections.remove(conn)
+            _stats["closed"] += 1
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+# Function to point get_connection() at another database for a block
+@contextmanager
+def use_database(db_path):
+    """
+    Context manager making db_path the default database of the current thread.
+
+    Inside the block, get_connection() and group_commit() without a path use
+    db_path; the sharding router runs each call against the user's shard this way.
+
+    Args:
+        db_path (str): Database path, or None for the configured path.
+
+    Yields:
+        str: The database path in effect.
+    """
+    previous = getattr(_local, "db_path", None)
+    _local.db_path = db_path
+    try:
+        yield db_path or _settings["db_path"]
+    finally:
+        _local.db_path = previous
+
+# Function to check whether the current thread is inside group_commit()
+def in_group_commit():
+    """
+    Returns:
+        bool: True while connection.commit() defers commits to an open group_commit().
+    """
+    return bool(getattr(_local, "group_depth", 0))
+
+# Function to commit unless the current thread is inside group_commit()
+def commit(conn):
+    """
+    Commits the connection, or defers the commit while a group commit or savepoint is open.
+
+    Single-row write functions call this instead of conn.commit() so that
+    group_commit() can fold many of them into one transaction, and so that
+    they can run inside a savepoint() without ending it. The enclosing
+    block commits their writes when it exits.
+
+    Args:
+        conn (sqlite3.Connection): The connection to commit.
+    """
+    if getattr(_local, "group_depth", 0) or getattr(_local, "savepoint_depth", 0):
+        return
+    conn.commit()
+
+# Function to run several writes as one transaction with a single commit
+@contextmanager
+def group_commit(db_path=None):
+    """
+    Context manager that batches the writes of the current thread into one transaction.
+
+    Inside the block connection.commit() does nothing; the transaction is
+    committed once when the block exits, or rolled back if it raises.
+
+    Args:
+        db_path (str, optional): Database path. Defaults to the current database (see use_database()).
+
+    Yields:
+        sqlite3.Connection: The pooled connection the writes must use.
+    """
+    conn = get_connection(db_path)
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    _local.group_depth = getattr(_local, "group_depth", 0) + 1
+    if _local.group_depth == 1:
+        _local.pending_callbacks = []
+    try:
+        yield conn
+    except BaseException:
+        _local.group_depth -= 1
+        if not _local.group_depth:
+            _local.pending_callbacks = []
+            conn.rollback()
+        raise
+    _local.group_depth -= 1
+    if not _local.group_depth:
+        conn.commit()
+        callbacks, _local.pending_callbacks = _local.pending_callbacks, []
+        for callback in callbacks:
+            callback()
+
+# Function to run something once the current writes are committed
+def after_commit(callback):
+    """
+    Runs a callback after the current thread's writes are committed.
+
+    Outside group_commit() the caller has already committed, so the callback
+    runs immediately; inside, it runs once the group commits and is dropped if
+    the group rolls back. Used to invalidate in-memory derived data only after
+    other threads can see the new rows.
+
+    Args:
+        callback (callable): Called without arguments.
+    """
+    if getattr(_local, "group_depth", 0):
+        _local.pending_callbacks.append(callback)
+    else:
+        callback()
+
+# Function to run part of a transaction so it can be undone on its own
+@contextmanager
+def savepoint(conn, name="sp"):
+    """
+    Context manager wrapping a block in a SAVEPOINT.
+
+    If the block raises, only its own changes are rolled back and the
+    exception is re-raised; the enclosing transaction stays usable. Inside
+    the block connection.commit() does nothing. An outermost savepoint
+    commits when it is released; code inside it must not call conn.commit()
+    or conn.rollback() directly, as that ends the savepoint.
+
+    Args:
+        conn (sqlite3.Connection): The connection to use.
+        name (str): Savepoint name.
+
+    Yields:
+        sqlite3.Connection: The same connection.
+    """
+    conn.execute(f"SAVEPOINT {name}")
+    _local.savepoint_depth = getattr(_local, "savepoint_depth", 0) + 1
+    try:
+        yield conn
+    except BaseException:
+        _local.savepoint_depth -= 1
+        conn.execute(f"ROLLBACK TO {name}")
+        conn.execute(f"RELEASE {name}")
+        raise
+    _local.savepoint_depth -= 1
+    conn.execute(f"RELEASE {name}")
+
+# Function to report connection pool statistics
+def pool_stats():
+    """
+    Returns the connection pool hit and miss statistics.
+
+    Returns:
+        dict: Counts of hits (reused connections), misses (new connections),
+        closed connections, currently open connections and the hit ratio.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+        stats["open"] = len(_open_connections)
+    requests = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = stats["hits"] / requests if requests else 0.0
+    return stats
+
+# Function to reset the connection pool statistics
+def reset_pool_stats():
+    """
+    Resets the hit, miss and closed counters to zero.
+    """
+    with _stats_lock:
+        _stats["hits"] = 0
+        _stats["misses"] = 0
+        _stats["closed"] = 0
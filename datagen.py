@@ -0,0 +1,260 @@
+import argparse
+import calendar
+import math
+import random
+import time
+
+from . import backup, changelog, connection, prefix_index, report_cache, rollups, schema
+from .finance_app import auth
+
+# Seeded generator of realistic test data, written straight into the schema.
+# Every user gets a monthly salary and rent, and the remaining transactions
+# are drawn from weighted expense categories with log-normal amounts, plus
+# occasional side income. Each user has its own random stream derived from
+# (seed, user index), so the data does not depend on chunk sizes.
+
+# Expense categories: (weight, mu, sigma) of a log-normal amount distribution
+EXPENSE_CATEGORIES = {
+    "Groceries": (30, 3.5, 0.5),
+    "Food": (22, 2.8, 0.6),
+    "Transport": (14, 2.6, 0.7),
+    "Shopping": (10, 3.8, 0.9),
+    "Entertainment": (7, 3.0, 0.8),
+    "Utilities": (6, 4.3, 0.3),
+    "Health": (4, 3.7, 0.9),
+    "Travel": (2, 5.5, 0.8),
+}
+# Occasional income on top of the salary: (share of variable transactions, mu, sigma)
+SIDE_INCOME_CATEGORIES = {
+    "Freelance": (0.03, 5.5, 0.7),
+    "Interest": (0.02, 2.0, 1.0),
+}
+# Categories that get a monthly budget
+BUDGET_CATEGORIES = ("Groceries", "Food", "Transport", "Shopping", "Entertainment")
+
+DEFAULT_START_DATE = '2024-01-01'
+DEFAULT_MONTHS = 12
+DEFAULT_PASSWORD = 'password'
+DEFAULT_CHUNK_SIZE = 50000
+
+# Function to list the (year, month) pairs covered by the generated data
+def month_range(start_date=DEFAULT_START_DATE, months=DEFAULT_MONTHS):
+    """
+    Lists consecutive months starting with the month of start_date.
+
+    Args:
+        start_date (str): First date in YYYY-MM-DD format.
+        months (int): Number of months.
+
+    Returns:
+        list: (year, month) tuples.
+    """
+    year, month = int(start_date[:4]), int(start_date[5:7])
+    result = []
+    for _ in range(months):
+        result.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return result
+
+# Function to draw the transactions and budgets of one user
+def generate_user(rng, per_user, periods):
+    """
+    Draws the transactions and budgets of one user.
+
+    Args:
+        rng (random.Random): The user's random stream.
+        per_user (int): Number of transactions.
+        periods (list): (year, month) tuples to spread the transactions over.
+
+    Returns:
+        tuple: (transactions, budgets). Transactions are (type, category,
+        amount_cents, date) tuples, budgets are (category, amount, month, year).
+    """
+    transactions = []
+    salary = rng.uniform(2000, 8000)
+    rent = rng.uniform(600, 2500)
+    payday = rng.choice((1, 15, 25))
+
+    # Fixed monthly income and rent, as far as the transaction count allows
+    for year, month in periods:
+        if len(transactions) + 2 > per_user:
+            break
+        transactions.append(('income', 'Salary', round(salary * rng.uniform(0.97, 1.03) * 100),
+                             f"{year:04d}-{month:02d}-{payday:02d}"))
+        transactions.append(('expense', 'Rent', round(rent * 100), f"{year:04d}-{month:02d}-01"))
+
+    names = list(EXPENSE_CATEGORIES)
+    weights = [EXPENSE_CATEGORIES[name][0] for name in names]
+    variable = per_user - len(transactions)
+    side_share = sum(share for share, _, _ in SIDE_INCOME_CATEGORIES.values())
+    for _ in range(variable):
+        year, month = rng.choice(periods)
+        day = rng.randint(1, calendar.monthrange(year, month)[1])
+        when = f"{year:04d}-{month:02d}-{day:02d}"
+        draw = rng.random()
+        if draw < side_share:
+            for name, (share, mu, sigma) in SIDE_INCOME_CATEGORIES.items():
+                if draw < share:
+                    break
+                draw -= share
+            transactions.append(('income', name, max(1, round(rng.lognormvariate(mu, sigma) * 100)), when))
+        else:
+            name = rng.choices(names, weights)[0]
+            _, mu, sigma = EXPENSE_CATEGORIES[name]
+            transactions.append(('expense', name, max(1, round(rng.lognormvariate(mu, sigma) * 100)), when))
+
+    # Budgets around the expected monthly spending, so some are exceeded
+    budgets = []
+    per_month = variable * (1 - side_share) / len(periods)
+    total_weight = sum(weights)
+    for name in BUDGET_CATEGORIES:
+        weight, mu, sigma = EXPENSE_CATEGORIES[name]
+        expected = per_month * weight / total_weight * math.exp(mu + sigma * sigma / 2)
+        for year, month in periods:
+            amount = max(10, round(expected * rng.uniform(0.8, 1.3) / 10) * 10)
+            budgets.append((name, float(amount), month, year))
+    return transactions, budgets
+
+# Function to drop the triggers that would fire for every generated row
+def _drop_triggers(conn):
+    names = list(rollups.ROLLUP_TRIGGERS_SQL) + list(changelog.CHANGE_LOG_TRIGGERS_SQL)
+    for name in names:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    for name, sql in backup.INDEXES.items():
+        if "transaction_entries" in sql:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+
+# Function to write one chunk of generated users
+def _write_users(conn, users, category_ids, password_hash, username_prefix):
+    entries = []
+    budget_rows = []
+    for index, transactions, budgets in users:
+        cursor = conn.execute("INSERT INTO users (username, password) VALUES (?, ?)",
+                              (f"{username_prefix}{index}", password_hash))
+        user_id = cursor.lastrowid
+        for transaction_type, category, cents, when in transactions:
+            entries.append((user_id, schema.TYPE_CODES[transaction_type], category_ids[category], cents, when))
+        for category, amount, month, year in budgets:
+            budget_rows.append((user_id, category, amount, month, year))
+    conn.executemany(
+        "INSERT INTO transaction_entries (user_id, type, category_id, amount_cents, date) VALUES (?, ?, ?, ?, ?)",
+        entries,
+    )
+    conn.executemany(
+        "INSERT INTO budgets (user_id, category, amount, month, year) VALUES (?, ?, ?, ?, ?)",
+        budget_rows,
+    )
+    return len(entries), len(budget_rows)
+
+# Function to generate a synthetic data set into the configured database
+def generate_dataset(users, per_user, seed=0, start_date=DEFAULT_START_DATE, months=DEFAULT_MONTHS,
+                     budgets=True, password=DEFAULT_PASSWORD, username_prefix='user',
+                     chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """
+    Creates users with transactions and budgets, reproducibly from a seed.
+
+    Rows are written with executemany straight into the tables. The rollup
+    and change log triggers and the transaction indexes are dropped during
+    the load and restored afterwards (rollups are rebuilt in one pass), so the
+    database should not be written by anyone else meanwhile. Generated rows
+    are not recorded in the change log; take a snapshot afterwards if needed.
+
+    Args:
+        users (int): Number of users to create.
+        per_user (int): Number of transactions per user.
+        seed (int): Random seed; the same seed produces the same data.
+        start_date (str): First month of the data (YYYY-MM-DD).
+        months (int): Number of months the transactions are spread over.
+        budgets (bool): Also create monthly budgets.
+        password (str): Password of every generated user.
+        username_prefix (str): Usernames are the prefix followed by the user index.
+        chunk_size (int): Approximate number of transactions per commit.
+        progress (callable, optional): Called as progress(users_done, users).
+
+    Returns:
+        dict: Counts of "users", "transactions" and "budgets", and "seconds".
+    """
+    started = time.perf_counter()
+    if not _has_schema():
+        backup.initialize_db()
+    conn = connection.get_connection()
+    periods = month_range(start_date, months)
+    # Hashed once: every generated user shares the password and its salt
+    password_hash = auth.hash_password(password)
+    names = ['Salary', 'Rent'] + list(EXPENSE_CATEGORIES) + list(SIDE_INCOME_CATEGORIES)
+    conn.executemany("INSERT OR IGNORE INTO categories (name) VALUES (?)", ((name,) for name in names))
+    category_ids = dict(conn.execute("SELECT name, id FROM categories"))
+    conn.commit()
+
+    counts = {"users": 0, "transactions": 0, "budgets": 0}
+    users_per_chunk = max(1, chunk_size // max(1, per_user))
+    _drop_triggers(conn)
+    try:
+        pending = []
+        for index in range(users):
+            rng = random.Random(f"{seed}:{index}")
+            transactions, user_budgets = generate_user(rng, per_user, periods)
+            pending.append((index, transactions, user_budgets if budgets else []))
+            if len(pending) >= users_per_chunk or index == users - 1:
+                written, budget_rows = _write_users(conn, pending, category_ids, password_hash,
+                                                    username_prefix)
+                conn.commit()
+                counts["users"] += len(pending)
+                counts["transactions"] += written
+                counts["budgets"] += budget_rows
+                pending = []
+                if progress is not None:
+                    progress(counts["users"], users)
+    finally:
+        conn.rollback()
+        rollups.create_rollup_schema(conn)
+        rollups.rebuild_rollups(conn, commit=False)
+        changelog.create_changelog_schema(conn)
+        backup.ensure_indexes(conn)
+        conn.commit()
+        prefix_index.clear()
+        report_cache.clear()
+
+    counts["seconds"] = time.perf_counter() - started
+    return counts
+
+# Function to check whether the database has been initialized
+def _has_schema():
+    return connection.get_connection().execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'transaction_entries'"
+    ).fetchone() is not None
+
+# Command line entry point: python -m <package>.datagen --users N --per-user M
+def main(argv=None):
+    """
+    Generates a synthetic data set into the configured database.
+
+    Args:
+        argv (list, optional): Command line arguments without the program name.
+
+    Returns:
+        int: Process exit code.
+    """
+    parser = argparse.ArgumentParser(description="Generate synthetic finance data.")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--per-user", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--start-date", default=DEFAULT_START_DATE)
+    parser.add_argument("--months", type=int, default=DEFAULT_MONTHS)
+    parser.add_argument("--no-budgets", action="store_true")
+    parser.add_argument("--db", help="Database file (defaults to the configured path)")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        connection.configure(db_path=args.db)
+    counts = generate_dataset(
+        args.users, args.per_user, seed=args.seed, start_date=args.start_date, months=args.months,
+        budgets=not args.no_budgets,
+        progress=lambda done, total: print(f"Generated {done}/{total} users", end="\r"),
+    )
+    print(f"\nGenerated {counts['users']} users, {counts['transactions']} transactions and "
+          f"{counts['budgets']} budgets in {counts['seconds']:.1f}s.")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,13 +1,14 @@
-import sqlite3
+from . import connection, migrations
+
+# Function to create the application tables
 def create_tables():
-    conn = sqlite3.connect('finance.db')
-    cursor = conn.cursor()
+    """
+    Brings the database schema up to date.
+
+    Kept for older callers; the tables are defined by the migrations in
+    migrations.py, which also run when the first connection is opened.
 
-    # Create the users table
-    cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        username TEXT UNIQUE,
-                        password TEXT
-                    )''')
-    conn.commit()
-    conn.close()
+    Returns:
+        list: The migration versions that were applied.
+    """
+    return migrations.migrate(connection.get_connection())
@@ -0,0 +1,203 @@
+import csv
+import json
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional, only needed for Parquet exports
+    pyarrow = None
+
+from . import connection
+
+# Columns exposed per table. Password hashes are never exported.
+TABLE_COLUMNS = {
+    "users": ("id", "username"),
+    "transactions": ("id", "user_id", "type", "category", "amount", "date"),
+    "budgets": ("id", "user_id", "category", "amount", "month", "year"),
+}
+
+EXPORT_FORMATS = ('csv', 'jsonl', 'parquet')
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_PAGE_SIZE = 50
+
+# Function to build the filtered, id-ordered SELECT for a table
+def build_select(table, user_id=None, start_date=None, end_date=None, category=None,
+                 after_id=None, limit=None):
+    """
+    Builds the SQL and parameters for reading a table in id order.
+
+    Args:
+        table (str): 'users', 'transactions' or 'budgets'.
+        user_id (int, optional): Only rows of this user (the user itself for 'users').
+        start_date (str, optional): First date to include (YYYY-MM-DD). For budgets
+            the month of the date is compared.
+        end_date (str, optional): Last date to include (YYYY-MM-DD).
+        category (str, optional): Only rows of this category.
+        after_id (int, optional): Only rows with a greater id (keyset pagination).
+        limit (int, optional): Maximum number of rows.
+
+    Returns:
+        tuple: (sql, params).
+    """
+    if table not in TABLE_COLUMNS:
+        raise ValueError(f"Unknown table {table!r}; use one of {', '.join(TABLE_COLUMNS)}")
+
+    conditions = []
+    params = []
+    if user_id is not None:
+        conditions.append("id = ?" if table == "users" else "user_id = ?")
+        params.append(user_id)
+    if table == "transactions":
+        if start_date is not None:
+            conditions.append("date >= ?")
+            params.append(start_date)
+        if end_date is not None:
+            conditions.append("date <= ?")
+            params.append(end_date)
+    elif table == "budgets":
+        # Budgets are per month, so compare year * 100 + month
+        if start_date is not None:
+            conditions.append("year * 100 + month >= ?")
+            params.append(int(start_date[:4]) * 100 + int(start_date[5:7]))
+        if end_date is not None:
+            conditions.append("year * 100 + month <= ?")
+            params.append(int(end_date[:4]) * 100 + int(end_date[5:7]))
+    if category is not None and table != "users":
+        conditions.append("category = ?")
+        params.append(category)
+    if after_id is not None:
+        conditions.append("id > ?")
+        params.append(after_id)
+
+    sql = f"SELECT {', '.join(TABLE_COLUMNS[table])} FROM {table}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY id"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+    return sql, tuple(params)
+
+# Function to stream the rows of a table in batches
+def iter_rows(table, user_id=None, start_date=None, end_date=None, category=None,
+              batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Lazily yields the rows of a table, fetching them from SQLite in batches.
+
+    Memory use depends on batch_size only, not on the size of the table.
+
+    Args:
+        table (str): 'users', 'transactions' or 'budgets'.
+        user_id (int, optional): Only rows of this user.
+        start_date (str, optional): First date to include (YYYY-MM-DD).
+        end_date (str, optional): Last date to include (YYYY-MM-DD).
+        category (str, optional): Only rows of this category.
+        batch_size (int): Number of rows fetched at a time.
+
+    Yields:
+        tuple: One row, in the column order of TABLE_COLUMNS[table].
+    """
+    for rows in iter_batches(table, batch_size, user_id=user_id, start_date=start_date,
+                             end_date=end_date, category=category):
+        yield from rows
+
+# Function to stream the rows of a table as lists of rows
+def iter_batches(table, batch_size=DEFAULT_BATCH_SIZE, **filters):
+    """
+    Lazily yields the rows of a table in lists of up to batch_size rows.
+
+    Args:
+        table (str): 'users', 'transactions' or 'budgets'.
+        batch_size (int): Number of rows per batch.
+        **filters: user_id, start_date, end_date and category, as for iter_rows().
+
+    Yields:
+        list: A batch of row tuples.
+    """
+    sql, params = build_select(table, **filters)
+    cursor = connection.get_connection().cursor()
+    cursor.execute(sql, params)
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+# Function to export a table to a CSV, JSONL or Parquet file
+def export_table(table, path, fmt='csv', batch_size=DEFAULT_BATCH_SIZE, **filters):
+    """
+    Streams a table (optionally filtered) to a file.
+
+    Args:
+        table (str): 'users', 'transactions' or 'budgets'.
+        path (str): Output file path.
+        fmt (str): 'csv', 'jsonl' or 'parquet' (needs the pyarrow package).
+        batch_size (int): Number of rows fetched and written at a time.
+        **filters: user_id, start_date, end_date and category, as for iter_rows().
+
+    Returns:
+        int: The number of rows written.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}; use one of {', '.join(EXPORT_FORMATS)}")
+    if fmt == 'parquet' and pyarrow is None:
+        raise RuntimeError("Parquet export requires the 'pyarrow' package")
+
+    columns = TABLE_COLUMNS[table]
+    batches = iter_batches(table, batch_size=batch_size, **filters)
+    written = 0
+
+    if fmt == 'csv':
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for rows in batches:
+                writer.writerows(rows)
+                written += len(rows)
+    elif fmt == 'jsonl':
+        with open(path, 'w', encoding='utf-8') as f:
+            for rows in batches:
+                f.writelines(json.dumps(dict(zip(columns, row))) + '\n' for row in rows)
+                written += len(rows)
+    else:
+        writer = None
+        try:
+            for rows in batches:
+                batch = pyarrow.RecordBatch.from_arrays(
+                    [pyarrow.array(values) for values in zip(*rows)], names=list(columns)
+                )
+                if writer is None:
+                    writer = pyarrow.parquet.ParquetWriter(path, batch.schema)
+                writer.write_batch(batch)
+                written += len(rows)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    return written
+
+# Function to list one page of a table for interactive browsing
+def list_rows(table, after_id=0, limit=DEFAULT_PAGE_SIZE, **filters):
+    """
+    Returns one page of rows using keyset pagination on id.
+
+    Unlike OFFSET paging, every page costs the same no matter how deep the
+    caller has browsed: pass the returned next_after_id to get the next page.
+
+    Args:
+        table (str): 'users', 'transactions' or 'budgets'.
+        after_id (int): Return rows with an id greater than this (0 for the first page).
+        limit (int): Maximum number of rows on the page.
+        **filters: user_id, start_date, end_date and category, as for iter_rows().
+
+    Returns:
+        dict: {"rows": list of dicts, "next_after_id": int or None when there are no more rows}.
+    """
+    sql, params = build_select(table, after_id=after_id, limit=limit, **filters)
+    columns = TABLE_COLUMNS[table]
+    rows = [dict(zip(columns, row)) for row in connection.get_connection().execute(sql, params)]
+    next_after_id = rows[-1]["id"] if len(rows) == limit else None
+    return {"rows": rows, "next_after_id": next_after_id}
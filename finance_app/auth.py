@@ -1,5 +1,181 @@
-import sqlite3
 import hashlib
+import hmac
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .. import connection
+
+# Passwords are stored as self-describing strings, so the KDF and its cost
+# can be raised later without invalidating existing hashes:
+#   scrypt$<n>$<r>$<p>$<salt hex>$<hash hex>
+#   pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>
+# Rows written by earlier versions hold a bare unsalted SHA-256 hex digest;
+# they are rehashed with the current settings on the next successful login.
+#
+# The KDF is deliberately slow, so it runs on a small bounded thread pool
+# (hashlib releases the GIL while hashing): a burst of logins queues there
+# instead of occupying every thread of the application. Sessions let later
+# requests skip the KDF altogether.
+_settings = {
+    "algorithm": "scrypt" if hasattr(hashlib, "scrypt") else "pbkdf2_sha256",
+    "scrypt_n": 2 ** 14,
+    "scrypt_r": 8,
+    "scrypt_p": 1,
+    "pbkdf2_iterations": 600000,
+    "kdf_workers": min(4, os.cpu_count() or 1),
+    "session_ttl": 3600,
+    "max_sessions": 100000,
+}
+SALT_BYTES = 16
+HASH_BYTES = 32
+LEGACY_HASH_LENGTH = 64
+
+USER_LOOKUP_SQL = "SELECT id, password FROM users WHERE username = ?"
+# Only replace the hash that was verified, in case of a concurrent change
+REHASH_SQL = "UPDATE users SET password = ? WHERE id = ? AND password = ?"
+
+_pool_lock = threading.Lock()
+_state = {"pool": None, "dummy_hash": None}
+# token -> (user_id, username, expires); oldest first
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+
+# Function to change the password hashing and session settings
+def configure(algorithm=None, scrypt_n=None, scrypt_r=None, scrypt_p=None, pbkdf2_iterations=None,
+              kdf_workers=None, session_ttl=None, max_sessions=None):
+    """
+    Updates the KDF, its cost parameters and the session cache limits.
+
+    New hashes use the new settings; existing hashes keep working and are
+    upgraded on the user's next successful login.
+
+    Args:
+        algorithm (str, optional): 'scrypt' or 'pbkdf2_sha256'.
+        scrypt_n (int, optional): scrypt CPU/memory cost (a power of two).
+        scrypt_r (int, optional): scrypt block size.
+        scrypt_p (int, optional): scrypt parallelization.
+        pbkdf2_iterations (int, optional): PBKDF2-HMAC-SHA256 iterations.
+        kdf_workers (int, optional): Threads that may run the KDF at the same time.
+        session_ttl (float, optional): Seconds a session token stays valid.
+        max_sessions (int, optional): Sessions kept in memory; the oldest are dropped first.
+
+    Returns:
+        dict: The settings now in effect.
+    """
+    if algorithm is not None:
+        if algorithm not in ("scrypt", "pbkdf2_sha256"):
+            raise ValueError(f"Unknown algorithm {algorithm!r}; use 'scrypt' or 'pbkdf2_sha256'")
+        if algorithm == "scrypt" and not hasattr(hashlib, "scrypt"):
+            raise ValueError("hashlib.scrypt is not available in this Python build")
+        _settings["algorithm"] = algorithm
+    for name, value in (("scrypt_n", scrypt_n), ("scrypt_r", scrypt_r), ("scrypt_p", scrypt_p),
+                        ("pbkdf2_iterations", pbkdf2_iterations), ("session_ttl", session_ttl),
+                        ("max_sessions", max_sessions)):
+        if value is not None:
+            _settings[name] = value
+    if kdf_workers is not None and kdf_workers != _settings["kdf_workers"]:
+        _settings["kdf_workers"] = kdf_workers
+        with _pool_lock:
+            pool, _state["pool"] = _state["pool"], None
+        if pool is not None:
+            pool.shutdown(wait=False)
+    _state["dummy_hash"] = None
+    return dict(_settings)
+
+# Function to get the KDF thread pool, starting it on first use
+def _pool():
+    pool = _state["pool"]
+    if pool is None:
+        with _pool_lock:
+            if _state["pool"] is None:
+                _state["pool"] = ThreadPoolExecutor(max_workers=_settings["kdf_workers"],
+                                                    thread_name_prefix="finance-kdf")
+            pool = _state["pool"]
+    return pool
+
+# Function to derive a key from a password; runs on the KDF pool
+def _derive(password, algorithm, salt, params):
+    if algorithm == "scrypt":
+        n, r, p = params
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=128 * n * r * p + 1024 * 1024, dklen=HASH_BYTES)
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, params[0], dklen=HASH_BYTES)
+
+# Function to derive a key on the KDF pool and wait for it
+def _derive_pooled(password, algorithm, salt, params):
+    return _pool().submit(_derive, password, algorithm, salt, params).result()
+
+# Function to hash a password with the current settings
+def hash_password(password):
+    """
+    Hashes a password with a random salt and the configured KDF.
+
+    Args:
+        password (str): The password.
+
+    Returns:
+        str: The encoded hash to store in users.password.
+    """
+    salt = os.urandom(SALT_BYTES)
+    if _settings["algorithm"] == "scrypt":
+        params = (_settings["scrypt_n"], _settings["scrypt_r"], _settings["scrypt_p"])
+    else:
+        params = (_settings["pbkdf2_iterations"],)
+    digest = _derive_pooled(password, _settings["algorithm"], salt, params)
+    return "$".join([_settings["algorithm"], *map(str, params), salt.hex(), digest.hex()])
+
+# Function to check a password against a stored hash
+def verify_password(password, stored):
+    """
+    Checks a password against a stored hash of any supported format.
+
+    Args:
+        password (str): The password to check.
+        stored (str): The value of users.password.
+
+    Returns:
+        bool: True if the password matches.
+    """
+    if not stored:
+        return False
+    if "$" not in stored:
+        # Legacy unsalted SHA-256
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+    algorithm, *fields = stored.split("$")
+    try:
+        *params, salt, digest = fields
+        params = tuple(int(value) for value in params)
+        salt, digest = bytes.fromhex(salt), bytes.fromhex(digest)
+    except ValueError:
+        return False
+    if (algorithm, len(params)) not in (("scrypt", 3), ("pbkdf2_sha256", 1)):
+        return False
+    return hmac.compare_digest(_derive_pooled(password, algorithm, salt, params), digest)
+
+# Function to check whether a stored hash should be upgraded
+def needs_rehash(stored):
+    """
+    Tells whether a stored hash uses an old format, KDF or cost.
+
+    Args:
+        stored (str): The value of users.password.
+
+    Returns:
+        bool: True if it differs from what hash_password() would produce now.
+    """
+    if not stored or "$" not in stored:
+        return True
+    fields = stored.split("$")
+    if fields[0] != _settings["algorithm"]:
+        return True
+    if fields[0] == "scrypt":
+        return fields[1:4] != [str(_settings["scrypt_n"]), str(_settings["scrypt_r"]), str(_settings["scrypt_p"])]
+    return fields[1] != str(_settings["pbkdf2_iterations"])
 
 # Function to register a new user
 def register_user(username, password):
@@ -13,55 +189,169 @@ def register_user(username, password):
     Returns:
         bool: True if registration is successful, False if the username already exists.
     """
-    conn = sqlite3.connect('finance.db')
-    cursor = conn.cursor()
+    # Hash the password before storing it (outside the write transaction)
+    hashed_password = hash_password(password)
 
-    # Hash the password before storing it
-    hashed_password = hashlib.sha256(password.encode()).hexdigest()
+    conn = connection.get_connection()
+    cursor = conn.cursor()
 
     try:
-        # Insert the new user into the users table
-        cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, hashed_password))
-        conn.commit()
+        # Insert the new user into the users table; a duplicate only undoes
+        # this insert, not the writes of an enclosing group commit
+        with connection.savepoint(conn, "register_user"):
+            cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, hashed_password))
+        connection.commit(conn)
         print("User registered successfully!")
         return True
     except sqlite3.IntegrityError:
         print("Error: Username already exists. Please choose a different username.")
         return False
-    finally:
-        conn.close()
+
+# Function to store an upgraded password hash
+def store_rehash(user_id, stored, new_hash):
+    """
+    Replaces a user's password hash after a successful login.
+
+    Nothing is changed if the hash was replaced since it was verified.
+    Committed with connection.commit(), so it joins an enclosing group
+    commit or savepoint.
+
+    Args:
+        user_id (int): The user's ID.
+        stored (str): The hash that was verified.
+        new_hash (str): The hash to store instead.
+    """
+    conn = connection.get_connection()
+    conn.execute(REHASH_SQL, (new_hash, user_id, stored))
+    connection.commit(conn)
+
+# Function to verify credentials and return the user's ID
+def authenticate(username, password, rehash=None):
+    """
+    Verifies a username and password without printing anything.
+
+    The user is looked up by username alone (the UNIQUE index on
+    users.username) and the password checked with the KDF. Hashes in an old
+    format or with outdated settings are replaced after a successful check.
+
+    Args:
+        username (str): The username.
+        password (str): The password.
+        rehash (callable, optional): Called with (user_id, stored hash, new hash)
+            to store an upgraded hash. Defaults to store_rehash(); callers that
+            must not write on this thread pass a function that queues the write.
+
+    Returns:
+        int or None: The user's ID, or None if the credentials are wrong.
+    """
+    conn = connection.get_connection()
+    row = conn.execute(USER_LOOKUP_SQL, (username,)).fetchone()
+    if row is None:
+        # Spend the same time as for a wrong password, so unknown usernames
+        # cannot be told apart by the response time
+        if _state["dummy_hash"] is None:
+            _state["dummy_hash"] = hash_password(secrets.token_hex(8))
+        verify_password(password, _state["dummy_hash"])
+        return None
+
+    user_id, stored = row
+    if not verify_password(password, stored):
+        return None
+    if needs_rehash(stored):
+        (rehash or store_rehash)(user_id, stored, hash_password(password))
+    return user_id
 
 # Function to authenticate (login) an existing user
-def login_user(username, password):
+def login_user(username, password, rehash=None):
     """
     Logs in an existing user by verifying the username and password.
 
     Args:
         username (str): The username of the user.
         password (str): The password of the user.
+        rehash (callable, optional): Stores an upgraded hash (see authenticate()).
 
     Returns:
         bool: True if login is successful, False otherwise.
     """
-    conn = sqlite3.connect('finance.db')
-    cursor = conn.cursor()
-
-    # Hash the password to compare with stored hash
-    hashed_password = hashlib.sha256(password.encode()).hexdigest()
-
-    # Check if the user exists with the given username and hashed password
-    cursor.execute("SELECT * FROM users WHERE username=? AND password=?", (username, hashed_password))
-    user = cursor.fetchone()
-
-    conn.close()
-
-    if user:
+    if authenticate(username, password, rehash) is not None:
         print(f"Welcome, {username}! Login successful.")
         return True
     else:
         print("Error: Invalid username or password. Please try again.")
         return False
 
+# Function to log in and get a session token for later requests
+def create_session(username, password, rehash=None):
+    """
+    Verifies the credentials once and issues a session token.
+
+    The token is kept in an in-memory cache for session_ttl seconds (see
+    configure()), so later requests call get_session() instead of paying
+    for the KDF again. Sessions are per process and lost on restart.
+
+    Args:
+        username (str): The username.
+        password (str): The password.
+        rehash (callable, optional): Stores an upgraded hash (see authenticate()).
+
+    Returns:
+        str or None: The session token, or None if the credentials are wrong.
+    """
+    user_id = authenticate(username, password, rehash)
+    if user_id is None:
+        return None
+
+    token = secrets.token_urlsafe(32)
+    now = time.monotonic()
+    with _sessions_lock:
+        _sessions[token] = (user_id, username, now + _settings["session_ttl"])
+        # Drop expired sessions from the front, then the oldest beyond the limit
+        while _sessions:
+            oldest = next(iter(_sessions.values()))
+            if oldest[2] > now and len(_sessions) <= _settings["max_sessions"]:
+                break
+            _sessions.popitem(last=False)
+    return token
+
+# Function to look up a session token
+def get_session(token):
+    """
+    Returns the user of a valid session token.
+
+    Args:
+        token (str): A token from create_session().
+
+    Returns:
+        dict or None: "user_id" and "username", or None if the token is unknown or expired.
+    """
+    with _sessions_lock:
+        session = _sessions.get(token)
+        if session is None:
+            return None
+        if session[2] <= time.monotonic():
+            del _sessions[token]
+            return None
+    return {"user_id": session[0], "username": session[1]}
 
+# Function to log out
+def end_session(token):
+    """
+    Invalidates a session token.
 
+    Args:
+        token (str): A token from create_session().
 
+    Returns:
+        bool: True if the session existed.
+    """
+    with _sessions_lock:
+        return _sessions.pop(token, None) is not None
+
+# Function to drop every session
+def clear_sessions():
+    """
+    Invalidates all session tokens of this process.
+    """
+    with _sessions_lock:
+        _sessions.clear()
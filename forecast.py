@@ -0,0 +1,452 @@
+import argparse
+import time
+from datetime import date as date_type
+
+try:
+    import numpy as np
+except ImportError:  # optional, only needed to compute forecasts
+    np = None
+
+from . import connection, sharding
+
+# Cash-flow forecasts for every user, computed in bulk. The monthly rollups
+# already hold each user's transactions grouped by month, category and type,
+# including the archived years (archive.py leaves their rollups in the
+# database, and rollups.rebuild_rollups() merges them back from the archive
+# files), so archiving never shortens the history window. One ordered scan
+# reads the history window of all users and NumPy turns it into a dense
+# (users, months, income/expense) array batch by batch. Each series gets a
+# least-squares trend and, with two years of history, a seasonal component
+# per calendar month. Monte Carlo paths drawn from the residual spread give
+# percentile bands of the cumulative savings.
+#
+# Results are stored in the forecasts table, one row per user and forecast
+# month, so reading a forecast is a primary key range lookup. forecast_runs
+# records when and from which history each user's forecast was computed;
+# the refresh policy (see configure()) decides which users refresh_forecasts()
+# recomputes.
+REFRESH_POLICIES = ('always', 'changed', 'age')
+BAND_PERCENTILES = (10, 50, 90)
+MIN_TREND_MONTHS = 6
+# Calendar months seen at least this often get a seasonal component
+MIN_SEASON_YEARS = 2
+FETCH_BATCH_SIZE = 10000
+DEFAULT_BATCH_SIZE = 500
+
+FORECASTS_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS forecasts (
+                        user_id INTEGER NOT NULL,
+                        month TEXT NOT NULL,             -- YYYY-MM
+                        income REAL NOT NULL,            -- trend + season
+                        expenses REAL NOT NULL,
+                        savings REAL NOT NULL,
+                        balance_p10 REAL NOT NULL,       -- cumulative savings since the first
+                        balance_p50 REAL NOT NULL,       -- forecast month, Monte Carlo percentiles
+                        balance_p90 REAL NOT NULL,
+                        PRIMARY KEY (user_id, month)
+                    ) WITHOUT ROWID'''
+FORECAST_RUNS_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS forecast_runs (
+                        user_id INTEGER PRIMARY KEY,
+                        computed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),  -- UTC
+                        first_month TEXT NOT NULL,
+                        fingerprint TEXT NOT NULL        -- of the history the forecast was computed from
+                    )'''
+
+# Monthly expense and income of every user in a range of years, with the
+# month as a number (year * 12 + month - 1). Archived years are included
+# (see above), so no archive file is opened. _iter_user_batches() needs each
+# user's rows together, so the order is explicit; it is a prefix of the
+# primary key, so neither the grouping nor the ordering needs a sort.
+HISTORY_SQL = """
+    SELECT user_id, year * 12 + month - 1,
+           SUM(CASE WHEN type = 0 THEN total_cents ELSE 0 END),
+           SUM(CASE WHEN type = 1 THEN total_cents ELSE 0 END),
+           SUM(count)
+    FROM monthly_rollups
+    WHERE year BETWEEN ? AND ?
+    AND user_id NOT IN (SELECT user_id FROM moved_users)
+    GROUP BY user_id, year, month
+    ORDER BY user_id, year, month
+"""
+RUNS_BETWEEN_SQL = """
+    SELECT user_id, fingerprint, julianday('now') - julianday(computed_at)
+    FROM forecast_runs WHERE user_id BETWEEN ? AND ?
+"""
+INSERT_FORECAST_SQL = """
+    INSERT INTO forecasts (user_id, month, income, expenses, savings, balance_p10, balance_p50, balance_p90)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+UPSERT_RUN_SQL = """
+    INSERT INTO forecast_runs (user_id, first_month, fingerprint) VALUES (?, ?, ?)
+    ON CONFLICT (user_id) DO UPDATE SET computed_at = excluded.computed_at,
+        first_month = excluded.first_month, fingerprint = excluded.fingerprint
+"""
+FORECAST_SELECT_SQL = """
+    SELECT month, income, expenses, savings, balance_p10, balance_p50, balance_p90
+    FROM forecasts WHERE user_id = ? ORDER BY month
+"""
+
+_settings = {
+    "policy": 'changed',
+    "max_age_days": 30,
+    "history_months": 36,
+    "horizon": 12,
+    "paths": 200,
+    "seed": None,
+}
+
+# Function to fail clearly when NumPy is not installed
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("The forecast module requires the 'numpy' package")
+
+# Function to create the forecast tables (migration 7)
+def create_forecast_schema(conn=None):
+    """
+    Creates the forecasts and forecast_runs tables.
+
+    Args:
+        conn (sqlite3.Connection, optional): Connection to use. Defaults to the pooled connection.
+    """
+    if conn is None:
+        conn = connection.get_connection()
+    conn.execute(FORECASTS_TABLE_SQL)
+    conn.execute(FORECAST_RUNS_TABLE_SQL)
+
+# Function to change the forecast settings
+def configure(policy=None, max_age_days=None, history_months=None, horizon=None, paths=None, seed=None):
+    """
+    Updates the forecast settings used by refresh_forecasts().
+
+    Refresh policies:
+        'changed' (default): recompute users whose history changed since their
+            forecast, or whose forecast is older than max_age_days.
+        'age': recompute forecasts older than max_age_days, even if unchanged.
+        'always': recompute every user.
+    Users without a forecast, or whose forecast starts in an earlier month,
+    are always computed.
+
+    Args:
+        policy (str, optional): One of REFRESH_POLICIES.
+        max_age_days (float, optional): Age after which a forecast is refreshed.
+        history_months (int, optional): Months of history a forecast is based on.
+        horizon (int, optional): Months forecast, starting with the current month.
+        paths (int, optional): Monte Carlo paths per user.
+        seed (int, optional): Seed of the Monte Carlo draws, for reproducible bands.
+
+    Returns:
+        dict: The settings now in effect.
+    """
+    if policy is not None:
+        if policy not in REFRESH_POLICIES:
+            raise ValueError(f"Unknown refresh policy {policy!r}; use one of {', '.join(REFRESH_POLICIES)}")
+        _settings["policy"] = policy
+    if max_age_days is not None:
+        _settings["max_age_days"] = max_age_days
+    if history_months is not None:
+        if history_months < 1:
+            raise ValueError("history_months must be at least 1")
+        _settings["history_months"] = history_months
+    if horizon is not None:
+        if horizon < 1:
+            raise ValueError("horizon must be at least 1")
+        _settings["horizon"] = horizon
+    if paths is not None:
+        if paths < 1:
+            raise ValueError("paths must be at least 1")
+        _settings["paths"] = paths
+    if seed is not None:
+        _settings["seed"] = seed
+    return dict(_settings)
+
+# Function to convert a month number (year * 12 + month - 1) to 'YYYY-MM'
+def _month_label(number):
+    year, month = divmod(int(number), 12)
+    return f"{year:04d}-{month + 1:02d}"
+
+# Function to project a batch of income and expense histories
+def project(history, first_month, horizon=12, paths=200, rng=None):
+    """
+    Forecasts many users' monthly income and expenses at once.
+
+    Each of the 2 * users series is fitted independently but in the same
+    array operations: a least-squares trend over the months since the
+    user's first transaction (flat with fewer than MIN_TREND_MONTHS), plus
+    the mean detrended value of each calendar month seen in at least
+    MIN_SEASON_YEARS years. The residual spread drives `paths` Monte Carlo
+    paths per user; amounts are never projected below zero.
+
+    Args:
+        history (numpy.ndarray): Shape (users, months, 2) with the monthly
+            expense (index 0) and income (index 1) totals, oldest month first.
+        first_month (int): Month number (year * 12 + month - 1) of the first forecast month,
+            the one after the last history month.
+        horizon (int): Number of months to forecast.
+        paths (int): Monte Carlo paths per user.
+        rng (numpy.random.Generator, optional): Source of the draws.
+
+    Returns:
+        dict: "expenses" and "income" of shape (users, horizon) and "balance"
+        of shape (len(BAND_PERCENTILES), users, horizon): the percentiles of
+        the cumulative savings from the first forecast month.
+    """
+    _require_numpy()
+    rng = rng if rng is not None else np.random.default_rng()
+    users, months, _ = history.shape
+    # One row per series: expenses of user 0, income of user 0, expenses of user 1, ...
+    y = history.transpose(0, 2, 1).reshape(users * 2, months).astype(np.float64)
+    x = np.arange(months, dtype=np.float64)
+
+    # Months before the user's first transaction are not part of the history
+    active = history.any(axis=2)
+    started = np.where(active.any(axis=1), active.argmax(axis=1), months)
+    mask = (x[None, :] >= np.repeat(started, 2)[:, None]).astype(np.float64)
+    observed = mask.sum(axis=1)
+    n = np.maximum(observed, 1)
+
+    calendar_month = (first_month - months + np.arange(months)) % 12
+    one_hot = np.eye(12)[calendar_month]
+    seen = mask @ one_hot
+    valid = seen >= MIN_SEASON_YEARS
+    x_mean = (mask * x).sum(axis=1) / n
+    dx = (x[None, :] - x_mean[:, None]) * mask
+    sxx = (dx * dx).sum(axis=1)
+    fit_trend = (observed >= MIN_TREND_MONTHS) & (sxx > 0)
+
+    # Least-squares trend (flat when the history is short), then the mean
+    # residual per calendar month, centred so it does not shift the trend.
+    # The trend is fitted again without the season, which would bias it.
+    seasonal = np.zeros((users * 2, 12))
+    for _ in range(2):
+        deseasoned = y - seasonal[:, calendar_month]
+        y_mean = (mask * deseasoned).sum(axis=1) / n
+        slope = np.where(fit_trend, (dx * (deseasoned - y_mean[:, None])).sum(axis=1) / np.where(sxx > 0, sxx, 1), 0.0)
+        intercept = y_mean - slope * x_mean
+        residual = (y - intercept[:, None] - slope[:, None] * x[None, :]) * mask
+        seasonal = np.where(valid, (residual @ one_hot) / np.maximum(seen, 1), 0.0)
+        centre = seasonal.sum(axis=1, keepdims=True) / np.maximum(valid.sum(axis=1, keepdims=True), 1)
+        seasonal = np.where(valid, seasonal - centre, 0.0)
+
+    noise = (residual - seasonal[:, calendar_month] * mask) * mask
+    sigma = np.sqrt((noise * noise).sum(axis=1) / np.maximum(observed - 2, 1))
+
+    future = np.arange(months, months + horizon, dtype=np.float64)
+    point = intercept[:, None] + slope[:, None] * future[None, :] + seasonal[:, (first_month + np.arange(horizon)) % 12]
+    point = np.maximum(point, 0.0)
+
+    # Monte Carlo paths of both series, then the bands of the cumulative savings
+    draws = rng.standard_normal((users * 2, paths, horizon), dtype=np.float32)
+    draws *= sigma[:, None, None].astype(np.float32)
+    draws += point[:, None, :].astype(np.float32)
+    np.maximum(draws, 0, out=draws)
+    draws = draws.reshape(users, 2, paths, horizon)
+    balance = np.cumsum(draws[:, 1] - draws[:, 0], axis=2)
+
+    point = point.reshape(users, 2, horizon)
+    return {
+        "expenses": point[:, 0],
+        "income": point[:, 1],
+        "balance": np.percentile(balance, BAND_PERCENTILES, axis=1),
+    }
+
+# Function to stream the history rows in batches of whole users
+def _iter_user_batches(cursor, batch_size):
+    data = np.empty((0, 5), dtype=np.int64)
+    while True:
+        rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+        if rows:
+            data = np.concatenate((data, np.array(rows, dtype=np.int64)))
+        # Cut after batch_size users; the last user of a chunk may continue in the next
+        starts = np.flatnonzero(np.diff(data[:, 0])) + 1
+        while len(starts) >= batch_size:
+            cut = starts[batch_size - 1]
+            yield data[:cut]
+            data = data[cut:]
+            starts = starts[batch_size:] - cut
+        if not rows:
+            if len(data):
+                yield data
+            return
+
+# Function to pick the users of a batch whose forecast must be recomputed
+def _needs_refresh(conn, user_ids, fingerprints, first_label):
+    runs = {user_id: (fingerprint, age) for user_id, fingerprint, age in
+            conn.execute(RUNS_BETWEEN_SQL, (int(user_ids[0]), int(user_ids[-1])))}
+    policy, max_age = _settings["policy"], _settings["max_age_days"]
+    selected = []
+    for i, user_id in enumerate(user_ids.tolist()):
+        run = runs.get(user_id)
+        if (policy == 'always' or run is None or not run[0].startswith(first_label)
+                or run[1] > max_age or (policy == 'changed' and run[0] != fingerprints[i])):
+            selected.append(i)
+    return np.asarray(selected, dtype=np.int64)
+
+# Function to compute and store the forecasts of one batch of users
+def _refresh_batch(conn, rows, first_month, rng):
+    history_months, horizon = _settings["history_months"], _settings["horizon"]
+    # The query selects whole years; keep the months of the window
+    rows = rows[(rows[:, 1] >= first_month - history_months) & (rows[:, 1] < first_month)]
+    if not len(rows):
+        return 0, 0
+    user_ids, user_index = np.unique(rows[:, 0], return_inverse=True)
+    offsets = rows[:, 1] - (first_month - history_months)
+    expense_cents, income_cents = rows[:, 2], rows[:, 3]
+
+    # Per-user fingerprint of the history: months, transactions, cents and cents weighted by month
+    summary = np.stack([
+        np.bincount(user_index, minlength=len(user_ids)),
+        np.bincount(user_index, weights=rows[:, 4], minlength=len(user_ids)),
+        np.bincount(user_index, weights=expense_cents + income_cents, minlength=len(user_ids)),
+        np.bincount(user_index, weights=(offsets + 1) * (expense_cents + 3 * income_cents),
+                    minlength=len(user_ids)),
+    ], axis=1).astype(np.int64)
+    first_label = _month_label(first_month)
+    fingerprints = [first_label + ":" + ":".join(map(str, values)) for values in summary.tolist()]
+    selected = _needs_refresh(conn, user_ids, fingerprints, first_label)
+    if not len(selected):
+        return len(user_ids), 0
+
+    flat = user_index * history_months + offsets
+    history = np.stack([np.bincount(flat, weights=cents, minlength=len(user_ids) * history_months)
+                        for cents in (expense_cents, income_cents)], axis=1)
+    history = history.reshape(len(user_ids), history_months, 2)[selected] / 100.0
+    result = project(history, first_month, horizon, _settings["paths"], rng)
+
+    labels = [_month_label(first_month + h) for h in range(horizon)]
+    refreshed = user_ids[selected].tolist()
+    income = np.round(result["income"], 2).tolist()
+    expenses = np.round(result["expenses"], 2).tolist()
+    savings = np.round(result["income"] - result["expenses"], 2).tolist()
+    low, mid, high = (np.round(band, 2).tolist() for band in result["balance"])
+    forecast_rows = [
+        (user_id, labels[h], income[i][h], expenses[i][h], savings[i][h], low[i][h], mid[i][h], high[i][h])
+        for i, user_id in enumerate(refreshed)
+        for h in range(horizon)
+    ]
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany("DELETE FROM forecasts WHERE user_id = ?", ((user_id,) for user_id in refreshed))
+        conn.executemany(INSERT_FORECAST_SQL, forecast_rows)
+        conn.executemany(UPSERT_RUN_SQL, ((user_id, first_label, fingerprints[i])
+                                          for user_id, i in zip(refreshed, selected.tolist())))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(user_ids), len(refreshed)
+
+# Function to refresh the forecasts of the users in the current database
+def _refresh_current(first_month, batch_size, progress):
+    conn = connection.get_connection()
+    if conn.in_transaction:
+        raise RuntimeError("refresh_forecasts() cannot run inside an open transaction")
+    seed = _settings["seed"]
+    shard = sharding.current_shard() or 0
+    rng = np.random.default_rng(None if seed is None else (seed, shard))
+    # A separate cursor keeps the scan open while batches are written
+    cursor = conn.cursor()
+    cursor.execute(HISTORY_SQL, ((first_month - _settings["history_months"]) // 12, (first_month - 1) // 12))
+    result = {"users": 0, "refreshed": 0}
+    try:
+        for rows in _iter_user_batches(cursor, batch_size):
+            users, refreshed = _refresh_batch(conn, rows, first_month, rng)
+            result["users"] += users
+            result["refreshed"] += refreshed
+            if progress is not None:
+                progress(result["users"], result["refreshed"])
+    finally:
+        cursor.close()
+    return result
+
+# Function to recompute the forecasts the refresh policy selects
+def refresh_forecasts(as_of=None, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Computes the forecasts of every user with history, batch_size users at a time.
+
+    The history of all users is read in one scan of the monthly rollups (per
+    shard, in parallel); only the users selected by the refresh policy (see
+    configure()) are projected and written, one SQL transaction per batch.
+    Users without transactions in the history window are skipped.
+
+    Args:
+        as_of (str, optional): A date (YYYY-MM-DD) in the first forecast month;
+            the history ends with the month before. Defaults to today.
+        batch_size (int): Users projected together; memory grows with
+            batch_size * paths * horizon.
+        progress (callable, optional): Called as progress(users_checked, users_refreshed)
+            after each batch, per shard.
+
+    Returns:
+        dict: Number of "users" checked and "refreshed", and "seconds" taken.
+    """
+    _require_numpy()
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    day = date_type.fromisoformat(as_of) if as_of else date_type.today()
+    first_month = day.year * 12 + day.month - 1
+    started = time.perf_counter()
+    result = {"users": 0, "refreshed": 0}
+    for _, shard_result in sharding.fan_out(_refresh_current, first_month, batch_size, progress):
+        result["users"] += shard_result["users"]
+        result["refreshed"] += shard_result["refreshed"]
+    result["seconds"] = time.perf_counter() - started
+    return result
+
+# Function to read the stored forecast of a user
+@sharding.by_user
+def get_forecast(user_id):
+    """
+    Returns the stored monthly forecast of a user, as last computed by refresh_forecasts().
+
+    Args:
+        user_id (int): The ID of the user.
+
+    Returns:
+        list: One dict per month with month ('YYYY-MM'), income, expenses,
+        savings and balance_p10/p50/p90, the percentiles of the savings
+        accumulated since the first forecast month. Empty if none was computed.
+    """
+    conn = connection.get_connection()
+    columns = ("month", "income", "expenses", "savings", "balance_p10", "balance_p50", "balance_p90")
+    return [dict(zip(columns, row)) for row in conn.execute(FORECAST_SELECT_SQL, (user_id,))]
+
+# Command line entry point: python -m <package>.forecast refresh|show ...
+def main(argv=None):
+    """
+    Refreshes the forecasts (e.g. nightly from cron) or prints one user's forecast.
+
+    Args:
+        argv (list, optional): Command line arguments without the program name.
+
+    Returns:
+        int: Process exit code.
+    """
+    parser = argparse.ArgumentParser(description="Compute and show cash-flow forecasts.")
+    parser.add_argument("--db", help="Database file (defaults to the configured path)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    refresh = commands.add_parser("refresh", help="recompute the forecasts the refresh policy selects")
+    refresh.add_argument("--as-of", help="date in the first forecast month (defaults to today)")
+    refresh.add_argument("--policy", choices=REFRESH_POLICIES)
+    refresh.add_argument("--max-age-days", type=float)
+    refresh.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    show = commands.add_parser("show", help="print the stored forecast of a user")
+    show.add_argument("user_id", type=int)
+    args = parser.parse_args(argv)
+
+    if args.db:
+        connection.configure(db_path=args.db)
+    if args.command == "show":
+        for row in get_forecast(args.user_id):
+            print(f"{row['month']}: income {row['income']:.2f}, expenses {row['expenses']:.2f}, "
+                  f"savings {row['savings']:.2f}, balance {row['balance_p10']:.2f} / "
+                  f"{row['balance_p50']:.2f} / {row['balance_p90']:.2f}")
+        return 0
+
+    configure(policy=args.policy, max_age_days=args.max_age_days)
+    result = refresh_forecasts(args.as_of, batch_size=args.batch_size)
+    print(f"Refreshed {result['refreshed']} of {result['users']} users in {result['seconds']:.2f}s "
+          f"({result['users'] / result['seconds'] if result['seconds'] else 0:.0f} users/s).")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,83 @@
+import csv
+import json
+
+from . import transactions
+
+# Function to stream transaction records out of a CSV file
+def iter_csv_records(path, delimiter=',', encoding='utf-8'):
+    """
+    Lazily reads transaction records from a CSV file with a header row.
+
+    The header must name the columns user_id (optional if a default user is
+    given on import), type, category, amount and date. Only one row is held
+    in memory at a time.
+
+    Args:
+        path (str): Path of the CSV file.
+        delimiter (str): Field delimiter.
+        encoding (str): File encoding.
+
+    Yields:
+        dict: One record per data row.
+    """
+    with open(path, newline='', encoding=encoding) as f:
+        for row in csv.DictReader(f, delimiter=delimiter):
+            yield row
+
+# Function to stream transaction records out of a JSON Lines file
+def iter_jsonl_records(path, encoding='utf-8'):
+    """
+    Lazily reads transaction records from a JSON Lines file (one object per line).
+
+    Blank lines are skipped. Lines that are not valid JSON objects are yielded
+    as-is so that bulk insertion reports them as rejected instead of aborting.
+
+    Args:
+        path (str): Path of the JSONL file.
+        encoding (str): File encoding.
+
+    Yields:
+        dict: One record per line.
+    """
+    with open(path, encoding=encoding) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield line
+
+# Function to import transactions from a CSV file
+def import_csv(path, user_id=None, chunk_size=transactions.DEFAULT_CHUNK_SIZE, delimiter=','):
+    """
+    Imports transactions from a CSV file in chunked bulk inserts.
+
+    Args:
+        path (str): Path of the CSV file.
+        user_id (int, optional): User ID for rows without a user_id column.
+        chunk_size (int): Number of rows committed per transaction.
+        delimiter (str): Field delimiter.
+
+    Returns:
+        dict: The counts and rejected rows from transactions.add_transactions_bulk().
+    """
+    records = iter_csv_records(path, delimiter=delimiter)
+    return transactions.add_transactions_bulk(records, chunk_size=chunk_size, default_user_id=user_id)
+
+# Function to import transactions from a JSON Lines file
+def import_jsonl(path, user_id=None, chunk_size=transactions.DEFAULT_CHUNK_SIZE):
+    """
+    Imports transactions from a JSON Lines file in chunked bulk inserts.
+
+    Args:
+        path (str): Path of the JSONL file.
+        user_id (int, optional): User ID for records without a user_id.
+        chunk_size (int): Number of records committed per transaction.
+
+    Returns:
+        dict: The counts and rejected rows from transactions.add_transactions_bulk().
+    """
+    records = iter_jsonl_records(path)
+    return transactions.add_transactions_bulk(records, chunk_size=chunk_size, default_user_id=user_id)
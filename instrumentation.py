@@ -0,0 +1,360 @@
+import functools
+import inspect
+import json
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+from . import backup, budget, changelog, connection, export, reports, transactions
+from .finance_app import auth
+
+# Opt-in latency instrumentation. enable() installs a trace callback on every
+# pooled connection and wraps the public functions listed in
+# INSTRUMENTED_FUNCTIONS; disable() removes both again, so a disabled
+# process runs the original, unwrapped code with no extra cost.
+#
+# SQLite reports when a statement starts, not when it ends, so a statement
+# is timed from its start until the next statement on the same thread or
+# until the instrumented function that ran it returns. That includes
+# fetching its rows, which is where SQLite does most of the work.
+# Statements are grouped with their literal values replaced by '?'.
+# Trigger programs are reported with the text of the statement that fired
+# them, so a repeat of the running statement's text on the same connection
+# is counted as part of it (an executemany() of identical rows therefore
+# shows up as a single statement).
+#
+# Function timings record the total time of each call and its self time
+# (total minus time spent in nested instrumented calls), e.g. the
+# per-category loop of check_budget_exceedance() versus the fetch done by
+# get_budget_exceedances().
+
+# Histogram bucket upper bounds in seconds (Prometheus style, plus +Inf)
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_LOG_SIZE = 100
+MAX_LOGGED_SQL = 1000
+
+# Public functions wrapped by enable(), per module
+INSTRUMENTED_FUNCTIONS = {
+    "transactions": (transactions, ("add_transaction", "delete_transaction", "update_transaction",
+                                    "add_transactions_bulk", "update_transactions", "delete_transactions")),
+    "reports": (reports, ("get_monthly_report", "generate_monthly_report", "get_yearly_report",
+                          "generate_yearly_report", "get_totals", "calculate_totals")),
+    "budget": (budget, ("set_monthly_budget", "get_budget_exceedances", "check_budget_exceedance",
+                        "get_monthly_budgets", "view_monthly_budgets", "get_budget_status")),
+    "backup": (backup, ("initialize_db", "backup_database", "restore_database", "view_data")),
+    "changelog": (changelog, ("take_snapshot", "backup_changes", "restore_to_point_in_time")),
+    "export": (export, ("export_table", "list_rows")),
+    "auth": (auth, ("register_user", "authenticate", "login_user", "create_session")),
+}
+
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?(?:e[+-]?\d+)?\b|\bNULL\b", re.IGNORECASE)
+_SPACE_RE = re.compile(r"\s+")
+
+logger = logging.getLogger(__name__)
+
+_settings = {"enabled": False, "slow_query_threshold": None}
+_lock = threading.Lock()
+_local = threading.local()
+_statements = {}
+_functions = {}
+_slow_queries = deque(maxlen=SLOW_LOG_SIZE)
+_originals = {}
+
+# Function to create an empty histogram
+def _new_histogram():
+    return {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * (len(BUCKETS) + 1)}
+
+# Function to add one observation to a histogram
+def _observe(histogram, seconds):
+    histogram["count"] += 1
+    histogram["sum"] += seconds
+    if seconds > histogram["max"]:
+        histogram["max"] = seconds
+    histogram["buckets"][bisect_left(BUCKETS, seconds)] += 1
+
+# Function to reduce a traced statement to its shape
+def normalize_sql(sql):
+    """
+    Replaces literal values in a statement by '?' and collapses whitespace.
+
+    Args:
+        sql (str): The statement as reported by the trace callback.
+
+    Returns:
+        str: The normalized statement used as metric key.
+    """
+    return _SPACE_RE.sub(" ", _LITERAL_RE.sub("?", sql)).strip()
+
+# Function to record the statement that is running on this thread as finished
+def _finish_statement(now):
+    current = getattr(_local, "statement", None)
+    if current is None:
+        return
+    _local.statement = None
+    sql, started, conn, changes_before = current
+    seconds = now - started
+    try:
+        changed = conn.total_changes - changes_before
+    except Exception:  # the connection was closed meanwhile
+        changed = 0
+    key = normalize_sql(sql)
+    with _lock:
+        entry = _statements.get(key)
+        if entry is None:
+            entry = _statements[key] = {"duration": _new_histogram(), "rows_changed": 0}
+        _observe(entry["duration"], seconds)
+        entry["rows_changed"] += changed
+
+    threshold = _settings["slow_query_threshold"]
+    if threshold is not None and seconds >= threshold:
+        record = {"seconds": seconds, "sql": sql[:MAX_LOGGED_SQL], "time": time.time()}
+        with _lock:
+            _slow_queries.append(record)
+        logger.warning("Slow query (%.1f ms): %s", seconds * 1000, _SPACE_RE.sub(" ", record["sql"]).strip())
+
+# Function to build the trace callback of one connection
+def _trace_callback(conn):
+    def on_statement(sql):
+        current = getattr(_local, "statement", None)
+        if current is not None and current[2] is conn and current[0] == sql:
+            return
+        now = time.perf_counter()
+        _finish_statement(now)
+        _local.statement = (sql, now, conn, conn.total_changes)
+    return on_statement
+
+# Function to attach the trace callback to a connection
+def _hook_connection(conn):
+    conn.set_trace_callback(_trace_callback(conn))
+
+# Function to wrap a public function with timing
+def _wrap(name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        frame = [0.0]
+        stack.append(frame)
+        started = time.perf_counter()
+        result = None
+        try:
+            result = func(*args, **kwargs)
+            return result
+        finally:
+            now = time.perf_counter()
+            _finish_statement(now)
+            seconds = now - started
+            stack.pop()
+            if stack:
+                stack[-1][0] += seconds
+            try:
+                rows = len(result) if result is not None and not isinstance(result, (str, bool)) else 0
+            except TypeError:
+                rows = 0
+            with _lock:
+                entry = _functions.get(name)
+                if entry is None:
+                    entry = _functions[name] = {"duration": _new_histogram(), "self_seconds": 0.0,
+                                                "rows": 0}
+                _observe(entry["duration"], seconds)
+                entry["self_seconds"] += seconds - frame[0]
+                entry["rows"] += rows
+    return wrapper
+
+# Function to turn instrumentation on
+def enable(slow_query_threshold=None, statements=True, functions=True):
+    """
+    Starts recording statement and function timings.
+
+    Args:
+        slow_query_threshold (float, optional): Log statements taking at least
+            this many seconds (logger warning plus slow_queries()).
+        statements (bool): Trace SQL statements on every pooled connection.
+        functions (bool): Time the functions in INSTRUMENTED_FUNCTIONS.
+    """
+    _settings["slow_query_threshold"] = slow_query_threshold
+    if _settings["enabled"]:
+        disable()
+    _settings["enabled"] = True
+    if statements:
+        connection.add_connection_hook(_hook_connection)
+    if functions:
+        for module_name, (module, names) in INSTRUMENTED_FUNCTIONS.items():
+            for name in names:
+                func = getattr(module, name)
+                if inspect.isgeneratorfunction(func):
+                    continue
+                _originals[(module, name)] = func
+                setattr(module, name, _wrap(f"{module_name}.{name}", func))
+
+# Function to turn instrumentation off
+def disable():
+    """
+    Stops recording: removes the trace callbacks and restores the original
+    functions. Recorded metrics are kept until reset().
+    """
+    _settings["enabled"] = False
+    connection.remove_connection_hook(_hook_connection)
+    for conn in connection.open_connections():
+        try:
+            conn.set_trace_callback(None)
+        except Exception:
+            pass
+    for (module, name), func in _originals.items():
+        setattr(module, name, func)
+    _originals.clear()
+
+# Function to check whether instrumentation is on
+def is_enabled():
+    """
+    Returns:
+        bool: True between enable() and disable().
+    """
+    return _settings["enabled"]
+
+# Function to discard recorded metrics
+def reset():
+    """
+    Clears all recorded statement and function metrics and the slow query log.
+    """
+    with _lock:
+        _statements.clear()
+        _functions.clear()
+        _slow_queries.clear()
+
+# Function to list recent slow statements
+def slow_queries():
+    """
+    Returns:
+        list: The most recent slow statements (up to SLOW_LOG_SIZE), as dicts
+        with "seconds", "sql" (with its parameter values) and "time" (epoch seconds).
+    """
+    with _lock:
+        return list(_slow_queries)
+
+# Function to copy a histogram for export
+def _export_histogram(histogram):
+    return {"count": histogram["count"], "sum": histogram["sum"], "max": histogram["max"],
+            "buckets": list(histogram["buckets"])}
+
+# Function to take a JSON-serializable snapshot of the metrics
+def snapshot():
+    """
+    Returns all recorded metrics.
+
+    Returns:
+        dict: "enabled", "buckets" (upper bounds; the last count is +Inf),
+        "statements" keyed by normalized SQL with a "duration" histogram and
+        "rows_changed", "functions" keyed by name with a "duration" histogram,
+        "self_seconds" and "rows" (total length of returned lists), and "slow_queries".
+    """
+    with _lock:
+        return {
+            "enabled": _settings["enabled"],
+            "buckets": list(BUCKETS),
+            "statements": {
+                sql: {"duration": _export_histogram(entry["duration"]), "rows_changed": entry["rows_changed"]}
+                for sql, entry in _statements.items()
+            },
+            "functions": {
+                name: {"duration": _export_histogram(entry["duration"]),
+                       "self_seconds": entry["self_seconds"], "rows": entry["rows"]}
+                for name, entry in _functions.items()
+            },
+            "slow_queries": list(_slow_queries),
+        }
+
+# Function to write the snapshot as JSON
+def export_json(path=None, indent=2):
+    """
+    Serializes snapshot() as JSON.
+
+    Args:
+        path (str, optional): File to write. If None, the JSON is only returned.
+        indent (int): Indentation of the JSON output.
+
+    Returns:
+        str: The JSON text.
+    """
+    text = json.dumps(snapshot(), indent=indent)
+    if path is not None:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+    return text
+
+# Function to escape a Prometheus label value
+def _label(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+# Function to render one histogram in the Prometheus text format
+def _histogram_lines(metric, label, value, histogram):
+    lines = []
+    cumulative = 0
+    bounds = [repr(bound) for bound in BUCKETS] + ["+Inf"]
+    for bound, count in zip(bounds, histogram["buckets"]):
+        cumulative += count
+        lines.append(f'{metric}_bucket{{{label}="{_label(value)}",le="{bound}"}} {cumulative}')
+    lines.append(f'{metric}_sum{{{label}="{_label(value)}"}} {histogram["sum"]!r}')
+    lines.append(f'{metric}_count{{{label}="{_label(value)}"}} {histogram["count"]}')
+    return lines
+
+# Function to export the metrics in the Prometheus text exposition format
+def prometheus_text():
+    """
+    Renders the metrics in the Prometheus text format, e.g. for a /metrics endpoint.
+
+    Returns:
+        str: The metrics text.
+    """
+    data = snapshot()
+    lines = [
+        "# HELP finance_sql_statement_duration_seconds Time from statement start until the next statement or the end of the instrumented call.",
+        "# TYPE finance_sql_statement_duration_seconds histogram",
+    ]
+    for sql, entry in data["statements"].items():
+        lines.extend(_histogram_lines("finance_sql_statement_duration_seconds", "statement", sql,
+                                      entry["duration"]))
+    lines.append("# HELP finance_sql_statement_rows_changed_total Rows inserted, updated or deleted, including by triggers.")
+    lines.append("# TYPE finance_sql_statement_rows_changed_total counter")
+    for sql, entry in data["statements"].items():
+        lines.append(f'finance_sql_statement_rows_changed_total{{statement="{_label(sql)}"}} {entry["rows_changed"]}')
+
+    lines.append("# HELP finance_function_duration_seconds Total time of calls to public functions.")
+    lines.append("# TYPE finance_function_duration_seconds histogram")
+    for name, entry in data["functions"].items():
+        lines.extend(_histogram_lines("finance_function_duration_seconds", "function", name, entry["duration"]))
+    lines.append("# HELP finance_function_self_seconds_total Time spent in a function outside nested instrumented calls.")
+    lines.append("# TYPE finance_function_self_seconds_total counter")
+    for name, entry in data["functions"].items():
+        lines.append(f'finance_function_self_seconds_total{{function="{_label(name)}"}} {entry["self_seconds"]!r}')
+    lines.append("# HELP finance_function_rows_total Items in the lists and dicts returned by public functions.")
+    lines.append("# TYPE finance_function_rows_total counter")
+    for name, entry in data["functions"].items():
+        lines.append(f'finance_function_rows_total{{function="{_label(name)}"}} {entry["rows"]}')
+    return "\n".join(lines) + "\n"
+
+# Function to print the slowest statements and functions
+def print_summary(limit=10):
+    """
+    Prints the statements and functions with the highest total time.
+
+    Args:
+        limit (int): Number of entries to print per section.
+    """
+    data = snapshot()
+    print("Statements by total time:")
+    ranked = sorted(data["statements"].items(), key=lambda item: item[1]["duration"]["sum"], reverse=True)
+    for sql, entry in ranked[:limit]:
+        duration = entry["duration"]
+        print(f"  {duration['sum'] * 1000:10.2f} ms  {duration['count']:8d}x  {sql[:100]}")
+    print("Functions by total time (self time):")
+    ranked = sorted(data["functions"].items(), key=lambda item: item[1]["duration"]["sum"], reverse=True)
+    for name, entry in ranked[:limit]:
+        duration = entry["duration"]
+        print(f"  {duration['sum'] * 1000:10.2f} ms ({entry['self_seconds'] * 1000:10.2f} ms)  "
+              f"{duration['count']:8d}x  {name}")
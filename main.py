@@ -1,9 +1,61 @@
-from finance_app import auth, transactions, reports, budget
+from . import budget, reports, transactions
+from .finance_app import auth
+
+# Interactive console: python -m <package>.main
+# Logging in creates a session (see auth.create_session()); every later action
+# looks the user up from its token instead of checking the password, and
+# running the KDF, again.
+MENU = """
+1. Add a transaction
+2. Monthly report
+3. Check budgets
+4. Log out"""
+
+# Function to run the menu of a logged-in user until they log out
+def session_loop(token):
+    """
+    Runs the actions of a logged-in user, identified by a session token.
+
+    Args:
+        token (str): A token from auth.create_session().
+    """
+    while True:
+        print(MENU)
+        choice = input("Choose an option: ").strip()
+        if choice == '4':
+            auth.end_session(token)
+            print("Logged out.")
+            return
+
+        session = auth.get_session(token)
+        if session is None:
+            print("Your session has expired. Please log in again.")
+            return
+        user_id = session["user_id"]
+
+        try:
+            if choice == '1':
+                transaction_type = input("Type (income/expense): ").strip()
+                category = input("Category: ").strip()
+                amount = float(input("Amount: "))
+                date = input("Date (YYYY-MM-DD, empty for today): ").strip() or None
+                transactions.add_transaction(user_id, transaction_type, category, amount, date)
+            elif choice in ('2', '3'):
+                month = int(input("Month (1-12): "))
+                year = int(input("Year: "))
+                if choice == '2':
+                    reports.generate_monthly_report(user_id, month, year)
+                else:
+                    budget.check_budget_exceedance(user_id, month, year)
+            else:
+                print("Invalid option.")
+        except ValueError as e:
+            print(f"Error: {e}")
 
 def main():
     print("Welcome to the Personal Finance Management App")
     choice = input("Do you have an account? (yes/no): ")
-    
+
     if choice.lower() == 'no':
         username = input("Enter a username: ")
         password = input("Enter a password: ")
@@ -11,10 +63,10 @@ def main():
     else:
         username = input("Enter username: ")
         password = input("Enter password: ")
-        user = auth.login_user(username, password)
-        if user:
+        token = auth.create_session(username, password)
+        if token:
             print("Login successful!")
-            # Further actions such as adding transactions, viewing reports, etc.
+            session_loop(token)
         else:
             print("Invalid credentials")
 
@@ -0,0 +1,202 @@
+import sys
+
+from . import alerts, archive, backup, changelog, connection, rollups, schema, sharding
+
+# Ordered schema migrations. PRAGMA user_version records the last migration
+# applied to a database file, so opening an up-to-date database costs a
+# single PRAGMA read. connection.get_connection() runs the pending
+# migrations when it opens a connection.
+#
+# The version is recorded after a migration has committed, so a migration
+# interrupted in between runs again on the next start: every migration must
+# be safe to re-run (CREATE ... IF NOT EXISTS, or a check of the current
+# layout). Several processes starting at once may run the same migration.
+
+USERS_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS users (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        username TEXT UNIQUE,
+                        password TEXT
+                    )'''
+
+BUDGETS_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS budgets (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER,
+                        category TEXT,
+                        amount REAL,
+                        month INTEGER,
+                        year INTEGER,
+                        FOREIGN KEY (user_id) REFERENCES users(id)
+                    )'''
+
+# Function to create the users and budgets tables (version 1)
+def _create_base_tables(conn):
+    conn.execute(USERS_TABLE_SQL)
+    conn.execute(BUDGETS_TABLE_SQL)
+    conn.commit()
+
+# Function to create the compact transaction storage and what is derived from it (version 2)
+def _create_transaction_storage(conn):
+    # Databases created before the compact schema are migrated online
+    if schema.is_legacy(conn):
+        result = schema.migrate_to_compact(conn)
+        print(f"Migrated {result['migrated']} transactions to the compact schema.")
+    schema.create_compact_schema(conn)
+    rollups.create_rollup_schema(conn)
+    changelog.create_changelog_schema(conn)
+    backup.ensure_indexes(conn)
+    conn.commit()
+
+# Function to create the shard directory and the moved-user write guards (version 3)
+def _create_sharding_tables(conn):
+    sharding.create_sharding_schema(conn)
+    conn.commit()
+
+# Function to create the budget alert queue and the alerting rollup triggers (version 4)
+def _create_budget_alerts(conn):
+    alerts.create_alerts_schema(conn)
+    # The rollup triggers gained the alert step; CREATE ... IF NOT EXISTS
+    # would keep the old definitions
+    for name in ("trg_rollups_insert", "trg_rollups_update"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    rollups.create_rollup_schema(conn)
+    conn.commit()
+
+# Function to create the registry of archived years (version 5)
+def _create_archive_registry(conn):
+    archive.create_archive_schema(conn)
+    conn.commit()
+
+# Function to create the recurring transaction rules (version 6)
+def _create_recurring_rules(conn):
+    # Imported here: recurring's functions are routed with sharding.by_user,
+    # which needs sharding fully loaded, and sharding imports this module
+    from . import recurring
+    recurring.create_recurring_schema(conn)
+    conn.commit()
+
+# Function to create the cash-flow forecast tables (version 7)
+def _create_forecasts(conn):
+    # Imported here for the same reason as recurring
+    from . import forecast
+    forecast.create_forecast_schema(conn)
+    conn.commit()
+
+# Function to add the moved-user delete guards to existing databases (version 8)
+def _create_moved_user_delete_guards(conn):
+    # Every statement is CREATE ... IF NOT EXISTS, so only the new guards are
+    # added; recurring is imported here as in version 6
+    from . import recurring
+    sharding.create_sharding_schema(conn)
+    recurring.create_recurring_schema(conn)
+    conn.commit()
+
+# (version, description, function) in the order they are applied. Append new
+# migrations at the end with the next version number; never renumber.
+MIGRATIONS = [
+    (1, "users and budgets tables", _create_base_tables),
+    (2, "compact transactions, rollups, change log and indexes", _create_transaction_storage),
+    (3, "shard directory and moved-user guards", _create_sharding_tables),
+    (4, "budget alert queue", _create_budget_alerts),
+    (5, "archived years registry", _create_archive_registry),
+    (6, "recurring transaction rules", _create_recurring_rules),
+    (7, "cash-flow forecasts", _create_forecasts),
+    (8, "moved-user delete guards", _create_moved_user_delete_guards),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Function to read the schema version of a database
+def get_version(conn=None):
+    """
+    Returns the version of the last migration applied to the database.
+
+    Args:
+        conn (sqlite3.Connection, optional): Connection to use. Defaults to the pooled connection.
+
+    Returns:
+        int: The PRAGMA user_version value, 0 for a new database.
+    """
+    if conn is None:
+        conn = connection.get_connection()
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+# Function to list the migrations a database still needs
+def pending_migrations(conn=None):
+    """
+    Lists the migrations newer than the database's version.
+
+    Args:
+        conn (sqlite3.Connection, optional): Connection to use. Defaults to the pooled connection.
+
+    Returns:
+        list: (version, description) tuples in the order they would run.
+    """
+    current = get_version(conn)
+    return [(version, description) for version, description, _ in MIGRATIONS if version > current]
+
+# Function to bring a database up to the latest schema version
+def migrate(conn=None):
+    """
+    Applies every pending migration in order.
+
+    Args:
+        conn (sqlite3.Connection, optional): Connection to use. Defaults to the pooled connection.
+
+    Returns:
+        list: The versions that were applied; empty if the database was up to date.
+
+    Raises:
+        RuntimeError: If the database was written by a newer version of the package.
+    """
+    if conn is None:
+        conn = connection.get_connection()
+    current = get_version(conn)
+    if current > LATEST_VERSION:
+        raise RuntimeError(f"Database schema version {current} is newer than this package "
+                           f"supports ({LATEST_VERSION})")
+
+    applied = []
+    for version, _, upgrade in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            upgrade(conn)
+        except Exception:
+            conn.rollback()
+            raise
+        conn.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+        applied.append(version)
+        current = version
+    return applied
+
+# Command line entry point: python -m <package>.migrations [status|migrate]
+def main(argv=None):
+    """
+    Prints the schema version and pending migrations (default) or applies them.
+
+    Args:
+        argv (list, optional): Command line arguments without the program name.
+
+    Returns:
+        int: Process exit code.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv else "status"
+
+    if command not in ("status", "migrate"):
+        print(f"Unknown command {command!r}; use 'status' or 'migrate'.")
+        return 2
+    conn = backup.connect_db()
+    try:
+        if command == "migrate":
+            applied = migrate(conn)
+            print(f"Applied migrations {applied}." if applied else "Nothing to migrate.")
+        print(f"Schema version {get_version(conn)} (latest {LATEST_VERSION}).")
+        for version, description in pending_migrations(conn):
+            print(f"  pending {version}: {description}")
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,194 @@
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from . import archive, connection, schema
+
+# In-memory per-user index of cumulative daily income and expenses, so that
+# the totals of any date range are two binary searches instead of two SUM
+# queries. For each cached user:
+#   dates    sorted distinct transaction dates ('YYYY-MM-DD')
+#   income   income[i] = total income in cents on all dates up to and including dates[i]
+#   expense  the same for expenses
+#   stale_from  first date whose entries must be recomputed, or None
+# Mutations call invalidate(user_id, date); only entries from that date on
+# are dropped and later recomputed with one grouped query (plus one per
+# archived year in that range, see archive.py).
+#
+# The index lives in this process only: writes made by other processes are
+# not seen, so deployments with several writer processes should disable it.
+# It is dropped when the configured database changes (connection.configure()).
+MAX_CACHED_USERS = 10000
+
+DAILY_TOTALS_SQL = """
+    SELECT date, type, SUM(amount_cents) FROM transaction_entries
+    WHERE user_id = ? AND date >= ?
+    GROUP BY date, type
+    ORDER BY date
+"""
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+_settings = {"enabled": True}
+_state = {"db_path": None}
+_stats = {"hits": 0, "builds": 0, "extends": 0, "invalidations": 0}
+
+# Function to turn the index on or off
+def set_enabled(enabled):
+    """
+    Enables or disables the index. While disabled, reports.calculate_totals()
+    queries SQLite directly and the cache is emptied.
+
+    Args:
+        enabled (bool): Whether the index should be used.
+    """
+    _settings["enabled"] = bool(enabled)
+    if not enabled:
+        clear()
+
+# Function to check whether the index is in use
+def is_enabled():
+    """
+    Returns:
+        bool: True if reports.calculate_totals() answers from the index.
+    """
+    return _settings["enabled"]
+
+# Function to recompute the stale tail of a user's index
+def _extend(entry, user_id):
+    since = entry["stale_from"]
+    conn = connection.get_connection()
+    rows = conn.execute(DAILY_TOTALS_SQL, (user_id, since)).fetchall()
+    archived = archive.archived_connections(since or 0, 9999, conn)
+    if archived:
+        for archive_conn in archived:
+            rows += archive_conn.execute(DAILY_TOTALS_SQL, (user_id, since)).fetchall()
+        rows.sort()
+
+    dates, income, expense = entry["dates"], entry["income"], entry["expense"]
+    running_income = income[-1] if income else 0
+    running_expense = expense[-1] if expense else 0
+    for date, transaction_type, total in rows:
+        if not dates or dates[-1] != date:
+            dates.append(date)
+            income.append(running_income)
+            expense.append(running_expense)
+        if transaction_type == schema.TYPE_INCOME:
+            running_income += total
+            income[-1] = running_income
+        elif transaction_type == schema.TYPE_EXPENSE:
+            running_expense += total
+            expense[-1] = running_expense
+    entry["stale_from"] = None
+
+# Function to get a user's up-to-date index entry
+def _get_entry(user_id):
+    db_path = connection.get_db_path()
+    if _state["db_path"] != db_path:
+        # The entries were built from another database
+        _cache.clear()
+        _state["db_path"] = db_path
+    entry = _cache.get(user_id)
+    if entry is None:
+        entry = {"dates": [], "income": [], "expense": [], "stale_from": ''}
+        _cache[user_id] = entry
+        _stats["builds"] += 1
+        while len(_cache) > MAX_CACHED_USERS:
+            _cache.popitem(last=False)
+    else:
+        _cache.move_to_end(user_id)
+    if entry["stale_from"] is not None:
+        if entry["dates"]:
+            _stats["extends"] += 1
+        _extend(entry, user_id)
+    else:
+        _stats["hits"] += 1
+    return entry
+
+# Function to look up the totals of an inclusive date range in cents
+def range_totals_cents(user_id, start_date, end_date):
+    """
+    Returns the total income and expenses of a user between two dates (inclusive), in cents.
+
+    Args:
+        user_id (int): The ID of the user.
+        start_date (str): Start date in YYYY-MM-DD format.
+        end_date (str): End date in YYYY-MM-DD format.
+
+    Returns:
+        tuple: (income_cents, expense_cents).
+    """
+    with _lock:
+        entry = _get_entry(user_id)
+        dates = entry["dates"]
+        before = bisect_left(dates, start_date) - 1
+        through = bisect_right(dates, end_date) - 1
+        if through <= before:
+            return 0, 0
+        income = entry["income"][through] - (entry["income"][before] if before >= 0 else 0)
+        expense = entry["expense"][through] - (entry["expense"][before] if before >= 0 else 0)
+        return income, expense
+
+# Function to look up the totals of an inclusive date range as amounts
+def range_totals(user_id, start_date, end_date):
+    """
+    Returns the total income and expenses of a user between two dates (inclusive).
+
+    Args:
+        user_id (int): The ID of the user.
+        start_date (str): Start date in YYYY-MM-DD format.
+        end_date (str): End date in YYYY-MM-DD format.
+
+    Returns:
+        tuple: (total_income, total_expenses).
+    """
+    income, expense = range_totals_cents(user_id, start_date, end_date)
+    return schema.from_cents(income), schema.from_cents(expense)
+
+# Function to drop the index entries affected by a change
+def invalidate(user_id, from_date=None):
+    """
+    Marks a user's cumulative totals as stale from a date onwards.
+
+    Args:
+        user_id (int): The ID of the user.
+        from_date (str, optional): Earliest date affected by the change. If None,
+            the user's whole index is dropped.
+    """
+    with _lock:
+        entry = _cache.get(user_id)
+        if entry is None:
+            return
+        _stats["invalidations"] += 1
+        if from_date is None:
+            del _cache[user_id]
+            return
+        if entry["stale_from"] is not None and entry["stale_from"] <= from_date:
+            return
+        keep = bisect_left(entry["dates"], from_date)
+        del entry["dates"][keep:]
+        del entry["income"][keep:]
+        del entry["expense"][keep:]
+        entry["stale_from"] = from_date
+
+# Function to drop the whole index
+def clear():
+    """
+    Drops every cached user, e.g. after the database file was replaced.
+    """
+    with _lock:
+        _cache.clear()
+
+# Function to report index statistics
+def index_stats():
+    """
+    Returns counters for the prefix-sum index.
+
+    Returns:
+        dict: Cached users, lookups served without SQL (hits), full builds,
+        partial re-computations (extends) and invalidations.
+    """
+    with _lock:
+        stats = dict(_stats)
+        stats["cached_users"] = len(_cache)
+    return stats
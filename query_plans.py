@@ -0,0 +1,90 @@
+from . import backup, budget, connection, export, reports
+
+# The report and budget queries checked by check_query_plans(), with sample
+# parameters for EXPLAIN QUERY PLAN.
+PUBLIC_QUERIES = {
+    "reports.monthly_totals": (reports.MONTHLY_TOTALS_SQL, (1, 2024, 1)),
+    "reports.yearly_totals": (reports.YEARLY_TOTALS_SQL, (1, 2024)),
+    "reports.total_by_type_between": (reports.TOTAL_BY_TYPE_BETWEEN_SQL, (1, 0, '2024-01-01', '2024-01-31')),
+    "budget.budget_lookup": (budget.BUDGET_LOOKUP_SQL, (1, 'Food', 1, 2024)),
+    "budget.budgets_for_month": (budget.BUDGETS_FOR_MONTH_SQL, (1, 2024, 1)),
+    "budget.exceeded_budgets": (budget.EXCEEDED_BUDGETS_SQL, (1, 2024, 1)),
+    "budget.all_exceeded_budgets": (budget.ALL_EXCEEDED_BUDGETS_SQL, (2024, 1)),
+    "export.browse_transactions": export.build_select("transactions", user_id=1, after_id=100, limit=50),
+    "export.browse_budgets": export.build_select("budgets", user_id=1, after_id=100, limit=50),
+}
+
+# Function to get the EXPLAIN QUERY PLAN output of a query
+def explain(sql, params=(), conn=None):
+    """
+    Returns the query plan details reported by SQLite for a query.
+
+    Args:
+        sql (str): The query to explain.
+        params (tuple): Sample parameters for the query.
+        conn (sqlite3.Connection, optional): Connection to use. Defaults to the pooled connection.
+
+    Returns:
+        list: The 'detail' column of each plan row, e.g. 'SEARCH transactions USING INDEX ...'.
+    """
+    if conn is None:
+        conn = connection.get_connection()
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+# Function to decide whether a plan reads every table through an index
+def uses_index(plan):
+    """
+    Checks that no step of a query plan is a full table scan.
+
+    Args:
+        plan (list): Plan details as returned by explain().
+
+    Returns:
+        bool: True if every table access is an index search.
+    """
+    for detail in plan:
+        if detail.startswith("SCAN") and "INDEX" not in detail:
+            return False
+    return any("INDEX" in detail or "PRIMARY KEY" in detail for detail in plan)
+
+# Function to check every public query against the current schema
+def check_query_plans(conn=None):
+    """
+    Runs EXPLAIN QUERY PLAN for each query in PUBLIC_QUERIES.
+
+    Args:
+        conn (sqlite3.Connection, optional): Connection to use. Defaults to the pooled connection.
+
+    Returns:
+        list: One dict per query with its "name", "plan" and "uses_index" flag.
+    """
+    results = []
+    for name, (sql, params) in PUBLIC_QUERIES.items():
+        plan = explain(sql, params, conn)
+        results.append({"name": name, "plan": plan, "uses_index": uses_index(plan)})
+    return results
+
+# Function to raise if any public query would scan a whole table
+def assert_query_plans_use_indexes(conn=None):
+    """
+    Verifies that every public query is served by an index.
+
+    Args:
+        conn (sqlite3.Connection, optional): Connection to use. Defaults to the pooled connection.
+
+    Raises:
+        AssertionError: Listing the queries that fall back to a table scan.
+    """
+    failures = [r for r in check_query_plans(conn) if not r["uses_index"]]
+    if failures:
+        lines = [f"{r['name']}: {'; '.join(r['plan'])}" for r in failures]
+        raise AssertionError("Queries without an index:\n" + "\n".join(lines))
+
+if __name__ == "__main__":
+    backup.initialize_db()
+    ok = True
+    for result in check_query_plans():
+        status = "OK  " if result["uses_index"] else "SCAN"
+        ok = ok and result["uses_index"]
+        print(f"{status} {result['name']}: {'; '.join(result['plan'])}")
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,424 @@
+import argparse
+import calendar
+import heapq
+from datetime import date as date_type, timedelta
+
+from . import alerts, connection, prefix_index, report_cache, schema, sharding, transactions
+
+# Recurring transactions (rent, salary, subscriptions) stored as rules rather
+# than as rows. A rule repeats every `interval` days, weeks, months or years
+# from its start date, optionally until a date or for a number of
+# occurrences; monthly and yearly rules keep the start date's day of the
+# month, moved to the month's last day when it is shorter. Schedules can also
+# be given as an iCalendar RRULE with FREQ, INTERVAL, COUNT and UNTIL.
+#
+# Occurrences are computed on demand by generators and never stored until
+# materialize_due() inserts the ones that are due as ordinary transactions.
+# Each rule keeps the number of occurrences materialized so far and the date
+# of the next one; both advance in the same SQL transaction as the inserted
+# rows, so running the materializer again (or twice at once) inserts nothing
+# twice. Occurrences from next_date on are "projected": reports and budget
+# checks can include them for a window without writing anything.
+FREQUENCIES = ('daily', 'weekly', 'monthly', 'yearly')
+DEFAULT_MATERIALIZE_BATCH_SIZE = 1000
+
+RULES_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS recurring_rules (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER NOT NULL,
+                        type TEXT NOT NULL,              -- 'income' or 'expense'
+                        category TEXT,
+                        amount REAL NOT NULL,
+                        frequency TEXT NOT NULL,         -- FREQUENCIES
+                        interval INTEGER NOT NULL DEFAULT 1,
+                        start_date TEXT NOT NULL,        -- YYYY-MM-DD, the first occurrence
+                        until TEXT,                      -- last possible date, NULL for none
+                        max_count INTEGER,               -- number of occurrences, NULL for unlimited
+                        materialized INTEGER NOT NULL DEFAULT 0,
+                        next_date TEXT,                  -- next occurrence to materialize, NULL when done
+                        FOREIGN KEY (user_id) REFERENCES users(id)
+                    )'''
+RULES_USER_INDEX_SQL = "CREATE INDEX IF NOT EXISTS idx_recurring_rules_user ON recurring_rules (user_id, next_date)"
+RULES_DUE_INDEX_SQL = "CREATE INDEX IF NOT EXISTS idx_recurring_rules_next ON recurring_rules (next_date)"
+# Same write guard as the one sharding puts on transactions and budgets
+_RULES_MOVED_TRIGGER_SQL = '''CREATE TRIGGER IF NOT EXISTS trg_recurring_rules_moved_{event}
+                        BEFORE {event} ON recurring_rules
+                    WHEN EXISTS (SELECT 1 FROM moved_users WHERE user_id = {row}.user_id)
+                    BEGIN
+                        SELECT RAISE(ABORT, '{message}');
+                    END'''
+
+RULE_COLUMNS = ("id", "user_id", "type", "category", "amount", "frequency", "interval", "start_date",
+                "until", "max_count", "materialized", "next_date")
+RULE_SELECT_SQL = f"SELECT {', '.join(RULE_COLUMNS)} FROM recurring_rules"
+# Rules of a user with occurrences left up to a date
+PENDING_RULES_SQL = RULE_SELECT_SQL + " WHERE user_id = ? AND next_date IS NOT NULL AND next_date <= ? ORDER BY id"
+# Rules with occurrences due by a date, skipping users that moved to another shard
+DUE_RULES_SQL = RULE_SELECT_SQL + """
+    WHERE next_date IS NOT NULL AND next_date <= ? AND id > ?
+    AND user_id NOT IN (SELECT user_id FROM moved_users)
+    ORDER BY id LIMIT ?
+"""
+ADVANCE_RULE_SQL = "UPDATE recurring_rules SET materialized = ?, next_date = ? WHERE id = ?"
+
+# Function to create the rules table (migration 6)
+def create_recurring_schema(conn=None):
+    """
+    Creates the recurring_rules table, its indexes and its moved-user write guards.
+
+    Args:
+        conn (sqlite3.Connection, optional): Connection to use. Defaults to the pooled connection.
+    """
+    if conn is None:
+        conn = connection.get_connection()
+    conn.execute(RULES_TABLE_SQL)
+    conn.execute(RULES_USER_INDEX_SQL)
+    conn.execute(RULES_DUE_INDEX_SQL)
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(_RULES_MOVED_TRIGGER_SQL.format(event=event, row="OLD" if event == "DELETE" else "NEW",
+                                                     message=sharding.MOVED_MESSAGE))
+
+# Function to parse an iCalendar RRULE into rule settings
+def parse_rrule(text):
+    """
+    Parses the supported subset of an RRULE, e.g. 'FREQ=MONTHLY;INTERVAL=3;COUNT=4'.
+
+    Args:
+        text (str): The rule, with or without a leading 'RRULE:'.
+
+    Returns:
+        dict: "frequency", "interval", "count" and "until" (YYYY-MM-DD or None).
+
+    Raises:
+        ValueError: For malformed rules and unsupported parts such as BYDAY.
+    """
+    if text.upper().startswith("RRULE:"):
+        text = text[6:]
+    parts = {}
+    for part in filter(None, text.split(";")):
+        key, separator, value = part.partition("=")
+        if not separator:
+            raise ValueError(f"invalid RRULE part: {part!r}")
+        parts[key.strip().upper()] = value.strip()
+
+    unsupported = set(parts) - {"FREQ", "INTERVAL", "COUNT", "UNTIL"}
+    if unsupported:
+        raise ValueError(f"unsupported RRULE parts: {', '.join(sorted(unsupported))}")
+    until = parts.get("UNTIL")
+    if until:
+        # Dates may be written as 20241231 or 20241231T000000Z
+        until = until[:8]
+        until = f"{until[:4]}-{until[4:6]}-{until[6:8]}" if until.isdigit() else parts["UNTIL"]
+    try:
+        return {
+            "frequency": parts.get("FREQ", "").lower(),
+            "interval": int(parts.get("INTERVAL", 1)),
+            "count": int(parts["COUNT"]) if "COUNT" in parts else None,
+            "until": until or None,
+        }
+    except ValueError:
+        raise ValueError(f"invalid RRULE: {text!r}")
+
+# Function to compute the date of the n-th occurrence (0 is the start date)
+def _nth_date(start, frequency, interval, n):
+    if frequency == 'daily':
+        return start + timedelta(days=n * interval)
+    if frequency == 'weekly':
+        return start + timedelta(weeks=n * interval)
+    months = n * interval * (12 if frequency == 'yearly' else 1)
+    year, month = divmod(start.month - 1 + months, 12)
+    year, month = start.year + year, month + 1
+    return date_type(year, month, min(start.day, calendar.monthrange(year, month)[1]))
+
+# Function to find an occurrence index at or before the first occurrence on a date or later
+def _index_near(start, frequency, interval, since):
+    if since <= start:
+        return 0
+    if frequency in ('daily', 'weekly'):
+        step = interval * (7 if frequency == 'weekly' else 1)
+        return (since - start).days // step
+    months = (since.year - start.year) * 12 + since.month - start.month
+    return max(0, months // (interval * (12 if frequency == 'yearly' else 1)) - 1)
+
+# Function to generate the pending occurrences of a rule
+def iter_occurrences(rule, start_date=None, end_date=None):
+    """
+    Lazily yields the dates of a rule's occurrences that are not materialized yet.
+
+    Occurrences are computed one at a time, so an open-ended rule can be
+    expanded with itertools.islice() or a date window.
+
+    Args:
+        rule (dict): A rule as returned by get_rules().
+        start_date (str, optional): Skip occurrences before this date (YYYY-MM-DD).
+        end_date (str, optional): Stop after this date (inclusive).
+
+    Yields:
+        str: Occurrence dates (YYYY-MM-DD) in order.
+    """
+    start = date_type.fromisoformat(rule["start_date"])
+    frequency, interval = rule["frequency"], rule["interval"]
+    first = rule["materialized"]
+    if start_date:
+        first = max(first, _index_near(start, frequency, interval, date_type.fromisoformat(start_date)))
+    limit = rule["max_count"]
+    last_date = min(filter(None, (rule["until"], end_date)), default=None)
+
+    n = first
+    while limit is None or n < limit:
+        occurrence = _nth_date(start, frequency, interval, n).isoformat()
+        if last_date is not None and occurrence > last_date:
+            return
+        if start_date is None or occurrence >= start_date:
+            yield occurrence
+        n += 1
+
+# Function to compute the next date to materialize after n occurrences
+def _next_date(rule, materialized):
+    if rule["max_count"] is not None and materialized >= rule["max_count"]:
+        return None
+    occurrence = _nth_date(date_type.fromisoformat(rule["start_date"]), rule["frequency"],
+                           rule["interval"], materialized).isoformat()
+    if rule["until"] and occurrence > rule["until"]:
+        return None
+    return occurrence
+
+# Function to convert a rule row to a dict
+def _to_rule(row):
+    return dict(zip(RULE_COLUMNS, row))
+
+# Function to add a recurring rule
+@sharding.by_user
+def add_rule(user_id, transaction_type, category, amount, frequency, start_date, interval=1, until=None,
+             count=None):
+    """
+    Adds a recurring income or expense.
+
+    Args:
+        user_id (int): The ID of the user.
+        transaction_type (str): 'income' or 'expense'.
+        category (str): The category of the generated transactions.
+        amount (float): The amount of each occurrence.
+        frequency (str): 'daily', 'weekly', 'monthly' or 'yearly', or an RRULE
+            such as 'FREQ=WEEKLY;INTERVAL=2;COUNT=10' (its parts override
+            interval, until and count).
+        start_date (str): Date of the first occurrence (YYYY-MM-DD).
+        interval (int): Repeat every this many days, weeks, months or years.
+        until (str, optional): No occurrences after this date (YYYY-MM-DD).
+        count (int, optional): Total number of occurrences.
+
+    Returns:
+        int: The ID of the new rule.
+
+    Raises:
+        ValueError: If any field is invalid.
+    """
+    if "=" in frequency:
+        parsed = parse_rrule(frequency)
+        frequency, interval = parsed["frequency"], parsed["interval"]
+        until = parsed["until"] or until
+        count = parsed["count"] if parsed["count"] is not None else count
+    if frequency not in FREQUENCIES:
+        raise ValueError(f"invalid frequency: {frequency!r}")
+    if not isinstance(interval, int) or interval < 1:
+        raise ValueError(f"invalid interval: {interval!r}")
+    if count is not None and (not isinstance(count, int) or count < 1):
+        raise ValueError(f"invalid count: {count!r}")
+    user_id, transaction_type, category, amount, start_date = transactions.validate_transaction(
+        (user_id, transaction_type, category, amount, start_date))
+    if until is not None:
+        transactions.validate_transaction((user_id, transaction_type, category, amount, until))
+
+    rule = {"start_date": start_date, "frequency": frequency, "interval": interval,
+            "until": until, "max_count": count}
+    conn = connection.get_connection()
+    cursor = conn.execute(
+        "INSERT INTO recurring_rules (user_id, type, category, amount, frequency, interval, start_date, "
+        "until, max_count, next_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (user_id, transaction_type, category, amount, frequency, interval, start_date, until, count,
+         _next_date(rule, 0)),
+    )
+    connection.commit(conn)
+    # Cached reports that include projections are outdated
+    connection.after_commit(lambda: report_cache.bump_version(user_id))
+    return cursor.lastrowid
+
+# Function to delete a recurring rule
+@sharding.by_user
+def delete_rule(user_id, rule_id):
+    """
+    Deletes a rule. Occurrences it already materialized are kept.
+
+    Args:
+        user_id (int): The ID of the user owning the rule.
+        rule_id (int): The ID of the rule.
+
+    Returns:
+        bool: True if the rule existed.
+    """
+    conn = connection.get_connection()
+    cursor = conn.execute("DELETE FROM recurring_rules WHERE id = ? AND user_id = ?", (rule_id, user_id))
+    connection.commit(conn)
+    if cursor.rowcount:
+        connection.after_commit(lambda: report_cache.bump_version(user_id))
+    return cursor.rowcount > 0
+
+# Function to list the rules of a user
+@sharding.by_user
+def get_rules(user_id):
+    """
+    Args:
+        user_id (int): The ID of the user.
+
+    Returns:
+        list: Rule dicts with the columns of recurring_rules.
+    """
+    conn = connection.get_connection()
+    return [_to_rule(row) for row in conn.execute(RULE_SELECT_SQL + " WHERE user_id = ? ORDER BY id", (user_id,))]
+
+# Function to generate the projected transactions of a user in a window
+@sharding.by_user
+def iter_projected(user_id, start_date, end_date):
+    """
+    Lazily yields the occurrences of a user's rules in a window that are not materialized yet.
+
+    Nothing is written; the occurrences of all rules are merged in date order.
+
+    Args:
+        user_id (int): The ID of the user.
+        start_date (str): Start date in YYYY-MM-DD format.
+        end_date (str): End date in YYYY-MM-DD format (inclusive).
+
+    Yields:
+        dict: rule_id, user_id, type, category, amount and date of each occurrence.
+    """
+    conn = connection.get_connection()
+    rules = [_to_rule(row) for row in conn.execute(PENDING_RULES_SQL, (user_id, end_date))]
+
+    def occurrences(rule):
+        for occurrence in iter_occurrences(rule, start_date, end_date):
+            yield {"rule_id": rule["id"], "user_id": rule["user_id"], "type": rule["type"],
+                   "category": rule["category"], "amount": rule["amount"], "date": occurrence}
+
+    yield from heapq.merge(*map(occurrences, rules), key=lambda occurrence: occurrence["date"])
+
+# Function to total the projected income and expenses of a user in a window
+def projected_cents(user_id, start_date, end_date):
+    """
+    Sums the projected occurrences of a window by transaction type.
+
+    Args:
+        user_id (int): The ID of the user.
+        start_date (str): Start date in YYYY-MM-DD format.
+        end_date (str): End date in YYYY-MM-DD format (inclusive).
+
+    Returns:
+        dict: Type code (schema.TYPE_CODES) -> total in cents.
+    """
+    totals = {}
+    for occurrence in iter_projected(user_id, start_date, end_date):
+        code = schema.type_code(occurrence["type"])
+        totals[code] = totals.get(code, 0) + schema.to_cents(occurrence["amount"])
+    return totals
+
+# Function to materialize the due occurrences of one batch of rules
+def _materialize_batch(conn, as_of, after_id, batch_size):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Read inside the write transaction, so concurrent runs never both see a rule as due
+        rules = [_to_rule(row) for row in conn.execute(DUE_RULES_SQL, (as_of, after_id, batch_size))]
+        entries, advanced, earliest = [], [], {}
+        for rule in rules:
+            occurrences = list(iter_occurrences(rule, end_date=as_of))
+            code, cents = schema.type_code(rule["type"]), schema.to_cents(rule["amount"])
+            entries.extend((rule["user_id"], code, rule["category"], cents, occurrence)
+                           for occurrence in occurrences)
+            materialized = rule["materialized"] + len(occurrences)
+            advanced.append((materialized, _next_date(rule, materialized), rule["id"]))
+            if occurrences and (rule["user_id"] not in earliest or occurrences[0] < earliest[rule["user_id"]]):
+                earliest[rule["user_id"]] = occurrences[0]
+
+        conn.executemany(transactions.INSERT_CATEGORY_SQL,
+                         {(rule["category"],) for rule in rules if rule["category"]})
+        cursor = conn.cursor()
+        since = alerts.mark(cursor)
+        cursor.executemany(transactions.INSERT_TRANSACTION_SQL, entries)
+        raised = alerts.collect(cursor, since)
+        conn.executemany(ADVANCE_RULE_SQL, advanced)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    alerts.notify(raised)
+    for user_id, first in earliest.items():
+        prefix_index.invalidate(user_id, first)
+        report_cache.bump_version(user_id)
+    return len(rules), len(entries), rules[-1]["id"] if rules else None
+
+# Function to materialize the due occurrences in the current database
+def _materialize_current(as_of, batch_size):
+    conn = connection.get_connection()
+    if conn.in_transaction:
+        raise RuntimeError("materialize_due() cannot run inside an open transaction")
+    result = {"rules": 0, "inserted": 0}
+    after_id = 0
+    while True:
+        rules, inserted, last_id = _materialize_batch(conn, as_of, after_id, batch_size)
+        result["rules"] += rules
+        result["inserted"] += inserted
+        if rules < batch_size:
+            return result
+        after_id = last_id
+
+# Function to insert every due occurrence as a transaction
+def materialize_due(as_of=None, batch_size=DEFAULT_MATERIALIZE_BATCH_SIZE):
+    """
+    Inserts the occurrences of every rule dated up to a day as transactions.
+
+    Rules are processed in batches, one SQL transaction per batch (and per
+    shard): the rows are inserted with executemany and the rules advanced in
+    the same transaction, so the function is idempotent and safe to run from
+    cron, repeatedly or from several processes.
+
+    Args:
+        as_of (str, optional): Last date to materialize (YYYY-MM-DD). Defaults to today.
+        batch_size (int): Rules per SQL transaction.
+
+    Returns:
+        dict: Number of "rules" advanced and transactions "inserted".
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    as_of = as_of or date_type.today().isoformat()
+    date_type.fromisoformat(as_of)
+    result = {"rules": 0, "inserted": 0}
+    for _, shard_result in sharding.fan_out(_materialize_current, as_of, batch_size):
+        result["rules"] += shard_result["rules"]
+        result["inserted"] += shard_result["inserted"]
+    return result
+
+# Command line entry point: python -m <package>.recurring materialize [--as-of DATE]
+def main(argv=None):
+    """
+    Materializes the due occurrences of all recurring rules (e.g. from cron).
+
+    Args:
+        argv (list, optional): Command line arguments without the program name.
+
+    Returns:
+        int: Process exit code.
+    """
+    parser = argparse.ArgumentParser(description="Insert the due occurrences of recurring transactions.")
+    parser.add_argument("command", choices=["materialize"])
+    parser.add_argument("--as-of", help="last date to materialize (defaults to today)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_MATERIALIZE_BATCH_SIZE)
+    parser.add_argument("--db", help="Database file (defaults to the configured path)")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        connection.configure(db_path=args.db)
+    result = materialize_due(args.as_of, batch_size=args.batch_size)
+    print(f"Inserted {result['inserted']} transactions from {result['rules']} rules.")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
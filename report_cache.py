@@ -0,0 +1,246 @@
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from . import connection
+
+# LRU cache for report and budget read results. Every entry is tagged with
+# the data version of its user; writes bump the version (bump_version), so a
+# stale entry is simply never matched again and ages out of the LRU.
+#
+# Keys include the database path, so switching databases never serves a
+# result computed from another one.
+#
+# The cache is off by default: versions are only bumped by the process that
+# writes, so a per-process cache would keep serving results after another
+# process changed the data. configure(shared_path=...) turns it on with
+# versions and entries in a small SQLite file, so several worker processes
+# share results and see each other's invalidations; every process writing
+# to the database must use the same file. That file only holds the cache
+# tables, not the finance schema. configure(enabled=True) without a shared
+# file is only safe when this process is the only writer.
+DEFAULT_MAX_ENTRIES = 4096
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+SHARED_SCHEMA_SQL = (
+    '''CREATE TABLE IF NOT EXISTS cache_versions (
+                        user_id INTEGER PRIMARY KEY,
+                        version INTEGER NOT NULL
+                    )''',
+    '''CREATE TABLE IF NOT EXISTS cache_entries (
+                        key BLOB PRIMARY KEY,
+                        user_id INTEGER NOT NULL,
+                        version INTEGER NOT NULL,
+                        value BLOB NOT NULL,
+                        size INTEGER NOT NULL,
+                        last_used REAL NOT NULL
+                    )''',
+    "CREATE INDEX IF NOT EXISTS idx_cache_entries_last_used ON cache_entries (last_used)",
+)
+
+_settings = {
+    "enabled": False,
+    "max_entries": DEFAULT_MAX_ENTRIES,
+    "max_bytes": DEFAULT_MAX_BYTES,
+    "shared_path": None,
+}
+_lock = threading.Lock()
+_entries = OrderedDict()      # key -> (version, pickled value)
+_versions = {}                # user_id -> version
+_state = {"bytes": 0, "epoch": 0}
+_stats = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0, "bumps": 0}
+
+# Function to change the cache settings
+def configure(enabled=None, max_entries=None, max_bytes=None, shared_path=None):
+    """
+    Updates the cache settings. Changing settings empties the in-process cache.
+
+    Args:
+        enabled (bool, optional): Turn the cache on or off. Only turn on an
+            in-process cache when no other process writes to the database.
+        max_entries (int, optional): Maximum number of cached results.
+        max_bytes (int, optional): Maximum total size of the pickled results.
+        shared_path (str, optional): Path of a SQLite file to share the cache between
+            processes; turns the cache on unless enabled=False. Pass '' to stop
+            sharing, which turns the cache off unless enabled=True.
+
+    Returns:
+        dict: The settings now in effect.
+    """
+    with _lock:
+        if enabled is not None:
+            _settings["enabled"] = bool(enabled)
+        if max_entries is not None:
+            _settings["max_entries"] = int(max_entries)
+        if max_bytes is not None:
+            _settings["max_bytes"] = int(max_bytes)
+        if shared_path is not None:
+            _settings["shared_path"] = shared_path or None
+            if enabled is None:
+                _settings["enabled"] = bool(shared_path)
+        _entries.clear()
+        _versions.clear()
+        _state["bytes"] = 0
+    if _settings["shared_path"]:
+        conn = _shared_connection()
+        for sql in SHARED_SCHEMA_SQL:
+            conn.execute(sql)
+        conn.commit()
+    return dict(_settings)
+
+# Function to get the connection to the shared cache file
+def _shared_connection():
+    return connection.get_connection(_settings["shared_path"], migrate=False)
+
+# Function to get the current data version of a user
+def _current_version(user_id):
+    if _settings["shared_path"]:
+        row = _shared_connection().execute(
+            "SELECT version FROM cache_versions WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return row[0] if row else 0
+    return (_state["epoch"], _versions.get(user_id, 0))
+
+# Function to invalidate everything cached for a user
+def bump_version(user_id):
+    """
+    Marks all cached results of a user as outdated. Called after writes commit.
+
+    Args:
+        user_id (int): The ID of the user whose data changed.
+    """
+    if not _settings["enabled"]:
+        return
+    with _lock:
+        _stats["bumps"] += 1
+        if _settings["shared_path"]:
+            conn = _shared_connection()
+            conn.execute(
+                "INSERT INTO cache_versions (user_id, version) VALUES (?, 1) "
+                "ON CONFLICT (user_id) DO UPDATE SET version = version + 1",
+                (user_id,),
+            )
+            conn.commit()
+        else:
+            _versions[user_id] = _versions.get(user_id, 0) + 1
+
+# Function to invalidate every cached result
+def clear():
+    """
+    Invalidates every cached result, e.g. after the database file was replaced.
+    """
+    with _lock:
+        _entries.clear()
+        _versions.clear()
+        _state["bytes"] = 0
+        _state["epoch"] += 1
+        if _settings["shared_path"]:
+            conn = _shared_connection()
+            conn.execute("DELETE FROM cache_entries")
+            conn.execute("UPDATE cache_versions SET version = version + 1")
+            conn.commit()
+
+# Function to evict least recently used in-process entries until within bounds
+def _evict_local():
+    while _entries and (len(_entries) > _settings["max_entries"]
+                        or _state["bytes"] > _settings["max_bytes"]):
+        _, (_, value) = _entries.popitem(last=False)
+        _state["bytes"] -= len(value)
+        _stats["evictions"] += 1
+
+# Function to evict least recently used shared entries until within bounds
+def _evict_shared(conn):
+    count, total = conn.execute("SELECT COUNT(*), IFNULL(SUM(size), 0) FROM cache_entries").fetchone()
+    if count <= _settings["max_entries"] and total <= _settings["max_bytes"]:
+        return
+    evicted = 0
+    for key, size in conn.execute("SELECT key, size FROM cache_entries ORDER BY last_used").fetchall():
+        if count <= _settings["max_entries"] and total <= _settings["max_bytes"]:
+            break
+        conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+        count -= 1
+        total -= size
+        evicted += 1
+    _stats["evictions"] += evicted
+
+# Function to look up a result or compute and cache it
+def get_or_compute(name, user_id, args, compute):
+    """
+    Returns the cached result of a read function, computing it on a miss.
+
+    Args:
+        name (str): Name of the cached function, part of the key.
+        user_id (int): The user the result belongs to.
+        args (tuple): The remaining arguments, part of the key.
+        compute (callable): Called as compute(user_id, *args) on a miss.
+
+    Returns:
+        The result. Each call returns a fresh copy, so callers may modify it.
+    """
+    if not _settings["enabled"]:
+        return compute(user_id, *args)
+
+    key = pickle.dumps((os.path.abspath(connection.current_db_path()), name, user_id) + tuple(args))
+    with _lock:
+        version = _current_version(user_id)
+        if _settings["shared_path"]:
+            conn = _shared_connection()
+            cached = conn.execute(
+                "SELECT version, value FROM cache_entries WHERE key = ?", (key,)
+            ).fetchone()
+            if cached is not None and cached[0] == version:
+                conn.execute("UPDATE cache_entries SET last_used = ? WHERE key = ?", (time.time(), key))
+                conn.commit()
+        else:
+            cached = _entries.get(key)
+            if cached is not None and cached[0] == version:
+                _entries.move_to_end(key)
+
+        if cached is not None and cached[0] == version:
+            _stats["hits"] += 1
+            return pickle.loads(cached[1])
+        _stats["misses" if cached is None else "stale"] += 1
+
+    result = compute(user_id, *args)
+    value = pickle.dumps(result)
+
+    with _lock:
+        # Do not store a result computed against data that changed meanwhile
+        if _current_version(user_id) != version or len(value) > _settings["max_bytes"]:
+            return result
+        if _settings["shared_path"]:
+            conn = _shared_connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, user_id, version, value, size, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, user_id, version, value, len(value), time.time()),
+            )
+            _evict_shared(conn)
+            conn.commit()
+        else:
+            previous = _entries.pop(key, None)
+            if previous is not None:
+                _state["bytes"] -= len(previous[1])
+            _entries[key] = (version, value)
+            _state["bytes"] += len(value)
+            _evict_local()
+    return result
+
+# Function to report cache statistics
+def cache_stats():
+    """
+    Returns the cache counters.
+
+    Returns:
+        dict: hits, misses, stale (found but outdated), evictions and version
+        bumps, plus the number of entries and bytes held in this process.
+    """
+    with _lock:
+        stats = dict(_stats)
+        stats["entries"] = len(_entries)
+        stats["bytes"] = _state["bytes"]
+    lookups = stats["hits"] + stats["misses"] + stats["stale"]
+    stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
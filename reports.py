@@ -1,47 +1,99 @@
-import sqlite3
+import calendar
 from datetime import datetime
 
-# Function to generate financial report for a specific month and year
-def generate_monthly_report(user_id, month, year):
+from . import archive, connection, prefix_index, recurring, report_cache, schema, sharding
+
+# Income and expense totals of one month, read from the monthly rollups
+MONTHLY_TOTALS_SQL = """
+    SELECT type, SUM(total_cents) FROM monthly_rollups
+    WHERE user_id = ? AND year = ? AND month = ?
+    GROUP BY type
+"""
+
+# Income and expense totals of one year, read from the monthly rollups
+YEARLY_TOTALS_SQL = """
+    SELECT type, SUM(total_cents) FROM monthly_rollups
+    WHERE user_id = ? AND year = ?
+    GROUP BY type
+"""
+
+# Sum of one transaction type over an inclusive date range; served by the
+# (user_id, type, date, amount_cents) covering index.
+TOTAL_BY_TYPE_BETWEEN_SQL = """
+    SELECT SUM(amount_cents) FROM transaction_entries
+    WHERE user_id = ? AND type = ? AND date BETWEEN ? AND ?
+"""
+
+# Function to add the projected recurring occurrences of a period to per-type totals
+def _add_projected(totals, user_id, start_date, end_date):
+    for code, cents in recurring.projected_cents(user_id, start_date, end_date).items():
+        totals[code] = (totals.get(code) or 0) + cents
+
+# Function to get the monthly report figures without printing them
+@sharding.by_user
+def get_monthly_report(user_id, month, year, include_projected=False):
     """
-    Generates a monthly financial report showing total income, expenses, and savings.
+    Returns the total income, expenses, and savings for a month, using the report cache.
 
     Args:
         user_id (int): The ID of the user.
         month (int): The month for the report (1-12).
         year (int): The year for the report (e.g., 2023).
+        include_projected (bool): Add the occurrences of recurring rules in the
+            period that are not materialized yet (see recurring.py).
 
     Returns:
         dict: A dictionary containing total income, total expenses, and savings.
     """
-    conn = sqlite3.connect('finance.db')
-    cursor = conn.cursor()
+    return report_cache.get_or_compute("monthly_report", user_id, (month, year, include_projected),
+                                       _compute_monthly_report)
 
-    # Fetch total income for the given month and year
-    cursor.execute("""
-        SELECT SUM(amount) FROM transactions
-        WHERE user_id = ? AND type = 'income' AND strftime('%m', date) = ? AND strftime('%Y', date) = ?
-    """, (user_id, f'{month:02}', str(year)))
-    total_income = cursor.fetchone()[0] or 0.0
+def _compute_monthly_report(user_id, month, year, include_projected=False):
+    conn = connection.get_connection()
+    cursor = conn.cursor()
 
-    # Fetch total expenses for the given month and year
-    cursor.execute("""
-        SELECT SUM(amount) FROM transactions
-        WHERE user_id = ? AND type = 'expense' AND strftime('%m', date) = ? AND strftime('%Y', date) = ?
-    """, (user_id, f'{month:02}', str(year)))
-    total_expenses = cursor.fetchone()[0] or 0.0
+    # Fetch total income and expenses for the given month and year
+    cursor.execute(MONTHLY_TOTALS_SQL, (user_id, int(year), int(month)))
+    totals = dict(cursor.fetchall())
+    if include_projected:
+        last_day = calendar.monthrange(int(year), int(month))[1]
+        _add_projected(totals, user_id, f"{int(year):04d}-{int(month):02d}-01",
+                       f"{int(year):04d}-{int(month):02d}-{last_day:02d}")
+    income_cents = totals.get(schema.TYPE_INCOME) or 0
+    expense_cents = totals.get(schema.TYPE_EXPENSE) or 0
 
     # Calculate savings as the difference between income and expenses
-    savings = total_income - total_expenses
-
-    conn.close()
+    total_income = schema.from_cents(income_cents)
+    total_expenses = schema.from_cents(expense_cents)
+    savings = schema.from_cents(income_cents - expense_cents)
 
-    report = {
+    return {
         "total_income": total_income,
         "total_expenses": total_expenses,
         "savings": savings
     }
 
+# Function to generate financial report for a specific month and year
+@sharding.by_user
+def generate_monthly_report(user_id, month, year, include_projected=False):
+    """
+    Generates a monthly financial report showing total income, expenses, and savings.
+
+    Args:
+        user_id (int): The ID of the user.
+        month (int): The month for the report (1-12).
+        year (int): The year for the report (e.g., 2023).
+        include_projected (bool): Add the occurrences of recurring rules in the
+            period that are not materialized yet (see recurring.py).
+
+    Returns:
+        dict: A dictionary containing total income, total expenses, and savings.
+    """
+    report = get_monthly_report(user_id, month, year, include_projected)
+    total_income = report["total_income"]
+    total_expenses = report["total_expenses"]
+    savings = report["savings"]
+
     print(f"Monthly Report for {month}/{year}")
     print(f"Total Income: {total_income}")
     print(f"Total Expenses: {total_expenses}")
@@ -49,46 +101,67 @@ def generate_monthly_report(user_id, month, year):
 
     return report
 
-# Function to generate a yearly financial report
-def generate_yearly_report(user_id, year):
+# Function to get the yearly report figures without printing them
+@sharding.by_user
+def get_yearly_report(user_id, year, include_projected=False):
     """
-    Generates a yearly financial report showing total income, expenses, and savings.
+    Returns the total income, expenses, and savings for a year, using the report cache.
 
     Args:
         user_id (int): The ID of the user.
         year (int): The year for the report (e.g., 2023).
+        include_projected (bool): Add the occurrences of recurring rules in the
+            period that are not materialized yet (see recurring.py).
 
     Returns:
         dict: A dictionary containing total income, total expenses, and savings for the year.
     """
-    conn = sqlite3.connect('finance.db')
-    cursor = conn.cursor()
+    return report_cache.get_or_compute("yearly_report", user_id, (year, include_projected),
+                                       _compute_yearly_report)
 
-    # Fetch total income for the given year
-    cursor.execute("""
-        SELECT SUM(amount) FROM transactions
-        WHERE user_id = ? AND type = 'income' AND strftime('%Y', date) = ?
-    """, (user_id, str(year)))
-    total_income = cursor.fetchone()[0] or 0.0
+def _compute_yearly_report(user_id, year, include_projected=False):
+    conn = connection.get_connection()
+    cursor = conn.cursor()
 
-    # Fetch total expenses for the given year
-    cursor.execute("""
-        SELECT SUM(amount) FROM transactions
-        WHERE user_id = ? AND type = 'expense' AND strftime('%Y', date) = ?
-    """, (user_id, str(year)))
-    total_expenses = cursor.fetchone()[0] or 0.0
+    # Fetch total income and expenses for the given year
+    cursor.execute(YEARLY_TOTALS_SQL, (user_id, int(year)))
+    totals = dict(cursor.fetchall())
+    if include_projected:
+        _add_projected(totals, user_id, f"{int(year):04d}-01-01", f"{int(year):04d}-12-31")
+    income_cents = totals.get(schema.TYPE_INCOME) or 0
+    expense_cents = totals.get(schema.TYPE_EXPENSE) or 0
 
     # Calculate yearly savings
-    savings = total_income - total_expenses
-
-    conn.close()
+    total_income = schema.from_cents(income_cents)
+    total_expenses = schema.from_cents(expense_cents)
+    savings = schema.from_cents(income_cents - expense_cents)
 
-    report = {
+    return {
         "total_income": total_income,
         "total_expenses": total_expenses,
         "savings": savings
     }
 
+# Function to generate a yearly financial report
+@sharding.by_user
+def generate_yearly_report(user_id, year, include_projected=False):
+    """
+    Generates a yearly financial report showing total income, expenses, and savings.
+
+    Args:
+        user_id (int): The ID of the user.
+        year (int): The year for the report (e.g., 2023).
+        include_projected (bool): Add the occurrences of recurring rules in the
+            period that are not materialized yet (see recurring.py).
+
+    Returns:
+        dict: A dictionary containing total income, total expenses, and savings for the year.
+    """
+    report = get_yearly_report(user_id, year, include_projected)
+    total_income = report["total_income"]
+    total_expenses = report["total_expenses"]
+    savings = report["savings"]
+
     print(f"Yearly Report for {year}")
     print(f"Total Income: {total_income}")
     print(f"Total Expenses: {total_expenses}")
@@ -96,47 +169,88 @@ def generate_yearly_report(user_id, year):
 
     return report
 
-# Helper function to calculate total income, expenses, and savings for a custom period
-def calculate_totals(user_id, start_date, end_date):
+# Function to get the totals for a custom period without printing them
+@sharding.by_user
+def get_totals(user_id, start_date, end_date, include_projected=False):
     """
-    Calculates total income, expenses, and savings for a custom period.
+    Returns total income, expenses, and savings for a custom period, using the report cache.
+
+    Totals come from the in-memory prefix-sum index (two binary searches)
+    unless it is disabled, in which case two SUM queries are run. Both
+    include the archived years in the period (see archive.py).
 
     Args:
         user_id (int): The ID of the user.
         start_date (str): Start date in YYYY-MM-DD format.
         end_date (str): End date in YYYY-MM-DD format.
+        include_projected (bool): Add the occurrences of recurring rules in the
+            period that are not materialized yet (see recurring.py).
 
     Returns:
         dict: A dictionary containing total income, total expenses, and savings.
     """
-    conn = sqlite3.connect('finance.db')
-    cursor = conn.cursor()
+    return report_cache.get_or_compute("totals", user_id, (start_date, end_date, include_projected),
+                                       _compute_totals)
 
-    # Fetch total income for the given period
-    cursor.execute("""
-        SELECT SUM(amount) FROM transactions
-        WHERE user_id = ? AND type = 'income' AND date BETWEEN ? AND ?
-    """, (user_id, start_date, end_date))
-    total_income = cursor.fetchone()[0] or 0.0
+def _compute_totals(user_id, start_date, end_date, include_projected=False):
+    if prefix_index.is_enabled():
+        income_cents, expense_cents = prefix_index.range_totals_cents(user_id, start_date, end_date)
+    else:
+        conn = connection.get_connection()
+        cursor = conn.cursor()
 
-    # Fetch total expenses for the given period
-    cursor.execute("""
-        SELECT SUM(amount) FROM transactions
-        WHERE user_id = ? AND type = 'expense' AND date BETWEEN ? AND ?
-    """, (user_id, start_date, end_date))
-    total_expenses = cursor.fetchone()[0] or 0.0
+        # Fetch total income for the given period
+        cursor.execute(TOTAL_BY_TYPE_BETWEEN_SQL, (user_id, schema.TYPE_INCOME, start_date, end_date))
+        income_cents = cursor.fetchone()[0] or 0
 
-    # Calculate savings
-    savings = total_income - total_expenses
+        # Fetch total expenses for the given period
+        cursor.execute(TOTAL_BY_TYPE_BETWEEN_SQL, (user_id, schema.TYPE_EXPENSE, start_date, end_date))
+        expense_cents = cursor.fetchone()[0] or 0
+
+        # Years moved out of the database are summed from their archive files
+        for archive_conn in archive.archived_connections(start_date, end_date, conn):
+            income_cents += archive_conn.execute(
+                TOTAL_BY_TYPE_BETWEEN_SQL, (user_id, schema.TYPE_INCOME, start_date, end_date)).fetchone()[0] or 0
+            expense_cents += archive_conn.execute(
+                TOTAL_BY_TYPE_BETWEEN_SQL, (user_id, schema.TYPE_EXPENSE, start_date, end_date)).fetchone()[0] or 0
 
-    conn.close()
+    if include_projected:
+        projected = recurring.projected_cents(user_id, start_date, end_date)
+        income_cents += projected.get(schema.TYPE_INCOME, 0)
+        expense_cents += projected.get(schema.TYPE_EXPENSE, 0)
 
-    totals = {
+    # Calculate savings
+    total_income = schema.from_cents(income_cents)
+    total_expenses = schema.from_cents(expense_cents)
+    savings = schema.from_cents(income_cents - expense_cents)
+
+    return {
         "total_income": total_income,
         "total_expenses": total_expenses,
         "savings": savings
     }
 
+# Helper function to calculate total income, expenses, and savings for a custom period
+@sharding.by_user
+def calculate_totals(user_id, start_date, end_date, include_projected=False):
+    """
+    Calculates total income, expenses, and savings for a custom period.
+
+    Args:
+        user_id (int): The ID of the user.
+        start_date (str): Start date in YYYY-MM-DD format.
+        end_date (str): End date in YYYY-MM-DD format.
+        include_projected (bool): Add the occurrences of recurring rules in the
+            period that are not materialized yet (see recurring.py).
+
+    Returns:
+        dict: A dictionary containing total income, total expenses, and savings.
+    """
+    totals = get_totals(user_id, start_date, end_date, include_projected)
+    total_income = totals["total_income"]
+    total_expenses = totals["total_expenses"]
+    savings = totals["savings"]
+
     print(f"Total Income: {total_income}")
     print(f"Total Expenses: {total_expenses}")
     print(f"Savings: {savings}")
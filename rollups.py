@@ -0,0 +1,229 @@
+import sys
+
+from . import archive, connection
+
+# Per (user, month, category, type) totals of the transaction entries. Reports
+# and budget checks read these few rows instead of re-aggregating raw rows.
+ROLLUP_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS monthly_rollups (
+                        user_id INTEGER NOT NULL,
+                        year INTEGER NOT NULL,
+                        month INTEGER NOT NULL,
+                        category_id INTEGER NOT NULL,   -- 0 for transactions without a category
+                        type INTEGER NOT NULL,          -- schema.TYPE_CODES
+                        total_cents INTEGER NOT NULL DEFAULT 0,
+                        count INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (user_id, year, month, category_id, type)
+                    ) WITHOUT ROWID'''
+
+# The triggers keep monthly_rollups current inside the same SQL transaction as
+# every insert, update and delete on transaction_entries, including bulk inserts.
+# An update removes the old row's contribution and adds the new one, which
+# covers moves between months, categories, types and users. Inserts and
+# updates then check the month's budget and queue an alert when the expense
+# total has just gone over it (see alerts.py).
+_ADD_NEW_SQL = '''INSERT INTO monthly_rollups (user_id, year, month, category_id, type, total_cents, count)
+                        VALUES (NEW.user_id, CAST(substr(NEW.date, 1, 4) AS INTEGER),
+                                CAST(substr(NEW.date, 6, 2) AS INTEGER),
+                                IFNULL(NEW.category_id, 0), NEW.type, NEW.amount_cents, 1)
+                        ON CONFLICT (user_id, year, month, category_id, type)
+                        DO UPDATE SET total_cents = total_cents + excluded.total_cents, count = count + 1;'''
+_OLD_KEY_SQL = '''user_id = OLD.user_id
+                          AND year = CAST(substr(OLD.date, 1, 4) AS INTEGER)
+                          AND month = CAST(substr(OLD.date, 6, 2) AS INTEGER)
+                          AND category_id = IFNULL(OLD.category_id, 0) AND type = OLD.type'''
+_REMOVE_OLD_SQL = f'''UPDATE monthly_rollups SET total_cents = total_cents - OLD.amount_cents, count = count - 1
+                        WHERE {_OLD_KEY_SQL};
+                        DELETE FROM monthly_rollups
+                        WHERE {_OLD_KEY_SQL}
+                          AND count <= 0;'''
+
+# Trigger step queueing a budget alert (see alerts.py) when the expense
+# counter of NEW's month and category has just crossed the budget. {previous}
+# is the part of the old counter value that the trigger removed before adding
+# NEW (0 for inserts).
+_ALERT_STEP_SQL = '''INSERT INTO budget_alerts (user_id, category, month, year, budget_amount, total_spent)
+                        SELECT b.user_id, b.category, b.month, b.year, b.amount, r.total_cents / 100.0
+                        FROM budgets AS b
+                        JOIN categories AS c ON c.name = b.category
+                        JOIN monthly_rollups AS r
+                            ON r.user_id = b.user_id AND r.year = b.year AND r.month = b.month
+                            AND r.category_id = c.id AND r.type = 0
+                        WHERE NEW.type = 0 AND c.id = NEW.category_id AND b.user_id = NEW.user_id
+                          AND b.year = CAST(substr(NEW.date, 1, 4) AS INTEGER)
+                          AND b.month = CAST(substr(NEW.date, 6, 2) AS INTEGER)
+                          AND r.total_cents > round(b.amount * 100)
+                          AND r.total_cents - NEW.amount_cents + {previous} <= round(b.amount * 100);'''
+
+_ALERT_ON_INSERT_SQL = _ALERT_STEP_SQL.format(previous="0")
+# On update, OLD's amount was part of the counter before the write if OLD
+# counted towards the same month, category and user
+_ALERT_ON_UPDATE_SQL = _ALERT_STEP_SQL.format(previous='''(CASE WHEN OLD.type = 0
+                              AND OLD.user_id = NEW.user_id
+                              AND substr(OLD.date, 1, 7) = substr(NEW.date, 1, 7)
+                              AND IFNULL(OLD.category_id, 0) = IFNULL(NEW.category_id, 0)
+                              THEN OLD.amount_cents ELSE 0 END)''')
+
+ROLLUP_TRIGGERS_SQL = {
+    "trg_rollups_insert": f'''CREATE TRIGGER IF NOT EXISTS trg_rollups_insert
+                        AFTER INSERT ON transaction_entries
+                    BEGIN
+                        {_ADD_NEW_SQL}
+                        {_ALERT_ON_INSERT_SQL}
+                    END''',
+    "trg_rollups_delete": f'''CREATE TRIGGER IF NOT EXISTS trg_rollups_delete
+                        AFTER DELETE ON transaction_entries
+                    BEGIN
+                        {_REMOVE_OLD_SQL}
+                    END''',
+    "trg_rollups_update": f'''CREATE TRIGGER IF NOT EXISTS trg_rollups_update
+                        AFTER UPDATE OF user_id, type, category_id, amount_cents, date ON transaction_entries
+                    BEGIN
+                        {_REMOVE_OLD_SQL}
+                        {_ADD_NEW_SQL}
+                        {_ALERT_ON_UPDATE_SQL}
+                    END''',
+}
+
+# Aggregates the raw transaction entries into the rollup shape
+_AGGREGATE_SQL = '''
+    SELECT user_id, CAST(substr(date, 1, 4) AS INTEGER) AS year,
+           CAST(substr(date, 6, 2) AS INTEGER) AS month,
+           IFNULL(category_id, 0) AS category_id, type, SUM(amount_cents) AS total_cents,
+           COUNT(*) AS count
+    FROM transaction_entries
+    GROUP BY user_id, year, month, category_id, type
+'''
+
+# Adds the rollups of archived entries (see archive.py) to the rollup rows
+_MERGE_ARCHIVED_SQL = '''INSERT INTO monthly_rollups (user_id, year, month, category_id, type, total_cents, count)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (user_id, year, month, category_id, type)
+                        DO UPDATE SET total_cents = total_cents + excluded.total_cents,
+                                      count = count + excluded.count'''
+
+# Function to create the rollup table and its triggers
+def create_rollup_schema(conn=None):
+    """
+    Creates the monthly_rollups table and its maintenance triggers.
+
+    If the table did not exist yet and the database already holds
+    transactions, the rollups are built from scratch.
+
+    Args:
+        conn (sqlite3.Connection, optional): Connection to use. Defaults to the pooled connection.
+
+    Returns:
+        bool: True if the rollups had to be built from existing transactions.
+    """
+    if conn is None:
+        conn = connection.get_connection()
+
+    existed = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'monthly_rollups'"
+    ).fetchone() is not None
+
+    conn.execute(ROLLUP_TABLE_SQL)
+    for sql in ROLLUP_TRIGGERS_SQL.values():
+        conn.execute(sql)
+
+    if not existed and conn.execute("SELECT 1 FROM transaction_entries LIMIT 1").fetchone():
+        rebuild_rollups(conn, commit=False)
+        return True
+    return False
+
+# Function to recompute every rollup row from the transaction entries
+def rebuild_rollups(conn=None, commit=True):
+    """
+    Discards the rollups and recomputes them from the transaction entries,
+    including those moved to archive files.
+
+    Args:
+        conn (sqlite3.Connection, optional): Connection to use. Defaults to the pooled connection.
+        commit (bool): Commit when done. Pass False to run inside a caller's transaction.
+
+    Returns:
+        int: The number of rollup rows written.
+    """
+    if conn is None:
+        conn = connection.get_connection()
+    try:
+        conn.execute("DELETE FROM monthly_rollups")
+        conn.execute(
+            "INSERT INTO monthly_rollups (user_id, year, month, category_id, type, total_cents, count) "
+            + _AGGREGATE_SQL
+        )
+        for row in archive.archived_rollups(conn):
+            conn.execute(_MERGE_ARCHIVED_SQL, row)
+        written = conn.execute("SELECT COUNT(*) FROM monthly_rollups").fetchone()[0]
+        if commit:
+            conn.commit()
+    except Exception:
+        if commit:
+            conn.rollback()
+        raise
+    return written
+
+# Function to compare the rollups against a fresh aggregation
+def verify_rollups(conn=None):
+    """
+    Recomputes the rollups in memory and reports every row that differs.
+
+    Args:
+        conn (sqlite3.Connection, optional): Connection to use. Defaults to the pooled connection.
+
+    Returns:
+        list: One dict per drifted key with "key", "expected" and "actual"
+        (total_cents, count) tuples; None marks a missing row. Empty if consistent.
+    """
+    if conn is None:
+        conn = connection.get_connection()
+
+    expected = {row[:5]: (row[5], row[6]) for row in conn.execute(_AGGREGATE_SQL)}
+    for row in archive.archived_rollups(conn):
+        total_cents, count = expected.get(row[:5], (0, 0))
+        expected[row[:5]] = (total_cents + row[5], count + row[6])
+    actual = {
+        row[:5]: (row[5], row[6])
+        for row in conn.execute(
+            "SELECT user_id, year, month, category_id, type, total_cents, count FROM monthly_rollups"
+        )
+    }
+
+    drift = []
+    for key in expected.keys() | actual.keys():
+        want = expected.get(key)
+        have = actual.get(key)
+        if want != have:
+            drift.append({"key": key, "expected": want, "actual": have})
+    return drift
+
+# Command line entry point: python -m <package>.rollups [verify|rebuild]
+def main(argv=None):
+    """
+    Verifies (default) or rebuilds the rollups and prints a summary.
+
+    Args:
+        argv (list, optional): Command line arguments without the program name.
+
+    Returns:
+        int: Process exit code, 1 if drift was found while verifying.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv else "verify"
+
+    if command == "rebuild":
+        written = rebuild_rollups()
+        print(f"Rebuilt {written} rollup rows.")
+        return 0
+    if command == "verify":
+        drift = verify_rollups()
+        for entry in drift:
+            print(f"Drift at {entry['key']}: expected {entry['expected']}, found {entry['actual']}")
+        print("Rollups are consistent." if not drift else f"{len(drift)} rollup rows drifted.")
+        return 1 if drift else 0
+
+    print(f"Unknown command {command!r}; use 'verify' or 'rebuild'.")
+    return 2
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,425 @@
+import sys
+import time
+
+from . import backup, changelog, connection, prefix_index, report_cache, rollups
+
+# Compact storage for transactions (schema version 2, see migrations.py).
+#
+# transaction_entries stores one row per transaction with
+#   type          INTEGER  0 = expense, 1 = income (SQLite stores 0 and 1 in
+#                          the record header alone, without payload bytes)
+#   category_id   INTEGER  key into the categories dictionary, NULL for none
+#   amount_cents  INTEGER  amount in minor units, so sums are exact
+# `transactions` is a view with the original columns (type and category as
+# text, amount as REAL) plus INSTEAD OF triggers, so ad-hoc SQL, exports and
+# change log replays written against the old table keep working. The
+# package's own hot paths read and write transaction_entries directly.
+
+TYPE_CODES = {'expense': 0, 'income': 1}
+TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+TYPE_EXPENSE = TYPE_CODES['expense']
+TYPE_INCOME = TYPE_CODES['income']
+
+DEFAULT_MIGRATION_BATCH_SIZE = 20000
+MEASURE_REPEATS = 3
+
+CATEGORIES_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS categories (
+                        id INTEGER PRIMARY KEY,
+                        name TEXT NOT NULL UNIQUE
+                    )'''
+
+ENTRIES_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS transaction_entries (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER NOT NULL,
+                        type INTEGER NOT NULL,       -- TYPE_CODES
+                        category_id INTEGER,         -- categories.id, NULL for none
+                        amount_cents INTEGER NOT NULL,
+                        date TEXT NOT NULL,          -- YYYY-MM-DD
+                        FOREIGN KEY (user_id) REFERENCES users(id),
+                        FOREIGN KEY (category_id) REFERENCES categories(id)
+                    )'''
+
+TRANSACTIONS_VIEW_SQL = '''CREATE VIEW IF NOT EXISTS transactions AS
+                    SELECT e.id AS id, e.user_id AS user_id,
+                           CASE e.type WHEN 1 THEN 'income' WHEN 0 THEN 'expense' END AS type,
+                           c.name AS category, e.amount_cents / 100.0 AS amount, e.date AS date
+                    FROM transaction_entries AS e
+                    LEFT JOIN categories AS c ON c.id = e.category_id'''
+
+# SQL expressions converting the legacy column values of NEW to the compact ones
+_TYPE_CODE_SQL = "CASE NEW.type WHEN 'income' THEN 1 WHEN 'expense' THEN 0 END"
+_CATEGORY_ID_SQL = "(SELECT id FROM categories WHERE name = NEW.category)"
+_AMOUNT_CENTS_SQL = "CAST(round(NEW.amount * 100) AS INTEGER)"
+_ADD_CATEGORY_SQL = ("INSERT OR IGNORE INTO categories (name) "
+                     "SELECT NULLIF(NEW.category, '') WHERE NULLIF(NEW.category, '') IS NOT NULL;")
+
+# Writes to the view are translated to the compact table. A conflict clause on
+# the outer statement (e.g. INSERT OR IGNORE during change log replay) also
+# applies to the statements inside these triggers.
+VIEW_TRIGGERS_SQL = {
+    "trg_transactions_view_insert": f'''CREATE TRIGGER IF NOT EXISTS trg_transactions_view_insert
+                        INSTEAD OF INSERT ON transactions
+                    BEGIN
+                        {_ADD_CATEGORY_SQL}
+                        INSERT INTO transaction_entries (id, user_id, type, category_id, amount_cents, date)
+                        VALUES (NEW.id, NEW.user_id, {_TYPE_CODE_SQL}, {_CATEGORY_ID_SQL},
+                                {_AMOUNT_CENTS_SQL}, NEW.date);
+                    END''',
+    "trg_transactions_view_update": f'''CREATE TRIGGER IF NOT EXISTS trg_transactions_view_update
+                        INSTEAD OF UPDATE ON transactions
+                    BEGIN
+                        {_ADD_CATEGORY_SQL}
+                        UPDATE transaction_entries
+                        SET user_id = NEW.user_id, type = {_TYPE_CODE_SQL},
+                            category_id = {_CATEGORY_ID_SQL},
+                            amount_cents = {_AMOUNT_CENTS_SQL}, date = NEW.date
+                        WHERE id = OLD.id;
+                    END''',
+    "trg_transactions_view_delete": '''CREATE TRIGGER IF NOT EXISTS trg_transactions_view_delete
+                        INSTEAD OF DELETE ON transactions
+                    BEGIN
+                        DELETE FROM transaction_entries WHERE id = OLD.id;
+                    END''',
+}
+
+# Temporary triggers mirroring writes on the legacy table into
+# transaction_entries while migrate_to_compact() copies it
+_SYNC_VALUES_SQL = f"NEW.id, NEW.user_id, {_TYPE_CODE_SQL}, {_CATEGORY_ID_SQL}, {_AMOUNT_CENTS_SQL}, NEW.date"
+MIGRATION_SYNC_TRIGGERS_SQL = {
+    "trg_migrate_transactions_insert": f'''CREATE TRIGGER IF NOT EXISTS trg_migrate_transactions_insert
+                        AFTER INSERT ON transactions
+                    BEGIN
+                        {_ADD_CATEGORY_SQL}
+                        INSERT OR REPLACE INTO transaction_entries
+                            (id, user_id, type, category_id, amount_cents, date)
+                        VALUES ({_SYNC_VALUES_SQL});
+                    END''',
+    "trg_migrate_transactions_update": f'''CREATE TRIGGER IF NOT EXISTS trg_migrate_transactions_update
+                        AFTER UPDATE ON transactions
+                    BEGIN
+                        {_ADD_CATEGORY_SQL}
+                        DELETE FROM transaction_entries WHERE id = OLD.id;
+                        INSERT OR REPLACE INTO transaction_entries
+                            (id, user_id, type, category_id, amount_cents, date)
+                        VALUES ({_SYNC_VALUES_SQL});
+                    END''',
+    "trg_migrate_transactions_delete": '''CREATE TRIGGER IF NOT EXISTS trg_migrate_transactions_delete
+                        AFTER DELETE ON transactions
+                    BEGIN
+                        DELETE FROM transaction_entries WHERE id = OLD.id;
+                    END''',
+}
+
+# Copies one id range of the legacy table; rows the sync triggers already
+# wrote are left alone
+_COPY_BATCH_SQL = '''
+    INSERT OR IGNORE INTO transaction_entries (id, user_id, type, category_id, amount_cents, date)
+    SELECT t.id, t.user_id, CASE t.type WHEN 'income' THEN 1 WHEN 'expense' THEN 0 END,
+           c.id, CAST(round(t.amount * 100) AS INTEGER), t.date
+    FROM transactions AS t
+    LEFT JOIN categories AS c ON c.name = NULLIF(t.category, '')
+    WHERE t.id > ? AND t.id <= ?
+'''
+_COPY_CATEGORIES_SQL = '''
+    INSERT OR IGNORE INTO categories (name)
+    SELECT DISTINCT NULLIF(category, '') FROM transactions
+    WHERE id > ? AND id <= ? AND NULLIF(category, '') IS NOT NULL
+'''
+
+# Queries timed by measure(): a full pass over the stored rows, and the
+# per-type, per-category aggregation that reports and rollups perform
+SCAN_SQL = {
+    "legacy": {
+        "full_scan": "SELECT COUNT(*), SUM(amount) FROM transactions NOT INDEXED",
+        "group_by": "SELECT type, category, SUM(amount) FROM transactions NOT INDEXED GROUP BY type, category",
+    },
+    "compact": {
+        "full_scan": "SELECT COUNT(*), SUM(amount_cents) FROM transaction_entries NOT INDEXED",
+        "group_by": ("SELECT type, category_id, SUM(amount_cents) FROM transaction_entries NOT INDEXED "
+                     "GROUP BY type, category_id"),
+    },
+}
+
+# Function to convert a transaction type name to its stored code
+def type_code(transaction_type):
+    """
+    Returns the stored code of a transaction type.
+
+    Args:
+        transaction_type (str): 'income' or 'expense'.
+
+    Returns:
+        int: The code from TYPE_CODES.
+
+    Raises:
+        ValueError: If the type is unknown.
+    """
+    try:
+        return TYPE_CODES[transaction_type]
+    except KeyError:
+        raise ValueError(f"invalid type: {transaction_type!r}")
+
+# Function to convert an amount to integer minor units
+def to_cents(amount):
+    """
+    Converts an amount to integer cents, rounding to the nearest cent.
+
+    Args:
+        amount (float or str): The amount.
+
+    Returns:
+        int: The amount in cents.
+    """
+    return int(round(float(amount) * 100))
+
+# Function to convert integer minor units back to an amount
+def from_cents(cents):
+    """
+    Converts integer cents to an amount.
+
+    Args:
+        cents (int): The amount in cents (None is treated as 0).
+
+    Returns:
+        float: The amount.
+    """
+    return (cents or 0) / 100.0
+
+# Function to check whether transactions are still stored in the old layout
+def is_legacy(conn=None):
+    """
+    Checks whether the database still has the original transactions table.
+
+    Args:
+        conn (sqlite3.Connection, optional): Connection to use. Defaults to the pooled connection.
+
+    Returns:
+        bool: True if `transactions` is a table rather than the compatibility view.
+    """
+    if conn is None:
+        conn = connection.get_connection()
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transactions'"
+    ).fetchone() is not None
+
+# Function to create the compact tables and the compatibility view
+def create_compact_schema(conn=None):
+    """
+    Creates the categories and transaction_entries tables, the transactions
+    view and its INSTEAD OF triggers.
+
+    Args:
+        conn (sqlite3.Connection, optional): Connection to use. Defaults to the pooled connection.
+    """
+    if conn is None:
+        conn = connection.get_connection()
+    conn.execute(CATEGORIES_TABLE_SQL)
+    conn.execute(ENTRIES_TABLE_SQL)
+    if not is_legacy(conn):
+        conn.execute(TRANSACTIONS_VIEW_SQL)
+        for sql in VIEW_TRIGGERS_SQL.values():
+            conn.execute(sql)
+
+# Function to time a query, keeping the best of a few runs
+def _time_query(conn, sql):
+    best = None
+    for _ in range(MEASURE_REPEATS):
+        started = time.perf_counter()
+        conn.execute(sql).fetchall()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+# Function to measure the storage size and scan speed of the transactions data
+def measure(conn=None):
+    """
+    Reports how much space the transactions data takes and how fast it can be scanned.
+
+    Args:
+        conn (sqlite3.Connection, optional): Connection to use. Defaults to the pooled connection.
+
+    Returns:
+        dict: "layout" ('legacy' or 'compact'), "rows", "database_bytes" (in-use
+        pages, excluding the freelist), "transactions_bytes" (table plus its
+        indexes), and per query in SCAN_SQL the best "seconds" and "rows_per_second".
+    """
+    if conn is None:
+        conn = connection.get_connection()
+    layout = "legacy" if is_legacy(conn) else "compact"
+    table = "transactions" if layout == "legacy" else "transaction_entries"
+
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    tables = [table] + ([] if layout == "legacy" else ["categories"])
+    placeholders = ", ".join("?" for _ in tables)
+    transactions_bytes = conn.execute(
+        "SELECT IFNULL(SUM(pgsize), 0) FROM dbstat WHERE name IN ("
+        f"SELECT name FROM sqlite_master WHERE tbl_name IN ({placeholders}))",
+        tables,
+    ).fetchone()[0]
+    rows = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    report = {
+        "layout": layout,
+        "rows": rows,
+        "database_bytes": (page_count - freelist) * page_size,
+        "transactions_bytes": transactions_bytes,
+    }
+    for name, sql in SCAN_SQL[layout].items():
+        seconds = _time_query(conn, sql)
+        report[name] = {"seconds": seconds, "rows_per_second": rows / seconds if seconds else 0.0}
+    return report
+
+# Function to copy the legacy table into transaction_entries in short batches
+def _copy_legacy_rows(conn, batch_size, pause, progress):
+    last_id = 0
+    max_id = conn.execute("SELECT IFNULL(MAX(id), 0) FROM transactions").fetchone()[0]
+    copied = 0
+    while last_id < max_id:
+        upper = last_id + batch_size
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(_COPY_CATEGORIES_SQL, (last_id, upper))
+            copied += conn.execute(_COPY_BATCH_SQL, (last_id, upper)).rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        last_id = upper
+        if progress is not None:
+            progress(min(last_id, max_id), max_id)
+        if pause:
+            time.sleep(pause)
+    return copied
+
+# Function to replace the legacy table by the compact schema in one transaction
+def _swap_in_compact_schema(conn):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        legacy_rows = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+        compact_rows = conn.execute("SELECT COUNT(*) FROM transaction_entries").fetchone()[0]
+        if legacy_rows != compact_rows:
+            raise RuntimeError(f"Migration copied {compact_rows} of {legacy_rows} transactions")
+
+        # Keep AUTOINCREMENT from reusing ids of deleted legacy rows
+        conn.execute(
+            "UPDATE sqlite_sequence SET seq = MAX(seq, IFNULL("
+            "(SELECT seq FROM sqlite_sequence WHERE name = 'transactions'), 0)) "
+            "WHERE name = 'transaction_entries'"
+        )
+        conn.execute(
+            "INSERT INTO sqlite_sequence (name, seq) "
+            "SELECT 'transaction_entries', seq FROM sqlite_sequence WHERE name = 'transactions' "
+            "AND NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'transaction_entries')"
+        )
+        # Dropping the table also drops its indexes and triggers, including
+        # the sync triggers and the old rollup and change log triggers
+        conn.execute("DROP TABLE transactions")
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = 'transactions'")
+        # The rollups are keyed by text in the old layout; rebuild them
+        conn.execute("DROP TABLE IF EXISTS monthly_rollups")
+
+        create_compact_schema(conn)
+        rollups.create_rollup_schema(conn)
+        changelog.create_changelog_schema(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return legacy_rows
+
+# Function to migrate a database from the legacy transactions table
+def migrate_to_compact(conn=None, batch_size=DEFAULT_MIGRATION_BATCH_SIZE, pause=0.0,
+                       progress=None, vacuum=False):
+    """
+    Migrates the transactions table to the compact schema while the database stays in use.
+
+    Rows are copied in short id-range transactions, so processes still running
+    the previous version keep reading and writing the legacy table meanwhile;
+    temporary triggers mirror their writes into the new table. The final swap
+    (drop the legacy table, create the view, rebuild the rollups) is one short
+    transaction. Empty categories ('') become NULL, as validate_transaction() does.
+
+    Args:
+        conn (sqlite3.Connection, optional): Connection to use. Defaults to the pooled connection.
+        batch_size (int): Number of ids copied per transaction.
+        pause (float): Seconds to sleep between batches to give other writers room.
+        progress (callable, optional): Called as progress(copied_up_to_id, max_id).
+        vacuum (bool): Run VACUUM afterwards to return the freed space to the
+            file system. VACUUM blocks other connections while it runs.
+
+    Returns:
+        dict: {"migrated": int, "before": measure(), "after": measure()}, or
+        {"migrated": 0} if the database already uses the compact schema.
+    """
+    if conn is None:
+        conn = connection.get_connection()
+    if not is_legacy(conn):
+        return {"migrated": 0}
+
+    conn.commit()
+    before = measure(conn)
+    conn.execute(CATEGORIES_TABLE_SQL)
+    conn.execute(ENTRIES_TABLE_SQL)
+    for sql in MIGRATION_SYNC_TRIGGERS_SQL.values():
+        conn.execute(sql)
+    conn.commit()
+
+    _copy_legacy_rows(conn, batch_size, pause, progress)
+    migrated = _swap_in_compact_schema(conn)
+    backup.ensure_indexes(conn)
+    conn.commit()
+    if vacuum:
+        conn.execute("VACUUM")
+
+    prefix_index.clear()
+    report_cache.clear()
+    return {"migrated": migrated, "before": before, "after": measure(conn)}
+
+# Function to print a measure() report
+def _print_measurement(title, report):
+    print(f"{title} ({report['layout']}, {report['rows']} rows):")
+    print(f"  database size:     {report['database_bytes'] / 1024:.0f} KiB")
+    print(f"  transactions data: {report['transactions_bytes'] / 1024:.0f} KiB")
+    for name in ("full_scan", "group_by"):
+        print(f"  {name}: {report[name]['seconds'] * 1000:.1f} ms "
+              f"({report[name]['rows_per_second']:,.0f} rows/s)")
+
+# Command line entry point: python -m <package>.schema [measure|migrate [--vacuum]]
+def main(argv=None):
+    """
+    Measures the transactions storage (default) or migrates it to the compact schema.
+
+    Args:
+        argv (list, optional): Command line arguments without the program name.
+
+    Returns:
+        int: Process exit code.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv else "measure"
+    # Measure the database as it is instead of migrating it on connect
+    connection.configure(migrate=False)
+
+    if command == "measure":
+        _print_measurement("Transactions storage", measure())
+        return 0
+    if command == "migrate":
+        result = migrate_to_compact(
+            progress=lambda done, total: print(f"Copied ids up to {done} of {total}"),
+            vacuum="--vacuum" in argv[1:],
+        )
+        if not result["migrated"] and "before" not in result:
+            print("The database already uses the compact schema.")
+            return 0
+        print(f"Migrated {result['migrated']} transactions.")
+        _print_measurement("Before", result["before"])
+        _print_measurement("After", result["after"])
+        return 0
+
+    print(f"Unknown command {command!r}; use 'measure' or 'migrate'.")
+    return 2
+
+if __name__ == "__main__":
+    raise SystemExit(main())
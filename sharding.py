@@ -0,0 +1,818 @@
+import functools
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from . import backup, connection
+
+# Optional sharded storage. Users are spread over several database files
+# (shards) so writes of different users do not queue for the same SQLite
+# write lock. Shard 0 is the configured database; it also holds the
+# directory: users, the shard list and the per-user placement overrides.
+# Every shard has the full schema, created by the migrations on first use.
+#
+# A user lives on shard jump_hash(user_id, active shard count) unless
+# user_shards says otherwise. Jump consistent hashing moves only the users
+# that have to move when shards are added or removed. The functions in
+# transactions, budget and reports are wrapped with by_user() /
+# by_transaction(), which run them against the right shard through
+# connection.use_database(). Without shards every call goes to the
+# configured database exactly as before.
+#
+# Transaction ids stay globally unique because each shard allocates them
+# from its own range (shard index << SHARD_ID_BITS), so update and delete by
+# id are routed without a lookup. Users that move get new transaction ids.
+#
+# reshard() moves users online, one user per short write transaction on the
+# source shard. A moved user's rows stay frozen on the source until purged:
+# a moved_users row makes the source reject further writes for that user, so
+# processes still routing with the old placement fail and retry on the new
+# shard, and readers routing with it see the same data. Routers reload the
+# placement at least every REFRESH_SECONDS.
+
+SHARD_ID_BITS = 48
+REFRESH_SECONDS = 1.0
+MAX_FANOUT_WORKERS = 8
+FANOUT_QUEUE_SIZE = 16
+MOVED_MESSAGE = "user moved to another shard"
+
+# The shard list and placement overrides (used in shard 0)
+SHARDS_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS shards (
+                        id INTEGER PRIMARY KEY,         -- 0 is the configured database
+                        path TEXT,                      -- NULL for shard 0; relative to shard 0's directory
+                        active INTEGER NOT NULL DEFAULT 1
+                    )'''
+USER_SHARDS_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS user_shards (
+                        user_id INTEGER PRIMARY KEY,
+                        shard INTEGER NOT NULL,
+                        version INTEGER NOT NULL        -- lets routers load only new overrides
+                    )'''
+USER_SHARDS_INDEX_SQL = "CREATE INDEX IF NOT EXISTS idx_user_shards_version ON user_shards (version)"
+
+# Users that moved away from a shard (used in every shard); their rows may
+# still be there until purge_moved_users() runs, but cannot be written or
+# deleted (purge_moved_users() lifts the guard inside its own transaction)
+MOVED_USERS_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS moved_users (
+                        user_id INTEGER PRIMARY KEY,
+                        shard INTEGER NOT NULL
+                    )'''
+# Filled in with NEW (INSERT, UPDATE) or OLD (DELETE)
+_REJECT_MOVED_SQL = f'''WHEN EXISTS (SELECT 1 FROM moved_users WHERE user_id = {{row}}.user_id)
+                    BEGIN
+                        SELECT RAISE(ABORT, '{MOVED_MESSAGE}');
+                    END'''
+MOVED_USER_TRIGGERS_SQL = {
+    f"trg_{table}_moved_{event.lower()}": f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_moved_{event.lower()}
+                        BEFORE {event} ON {table}
+                    {_REJECT_MOVED_SQL.format(row="OLD" if event == "DELETE" else "NEW")}'''
+    for table in ("transaction_entries", "budgets")
+    for event in ("INSERT", "UPDATE", "DELETE")
+}
+
+_USER_ROWS_SQL = '''
+    SELECT e.type, c.name, e.amount_cents, e.date
+    FROM transaction_entries AS e
+    LEFT JOIN categories AS c ON c.id = e.category_id
+    WHERE e.user_id = ?
+    ORDER BY e.id
+'''
+_INSERT_ENTRY_SQL = (
+    "INSERT INTO transaction_entries (user_id, type, category_id, amount_cents, date) "
+    "VALUES (?, ?, (SELECT id FROM categories WHERE name = ?), ?, ?)"
+)
+_SHARD_USERS_SQL = (
+    "SELECT user_id FROM transaction_entries UNION SELECT user_id FROM budgets "
+    "UNION SELECT user_id FROM recurring_rules"
+)
+_RULE_COLUMNS = "type, category, amount, frequency, interval, start_date, until, max_count, materialized, next_date"
+
+_state = {
+    "loaded_at": None,
+    "shards": (),           # (id, path, active) rows of the shards table
+    "active": 1,
+    "overrides": {},
+    "version": 0,
+    "pool": None,
+}
+_lock = threading.Lock()
+_local = threading.local()
+
+# Function to create the sharding tables and write guards (migration 3)
+def create_sharding_schema(conn=None):
+    """
+    Creates the shard directory tables, moved_users and its write guards.
+
+    Args:
+        conn (sqlite3.Connection, optional): Connection to use. Defaults to the pooled connection.
+    """
+    if conn is None:
+        conn = connection.get_connection()
+    conn.execute(SHARDS_TABLE_SQL)
+    conn.execute(USER_SHARDS_TABLE_SQL)
+    conn.execute(USER_SHARDS_INDEX_SQL)
+    conn.execute(MOVED_USERS_TABLE_SQL)
+    for sql in MOVED_USER_TRIGGERS_SQL.values():
+        conn.execute(sql)
+
+# Function to map a key to one of n buckets with jump consistent hashing
+def jump_hash(key, buckets):
+    """
+    Jump consistent hash (Lamping & Veach): going from n to n + 1 buckets
+    moves only 1/(n + 1) of the keys, all of them into the new bucket.
+
+    Args:
+        key (int): The key, e.g. a user ID.
+        buckets (int): Number of buckets (at least 1).
+
+    Returns:
+        int: A bucket index in range(buckets).
+    """
+    key &= 0xFFFFFFFFFFFFFFFF
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+# Function to get the connection to the directory (shard 0)
+def _directory():
+    return connection.get_connection(connection.get_db_path())
+
+# Function to reload the shard list and the placement overrides
+def _refresh(force=False):
+    now = time.monotonic()
+    if not force and _state["loaded_at"] is not None and now - _state["loaded_at"] < REFRESH_SECONDS:
+        return
+    with _lock:
+        conn = _directory()
+        overrides, version = _state["overrides"], _state["version"]
+        try:
+            shards = tuple(conn.execute("SELECT id, path, active FROM shards ORDER BY id"))
+            if shards != _state["shards"]:
+                # The shard list changed (e.g. a reshard finished): load everything again
+                overrides, version = {}, 0
+            rows = conn.execute(
+                "SELECT user_id, shard, version FROM user_shards WHERE version > ?", (version,)
+            ).fetchall()
+        except sqlite3.OperationalError:  # migrations turned off on an older database
+            shards, rows = (), []
+        if rows:
+            # Readers use the old mapping until the new one is complete
+            overrides = dict(overrides)
+            for user_id, shard, row_version in rows:
+                overrides[user_id] = shard
+                version = max(version, row_version)
+        # Stale overrides still point at the right shard under the new count,
+        # so the count is switched first
+        _state["shards"] = shards
+        _state["active"] = max(1, sum(1 for _, _, active in shards if active))
+        _state["overrides"] = overrides
+        _state["version"] = version
+        _state["loaded_at"] = now
+
+# Function to check whether users are spread over several shards
+def is_sharded():
+    """
+    Returns:
+        bool: True if more than one shard is active or users have been moved.
+    """
+    _refresh()
+    return _state["active"] > 1 or bool(_state["overrides"])
+
+# Function to resolve the file of a shard
+def shard_file(index):
+    """
+    Returns the database path of a shard.
+
+    Args:
+        index (int): The shard index.
+
+    Returns:
+        str: The path; shard 0 (and unknown shards) map to the configured database.
+    """
+    main = connection.get_db_path()
+    for shard_id, path, _ in _state["shards"]:
+        if shard_id == index and path:
+            return path if os.path.isabs(path) else os.path.join(os.path.dirname(main), path)
+    return main
+
+# Function to find the shard a user lives on
+def shard_of(user_id):
+    """
+    Returns the index of the shard holding a user's data.
+
+    Args:
+        user_id (int): The ID of the user.
+
+    Returns:
+        int: The shard index.
+    """
+    _refresh()
+    shard = _state["overrides"].get(user_id)
+    if shard is None:
+        shard = jump_hash(int(user_id), _state["active"])
+    return shard
+
+# Function to find the database of a user
+def shard_path(user_id):
+    """
+    Returns the database path for a user, or None when sharding is not in use.
+
+    Args:
+        user_id (int): The ID of the user.
+
+    Returns:
+        str: The path of the user's shard, or None.
+    """
+    if not is_sharded():
+        return None
+    return shard_file(shard_of(user_id))
+
+# Function to find the database of a transaction from its ID
+def transaction_shard_path(transaction_id):
+    """
+    Returns the database path holding a transaction, or None when sharding is not in use.
+
+    Args:
+        transaction_id (int): The ID of the transaction.
+
+    Returns:
+        str: The path of the shard that allocated the ID, or None.
+    """
+    if not is_sharded():
+        return None
+    return shard_file(int(transaction_id) >> SHARD_ID_BITS)
+
+# Function to run a routed call, retrying once if the user was just moved
+def _run_routed(path_for, key, func, args, kwargs):
+    path = path_for(key)
+    if path is None:
+        return func(*args, **kwargs)
+    try:
+        with connection.use_database(path):
+            return func(*args, **kwargs)
+    except sqlite3.IntegrityError as e:
+        # A group commit must be retried as a whole by its owner
+        if MOVED_MESSAGE not in str(e) or connection.in_group_commit():
+            raise
+        connection.get_connection(path).rollback()
+    _refresh(force=True)
+    with connection.use_database(path_for(key)):
+        return func(*args, **kwargs)
+
+# Decorator routing a function whose first argument is a user ID
+def by_user(func):
+    """
+    Runs the decorated function against the shard of its first argument (user_id).
+
+    Args:
+        func (callable): A function taking user_id as first argument.
+
+    Returns:
+        callable: The routed function.
+    """
+    @functools.wraps(func)
+    def wrapper(user_id, *args, **kwargs):
+        return _run_routed(shard_path, user_id, func, (user_id,) + args, kwargs)
+    wrapper.routed_by = "user"
+    return wrapper
+
+# Decorator routing a function whose first argument is a transaction ID
+def by_transaction(func):
+    """
+    Runs the decorated function against the shard that holds its first
+    argument (transaction_id).
+
+    Args:
+        func (callable): A function taking transaction_id as first argument.
+
+    Returns:
+        callable: The routed function.
+    """
+    @functools.wraps(func)
+    def wrapper(transaction_id, *args, **kwargs):
+        return _run_routed(transaction_shard_path, transaction_id, func, (transaction_id,) + args, kwargs)
+    wrapper.routed_by = "transaction"
+    return wrapper
+
+# Function to find the database a routed function call would use
+def call_path(func, args):
+    """
+    Returns the database a call of a by_user() / by_transaction() function goes to.
+
+    Args:
+        func (callable): The function.
+        args (tuple): Its positional arguments.
+
+    Returns:
+        str: The shard path, or None if unsharded or the function is not routed.
+    """
+    routed_by = getattr(func, "routed_by", None)
+    if routed_by == "user":
+        return shard_path(args[0])
+    if routed_by == "transaction":
+        return transaction_shard_path(args[0])
+    return None
+
+# Function to group items by the shard of their user
+def partition(items, user_of):
+    """
+    Groups items by the database of their user, keeping their order.
+
+    Args:
+        items (iterable): The items, e.g. transaction rows.
+        user_of (callable): Returns the user ID of an item.
+
+    Returns:
+        dict: Shard path (None when unsharded) -> list of items.
+    """
+    groups = {}
+    if not is_sharded():
+        groups[None] = list(items)
+        return groups
+    for item in items:
+        groups.setdefault(shard_path(user_of(item)), []).append(item)
+    return groups
+
+# Function to list the shards whose data is read by cross-shard operations
+def shard_indexes():
+    """
+    Returns:
+        list: Every shard index that may hold data, active or not, [0] when unsharded.
+    """
+    _refresh()
+    return [shard_id for shard_id, _, _ in _state["shards"]] or [0]
+
+# Function to get the thread pool used for fan-out
+def _pool():
+    with _lock:
+        if _state["pool"] is None:
+            _state["pool"] = ThreadPoolExecutor(max_workers=MAX_FANOUT_WORKERS, thread_name_prefix="shard")
+        return _state["pool"]
+
+# Function to run a function on one shard
+def _on_shard(index, func, args, kwargs):
+    _local.shard = index
+    try:
+        with connection.use_database(shard_file(index)):
+            return func(*args, **kwargs)
+    finally:
+        _local.shard = None
+
+# Function to get the shard a fan-out call is running on
+def current_shard():
+    """
+    Returns:
+        int: The shard index inside a fan_out() / fan_out_batches() call, else None.
+    """
+    return getattr(_local, "shard", None)
+
+# Function to run a function on every shard in parallel
+def fan_out(func, *args, **kwargs):
+    """
+    Runs func(*args, **kwargs) once per shard, in parallel worker threads.
+
+    Inside the call, get_connection() returns the connection to that shard
+    and current_shard() its index.
+    Rows of users that moved away from a shard but were not purged yet are
+    still there; filter them with owns().
+
+    Args:
+        func (callable): The function to run.
+
+    Returns:
+        list: (shard index, result) tuples in shard order.
+
+    Raises:
+        Exception: The first exception raised on any shard.
+    """
+    indexes = shard_indexes()
+    if len(indexes) == 1:
+        return [(indexes[0], _on_shard(indexes[0], func, args, kwargs))]
+    futures = [(index, _pool().submit(_on_shard, index, func, args, kwargs)) for index in indexes]
+    return [(index, future.result()) for index, future in futures]
+
+# Function to stream the batches of a generator function from every shard
+def fan_out_batches(func, *args, **kwargs):
+    """
+    Runs a generator function on every shard in parallel and yields its
+    batches as they arrive. At most FANOUT_QUEUE_SIZE batches are buffered.
+
+    Args:
+        func (callable): Generator function yielding batches (e.g. lists of rows).
+
+    Yields:
+        tuple: (shard index, batch). Batches of one shard keep their order.
+    """
+    indexes = shard_indexes()
+    results = queue.Queue(FANOUT_QUEUE_SIZE)
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        for batch in func(*args, **kwargs):
+            while not stop.is_set():
+                try:
+                    results.put((current_shard(), batch), timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if stop.is_set():
+                return
+
+    def run(index):
+        try:
+            _on_shard(index, produce, (), {})
+            results.put((index, done))
+        except BaseException as e:
+            results.put((index, e))
+
+    for index in indexes:
+        _pool().submit(run, index)
+    remaining = len(indexes)
+    try:
+        while remaining:
+            index, batch = results.get()
+            if batch is done:
+                remaining -= 1
+            elif isinstance(batch, BaseException):
+                raise batch
+            else:
+                yield index, batch
+    finally:
+        stop.set()
+
+# Function to check whether a row found on a shard belongs to it
+def owns(index, user_id):
+    """
+    Args:
+        index (int): A shard index.
+        user_id (int): The ID of the user.
+
+    Returns:
+        bool: True if the user currently lives on that shard.
+    """
+    return shard_of(user_id) == index
+
+# Function to create a shard file and reserve its transaction ID range
+def _prepare_shard(index, path):
+    conn = connection.get_connection(path)
+    create_sharding_schema(conn)
+    base = index << SHARD_ID_BITS
+    conn.execute(
+        "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'transaction_entries'", (base,)
+    )
+    conn.execute(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'transaction_entries', ? "
+        "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'transaction_entries')",
+        (base,),
+    )
+    conn.commit()
+
+# Function to record where a user lives now
+def _set_override(conn, user_id, shard):
+    conn.execute(
+        "INSERT INTO user_shards (user_id, shard, version) "
+        "VALUES (?, ?, (SELECT IFNULL(MAX(version), 0) + 1 FROM user_shards)) "
+        "ON CONFLICT (user_id) DO UPDATE SET shard = excluded.shard, version = excluded.version",
+        (user_id, shard),
+    )
+
+# Function to read a user's transactions from the archive files of a shard
+def _archived_user_rows(path, conn, user_id):
+    # Imported here: archive imports this module
+    from . import archive
+    with connection.use_database(path):
+        archived = archive.archived_connections(0, 9999, conn)
+    rows = []
+    for archive_conn in archived:
+        rows += archive_conn.execute(_USER_ROWS_SQL, (user_id,)).fetchall()
+    return rows
+
+# Function to move one user to another shard
+def move_user(user_id, target):
+    """
+    Copies a user's transactions, budgets and recurring rules to another shard
+    and points the router there.
+
+    The source shard is locked for writes while the user is copied, which
+    takes one short transaction. Afterwards the source rejects writes for the
+    user; its old rows are removed by purge_moved_users(). The copied
+    transactions get new IDs from the target's range. Transactions in the
+    source's archive files (see archive.py) are copied into the target's
+    database, like late entries for an archived year, so reports and
+    forecasts keep them; archive_years() moves them out again. The archive
+    files themselves are read-only and keep their copy, so rows the target
+    archived during an earlier stay of the user are not copied again.
+
+    Raises:
+        ValueError: If the target shard is unknown.
+        RuntimeError: If rows the target archived during an earlier stay were
+            deleted since; its archives would still count them.
+
+    Args:
+        user_id (int): The ID of the user.
+        target (int): Index of the destination shard (must exist in the shards table).
+
+    Returns:
+        dict: "from" and "to" shard indexes and the number of "transactions",
+        "budgets" and "rules" copied (0 if the user already lived on the target).
+    """
+    _refresh(force=True)
+    if target not in shard_indexes():
+        raise ValueError(f"Unknown shard {target}")
+    source = shard_of(user_id)
+    result = {"from": source, "to": target, "transactions": 0, "budgets": 0, "rules": 0}
+    if source == target:
+        return result
+
+    directory = _directory()
+    src = connection.get_connection(shard_file(source))
+    dst = connection.get_connection(shard_file(target))
+    # Rows archived during an earlier stay on the target are still counted there
+    left_behind = Counter(tuple(row) for row in _archived_user_rows(shard_file(target), dst, user_id))
+    src.execute("BEGIN IMMEDIATE")
+    try:
+        entries = []
+        for row in (_archived_user_rows(shard_file(source), src, user_id)
+                    + src.execute(_USER_ROWS_SQL, (user_id,)).fetchall()):
+            if left_behind[tuple(row)]:
+                left_behind[tuple(row)] -= 1
+            else:
+                entries.append(row)
+        if +left_behind:
+            raise RuntimeError(f"User {user_id} deleted transactions that are archived on shard {target}; "
+                               "move the user to another shard")
+        budgets = src.execute(
+            "SELECT category, amount, month, year FROM budgets WHERE user_id = ? ORDER BY id", (user_id,)
+        ).fetchall()
+        rules = src.execute(
+            f"SELECT {_RULE_COLUMNS} FROM recurring_rules WHERE user_id = ? ORDER BY id", (user_id,)
+        ).fetchall()
+
+        dst.execute("BEGIN IMMEDIATE")
+        try:
+            # Leftovers of an interrupted move, or frozen rows of an earlier stay
+            dst.execute("DELETE FROM moved_users WHERE user_id = ?", (user_id,))
+            dst.execute("DELETE FROM transaction_entries WHERE user_id = ?", (user_id,))
+            dst.execute("DELETE FROM budgets WHERE user_id = ?", (user_id,))
+            dst.execute("DELETE FROM recurring_rules WHERE user_id = ?", (user_id,))
+            # Forecasts are recomputed on the target by the next forecast.refresh_forecasts()
+            dst.execute("DELETE FROM forecasts WHERE user_id = ?", (user_id,))
+            dst.execute("DELETE FROM forecast_runs WHERE user_id = ?", (user_id,))
+            dst.executemany("INSERT OR IGNORE INTO categories (name) VALUES (?)",
+                            {(name,) for _, name, _, _ in entries if name})
+            dst.executemany(_INSERT_ENTRY_SQL, ((user_id,) + tuple(row) for row in entries))
+            dst.executemany("INSERT INTO budgets (user_id, category, amount, month, year) VALUES (?, ?, ?, ?, ?)",
+                            ((user_id,) + tuple(row) for row in budgets))
+            dst.executemany(f"INSERT INTO recurring_rules (user_id, {_RULE_COLUMNS}) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            ((user_id,) + tuple(row) for row in rules))
+            if directory is dst:
+                _set_override(dst, user_id, target)
+            dst.commit()
+        except Exception:
+            dst.rollback()
+            raise
+        if directory is not src and directory is not dst:
+            _set_override(directory, user_id, target)
+            directory.commit()
+
+        src.execute("INSERT OR REPLACE INTO moved_users (user_id, shard) VALUES (?, ?)", (user_id, target))
+        if directory is src:
+            _set_override(src, user_id, target)
+        src.commit()
+    except Exception:
+        src.rollback()
+        raise
+
+    _refresh(force=True)
+    result["transactions"] = len(entries)
+    result["budgets"] = len(budgets)
+    result["rules"] = len(rules)
+    return result
+
+# Function to delete the frozen rows of users that moved away from the current shard
+def _purge_current_shard(index):
+    conn = connection.get_connection()
+    purged = 0
+    for (user_id,) in conn.execute(_SHARD_USERS_SQL).fetchall():
+        shard = shard_of(user_id)
+        if shard == index:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # The delete guards only let the rows go while the user is not
+            # marked as moved; the mark is back before anyone else can write
+            conn.execute("DELETE FROM moved_users WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM transaction_entries WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM budgets WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM recurring_rules WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM forecasts WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM forecast_runs WHERE user_id = ?", (user_id,))
+            conn.execute("INSERT INTO moved_users (user_id, shard) VALUES (?, ?)", (user_id, shard))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        purged += 1
+    return purged
+
+# Function to delete the rows left behind by moved users
+def purge_moved_users():
+    """
+    Deletes, on every shard, the rows of users that live on another shard.
+
+    Run it once every process has picked up the new placement (reshard()
+    waits 2 * REFRESH_SECONDS before purging).
+
+    Returns:
+        dict: Shard index -> number of users purged there.
+    """
+    _refresh(force=True)
+    return dict(fan_out(lambda: _purge_current_shard(current_shard())))
+
+# Function to list users whose rows sit on a shard they do not live on
+def check_placement():
+    """
+    Finds rows stored outside their user's shard, e.g. not yet purged after a move.
+
+    Returns:
+        list: (shard index, user_id) tuples.
+    """
+    _refresh(force=True)
+
+    def misplaced():
+        index = current_shard()
+        users = connection.get_connection().execute(_SHARD_USERS_SQL).fetchall()
+        return [(index, user_id) for (user_id,) in users if shard_of(user_id) != index]
+
+    return [row for _, rows in fan_out(misplaced) for row in rows]
+
+# Function to build the default file name of a shard
+def default_shard_path(index):
+    """
+    Args:
+        index (int): The shard index (1 or more).
+
+    Returns:
+        str: '<database stem>_shard<index><ext>', next to the configured database.
+    """
+    stem, ext = os.path.splitext(os.path.basename(connection.get_db_path()))
+    return f"{stem}_shard{index}{ext or '.db'}"
+
+# Function to change the number of shards, moving users online
+def reshard(count, paths=None, pause=0.0, progress=None, purge=True):
+    """
+    Spreads the users over `count` shards; count=1 gathers them back in shard 0.
+
+    New shard files are created first, then every user whose shard changes is
+    moved with move_user(), then the new shard count is switched on. Users
+    registered meanwhile are moved as well. Other processes keep working
+    throughout; run one reshard at a time.
+
+    Args:
+        count (int): The new number of active shards.
+        paths (dict, optional): Shard index -> database path for new shards.
+            Defaults to default_shard_path().
+        pause (float): Seconds to sleep between users to give other writers room.
+        progress (callable, optional): Called as progress(users_checked, users_moved).
+        purge (bool): Wait for other processes to reload the placement and
+            then delete the rows left behind by moved users.
+
+    Returns:
+        dict: "shards" (the new count), "moved" users, "transactions" copied and
+        "purged" (shard index -> users purged).
+    """
+    if count < 1:
+        raise ValueError("count must be at least 1")
+    paths = paths or {}
+    directory = _directory()
+    create_sharding_schema(directory)
+    directory.execute("INSERT OR IGNORE INTO shards (id, path, active) VALUES (0, NULL, 1)")
+    for index in range(1, count):
+        directory.execute("INSERT OR IGNORE INTO shards (id, path, active) VALUES (?, ?, 0)",
+                          (index, paths.get(index, default_shard_path(index))))
+    directory.commit()
+    _refresh(force=True)
+    for index in range(1, count):
+        _prepare_shard(index, shard_file(index))
+
+    result = {"shards": count, "moved": 0, "transactions": 0, "purged": {}}
+    checked = 0
+    last_id = 0
+    while True:
+        users = [row[0] for row in directory.execute(
+            "SELECT id FROM users WHERE id > ? ORDER BY id", (last_id,))]
+        if not users:
+            # Switch over, unless a user registered since the last scan
+            directory.execute("BEGIN IMMEDIATE")
+            try:
+                if directory.execute("SELECT 1 FROM users WHERE id > ?", (last_id,)).fetchone():
+                    directory.rollback()
+                    continue
+                directory.execute("UPDATE shards SET active = (id < ?)", (count,))
+                directory.create_function("jump_hash", 2, jump_hash, deterministic=True)
+                directory.execute("DELETE FROM user_shards WHERE shard = jump_hash(user_id, ?)", (count,))
+                directory.commit()
+            except Exception:
+                directory.rollback()
+                raise
+            break
+        for user_id in users:
+            target = jump_hash(user_id, count)
+            if shard_of(user_id) != target:
+                moved = move_user(user_id, target)
+                result["moved"] += 1
+                result["transactions"] += moved["transactions"]
+                if pause:
+                    time.sleep(pause)
+            checked += 1
+            last_id = user_id
+            if progress is not None:
+                progress(checked, result["moved"])
+
+    _refresh(force=True)
+    if purge:
+        time.sleep(2 * REFRESH_SECONDS)
+        result["purged"] = purge_moved_users()
+    return result
+
+# Function to back up every shard in parallel
+def backup_shards(backup_dir='backups', **backup_options):
+    """
+    Backs up every shard with backup.backup_database(), in parallel.
+
+    Args:
+        backup_dir (str): Directory for the backup files.
+        **backup_options: Passed on to backup_database() (e.g. compression).
+
+    Returns:
+        dict: Shard index -> backup file path (None if that backup failed).
+    """
+    return dict(fan_out(lambda: backup.backup_database(backup_dir, db_name=shard_file(current_shard()),
+                                                       **backup_options)))
+
+# Function to print the shard layout
+def print_status():
+    """
+    Prints every shard with its path, whether it is active and its user count.
+    """
+    _refresh(force=True)
+
+    def count_users():
+        return connection.get_connection().execute(
+            "SELECT COUNT(DISTINCT user_id) FROM transaction_entries").fetchone()[0]
+
+    counts = dict(fan_out(count_users))
+    active = {shard_id: flag for shard_id, _, flag in _state["shards"]} or {0: 1}
+    for index in shard_indexes():
+        state = "active" if active.get(index) else "inactive"
+        print(f"Shard {index} ({state}): {shard_file(index)}, {counts[index]} users with transactions")
+    print(f"{len(_state['overrides'])} users placed by override.")
+
+# Command line entry point: python -m <package>.sharding status|reshard N|check|purge
+def main(argv=None):
+    """
+    Shows the shard layout (default), reshards, checks placement or purges moved users.
+
+    Args:
+        argv (list, optional): Command line arguments without the program name.
+
+    Returns:
+        int: Process exit code; 1 if check found misplaced rows.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv else "status"
+
+    if command == "status":
+        print_status()
+        return 0
+    if command == "reshard" and len(argv) == 2:
+        result = reshard(int(argv[1]), progress=lambda checked, moved: print(
+            f"Checked {checked} users, moved {moved}", end="\r"))
+        print(f"\nNow {result['shards']} shard(s); moved {result['moved']} users and "
+              f"{result['transactions']} transactions.")
+        return 0
+    if command == "check":
+        misplaced = check_placement()
+        for index, user_id in misplaced:
+            print(f"User {user_id} has rows on shard {index} but lives on shard {shard_of(user_id)}")
+        print("Placement is consistent." if not misplaced else f"{len(misplaced)} misplaced users.")
+        return 1 if misplaced else 0
+    if command == "purge":
+        for index, purged in purge_moved_users().items():
+            print(f"Shard {index}: purged {purged} users")
+        return 0
+
+    print(f"Unknown command {' '.join(argv)!r}; use 'status', 'reshard N', 'check' or 'purge'.")
+    return 2
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,229 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from . import budget, connection, reports, schema, sharding
+
+# Month-end statements for every user, computed on a pool of worker
+# processes. The users are split into chunks of consecutive IDs; each worker
+# keeps one read-only connection per database file and answers a chunk with
+# the same rollup queries the reports and budget modules use, without the
+# report cache or any printing. Completed chunks are appended to a JSONL file
+# and recorded in a checkpoint, so an interrupted run resumes where it stopped.
+DEFAULT_CHUNK_SIZE = 500
+
+USER_IDS_SQL = "SELECT id FROM users WHERE id <= ? ORDER BY id"
+
+# Connections of the current worker process, by database path
+_worker = {"connections": {}}
+
+# Function to set up a worker process
+def _init_worker(settings):
+    connection.configure(db_path=settings["db_path"], cache_size=settings["cache_size"],
+                         mmap_size=settings["mmap_size"])
+    _worker["connections"] = {}
+
+# Function to get the read-only connection of the current worker for a database
+def _worker_connection(db_path):
+    conn = _worker["connections"].get(db_path)
+    if conn is None:
+        conn = _worker["connections"][db_path] = connection.connect_read_only(db_path)
+    return conn
+
+# Function to compute the statement of one user
+def _statement(cursor, user_id, month, year):
+    cursor.execute(reports.MONTHLY_TOTALS_SQL, (user_id, year, month))
+    totals = dict(cursor.fetchall())
+    income_cents = totals.get(schema.TYPE_INCOME) or 0
+    expense_cents = totals.get(schema.TYPE_EXPENSE) or 0
+
+    cursor.execute(budget.EXCEEDED_BUDGETS_SQL, (user_id, year, month))
+    exceeded = [{
+        "category": category,
+        "budget_amount": budget_amount,
+        "total_spent": total_spent,
+        "over_budget": total_spent - budget_amount
+    } for category, budget_amount, total_spent in cursor.fetchall()]
+
+    return {
+        "user_id": user_id,
+        "month": month,
+        "year": year,
+        "total_income": schema.from_cents(income_cents),
+        "total_expenses": schema.from_cents(expense_cents),
+        "savings": schema.from_cents(income_cents - expense_cents),
+        "exceeded_budgets": exceeded
+    }
+
+# Function run by a worker process for one chunk of users
+def _process_chunk(index, parts, month, year):
+    results = []
+    for db_path, user_ids in parts:
+        cursor = _worker_connection(db_path).cursor()
+        try:
+            for user_id in user_ids:
+                results.append(_statement(cursor, user_id, month, year))
+        finally:
+            cursor.close()
+    return index, results
+
+# Function to split the users into chunks, each grouped by database file
+def _plan_chunks(user_ids, chunk_size):
+    chunks = []
+    for start in range(0, len(user_ids), chunk_size):
+        groups = sharding.partition(user_ids[start:start + chunk_size], lambda user_id: user_id)
+        chunks.append([(path or connection.get_db_path(), ids) for path, ids in groups.items()])
+    return chunks
+
+# Function to read a checkpoint file, if there is one for this run
+def _load_checkpoint(path, month, year, chunk_size):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    if (checkpoint.get("month"), checkpoint.get("year"), checkpoint.get("chunk_size")) != (month, year, chunk_size):
+        raise ValueError(f"Checkpoint {path} belongs to another run "
+                         f"({checkpoint.get('month')}/{checkpoint.get('year')}, "
+                         f"chunk size {checkpoint.get('chunk_size')})")
+    return checkpoint
+
+# Function to replace the checkpoint file atomically
+def _save_checkpoint(path, checkpoint):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+# Function to generate the month-end statements of all users in parallel
+def generate_statements(month, year, output=None, callback=None, workers=None,
+                        chunk_size=DEFAULT_CHUNK_SIZE, checkpoint=None, progress=None):
+    """
+    Computes the monthly statement of every user on a pool of worker processes.
+
+    Each statement is a dict with user_id, month, year, total_income,
+    total_expenses, savings and exceeded_budgets (the records returned by
+    budget.get_budget_exceedances()). Statements are delivered one chunk at
+    a time, in the order the chunks complete.
+
+    The run can be resumed: after each chunk, the checkpoint file records the
+    completed chunks and the size of the output file. Running again with the
+    same month, year, chunk size and checkpoint skips the completed chunks and
+    truncates whatever a crash left after the last checkpoint. The user list
+    is fixed when the run starts, so users registered later are not included.
+    The checkpoint is removed when the run completes.
+
+    Args:
+        month (int): The month (1-12).
+        year (int): The year (e.g., 2024).
+        output (str, optional): JSONL file the statements are written to.
+        callback (callable, optional): Called with each statement dict.
+        workers (int, optional): Number of worker processes. Defaults to the CPU count.
+        chunk_size (int): Number of users per chunk.
+        checkpoint (str, optional): Checkpoint file. Defaults to output + '.checkpoint'
+            when output is given; without either there is no checkpointing.
+        progress (callable, optional): Called as progress(done_chunks, total_chunks).
+
+    Returns:
+        dict: Counts of users, statements, exceeded budgets, chunks and
+        resumed (skipped) chunks, plus the elapsed seconds.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    month, year = int(month), int(year)
+    if checkpoint is None and output:
+        checkpoint = output + ".checkpoint"
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+
+    state = _load_checkpoint(checkpoint, month, year, chunk_size)
+    if state is None:
+        conn = connection.get_connection()
+        max_user_id = conn.execute("SELECT IFNULL(MAX(id), 0) FROM users").fetchone()[0]
+        state = {"month": month, "year": year, "chunk_size": chunk_size,
+                 "max_user_id": max_user_id, "done": [], "offset": 0}
+    user_ids = [row[0] for row in connection.get_connection().execute(USER_IDS_SQL, (state["max_user_id"],))]
+    chunks = _plan_chunks(user_ids, chunk_size)
+    done = set(state["done"])
+    result = {"users": len(user_ids), "statements": 0, "exceeded": 0,
+              "chunks": len(chunks), "resumed": len(done), "seconds": 0.0}
+
+    out = None
+    if output:
+        out = open(output, "r+b" if os.path.exists(output) else "wb")
+        # Drop any statements written after the last checkpoint
+        out.truncate(state["offset"])
+        out.seek(state["offset"])
+
+    settings = connection.configure()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(settings,)) as pool:
+            futures = [pool.submit(_process_chunk, index, parts, month, year)
+                       for index, parts in enumerate(chunks) if index not in done]
+            for future in as_completed(futures):
+                index, statements = future.result()
+                if out is not None:
+                    out.write("".join(json.dumps(statement) + "\n" for statement in statements).encode("utf-8"))
+                    out.flush()
+                    os.fsync(out.fileno())
+                    state["offset"] = out.tell()
+                if callback is not None:
+                    for statement in statements:
+                        callback(statement)
+                result["statements"] += len(statements)
+                result["exceeded"] += sum(len(statement["exceeded_budgets"]) for statement in statements)
+
+                done.add(index)
+                if checkpoint:
+                    state["done"] = sorted(done)
+                    _save_checkpoint(checkpoint, state)
+                if progress:
+                    progress(len(done), len(chunks))
+    finally:
+        if out is not None:
+            out.close()
+
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    result["seconds"] = time.perf_counter() - started
+    return result
+
+# Command line entry point: python -m <package>.statements MONTH YEAR --output FILE
+def main(argv=None):
+    """
+    Generates the month-end statements of all users into a JSONL file.
+
+    Args:
+        argv (list, optional): Command line arguments without the program name.
+
+    Returns:
+        int: Process exit code.
+    """
+    parser = argparse.ArgumentParser(description="Generate month-end statements for all users.")
+    parser.add_argument("month", type=int)
+    parser.add_argument("year", type=int)
+    parser.add_argument("--output", required=True, help="JSONL file for the statements")
+    parser.add_argument("--workers", type=int, help="Worker processes (defaults to the CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--checkpoint", help="Checkpoint file (defaults to OUTPUT.checkpoint)")
+    parser.add_argument("--db", help="Database file (defaults to the configured path)")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        connection.configure(db_path=args.db)
+    result = generate_statements(
+        args.month, args.year, output=args.output, workers=args.workers,
+        chunk_size=args.chunk_size, checkpoint=args.checkpoint,
+        progress=lambda done, total: print(f"Completed {done}/{total} chunks", end="\r", file=sys.stderr),
+    )
+    resumed = f", resumed after {result['resumed']} chunks" if result["resumed"] else ""
+    print(f"\nWrote {result['statements']} statements ({result['exceeded']} exceeded budgets) "
+          f"for {result['users']} users in {result['seconds']:.1f}s{resumed}.")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,31 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# The modules use relative imports, so the repository is imported as a package
+# named after its directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(ROOT))
+PACKAGE = os.path.basename(ROOT)
+
+
+# Function to import a module of the package under test
+def load(name):
+    return importlib.import_module(f"{PACKAGE}.{name}")
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Points the package at a fresh database in a temporary directory."""
+    connection = load("connection")
+    monkeypatch.chdir(tmp_path)
+    db_path = str(tmp_path / "finance.db")
+    previous = connection.configure()["db_path"]
+    connection.configure(db_path=db_path)
+    # The shard map is cached per process; load the new database's
+    load("sharding")._refresh(force=True)
+    yield db_path
+    connection.close_all_connections()
+    connection.configure(db_path=previous)
@@ -0,0 +1,32 @@
+import asyncio
+
+import pytest
+
+from conftest import load
+
+aio = load("aio")
+reports = load("reports")
+
+
+@pytest.fixture
+def writer(db):
+    aio.start()
+    yield
+    aio.shutdown()
+
+
+def test_concurrent_writes_commit_and_a_failing_one_is_isolated(writer):
+    async def run():
+        writes = [aio.add_transaction(1, "expense", "Food", amount, "2024-03-01") for amount in range(1, 51)]
+        writes.append(aio.add_transaction(1, "loan", "Food", 1000, "2024-03-01"))
+        results = await asyncio.gather(*writes, return_exceptions=True)
+        totals = await aio.calculate_totals(1, "2024-03-01", "2024-03-31")
+        return results, totals
+
+    before = aio.write_stats()
+    results, totals = asyncio.run(run())
+    assert isinstance(results[-1], ValueError)
+    assert len(set(results[:-1])) == 50
+    assert totals["total_expenses"] == sum(range(1, 51))
+    assert reports.get_monthly_report(1, 3, 2024)["total_expenses"] == sum(range(1, 51))
+    assert aio.write_stats()["writes"] - before["writes"] == 51
@@ -0,0 +1,49 @@
+import pytest
+
+from conftest import load
+
+alerts = load("alerts")
+budget = load("budget")
+connection = load("connection")
+transactions = load("transactions")
+
+
+@pytest.fixture
+def heard(db):
+    received = []
+    alerts.add_listener(received.append)
+    yield received
+    alerts.remove_listener(received.append)
+
+
+def test_an_alert_is_queued_when_a_write_crosses_the_budget(heard):
+    budget.set_monthly_budget(1, "Food", 50, 3, 2024)
+    first = transactions.add_transaction(1, "expense", "Food", 30, "2024-03-01")
+    assert alerts.get_alerts(1) == []
+
+    transactions.add_transaction(1, "expense", "Food", 30, "2024-03-02")
+    transactions.add_transaction(1, "expense", "Food", 10, "2024-03-03")
+    queued = alerts.get_alerts(1)
+    assert [(alert["category"], alert["total_spent"], alert["over_budget"]) for alert in queued] == [("Food", 60, 10)]
+    assert heard == queued
+
+    # Back under the budget, then over it again
+    transactions.update_transaction(first, amount=5)
+    transactions.add_transaction(1, "expense", "Food", 20, "2024-03-04")
+    assert [alert["total_spent"] for alert in alerts.get_alerts(1)] == [60, 65]
+
+    budget.set_monthly_budget(2, "Rent", 100, 3, 2024)
+    transactions.add_transaction(2, "expense", "Rent", 80, "2024-03-01")
+    budget.set_monthly_budget(2, "Rent", 70, 3, 2024)
+    assert [alert["budget_amount"] for alert in alerts.get_alerts(2)] == [70]
+    assert alerts.delete_alerts(queued[0]["id"]) == 1
+
+
+def test_a_rolled_back_write_raises_no_alert(heard):
+    budget.set_monthly_budget(1, "Food", 50, 3, 2024)
+    with pytest.raises(RuntimeError):
+        with connection.group_commit():
+            transactions.add_transaction(1, "expense", "Food", 80, "2024-03-01")
+            raise RuntimeError("abort")
+    assert alerts.get_alerts(1) == []
+    assert heard == []
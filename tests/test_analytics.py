@@ -0,0 +1,65 @@
+import pytest
+
+from conftest import load
+
+pytest.importorskip("numpy")
+
+analytics = load("analytics")
+archive = load("archive")
+connection = load("connection")
+sharding = load("sharding")
+transactions = load("transactions")
+
+
+def test_ledger_reads_the_users_shard_and_archived_years(db):
+    conn = connection.get_connection()
+    conn.executemany("INSERT INTO users (id, username, password) VALUES (?, ?, 'x')",
+                     [(user_id, f"user{user_id}") for user_id in range(1, 9)])
+    conn.commit()
+    user_id = next(u for u in range(1, 9) if sharding.jump_hash(u, 2) == 1)
+    transactions.add_transaction(user_id, "expense", "Food", 10, "2020-03-01")
+    transactions.add_transaction(user_id, "income", "Salary", 100, "2024-03-01")
+    sharding.reshard(2, purge=False)
+    sharding.purge_moved_users()
+    archive.archive_years(2022)
+    try:
+        ledger = analytics.load_ledger(user_id)
+        totals = analytics.window_totals(ledger, [("2020-01-01", "2020-12-31"), ("2024-01-01", "2024-12-31")])
+        assert list(totals["total_expenses"]) == [10, 0]
+        assert list(totals["total_income"]) == [0, 100]
+
+        transactions.add_transaction(user_id, "expense", "Food", 5, "2024-04-01")
+        assert analytics.refresh_ledger(ledger) == 1
+        assert analytics.window_totals(ledger, [("2024-01-01", "2024-12-31")])["total_expenses"][0] == 5
+    finally:
+        sharding.reshard(1, purge=False)
+
+
+def test_refresh_reloads_after_edits_deletes_and_moves(db):
+    conn = connection.get_connection()
+    conn.executemany("INSERT INTO users (id, username, password) VALUES (?, ?, 'x')",
+                     [(user_id, f"user{user_id}") for user_id in range(1, 9)])
+    conn.commit()
+    user_id = next(u for u in range(1, 9) if sharding.jump_hash(u, 2) == 1)
+    first = transactions.add_transaction(user_id, "expense", "Food", 10, "2024-03-01")
+    second = transactions.add_transaction(user_id, "expense", "Food", 20, "2024-03-02")
+    ledger = analytics.load_ledger(user_id)
+    year = [("2024-01-01", "2024-12-31")]
+
+    transactions.update_transaction(first, amount=15)
+    assert analytics.refresh_ledger(ledger) == 2
+    assert analytics.window_totals(ledger, year)["total_expenses"][0] == 35
+
+    transactions.delete_transaction(second)
+    analytics.refresh_ledger(ledger)
+    assert analytics.window_totals(ledger, year)["total_expenses"][0] == 15
+
+    # The moved rows get IDs from the new shard's range, below last_id or not
+    sharding.reshard(2, purge=True)
+    try:
+        transactions.add_transaction(user_id, "expense", "Food", 5, "2024-04-01")
+        analytics.refresh_ledger(ledger)
+        assert analytics.window_totals(ledger, year)["total_expenses"][0] == 20
+        assert analytics.refresh_ledger(ledger) == 0
+    finally:
+        sharding.reshard(1, purge=False)
@@ -0,0 +1,61 @@
+import os
+
+from conftest import load
+
+archive = load("archive")
+backup = load("backup")
+reports = load("reports")
+transactions = load("transactions")
+
+
+# Function to get a user's 2020 expenses from the raw entries and archives
+def _expenses_2020(user_id):
+    return reports.get_totals(user_id, "2020-01-01", "2020-12-31")["total_expenses"]
+
+
+def test_restoring_a_snapshot_from_before_a_re_archive_keeps_the_year(db, tmp_path):
+    transactions.add_transaction(1, "expense", "Food", 10, "2020-03-01")
+    transactions.add_transaction(1, "expense", "Rent", 20, "2023-03-01")
+    assert archive.archive_years(2021)["moved"] == 1
+    snapshot = backup.backup_database(str(tmp_path / "backups"), db)
+    first_file = archive.list_archives()[0]["file"]
+
+    # A late entry for the archived year, archived again into version 2
+    transactions.add_transaction(1, "expense", "Food", 5, "2020-06-01")
+    archive.archive_years(2021)
+    assert archive.list_archives()[0]["version"] == 2
+    assert _expenses_2020(1) == 15
+    assert archive.superseded_archives() == [first_file]
+    assert os.path.exists(os.path.join(os.path.dirname(db), first_file))
+
+    assert backup.restore_database(snapshot, db)
+    archive.close_archives()
+    assert archive.list_archives()[0]["file"] == first_file
+    assert _expenses_2020(1) == 10
+    assert reports.get_totals(1, "2023-01-01", "2023-12-31")["total_expenses"] == 20
+
+
+def test_archiving_after_restoring_an_older_snapshot_keeps_later_versions(db, tmp_path):
+    backups = str(tmp_path / "backups")
+    transactions.add_transaction(1, "expense", "Food", 10, "2020-03-01")
+    archive.archive_years(2021)
+    older = backup.backup_database(backups, db)
+
+    transactions.add_transaction(1, "expense", "Food", 5, "2020-06-01")
+    archive.archive_years(2021)
+    newer = backup.backup_database(backups, db)
+    second_file = archive.list_archives()[0]["file"]
+
+    # Back to version 1, then archive a different late entry
+    assert backup.restore_database(older, db)
+    archive.close_archives()
+    transactions.add_transaction(1, "expense", "Food", 7, "2020-09-01")
+    archive.archive_years(2021)
+    assert archive.list_archives()[0]["version"] == 3
+    assert _expenses_2020(1) == 17
+
+    # The snapshot that uses version 2 still restores intact
+    assert backup.restore_database(newer, db)
+    archive.close_archives()
+    assert archive.list_archives()[0]["file"] == second_file
+    assert _expenses_2020(1) == 15
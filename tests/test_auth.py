@@ -0,0 +1,83 @@
+import asyncio
+import hashlib
+import sqlite3
+
+import pytest
+
+from conftest import load
+
+aio = load("aio")
+auth = load("finance_app.auth")
+connection = load("connection")
+
+
+@pytest.fixture(autouse=True)
+def cheap_kdf():
+    """Keeps the KDF fast; the hash format and rehashing work the same."""
+    previous = auth.configure()
+    auth.configure(algorithm="pbkdf2_sha256", pbkdf2_iterations=1000)
+    yield
+    auth.configure(algorithm=previous["algorithm"], pbkdf2_iterations=previous["pbkdf2_iterations"])
+    auth.clear_sessions()
+
+
+# Function to add a user whose password is stored the pre-KDF way
+def _add_legacy_user(username, password):
+    conn = connection.get_connection()
+    conn.execute("INSERT INTO users (username, password) VALUES (?, ?)",
+                 (username, hashlib.sha256(password.encode()).hexdigest()))
+    conn.commit()
+
+
+# Function to read a user's stored hash through a separate connection
+def _committed_hash(db_path, username):
+    with sqlite3.connect(db_path) as other:
+        row = other.execute("SELECT password FROM users WHERE username = ?", (username,)).fetchone()
+    return row[0] if row else None
+
+
+def test_rehash_inside_savepoint_keeps_the_savepoint(db):
+    _add_legacy_user("alice", "secret")
+    conn = connection.get_connection()
+    with connection.savepoint(conn, "outer"):
+        user_id = auth.authenticate("alice", "secret")
+        conn.execute("INSERT INTO categories (name) VALUES ('Outer')")
+    assert user_id is not None
+    assert _committed_hash(db, "alice").startswith("pbkdf2_sha256$")
+    assert not auth.needs_rehash(_committed_hash(db, "alice"))
+
+
+def test_rehash_rolls_back_with_the_enclosing_savepoint(db):
+    _add_legacy_user("alice", "secret")
+    conn = connection.get_connection()
+    with pytest.raises(RuntimeError):
+        with connection.savepoint(conn, "outer"):
+            assert auth.authenticate("alice", "secret") is not None
+            raise RuntimeError("undo")
+    assert auth.needs_rehash(_committed_hash(db, "alice"))
+
+
+def test_duplicate_register_inside_group_commit_only_undoes_itself(db):
+    with connection.group_commit():
+        assert auth.register_user("a", "pw")
+        assert not auth.register_user("a", "other")
+        assert auth.register_user("b", "pw")
+        # Nothing is committed before the group ends
+        assert _committed_hash(db, "a") is None
+    assert _committed_hash(db, "a") is not None
+    assert _committed_hash(db, "b") is not None
+    assert auth.authenticate("a", "pw") is not None
+
+
+def test_async_login_rehashes_on_the_writer_thread(db):
+    _add_legacy_user("alice", "secret")
+
+    async def login():
+        return await aio.create_session("alice", "secret")
+
+    try:
+        token = asyncio.run(login())
+    finally:
+        aio.shutdown()
+    assert auth.get_session(token) is not None
+    assert not auth.needs_rehash(_committed_hash(db, "alice"))
@@ -0,0 +1,31 @@
+import gzip
+
+from conftest import load
+
+backup = load("backup")
+reports = load("reports")
+transactions = load("transactions")
+
+
+def test_compressed_hot_backup_restores_the_copied_state(db, tmp_path):
+    transactions.add_transaction(1, "expense", "Food", 10, "2024-03-01")
+    steps = []
+    backup_file = backup.backup_database(str(tmp_path / "backups"), db, pages=1, sleep=0,
+                                         progress=lambda *args: steps.append(args), compression="gzip")
+    assert backup_file.endswith(".db.gz")
+    assert len(steps) > 1
+    transactions.add_transaction(1, "expense", "Food", 20, "2024-03-02")
+
+    assert backup.restore_database(backup_file, db)
+    assert reports.get_monthly_report(1, 3, 2024)["total_expenses"] == 10
+
+
+def test_a_corrupt_backup_leaves_the_database_alone(db, tmp_path):
+    transactions.add_transaction(1, "expense", "Food", 10, "2024-03-01")
+    backup_file = tmp_path / "broken.db.gz"
+    with gzip.open(backup_file, "wb") as f:
+        f.write(b"not a database" * 100)
+
+    assert not backup.restore_database(str(backup_file), db)
+    assert reports.get_monthly_report(1, 3, 2024)["total_expenses"] == 10
+    assert [path.name for path in tmp_path.iterdir() if path.name.startswith(".restore-")] == []
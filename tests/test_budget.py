@@ -0,0 +1,19 @@
+from conftest import load
+
+budget = load("budget")
+transactions = load("transactions")
+
+
+def test_exceedances_for_one_user_and_all_users(db):
+    for user_id, spent in ((1, 60), (2, 40), (3, 90)):
+        budget.set_monthly_budget(user_id, "Food", 50, 3, 2024)
+        transactions.add_transaction(user_id, "expense", "Food", spent, "2024-03-10")
+    budget.set_monthly_budget(1, "Rent", 500, 3, 2024)
+    transactions.add_transaction(1, "expense", "Rent", 700, "2024-04-01")
+    transactions.add_transaction(1, "income", "Food", 100, "2024-03-11")
+
+    assert [row["category"] for row in budget.get_budget_exceedances(1, 3, 2024)] == ["Food"]
+    assert budget.get_budget_exceedances(2, 3, 2024) == []
+    rows = list(budget.check_all_budget_exceedances(3, 2024, batch_size=1))
+    assert [(row["user_id"], row["over_budget"]) for row in rows] == [(1, 10), (3, 40)]
+    assert budget.get_budget_status(1, "Rent", 3, 2024)["remaining"] == 500
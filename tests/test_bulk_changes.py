@@ -0,0 +1,54 @@
+import pytest
+
+from conftest import load
+
+alerts = load("alerts")
+connection = load("connection")
+reports = load("reports")
+rollups = load("rollups")
+transactions = load("transactions")
+
+
+# Function to add four March expenses for user 1 and one for user 2
+def _seed():
+    ids = [transactions.add_transaction(1, "expense", category, 10, f"2024-03-{day:02d}")
+           for day, category in ((1, "Food"), (2, "Food"), (3, "Rent"), (20, "Food"))]
+    transactions.add_transaction(2, "expense", "Food", 10, "2024-03-01")
+    return ids
+
+
+def test_dry_runs_count_without_changing_anything(db):
+    _seed()
+    assert transactions.update_transactions({"amount": 1}, category="Food", dry_run=True) == 4
+    assert transactions.delete_transactions(user_id=1, end_date="2024-03-02", dry_run=True) == 2
+    assert reports.get_monthly_report(1, 3, 2024)["total_expenses"] == 40
+
+
+def test_bulk_changes_apply_to_the_filtered_rows(db):
+    ids = _seed()
+    assert transactions.update_transactions({"category": "Groceries", "amount": 2.5}, user_id=1,
+                                            category="Food", end_date="2024-03-10") == 2
+    assert transactions.delete_transactions(ids=[ids[2], ids[3]]) == 2
+    assert reports.get_monthly_report(1, 3, 2024)["total_expenses"] == 5
+    assert reports.get_monthly_report(2, 3, 2024)["total_expenses"] == 10
+    assert rollups.verify_rollups() == []
+    with pytest.raises(ValueError, match="filter"):
+        transactions.delete_transactions()
+
+
+def test_a_failed_bulk_update_only_undoes_itself(db, monkeypatch):
+    _seed()
+
+    def fail(cursor, since, user_id=None):
+        raise RuntimeError("failed after the UPDATE ran")
+
+    with connection.group_commit():
+        transactions.add_transaction(1, "income", "Salary", 100, "2024-03-05")
+        monkeypatch.setattr(alerts, "collect", fail)
+        with pytest.raises(RuntimeError):
+            transactions.update_transactions({"amount": 99}, user_id=1)
+        monkeypatch.undo()
+
+    report = reports.get_monthly_report(1, 3, 2024)
+    assert (report["total_income"], report["total_expenses"]) == (100, 40)
+    assert rollups.verify_rollups() == []
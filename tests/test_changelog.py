@@ -0,0 +1,58 @@
+import sqlite3
+import time
+
+from conftest import load
+
+alerts = load("alerts")
+budget = load("budget")
+changelog = load("changelog")
+connection = load("connection")
+reports = load("reports")
+rollups = load("rollups")
+transactions = load("transactions")
+
+
+# Function to read the database clock in the change log format
+def _now():
+    return connection.get_connection().execute("SELECT strftime('%Y-%m-%d %H:%M:%f', 'now')").fetchone()[0]
+
+
+def test_snapshot_position_includes_writes_committed_during_the_copy(db, tmp_path):
+    backup_dir = str(tmp_path / "backups")
+    transactions.add_transaction(1, "expense", "Food", 10, "2024-03-01")
+    written = []
+
+    def write_once(status, remaining, total):
+        if not written:
+            written.append(transactions.add_transaction(1, "expense", "Food", 20, "2024-03-02"))
+
+    snapshot = changelog.take_snapshot(backup_dir, db, pages=1, sleep=0, progress=write_once)
+    with sqlite3.connect(snapshot) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM transaction_entries").fetchone()[0] == 2
+        in_snapshot = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()[0]
+    assert changelog.read_manifest(backup_dir)[-1]["seq"] == in_snapshot
+
+    # The write made during the copy reaches the deltas for older snapshots
+    changelog.backup_changes(backup_dir, db)
+    deltas = [e for e in changelog.read_manifest(backup_dir) if e["kind"] == "delta"]
+    assert deltas[-1]["to_seq"] == in_snapshot
+
+
+def test_point_in_time_restore_replays_up_to_the_target_without_new_alerts(db, tmp_path):
+    backup_dir = str(tmp_path / "backups")
+    transactions.add_transaction(1, "expense", "Food", 10, "2024-03-01")
+    budget.set_monthly_budget(1, "Food", 15, 3, 2024)
+    changelog.take_snapshot(backup_dir, db)
+
+    transactions.add_transaction(1, "expense", "Food", 20, "2024-03-02")
+    assert len(alerts.get_alerts(1)) == 1
+    time.sleep(0.01)
+    target = _now()
+    time.sleep(0.01)
+    transactions.add_transaction(1, "expense", "Food", 40, "2024-03-03")
+    changelog.backup_changes(backup_dir, db)
+
+    assert changelog.restore_to_point_in_time(target, backup_dir, db)
+    assert reports.get_monthly_report(1, 3, 2024)["total_expenses"] == 30
+    assert rollups.verify_rollups() == []
+    assert alerts.get_alerts(1) == []
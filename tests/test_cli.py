@@ -0,0 +1,75 @@
+import io
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+from conftest import load
+
+cli = load("cli")
+connection = load("connection")
+
+
+# Function to start the daemon in a thread and wait for its socket
+def _start_daemon(socket_path):
+    stop = threading.Event()
+    thread = threading.Thread(target=cli.serve, args=(socket_path, stop), daemon=True)
+    thread.start()
+    for _ in range(200):
+        if os.path.exists(socket_path):
+            break
+        threading.Event().wait(0.01)
+    return stop, thread
+
+
+def test_daemon_closes_each_clients_connection(db, tmp_path):
+    socket_path = str(tmp_path / "finance.sock")
+    stdout = sys.stdout
+    stop, thread = _start_daemon(socket_path)
+    try:
+        open_before = connection.pool_stats()["open"]
+        for i in range(20):
+            responses = [json.loads(r) for r in cli.send(socket_path, [f"add 1 expense Food {i + 1}"])]
+            assert responses[0]["ok"], responses
+        # The client thread closes its connection after the client has gone
+        for _ in range(200):
+            if connection.pool_stats()["open"] <= open_before:
+                break
+            threading.Event().wait(0.01)
+        assert connection.pool_stats()["open"] <= open_before
+    finally:
+        stop.set()
+        thread.join(5)
+    assert not thread.is_alive()
+    assert not os.path.exists(socket_path)
+    # The host's stdout is given back
+    assert sys.stdout is stdout
+
+
+def test_group_batch_failures_only_undo_their_own_command(db):
+    auth = load("finance_app.auth")
+    previous = auth.configure()
+    auth.configure(algorithm="pbkdf2_sha256", pbkdf2_iterations=1000)
+    lines = [
+        "register a pw",
+        "add 1 expense Food 10",
+        "register a other",
+        "add 1 bogus Food 5",
+        "register b pw",
+        "add 1 income Salary 100",
+    ]
+    out = io.StringIO()
+    try:
+        failures = cli.run_batch(lines, out, group=True)
+    finally:
+        auth.configure(algorithm=previous["algorithm"], pbkdf2_iterations=previous["pbkdf2_iterations"])
+    responses = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [r["ok"] for r in responses] == [True, True, False, False, True, True]
+    assert failures == 2
+
+    with sqlite3.connect(db) as other:
+        users = [row[0] for row in other.execute("SELECT username FROM users ORDER BY username")]
+        count = other.execute("SELECT COUNT(*) FROM transaction_entries").fetchone()[0]
+    assert users == ["a", "b"]
+    assert count == 2
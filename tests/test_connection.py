@@ -0,0 +1,36 @@
+import sqlite3
+import threading
+
+import pytest
+
+from conftest import load
+
+connection = load("connection")
+
+
+# Function to run a function in a new thread and return its result
+def _in_thread(function):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(function()))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def test_each_thread_reuses_one_tuned_connection(db):
+    conn = connection.get_connection()
+    assert connection.get_connection() is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+    assert _in_thread(connection.get_connection) is not conn
+
+
+def test_close_all_connections_closes_other_threads_connections(db):
+    other = _in_thread(connection.get_connection)
+    conn = connection.get_connection()
+    connection.close_all_connections()
+    for closed in (conn, other):
+        with pytest.raises(sqlite3.ProgrammingError):
+            closed.execute("SELECT 1")
+    assert connection.get_connection() is not conn
+    assert connection.pool_stats()["open"] == 1
@@ -0,0 +1,45 @@
+import pytest
+
+from conftest import load
+
+auth = load("finance_app.auth")
+benchmark = load("benchmark")
+connection = load("connection")
+datagen = load("datagen")
+rollups = load("rollups")
+
+
+@pytest.fixture(autouse=True)
+def cheap_kdf():
+    previous = auth.configure()
+    auth.configure(algorithm="pbkdf2_sha256", pbkdf2_iterations=1000)
+    yield
+    auth.configure(algorithm=previous["algorithm"], pbkdf2_iterations=previous["pbkdf2_iterations"])
+
+
+# Function to generate a data set into its own file and read it back
+def _generate(path, chunk_size):
+    with connection.use_database(path):
+        counts = datagen.generate_dataset(5, 40, seed=7, chunk_size=chunk_size)
+        assert rollups.verify_rollups() == []
+        conn = connection.get_connection()
+        rows = conn.execute("SELECT user_id, type, category_id, amount_cents, date FROM transaction_entries "
+                            "ORDER BY id").fetchall()
+        budgets = conn.execute("SELECT user_id, category, amount, month, year FROM budgets ORDER BY id").fetchall()
+    return counts, rows, budgets
+
+
+def test_the_same_seed_gives_the_same_data_for_any_chunk_size(db, tmp_path):
+    counts, rows, budgets = _generate(str(tmp_path / "a.db"), chunk_size=40)
+    assert (counts["users"], counts["transactions"]) == (5, 200)
+    assert len(rows) == 200 and budgets
+    assert _generate(str(tmp_path / "b.db"), chunk_size=1000)[1:] == (rows, budgets)
+
+
+def test_benchmark_run_reports_every_requested_case(db, tmp_path):
+    result = benchmark.run_benchmarks("10k", iterations=3, cases=["add_transaction", "calculate_totals"],
+                                      workdir=str(tmp_path))
+    assert result["rows"] == 10000
+    for case in ("add_transaction", "calculate_totals"):
+        assert result["cases"][case]["iterations"] == 3
+        assert result["cases"][case]["p50"] > 0
@@ -0,0 +1,40 @@
+import csv
+import json
+
+from conftest import load
+
+connection = load("connection")
+export = load("export")
+transactions = load("transactions")
+
+
+def test_paging_walks_every_filtered_row_once(db):
+    for day in range(1, 8):
+        transactions.add_transaction(1, "expense", "Food" if day % 2 else "Rent", day, f"2024-03-{day:02d}")
+    transactions.add_transaction(2, "expense", "Food", 1, "2024-03-01")
+
+    seen, after_id = [], 0
+    while after_id is not None:
+        page = export.list_rows("transactions", after_id=after_id, limit=2, user_id=1, category="Food")
+        seen += [row["amount"] for row in page["rows"]]
+        after_id = page["next_after_id"]
+    assert seen == [1, 3, 5, 7]
+    assert [row[4] for row in export.iter_rows("transactions", user_id=1, start_date="2024-03-06",
+                                               batch_size=1)] == [6, 7]
+
+
+def test_exports_stream_rows_without_password_hashes(db, tmp_path):
+    conn = connection.get_connection()
+    conn.execute("INSERT INTO users (username, password) VALUES ('alice', 'secret-hash')")
+    conn.commit()
+    transactions.add_transaction(1, "income", "Salary", 100, "2024-03-01")
+    transactions.add_transaction(1, "expense", "Food", 12.5, "2024-03-02")
+
+    assert export.export_table("users", str(tmp_path / "users.csv")) == 1
+    with open(tmp_path / "users.csv", newline="") as f:
+        assert list(csv.reader(f)) == [["id", "username"], ["1", "alice"]]
+    assert export.export_table("transactions", str(tmp_path / "rows.jsonl"), fmt="jsonl", batch_size=1) == 2
+    with open(tmp_path / "rows.jsonl") as f:
+        rows = [json.loads(line) for line in f]
+    assert [(row["type"], row["category"], row["amount"]) for row in rows] == [
+        ("income", "Salary", 100), ("expense", "Food", 12.5)]
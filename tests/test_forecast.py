@@ -0,0 +1,58 @@
+import pytest
+
+from conftest import load
+
+pytest.importorskip("numpy")
+
+archive = load("archive")
+forecast = load("forecast")
+rollups = load("rollups")
+transactions = load("transactions")
+
+
+@pytest.fixture
+def seeded():
+    previous = forecast.configure()
+    forecast.configure(policy="always", seed=1)
+    yield
+    forecast.configure(policy=previous["policy"])
+    forecast._settings["seed"] = previous["seed"]
+
+
+def test_archiving_years_in_the_history_window_keeps_the_forecast(db, seeded):
+    for year in (2022, 2023, 2024):
+        for month in range(1, 13):
+            date = f"{year}-{month:02d}-10"
+            transactions.add_transaction(1, "income", "Salary", 3000 + 10 * month, date)
+            transactions.add_transaction(1, "expense", "Rent", 1000 + (200 if month == 12 else 0), date)
+    forecast.refresh_forecasts(as_of="2025-01-15")
+    before = forecast.get_forecast(1)
+    assert len(before) == forecast.configure()["horizon"]
+
+    # 2022 and 2023 move to archive files; their rollups stay in the database
+    archive.archive_years(2024)
+    forecast.refresh_forecasts(as_of="2025-01-15")
+    assert forecast.get_forecast(1) == before
+
+    rollups.rebuild_rollups()
+    forecast.refresh_forecasts(as_of="2025-01-15")
+    assert forecast.get_forecast(1) == before
+
+
+def test_batches_never_split_a_users_history(db, seeded, monkeypatch):
+    for user_id in range(1, 6):
+        for month in range(1, 13):
+            date = f"2024-{month:02d}-10"
+            transactions.add_transaction(user_id, "income", "Salary", 1000 * user_id + month, date)
+            transactions.add_transaction(user_id, "expense", "Food", 100 * user_id, date)
+
+    # FETCH_BATCH_SIZE rows at a time: users straddle the fetches
+    monkeypatch.setattr(forecast, "FETCH_BATCH_SIZE", 7)
+    forecast.refresh_forecasts(as_of="2025-01-15", batch_size=2)
+    monkeypatch.undo()
+    small = {user_id: forecast.get_forecast(user_id) for user_id in range(1, 6)}
+    forecast.refresh_forecasts(as_of="2025-01-15", batch_size=500)
+    for user_id in range(1, 6):
+        whole = forecast.get_forecast(user_id)
+        assert [(m["income"], m["expenses"]) for m in small[user_id]] == \
+               [(m["income"], m["expenses"]) for m in whole]
@@ -0,0 +1,36 @@
+from conftest import load
+
+importers = load("importers")
+reports = load("reports")
+transactions = load("transactions")
+
+
+def test_bulk_insert_commits_in_chunks_and_reports_rejected_records(db):
+    records = ({"type": "expense", "category": "Food", "amount": amount, "date": "2024-03-01"}
+               for amount in range(1, 6))
+    bad = [{"type": "loan", "category": "Food", "amount": 1, "date": "2024-03-01"},
+           {"type": "expense", "category": "Food", "amount": -1, "date": "2024-03-01"},
+           {"type": "expense", "category": "Food", "amount": 1, "date": "2024-3-1"}]
+    result = transactions.add_transactions_bulk(list(records) + bad, chunk_size=2, default_user_id=1)
+    assert result["inserted"] == 5
+    assert result["chunks"] == 3
+    assert [rejected["index"] for rejected in result["rejected"]] == [6, 7, 8]
+    assert reports.get_monthly_report(1, 3, 2024)["total_expenses"] == 15
+
+
+def test_csv_and_jsonl_imports(db, tmp_path):
+    csv_file = tmp_path / "rows.csv"
+    csv_file.write_text("type,category,amount,date\n"
+                        "income,Salary,100,2024-03-01\n"
+                        "expense,Food,12.5,2024-03-02\n")
+    jsonl_file = tmp_path / "rows.jsonl"
+    jsonl_file.write_text('{"user_id": 2, "type": "expense", "category": "Rent", "amount": 50, "date": "2024-03-03"}\n'
+                          '\n'
+                          'not json\n')
+
+    assert importers.import_csv(str(csv_file), user_id=1)["inserted"] == 2
+    result = importers.import_jsonl(str(jsonl_file))
+    assert result["inserted"] == 1
+    assert result["rejected"][0]["record"] == "not json"
+    assert reports.get_monthly_report(1, 3, 2024)["savings"] == 87.5
+    assert reports.get_monthly_report(2, 3, 2024)["total_expenses"] == 50
@@ -0,0 +1,40 @@
+import pytest
+
+from conftest import load
+
+instrumentation = load("instrumentation")
+reports = load("reports")
+transactions = load("transactions")
+
+
+@pytest.fixture
+def instrumented(db):
+    instrumentation.reset()
+    instrumentation.enable(slow_query_threshold=0)
+    yield
+    instrumentation.disable()
+    instrumentation.reset()
+
+
+def test_normalize_sql_replaces_literals():
+    sql = "SELECT *  FROM t\n WHERE a = 'it''s' AND b = 12.5 AND c IS NULL"
+    assert instrumentation.normalize_sql(sql) == "SELECT * FROM t WHERE a = ? AND b = ? AND c IS ?"
+
+
+def test_functions_and_statements_are_timed_until_disabled(instrumented):
+    original = transactions.add_transaction.__wrapped__
+    transactions.add_transaction(1, "expense", "Food", 10, "2024-03-01")
+    transactions.add_transaction(1, "expense", "Food", 20, "2024-03-02")
+    reports.get_monthly_report(1, 3, 2024)
+
+    metrics = instrumentation.snapshot()
+    assert metrics["functions"]["transactions.add_transaction"]["duration"]["count"] == 2
+    assert metrics["functions"]["reports.get_monthly_report"]["duration"]["count"] == 1
+    assert any(sql.startswith("INSERT INTO transaction_entries") for sql in metrics["statements"])
+    assert instrumentation.slow_queries()
+    assert "transactions.add_transaction" in instrumentation.prometheus_text()
+
+    instrumentation.disable()
+    assert transactions.add_transaction is original
+    transactions.add_transaction(1, "expense", "Food", 5, "2024-03-03")
+    assert instrumentation.snapshot()["functions"]["transactions.add_transaction"]["duration"]["count"] == 2
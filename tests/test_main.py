@@ -0,0 +1,31 @@
+from conftest import load
+
+auth = load("finance_app.auth")
+app = load("main")
+reports = load("reports")
+
+
+def test_console_authenticates_once_per_session(db, monkeypatch):
+    previous = auth.configure()
+    auth.configure(algorithm="pbkdf2_sha256", pbkdf2_iterations=1000)
+    try:
+        assert auth.register_user("alice", "secret")
+        user_id = auth.authenticate("alice", "secret")
+        answers = iter(["yes", "alice", "secret",
+                        "1", "expense", "Food", "12.5", "2024-03-01",
+                        "1", "income", "Salary", "100", "2024-03-02",
+                        "2", "3", "2024",
+                        "4"])
+        monkeypatch.setattr("builtins.input", lambda prompt="": next(answers))
+        calls = []
+        authenticate = auth.authenticate
+        monkeypatch.setattr(auth, "authenticate", lambda *args: calls.append(args) or authenticate(*args))
+
+        app.main()
+    finally:
+        auth.configure(algorithm=previous["algorithm"], pbkdf2_iterations=previous["pbkdf2_iterations"])
+
+    assert len(calls) == 1
+    report = reports.get_monthly_report(user_id, 3, 2024)
+    assert (report["total_income"], report["total_expenses"]) == (100, 12.5)
+    assert not auth._sessions
@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import PACKAGE, ROOT, load
+
+connection = load("connection")
+migrations = load("migrations")
+reports = load("reports")
+transactions = load("transactions")
+
+IMPORT_SCRIPT = f"""
+import sys
+import {PACKAGE}
+print(sorted(name for name in sys.modules if name.startswith("{PACKAGE}.")))
+print({PACKAGE}.calculate_totals.__module__)
+"""
+
+
+def test_importing_the_package_loads_nothing_and_creates_no_files(tmp_path):
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(ROOT))
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, check=True).stdout.splitlines()
+    assert output[0] == "[]"
+    assert output[1] == f"{PACKAGE}.reports"
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_migrations_bring_a_database_up_to_date_and_can_run_again(db):
+    transactions.add_transaction(1, "expense", "Food", 10, "2024-03-01")
+    conn = connection.get_connection()
+    assert migrations.get_version(conn) == migrations.LATEST_VERSION
+    assert migrations.pending_migrations(conn) == []
+
+    # As after a crash between a migration's commit and its version update
+    conn.execute("PRAGMA user_version = 3")
+    assert migrations.migrate(conn) == list(range(4, migrations.LATEST_VERSION + 1))
+    assert reports.get_monthly_report(1, 3, 2024)["total_expenses"] == 10
+
+
+def test_a_database_from_a_newer_version_is_refused(db):
+    conn = connection.get_connection()
+    conn.execute(f"PRAGMA user_version = {migrations.LATEST_VERSION + 1}")
+    with pytest.raises(RuntimeError, match="newer"):
+        migrations.migrate(conn)
+    conn.execute(f"PRAGMA user_version = {migrations.LATEST_VERSION}")
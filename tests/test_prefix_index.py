@@ -0,0 +1,48 @@
+import random
+
+from conftest import load
+
+connection = load("connection")
+prefix_index = load("prefix_index")
+reports = load("reports")
+schema = load("schema")
+transactions = load("transactions")
+
+
+# Function to total a range with the SQL that calculate_totals() falls back to
+def _sql_totals(user_id, start_date, end_date):
+    conn = connection.get_connection()
+    return tuple(
+        conn.execute(reports.TOTAL_BY_TYPE_BETWEEN_SQL, (user_id, code, start_date, end_date)).fetchone()[0] or 0
+        for code in (schema.TYPE_INCOME, schema.TYPE_EXPENSE)
+    )
+
+
+# Function to pick a random date of 2024
+def _date(rng):
+    return f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+
+
+def test_index_matches_sql_totals_while_transactions_change(db):
+    rng = random.Random(11)
+    ids = []
+    for step in range(300):
+        action = rng.random()
+        if action < 0.6 or not ids:
+            ids.append(transactions.add_transaction(
+                rng.randint(1, 2), rng.choice(["income", "expense"]), "Food", rng.randint(1, 400) / 4, _date(rng)))
+        elif action < 0.8:
+            transactions.update_transaction(rng.choice(ids), amount=rng.randint(1, 400) / 4, date=_date(rng))
+        elif action < 0.95:
+            transactions.delete_transaction(ids.pop(rng.randrange(len(ids))))
+        else:
+            transactions.update_transactions({"amount": 1}, user_id=1, start_date=_date(rng), end_date="2024-12-31")
+
+        if step % 5 == 0:
+            user_id = rng.randint(1, 2)
+            start, end = sorted((_date(rng), _date(rng)))
+            assert prefix_index.range_totals_cents(user_id, start, end) == _sql_totals(user_id, start, end)
+
+    for user_id in (1, 2):
+        expected = _sql_totals(user_id, "2024-01-01", "2024-12-31")
+        assert prefix_index.range_totals_cents(user_id, "2024-01-01", "2024-12-31") == expected
@@ -0,0 +1,28 @@
+import pytest
+
+from conftest import load
+
+prefix_index = load("prefix_index")
+query_plans = load("query_plans")
+reports = load("reports")
+transactions = load("transactions")
+
+
+@pytest.fixture
+def sql_totals():
+    prefix_index.set_enabled(False)
+    yield
+    prefix_index.set_enabled(True)
+
+
+def test_report_and_budget_queries_use_indexes(db):
+    query_plans.assert_query_plans_use_indexes()
+
+
+def test_period_edges_are_counted_once(db, sql_totals):
+    for date in ("2024-01-01", "2024-01-31", "2024-02-01"):
+        transactions.add_transaction(1, "expense", "Food", 10, date)
+    assert reports.get_monthly_report(1, 1, 2024)["total_expenses"] == 20
+    assert reports.get_monthly_report(1, 2, 2024)["total_expenses"] == 10
+    assert reports.get_totals(1, "2024-01-31", "2024-02-01")["total_expenses"] == 20
+    assert reports.get_yearly_report(1, 2024)["total_expenses"] == 30
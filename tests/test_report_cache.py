@@ -0,0 +1,95 @@
+import sqlite3
+
+import pytest
+
+from conftest import load
+
+connection = load("connection")
+report_cache = load("report_cache")
+reports = load("reports")
+schema = load("schema")
+transactions = load("transactions")
+
+
+@pytest.fixture
+def shared_cache(tmp_path):
+    cache_path = str(tmp_path / "cache.db")
+    report_cache.configure(shared_path=cache_path)
+    yield cache_path
+    report_cache.configure(shared_path='')
+
+
+def test_shared_cache_file_only_holds_the_cache_tables(db, shared_cache):
+    transactions.add_transaction(1, "expense", "Food", 12.5, "2024-03-01")
+    assert reports.get_totals(1, "2024-01-01", "2024-12-31")["total_expenses"] == 12.5
+    assert reports.get_totals(1, "2024-01-01", "2024-12-31")["total_expenses"] == 12.5
+    assert report_cache.cache_stats()["hits"] >= 1
+
+    with sqlite3.connect(shared_cache) as conn:
+        names = {row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'")}
+        user_version = conn.execute("PRAGMA user_version").fetchone()[0]
+    assert names == {"cache_versions", "cache_entries", "idx_cache_entries_last_used"}
+    assert user_version == 0
+
+
+@pytest.fixture
+def local_cache():
+    report_cache.configure(enabled=True)
+    yield
+    report_cache.configure(enabled=False)
+
+
+def test_cache_is_off_unless_configured(db):
+    transactions.add_transaction(1, "expense", "Food", 12.5, "2024-03-01")
+    assert reports.get_yearly_report(1, 2024)["total_expenses"] == 12.5
+
+    # Another process writes: nothing in this process bumps the user's version
+    with sqlite3.connect(db) as conn:
+        conn.execute("INSERT INTO transaction_entries (user_id, type, category_id, amount_cents, date) "
+                     "SELECT 1, ?, id, 750, '2024-04-01' FROM categories WHERE name = 'Food'",
+                     (schema.TYPE_EXPENSE,))
+    assert reports.get_yearly_report(1, 2024)["total_expenses"] == 20
+    assert report_cache.cache_stats()["entries"] == 0
+
+
+@pytest.mark.parametrize("cache", ["local_cache", "shared_cache"])
+def test_switching_databases_does_not_serve_cached_reports(db, tmp_path, request, cache):
+    request.getfixturevalue(cache)
+    transactions.add_transaction(1, "expense", "Food", 12.5, "2024-03-01")
+    assert reports.get_totals(1, "2024-01-01", "2024-12-31")["total_expenses"] == 12.5
+
+    connection.configure(db_path=str(tmp_path / "other.db"))
+    assert reports.get_totals(1, "2024-01-01", "2024-12-31")["total_expenses"] == 0
+    assert reports.get_monthly_report(1, 3, 2024)["total_expenses"] == 0
+
+    connection.configure(db_path=db)
+    assert reports.get_totals(1, "2024-01-01", "2024-12-31")["total_expenses"] == 12.5
+
+
+def test_writes_invalidate_only_their_users_results(db, local_cache):
+    transactions.add_transaction(1, "expense", "Food", 10, "2024-03-01")
+    transactions.add_transaction(2, "expense", "Food", 20, "2024-03-01")
+    for user_id in (1, 2):
+        reports.get_monthly_report(user_id, 3, 2024)
+    before = report_cache.cache_stats()
+
+    transactions.add_transaction(1, "expense", "Food", 5, "2024-03-02")
+    assert reports.get_monthly_report(1, 3, 2024)["total_expenses"] == 15
+    assert reports.get_monthly_report(2, 3, 2024)["total_expenses"] == 20
+    stats = report_cache.cache_stats()
+    assert stats["stale"] - before["stale"] == 1
+    assert stats["hits"] - before["hits"] == 1
+
+
+def test_entry_limit_evicts_the_least_recently_used(db, local_cache):
+    report_cache.configure(max_entries=2)
+    try:
+        for month in (1, 2, 1, 3):
+            reports.get_monthly_report(1, month, 2024)
+        stats = report_cache.cache_stats()
+        assert stats["entries"] == 2
+        reports.get_monthly_report(1, 1, 2024)
+        assert report_cache.cache_stats()["hits"] - stats["hits"] == 1
+    finally:
+        report_cache.configure(max_entries=report_cache.DEFAULT_MAX_ENTRIES)
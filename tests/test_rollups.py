@@ -0,0 +1,47 @@
+import random
+
+from conftest import load
+
+connection = load("connection")
+reports = load("reports")
+rollups = load("rollups")
+transactions = load("transactions")
+
+
+def test_trigger_maintained_rollups_match_a_recompute(db):
+    rng = random.Random(4)
+    ids = []
+    for _ in range(200):
+        action = rng.random()
+        if action < 0.6 or not ids:
+            ids.append(transactions.add_transaction(
+                rng.randint(1, 3), rng.choice(["income", "expense"]), rng.choice(["Food", "Rent", None]),
+                rng.randint(1, 500) / 4, f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"))
+        elif action < 0.85:
+            transactions.update_transaction(
+                rng.choice(ids), transaction_type=rng.choice(["income", "expense"]),
+                category=rng.choice(["Food", "Gym"]), amount=rng.randint(1, 500) / 4,
+                date=f"2024-{rng.randint(1, 12):02d}-15")
+        else:
+            transactions.delete_transaction(ids.pop(rng.randrange(len(ids))))
+    transactions.delete_transactions(user_id=2, category="Rent")
+
+    assert rollups.verify_rollups() == []
+    conn = connection.get_connection()
+    expected = conn.execute("SELECT SUM(amount_cents) FROM transaction_entries "
+                            "WHERE user_id = 1 AND type = 0 AND date LIKE '2024-05-%'").fetchone()[0] or 0
+    assert reports.get_monthly_report(1, 5, 2024)["total_expenses"] == expected / 100
+
+
+def test_verify_reports_drift_and_rebuild_repairs_it(db):
+    transactions.add_transaction(1, "expense", "Food", 10, "2024-03-01")
+    conn = connection.get_connection()
+    conn.execute("UPDATE monthly_rollups SET total_cents = total_cents + 1")
+    conn.commit()
+
+    drift = rollups.verify_rollups()
+    assert len(drift) == 1
+    assert drift[0]["expected"] == (1000, 1)
+    assert drift[0]["actual"] == (1001, 1)
+    rollups.rebuild_rollups()
+    assert rollups.verify_rollups() == []
@@ -0,0 +1,58 @@
+import sqlite3
+
+from conftest import load
+
+backup = load("backup")
+connection = load("connection")
+rollups = load("rollups")
+schema = load("schema")
+
+LEGACY_TABLES_SQL = (
+    "CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE, password TEXT)",
+    "CREATE TABLE transactions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, type TEXT, "
+    "category TEXT, amount REAL, date TEXT)",
+    "CREATE TABLE budgets (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, category TEXT, "
+    "amount REAL, month INTEGER, year INTEGER)",
+)
+LEGACY_INSERT_SQL = "INSERT INTO transactions (user_id, type, category, amount, date) VALUES (?, ?, ?, ?, ?)"
+
+
+def test_migrate_to_compact_keeps_writes_made_during_the_copy(db, tmp_path):
+    legacy = str(tmp_path / "legacy.db")
+    old_process = sqlite3.connect(legacy, isolation_level=None)
+    for sql in LEGACY_TABLES_SQL:
+        old_process.execute(sql)
+    expected = {}
+    for i in range(1, 501):
+        row = (i % 3 + 1, "income" if i % 4 == 0 else "expense", ["Food", "Rent", ""][i % 3],
+               i / 4, f"2024-{i % 12 + 1:02d}-01")
+        expected[old_process.execute(LEGACY_INSERT_SQL, row).lastrowid] = row
+
+    # A process still running the previous version writes between the batches
+    def write_meanwhile(copied_up_to, max_id):
+        new_id = old_process.execute(LEGACY_INSERT_SQL, (1, "expense", "Gym", 7.5, "2024-06-01")).lastrowid
+        expected[new_id] = (1, "expense", "Gym", 7.5, "2024-06-01")
+        for row_id in (1, copied_up_to + 1):
+            if row_id in expected:
+                old_process.execute("UPDATE transactions SET amount = amount + 1 WHERE id = ?", (row_id,))
+                user_id, kind, category, amount, date = expected[row_id]
+                expected[row_id] = (user_id, kind, category, amount + 1, date)
+        if max_id - copied_up_to > 2:
+            old_process.execute("DELETE FROM transactions WHERE id = ?", (max_id - 1,))
+            expected.pop(max_id - 1, None)
+
+    conn = backup.connect_db(legacy)
+    try:
+        result = schema.migrate_to_compact(conn, batch_size=100, progress=write_meanwhile)
+    finally:
+        conn.close()
+        old_process.close()
+    assert result["migrated"] == len(expected)
+
+    with connection.use_database(legacy):
+        conn = connection.get_connection()
+        assert not schema.is_legacy(conn)
+        migrated = {row[0]: (row[1], row[2], row[3] or "", row[4], row[5])
+                    for row in conn.execute("SELECT id, user_id, type, category, amount, date FROM transactions")}
+        assert migrated == expected
+        assert rollups.verify_rollups() == []
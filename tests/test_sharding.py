@@ -0,0 +1,87 @@
+import sqlite3
+
+import pytest
+
+from conftest import load
+
+budget = load("budget")
+connection = load("connection")
+recurring = load("recurring")
+sharding = load("sharding")
+transactions = load("transactions")
+
+
+@pytest.fixture
+def moved_user(db):
+    """Spreads users 1-8 over two shards; returns a user moved to shard 1 and its old transaction ID."""
+    conn = connection.get_connection()
+    conn.executemany("INSERT INTO users (id, username, password) VALUES (?, ?, 'x')",
+                     [(user_id, f"user{user_id}") for user_id in range(1, 9)])
+    conn.commit()
+    user_id = next(u for u in range(1, 9) if sharding.jump_hash(u, 2) == 1)
+    old_id = transactions.add_transaction(user_id, "expense", "Food", 10, "2024-03-01")
+    budget.set_monthly_budget(user_id, "Food", 100, 3, 2024)
+    recurring.add_rule(user_id, "expense", "Rent", 500, "monthly", "2024-01-01")
+    sharding.reshard(2, purge=False)
+    yield user_id, old_id
+    sharding.reshard(1, purge=False)
+
+
+# Function to count a user's rows in one shard file
+def _count(path, table, user_id):
+    with sqlite3.connect(path) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {table} WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+
+def test_deleting_a_moved_users_transaction_by_its_old_id_fails(db, moved_user):
+    user_id, old_id = moved_user
+    target = sharding.shard_file(1)
+    assert _count(db, "transaction_entries", user_id) == 1
+    assert _count(target, "transaction_entries", user_id) == 1
+
+    with pytest.raises(sqlite3.IntegrityError, match=sharding.MOVED_MESSAGE):
+        transactions.delete_transaction(old_id)
+    conn = connection.get_connection(db)
+    for table in ("budgets", "recurring_rules"):
+        with pytest.raises(sqlite3.IntegrityError, match=sharding.MOVED_MESSAGE):
+            try:
+                conn.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+            finally:
+                conn.rollback()
+    assert _count(db, "transaction_entries", user_id) == 1
+    assert _count(db, "budgets", user_id) == 1
+    assert _count(db, "recurring_rules", user_id) == 1
+    assert _count(target, "transaction_entries", user_id) == 1
+
+
+def test_purge_still_removes_the_frozen_rows(db, moved_user):
+    user_id, _ = moved_user
+    assert sharding.purge_moved_users()[0] >= 1
+    assert _count(db, "transaction_entries", user_id) == 0
+    assert _count(db, "budgets", user_id) == 0
+    assert _count(db, "recurring_rules", user_id) == 0
+    assert _count(sharding.shard_file(1), "transaction_entries", user_id) == 1
+    with sqlite3.connect(db) as conn:
+        assert conn.execute("SELECT shard FROM moved_users WHERE user_id = ?", (user_id,)).fetchone() == (1,)
+
+
+def test_a_moved_user_keeps_their_archived_years(db):
+    archive = load("archive")
+    reports = load("reports")
+    conn = connection.get_connection()
+    conn.executemany("INSERT INTO users (id, username, password) VALUES (?, ?, 'x')",
+                     [(user_id, f"user{user_id}") for user_id in range(1, 9)])
+    conn.commit()
+    user_id = next(u for u in range(1, 9) if sharding.jump_hash(u, 2) == 1)
+    transactions.add_transaction(user_id, "expense", "Food", 40, "2020-05-01")
+    transactions.add_transaction(user_id, "expense", "Food", 60, "2024-05-01")
+    archive.archive_years(2021)
+
+    sharding.reshard(2, purge=True)
+    assert reports.get_yearly_report(user_id, 2020)["total_expenses"] == 40
+    assert reports.get_yearly_report(user_id, 2024)["total_expenses"] == 60
+
+    # Moving back skips the rows the old shard still holds in its archive
+    sharding.reshard(1, purge=True)
+    assert reports.get_yearly_report(user_id, 2020)["total_expenses"] == 40
+    assert _count(db, "transaction_entries", user_id) == 1
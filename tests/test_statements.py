@@ -0,0 +1,62 @@
+import json
+
+from conftest import load
+
+budget = load("budget")
+connection = load("connection")
+reports = load("reports")
+statements = load("statements")
+transactions = load("transactions")
+
+
+# Function to add users 1-5 with March spending, user 3 over its Food budget
+def _seed_users():
+    conn = connection.get_connection()
+    conn.executemany("INSERT INTO users (id, username, password) VALUES (?, ?, 'x')",
+                     [(user_id, f"user{user_id}") for user_id in range(1, 6)])
+    conn.commit()
+    for user_id in range(1, 6):
+        transactions.add_transaction(user_id, "income", "Salary", 100 * user_id, "2024-03-01")
+        transactions.add_transaction(user_id, "expense", "Food", 10 * user_id, "2024-03-15")
+        budget.set_monthly_budget(user_id, "Food", 25, 3, 2024)
+
+
+# Function to read a JSONL statements file keyed by user
+def _read(path):
+    with open(path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f]
+    assert len(rows) == len({row["user_id"] for row in rows})
+    return {row["user_id"]: row for row in rows}
+
+
+def test_statements_match_the_reports_of_every_user(db, tmp_path):
+    _seed_users()
+    output = str(tmp_path / "march.jsonl")
+    result = statements.generate_statements(3, 2024, output=output, workers=2, chunk_size=2)
+    assert (result["users"], result["statements"], result["chunks"], result["exceeded"]) == (5, 5, 3, 3)
+
+    written = _read(output)
+    for user_id in range(1, 6):
+        report = reports.get_monthly_report(user_id, 3, 2024)
+        assert written[user_id]["savings"] == report["savings"]
+        assert written[user_id]["exceeded_budgets"] == budget.get_budget_exceedances(user_id, 3, 2024)
+
+
+def test_an_interrupted_run_resumes_after_the_last_checkpoint(db, tmp_path):
+    _seed_users()
+    output = str(tmp_path / "march.jsonl")
+    statements.generate_statements(3, 2024, output=output, workers=1, chunk_size=2)
+    expected = _read(output)
+
+    # Chunk 0 (users 1 and 2) was checkpointed; a crash left half a line after it
+    first_chunk = "".join(json.dumps(expected[user_id]) + "\n" for user_id in (1, 2)).encode("utf-8")
+    with open(output, "wb") as f:
+        f.write(first_chunk + b'{"user_id": 3, "mon')
+    with open(output + ".checkpoint", "w", encoding="utf-8") as f:
+        json.dump({"month": 3, "year": 2024, "chunk_size": 2, "max_user_id": 5,
+                   "done": [0], "offset": len(first_chunk)}, f)
+
+    result = statements.generate_statements(3, 2024, output=output, workers=1, chunk_size=2)
+    assert (result["resumed"], result["statements"]) == (1, 3)
+    assert _read(output) == expected
+    assert not (tmp_path / "march.jsonl.checkpoint").exists()
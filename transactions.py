@@ -1,7 +1,53 @@
-import sqlite3
-from datetime import datetime
+import json
+import math
+from datetime import date as date_type, datetime
+from itertools import islice
+
+from . import alerts, connection, prefix_index, report_cache, schema, sharding
+
+TRANSACTION_TYPES = ('income', 'expense')
+TRANSACTION_FIELDS = ('user_id', 'type', 'category', 'amount', 'date')
+DEFAULT_CHUNK_SIZE = 10000
+# Largest accepted amount; amounts are stored as 64-bit integer cents
+MAX_AMOUNT = 10 ** 15
+
+# Rows are written to the compact table directly. The category name is
+# looked up in the categories dictionary, which INSERT_CATEGORY_SQL fills.
+INSERT_CATEGORY_SQL = "INSERT OR IGNORE INTO categories (name) VALUES (?)"
+INSERT_TRANSACTION_SQL = (
+    "INSERT INTO transaction_entries (user_id, type, category_id, amount_cents, date) "
+    "VALUES (?, ?, (SELECT id FROM categories WHERE name = ?), ?, ?)"
+)
+
+# Fields that update_transactions() can change, as in update_transaction()
+BULK_UPDATE_FIELDS = ('type', 'category', 'amount', 'date')
+# Users touched by a bulk change and their earliest affected date
+AFFECTED_USERS_SQL = "SELECT user_id, MIN(date) FROM transaction_entries WHERE {where} GROUP BY user_id"
+
+# Function to refresh in-memory data derived from transactions once committed
+def _transactions_changed(changes):
+    """
+    Invalidates derived in-memory data after transactions were written.
+
+    Args:
+        changes (iterable): (user_id, earliest affected date) pairs.
+    """
+    for user_id, date in changes:
+        connection.after_commit(lambda user_id=user_id, date=date: prefix_index.invalidate(user_id, date))
+        connection.after_commit(lambda user_id=user_id: report_cache.bump_version(user_id))
+
+# Function to look up the owner and date of a transaction before changing it
+def _transaction_owner(cursor, transaction_id):
+    cursor.execute("SELECT user_id, date FROM transaction_entries WHERE id = ?", (transaction_id,))
+    return cursor.fetchone()
+
+# Function to convert a validated row to the parameters of INSERT_TRANSACTION_SQL
+def _to_entry(row):
+    user_id, transaction_type, category, amount, date = row
+    return (user_id, schema.type_code(transaction_type), category, schema.to_cents(amount), date)
 
 # Function to add a transaction (income or expense)
+@sharding.by_user
 def add_transaction(user_id, transaction_type, category, amount, date=None):
     """
     Adds a new transaction (income/expense) for the user.
@@ -14,26 +60,32 @@ def add_transaction(user_id, transaction_type, category, amount, date=None):
         date (str, optional): The date of the transaction (YYYY-MM-DD). If None, defaults to today.
 
     Returns:
-        None
+        int: The ID of the new transaction.
     """
-    conn = sqlite3.connect('finance.db')
+    conn = connection.get_connection()
     cursor = conn.cursor()
 
     # Set date to today if not provided
     if date is None:
         date = datetime.today().strftime('%Y-%m-%d')
 
-    # Insert the transaction into the transactions table
-    cursor.execute(
-        "INSERT INTO transactions (user_id, type, category, amount, date) VALUES (?, ?, ?, ?, ?)",
-        (user_id, transaction_type, category, amount, date)
-    )
+    # Insert the transaction, adding its category to the dictionary if it is new
+    if category:
+        cursor.execute(INSERT_CATEGORY_SQL, (category,))
+    since = alerts.mark(cursor)
+    cursor.execute(INSERT_TRANSACTION_SQL, (user_id, schema.type_code(transaction_type),
+                                            category or None, schema.to_cents(amount), date))
+    transaction_id = cursor.lastrowid
+    raised = alerts.collect(cursor, since, user_id)
     
-    conn.commit()
-    conn.close()
+    connection.commit(conn)
+    _transactions_changed([(user_id, date)])
+    alerts.notify(raised)
     print(f"Transaction of {amount} added under {category} as {transaction_type} on {date}.")
+    return transaction_id
 
 # Function to delete a transaction by ID
+@sharding.by_transaction
 def delete_transaction(transaction_id):
     """
     Deletes a transaction by its ID.
@@ -44,21 +96,25 @@ def delete_transaction(transaction_id):
     Returns:
         None
     """
-    conn = sqlite3.connect('finance.db')
+    conn = connection.get_connection()
     cursor = conn.cursor()
 
+    owner = _transaction_owner(cursor, transaction_id)
+
     # Delete the transaction from the transactions table
-    cursor.execute("DELETE FROM transactions WHERE id = ?", (transaction_id,))
+    cursor.execute("DELETE FROM transaction_entries WHERE id = ?", (transaction_id,))
     
     if cursor.rowcount == 0:
         print(f"No transaction found with ID {transaction_id}.")
     else:
         print(f"Transaction {transaction_id} deleted successfully.")
 
-    conn.commit()
-    conn.close()
+    connection.commit(conn)
+    if owner:
+        _transactions_changed([owner])
 
 # Function to update an existing transaction by ID
+@sharding.by_transaction
 def update_transaction(transaction_id, transaction_type=None, category=None, amount=None, date=None):
     """
     Updates an existing transaction by its ID. Any field can be updated.
@@ -73,7 +129,7 @@ def update_transaction(transaction_id, transaction_type=None, category=None, amo
     Returns:
         None
     """
-    conn = sqlite3.connect('finance.db')
+    conn = connection.get_connection()
     cursor = conn.cursor()
 
     # Build the update query dynamically based on which fields are provided
@@ -82,13 +138,13 @@ def update_transaction(transaction_id, transaction_type=None, category=None, amo
 
     if transaction_type:
         update_fields.append("type = ?")
-        values.append(transaction_type)
+        values.append(schema.type_code(transaction_type))
     if category:
-        update_fields.append("category = ?")
+        update_fields.append("category_id = (SELECT id FROM categories WHERE name = ?)")
         values.append(category)
     if amount is not None:
-        update_fields.append("amount = ?")
-        values.append(amount)
+        update_fields.append("amount_cents = ?")
+        values.append(schema.to_cents(amount))
     if date:
         update_fields.append("date = ?")
         values.append(date)
@@ -98,15 +154,324 @@ def update_transaction(transaction_id, transaction_type=None, category=None, amo
         print("No fields to update.")
         return
 
+    owner = _transaction_owner(cursor, transaction_id)
+    if category:
+        cursor.execute(INSERT_CATEGORY_SQL, (category,))
+
     # Add transaction_id to the values and execute the update query
     values.append(transaction_id)
-    query = f"UPDATE transactions SET {', '.join(update_fields)} WHERE id = ?"
+    query = f"UPDATE transaction_entries SET {', '.join(update_fields)} WHERE id = ?"
+    since = alerts.mark(cursor)
     cursor.execute(query, values)
+    raised = alerts.collect(cursor, since, owner[0]) if owner else []
 
     if cursor.rowcount == 0:
         print(f"No transaction found with ID {transaction_id}.")
     else:
         print(f"Transaction {transaction_id} updated successfully.")
 
-    conn.commit()
-    conn.close()
+    connection.commit(conn)
+    if owner:
+        old_user_id, old_date = owner
+        _transactions_changed([(old_user_id, min(old_date, date) if date else old_date)])
+    alerts.notify(raised)
+
+# Function to validate one transaction record and normalise it to an insert tuple
+def validate_transaction(record, default_user_id=None):
+    """
+    Validates a transaction record and converts it to a row for the transactions table.
+
+    Args:
+        record (dict or sequence): Either a mapping with the keys user_id, type,
+            category, amount and date, or a sequence in that order. 'transaction_type'
+            is accepted as an alias for 'type'.
+        default_user_id (int, optional): User ID to use when the record has none.
+
+    Returns:
+        tuple: (user_id, type, category, amount, date) ready for insertion.
+
+    Raises:
+        ValueError: If the type, amount, date or user ID is invalid.
+    """
+    if isinstance(record, dict):
+        user_id = record.get('user_id') or default_user_id
+        transaction_type = record.get('type', record.get('transaction_type'))
+        category = record.get('category')
+        amount = record.get('amount')
+        date = record.get('date')
+    elif isinstance(record, (list, tuple)):
+        if len(record) != len(TRANSACTION_FIELDS):
+            raise ValueError(f"expected {len(TRANSACTION_FIELDS)} fields, got {len(record)}")
+        user_id, transaction_type, category, amount, date = record
+        user_id = user_id or default_user_id
+    else:
+        raise ValueError(f"record must be a mapping or a sequence, got {type(record).__name__}")
+
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid user_id: {user_id!r}")
+
+    if transaction_type not in TRANSACTION_TYPES:
+        raise ValueError(f"invalid type: {transaction_type!r}")
+
+    amount = _check_amount(amount)
+    _check_date(date)
+
+    return (user_id, transaction_type, category or None, amount, date)
+
+# Function to validate an amount and convert it to a float
+def _check_amount(amount):
+    try:
+        amount = float(amount)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid amount: {amount!r}")
+    if not math.isfinite(amount) or amount < 0 or amount > MAX_AMOUNT:
+        raise ValueError(f"invalid amount: {amount!r}")
+    return amount
+
+# Function to validate a YYYY-MM-DD date string
+def _check_date(date):
+    # date.fromisoformat is fast but also accepts compact forms; require YYYY-MM-DD
+    if not isinstance(date, str) or len(date) != 10 or date[4] != '-' or date[7] != '-':
+        raise ValueError(f"invalid date: {date!r}")
+    try:
+        date_type.fromisoformat(date)
+    except ValueError:
+        raise ValueError(f"invalid date: {date!r}")
+
+# Function to add many transactions in chunked, executemany-based commits
+def add_transactions_bulk(records, chunk_size=DEFAULT_CHUNK_SIZE, default_user_id=None):
+    """
+    Inserts many transactions efficiently without printing per row.
+
+    Records are consumed lazily, so a generator of any length can be passed.
+    Valid rows are inserted with executemany, one SQL transaction per chunk
+    (per chunk and shard when sharded); invalid rows are skipped and reported.
+
+    Args:
+        records (iterable): Transaction records accepted by validate_transaction().
+        chunk_size (int): Number of records to validate and commit per transaction.
+        default_user_id (int, optional): User ID for records that have none.
+
+    Returns:
+        dict: {"inserted": int, "rejected": list, "chunks": int}. Each rejected entry
+        is a dict with the 1-based record "index", the original "record" and the "error".
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+
+    result = {"inserted": 0, "rejected": [], "chunks": 0}
+    iterator = iter(records)
+    index = 0
+
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            break
+
+        rows = []
+        for record in chunk:
+            index += 1
+            try:
+                rows.append(validate_transaction(record, default_user_id))
+            except ValueError as e:
+                result["rejected"].append({"index": index, "record": record, "error": str(e)})
+
+        if rows:
+            # One transaction per shard touched by the chunk
+            for path, shard_rows in sharding.partition(rows, lambda row: row[0]).items():
+                conn = connection.get_connection(path)
+                try:
+                    categories = {row[2] for row in shard_rows if row[2]}
+                    conn.executemany(INSERT_CATEGORY_SQL, ((name,) for name in categories))
+                    cursor = conn.cursor()
+                    since = alerts.mark(cursor)
+                    cursor.executemany(INSERT_TRANSACTION_SQL, map(_to_entry, shard_rows))
+                    raised = alerts.collect(cursor, since)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                alerts.notify(raised)
+            earliest = {}
+            for row in rows:
+                if row[0] not in earliest or row[4] < earliest[row[0]]:
+                    earliest[row[0]] = row[4]
+            _transactions_changed(earliest.items())
+            result["inserted"] += len(rows)
+            result["chunks"] += 1
+
+    return result
+
+# Function to build the WHERE clause selecting transactions for a bulk change
+def _build_filter(user_id=None, start_date=None, end_date=None, category=None,
+                  transaction_type=None, ids=None):
+    conditions = []
+    params = []
+    if user_id is not None:
+        conditions.append("user_id = ?")
+        params.append(int(user_id))
+    if start_date is not None:
+        conditions.append("date >= ?")
+        params.append(start_date)
+    if end_date is not None:
+        conditions.append("date <= ?")
+        params.append(end_date)
+    if category is not None:
+        conditions.append("category_id = (SELECT id FROM categories WHERE name = ?)")
+        params.append(category)
+    if transaction_type is not None:
+        conditions.append("type = ?")
+        params.append(schema.type_code(transaction_type))
+    if ids is not None:
+        # One JSON parameter instead of one placeholder per ID
+        conditions.append("id IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps([int(transaction_id) for transaction_id in ids]))
+    if not conditions:
+        raise ValueError("a filter is required (user_id, dates, category, transaction_type or ids)")
+    if sharding.is_sharded():
+        # Leave the frozen rows of users that moved to another shard alone
+        conditions.append("user_id NOT IN (SELECT user_id FROM moved_users)")
+    return " AND ".join(conditions), params
+
+# Function to list the databases a bulk change has to visit
+def _bulk_targets(user_id):
+    if user_id is not None:
+        return [sharding.shard_path(user_id)]
+    if sharding.is_sharded():
+        return [sharding.shard_file(index) for index in sharding.shard_indexes()]
+    return [None]
+
+# Function to run a set-based change on every database it concerns
+def _run_bulk(user_id, apply):
+    total = 0
+    changed = []
+    for path in _bulk_targets(user_id):
+        with connection.use_database(path):
+            conn = connection.get_connection()
+            count, affected, raised = apply(conn)
+            total += count
+            changed.extend(affected)
+            alerts.notify(raised)
+    _transactions_changed(changed)
+    return total
+
+# Function to change many transactions with a single UPDATE
+def update_transactions(changes, user_id=None, start_date=None, end_date=None, category=None,
+                        transaction_type=None, ids=None, dry_run=False):
+    """
+    Applies the same field changes to every transaction matching a filter.
+
+    The change runs as one UPDATE statement inside a savepoint and is
+    committed once (or with the enclosing group_commit()); nothing is printed.
+    At least one filter is required. Without user_id, every shard is visited.
+
+    Args:
+        changes (dict): New values, keyed by 'type', 'category', 'amount' and/or 'date'.
+        user_id (int, optional): Only transactions of this user.
+        start_date (str, optional): First date to include (YYYY-MM-DD).
+        end_date (str, optional): Last date to include (YYYY-MM-DD).
+        category (str, optional): Only transactions of this category.
+        transaction_type (str, optional): Only 'income' or 'expense' transactions.
+        ids (iterable, optional): Only these transaction IDs.
+        dry_run (bool): Only count the matching transactions, without changing them.
+
+    Returns:
+        int: The number of transactions changed (or that would be changed).
+
+    Raises:
+        ValueError: If no filter is given, or a change is unknown or invalid.
+    """
+    unknown = set(changes) - set(BULK_UPDATE_FIELDS)
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+    if not changes:
+        raise ValueError("no fields to update")
+
+    update_fields = []
+    values = []
+    new_category = changes.get('category')
+    if 'type' in changes:
+        if changes['type'] not in TRANSACTION_TYPES:
+            raise ValueError(f"invalid type: {changes['type']!r}")
+        update_fields.append("type = ?")
+        values.append(schema.type_code(changes['type']))
+    if 'category' in changes:
+        update_fields.append("category_id = (SELECT id FROM categories WHERE name = ?)")
+        values.append(new_category or None)
+    if 'amount' in changes:
+        update_fields.append("amount_cents = ?")
+        values.append(schema.to_cents(_check_amount(changes['amount'])))
+    if 'date' in changes:
+        _check_date(changes['date'])
+        update_fields.append("date = ?")
+        values.append(changes['date'])
+
+    where, params = _build_filter(user_id, start_date, end_date, category, transaction_type, ids)
+    new_date = changes.get('date')
+
+    def apply(conn):
+        cursor = conn.cursor()
+        if dry_run:
+            cursor.execute(f"SELECT COUNT(*) FROM transaction_entries WHERE {where}", params)
+            return cursor.fetchone()[0], [], []
+
+        with connection.savepoint(conn, "bulk_update"):
+            # Users and earliest dates whose derived data the change invalidates
+            cursor.execute(AFFECTED_USERS_SQL.format(where=where), params)
+            affected = [(owner, min(date, new_date) if new_date else date) for owner, date in cursor.fetchall()]
+            if new_category:
+                cursor.execute(INSERT_CATEGORY_SQL, (new_category,))
+            since = alerts.mark(cursor)
+            cursor.execute(f"UPDATE transaction_entries SET {', '.join(update_fields)} WHERE {where}",
+                           values + params)
+            count = cursor.rowcount
+            raised = alerts.collect(cursor, since)
+        connection.commit(conn)
+        return count, affected, raised
+
+    return _run_bulk(user_id, apply)
+
+# Function to delete many transactions with a single DELETE
+def delete_transactions(user_id=None, start_date=None, end_date=None, category=None,
+                        transaction_type=None, ids=None, dry_run=False):
+    """
+    Deletes every transaction matching a filter.
+
+    The deletion runs as one DELETE statement inside a savepoint and is
+    committed once (or with the enclosing group_commit()); nothing is printed.
+    At least one filter is required. Without user_id, every shard is visited.
+
+    Args:
+        user_id (int, optional): Only transactions of this user.
+        start_date (str, optional): First date to include (YYYY-MM-DD).
+        end_date (str, optional): Last date to include (YYYY-MM-DD).
+        category (str, optional): Only transactions of this category.
+        transaction_type (str, optional): Only 'income' or 'expense' transactions.
+        ids (iterable, optional): Only these transaction IDs.
+        dry_run (bool): Only count the matching transactions, without deleting them.
+
+    Returns:
+        int: The number of transactions deleted (or that would be deleted).
+
+    Raises:
+        ValueError: If no filter is given.
+    """
+    where, params = _build_filter(user_id, start_date, end_date, category, transaction_type, ids)
+
+    def apply(conn):
+        cursor = conn.cursor()
+        if dry_run:
+            cursor.execute(f"SELECT COUNT(*) FROM transaction_entries WHERE {where}", params)
+            return cursor.fetchone()[0], [], []
+
+        with connection.savepoint(conn, "bulk_delete"):
+            cursor.execute(AFFECTED_USERS_SQL.format(where=where), params)
+            affected = cursor.fetchall()
+            cursor.execute(f"DELETE FROM transaction_entries WHERE {where}", params)
+            count = cursor.rowcount
+        connection.commit(conn)
+        return count, affected, []
+
+    return _run_bulk(user_id, apply)